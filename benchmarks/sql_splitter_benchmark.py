@@ -0,0 +1,74 @@
+"""
+Compares the old splitter of migrations in statements, which joins the fragments split by semicolons
+and counts quotes and parenthesis again on the whole joined statement, with the single pass SQLLexer.
+
+usage: python benchmarks/sql_splitter_benchmark.py [rows separated by comma] [legacy rows limit]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from simple_db_migrate.helpers import Utils
+from simple_db_migrate.sql import SQLDialect, SQLLexer
+
+def legacy_split(migration_sql):
+    all_statements = []
+    last_statement = ''
+
+    for statement in migration_sql.split(';'):
+        if len(last_statement) > 0:
+            curr_statement = '%s;%s' % (last_statement, statement)
+        else:
+            curr_statement = statement
+
+        count = Utils.count_occurrences(curr_statement)
+        single_quotes = count.get("'", 0)
+        double_quotes = count.get('"', 0)
+        left_parenthesis = count.get('(', 0)
+        right_parenthesis = count.get(')', 0)
+
+        if single_quotes % 2 == 0 and double_quotes % 2 == 0 and left_parenthesis == right_parenthesis:
+            all_statements.append(curr_statement)
+            last_statement = ''
+        else:
+            last_statement = curr_statement
+
+    return [s.strip() for s in all_statements if ((s.strip() != "") and (last_statement == ""))]
+
+def build_seed_data(rows):
+    # one insert with every row, each one with semicolons inside its literals, as a seed data migration
+    values = ",\n".join(["(%d, 'name %d; with semicolon', 'html &amp; entities; &lt;%d&gt;')" % (i, i, i) for i in range(rows)])
+    return "create table seed (id int, name varchar(100), html varchar(100));\ninsert into seed values\n%s;\ndrop table old_seed;" % values
+
+def measure(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+def main(sizes, legacy_limit):
+    lexer = SQLLexer(SQLDialect())
+    print("%10s %12s %14s %14s" % ("rows", "size (KB)", "legacy (s)", "lexer (s)"))
+    for rows in sizes:
+        sql = build_seed_data(rows)
+
+        elapsed, result = measure(lexer.split, sql)
+        assert len(result) == 3
+
+        legacy_elapsed = "skipped"
+        if rows <= legacy_limit:
+            legacy_elapsed, legacy_result = measure(legacy_split, sql)
+            assert legacy_result == result
+            legacy_elapsed = "%.4f" % legacy_elapsed
+
+        print("%10d %12d %14s %14.4f" % (rows, len(sql) / 1024, legacy_elapsed, elapsed))
+
+if __name__ == '__main__':
+    sizes = [250, 500, 1000, 100000]
+    legacy_limit = 1000
+    if len(sys.argv) > 1:
+        sizes = [int(size) for size in sys.argv[1].split(',')]
+    if len(sys.argv) > 2:
+        legacy_limit = int(sys.argv[2])
+    main(sizes, legacy_limit)
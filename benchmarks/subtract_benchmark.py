@@ -0,0 +1,52 @@
+"""
+Compares the old O(n*m) subtraction of migration lists with Lists.subtract,
+used by Main to find which file migrations were not executed on database yet.
+
+usage: python benchmarks/subtract_benchmark.py [sizes separated by comma] [legacy size limit]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from simple_db_migrate.core import Migration
+from simple_db_migrate.helpers import Lists
+
+def legacy_subtract(list_a, list_b):
+    return [l for l in list_a if l not in list_b]
+
+def build_migrations(size):
+    return [Migration(version="%014d" % i, file_name="%014d_migration_%d.migration" % (i, i)) for i in range(size)]
+
+def measure(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+def main(sizes, legacy_limit):
+    print("%10s %10s %14s %14s" % ("files", "history", "legacy (s)", "subtract (s)"))
+    for size in sizes:
+        file_migrations = build_migrations(size)
+        # database is one migration behind the files
+        schema_migrations = build_migrations(size - 1)
+
+        elapsed, result = measure(Lists.subtract, file_migrations, schema_migrations)
+        assert len(result) == 1
+
+        legacy_elapsed = "skipped"
+        if size <= legacy_limit:
+            legacy_elapsed, legacy_result = measure(legacy_subtract, file_migrations, schema_migrations)
+            assert legacy_result == result
+            legacy_elapsed = "%.4f" % legacy_elapsed
+
+        print("%10d %10d %14s %14.4f" % (size, size - 1, legacy_elapsed, elapsed))
+
+if __name__ == '__main__':
+    sizes = [1000, 2500, 5000, 10000]
+    legacy_limit = 10000
+    if len(sys.argv) > 1:
+        sizes = [int(size) for size in sys.argv[1].split(',')]
+    if len(sys.argv) > 2:
+        legacy_limit = int(sys.argv[2])
+    main(sizes, legacy_limit)
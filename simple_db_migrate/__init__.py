@@ -6,6 +6,8 @@ import os
 from .cli import CLI
 from .config import FileConfig, Config
 from .main import Main
+from .fleet import Fleet
+from .report import RunReport
 
 SIMPLE_DB_MIGRATE_VERSION = '3.0.2'
 
@@ -29,6 +31,7 @@ def run(options):
             CLI.show_colors()
 
         # Create config
+        config_started = RunReport.clock()
         if options.get('config_file') or os.path.exists('simple-db-migrate.conf'):
             config = FileConfig(options.get('config_file') or 'simple-db-migrate.conf', options.get('environment'))
         else:
@@ -50,6 +53,29 @@ def run(options):
         config.update('database_host', options.get('database_host'))
         config.update('database_port', options.get('database_port'))
         config.update('database_name', options.get('database_name'))
+        config.update('jobs', options.get('jobs'))
+        config.update('jobs_mode', options.get('jobs_mode'))
+        config.update('lazy_load', options.get('lazy_load'))
+        config.update('no_cache', options.get('no_cache'))
+        config.update('clear_cache', options.get('clear_cache'))
+        config.update('single_transaction', options.get('single_transaction'))
+        config.update('insert_batch_size', options.get('insert_batch_size'))
+        config.update('merge_alter_table', options.get('merge_alter_table'))
+        config.update('targets_concurrency', options.get('targets_concurrency'))
+        config.update('continue_on_error', options.get('continue_on_error'))
+        config.update('fast_check', options.get('fast_check'))
+        config.update('advisory_lock', options.get('advisory_lock'))
+        config.update('advisory_lock_timeout', options.get('advisory_lock_timeout'))
+        config.update('report_top', options.get('report_top'))
+        config.update('report_file', options.get('report_file'))
+        config.update('version_table_metadata', options.get('version_table_metadata'))
+        config.update('progress', options.get('progress'))
+        config.update('durations_file', options.get('durations_file'))
+        config.update('profile', options.get('profile'))
+        config.update('trace_file', options.get('trace_file'))
+
+        if options.get('database_migrations_cache_dir'):
+            config.update('database_migrations_cache_dir', os.path.abspath(options.get('database_migrations_cache_dir')))
 
         if config.get('database_port', None):
             config.update('database_port', int(config.get('database_port')))
@@ -72,8 +98,10 @@ def run(options):
 
         config.update('log_level', log_level)
 
+        config_finished = RunReport.clock()
+
         # Ask the password for user if configured
-        if config.get('database_password') == '<<ask_me>>':
+        if config.get('database_password', None) == '<<ask_me>>':
             if options.get('password'):
                 passwd = options.get('password')
             else:
@@ -90,8 +118,28 @@ def run(options):
             else:
                 CLI.error_and_exit("The '%s' is a wrong parameter for info" % options.get('info_database').lower())
 
+        profiler = None
+        if config.get('profile', None):
+            from .profiler import Profiler
+            profiler = Profiler(config.get('profile'))
+            profiler.start()
+
         # If CLI was correctly parsed, execute db-migrate.
-        Main(config).execute()
+        try:
+            if config.get('database_targets', None) and not config.get('new_migration', None):
+                execution = Fleet(config)
+            else:
+                execution = Main(config)
+            if config.get('trace_file', None):
+                # the config is loaded before the execution and its timeline exist
+                execution.report.add_span("config", config_started, config_finished)
+            execution.execute()
+        finally:
+            if profiler is not None:
+                profiler.stop()
+                CLI.msg("\n__________ Profile __________", "YELLOW")
+                for line in profiler.summary():
+                    CLI.msg(line, "YELLOW")
     except KeyboardInterrupt:
         CLI.info_and_exit("\nExecution interrupted by user...")
     except Exception as e:
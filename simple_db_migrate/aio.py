@@ -0,0 +1,12 @@
+"""
+asyncio variants of the sgdb contract, Main and Fleet, so the status and the migrations of many databases
+are multiplexed on one event loop; python 3 only, this module is not imported by the package.
+
+The code is on simple_db_migrate.py3.aio, out of the modules compiled on python 2.
+"""
+import sys
+
+if (sys.version_info < (3, 5)):
+    raise ImportError("simple_db_migrate.aio needs python 3.5 or newer")
+
+from .py3.aio import AsyncFleet, AsyncMain, AsyncMySQL, AsyncTargetMain
@@ -167,7 +167,7 @@ class CLI(object):
                 "opt_str": ("--db-engine",),
                 "dest": "database_engine",
                 "default": None,
-                "help": "Set each engine to use as sgdb (mysql, oracle, mssql). (default: 'mysql')"
+                "help": "Set each engine to use as sgdb (mysql, oracle, mssql, sqlite). (default: 'mysql')"
             },
 
             {
@@ -220,6 +220,168 @@ class CLI(object):
                 "help": "List of directories where migrations are separated by a colon"
             },
 
+            {
+                "opt_str": ("--jobs",),
+                "dest": "jobs",
+                "default": None,
+                "type": int,
+                "help": "Number of workers used to load the migration files concurrently. (default: 1)"
+            },
+
+            {
+                "opt_str": ("--jobs-mode",),
+                "dest": "jobs_mode",
+                "default": None,
+                "help": "Kind of workers used to load the migration files when --jobs is greater than 1 (thread, process). (default: 'thread')"
+            },
+
+            {
+                "opt_str": ("--lazy-load",),
+                "action": "store_true",
+                "dest": "lazy_load",
+                "default": False,
+                "help": "Read the SQL_UP and SQL_DOWN of the migration files only when they are needed, usually only for the migrations to be executed."
+            },
+
+            {
+                "opt_str": ("--cache-dir",),
+                "dest": "database_migrations_cache_dir",
+                "default": None,
+                "help": "Directory used to cache the parsed migration files, so unchanged files are not interpreted again."
+            },
+
+            {
+                "opt_str": ("--no-cache",),
+                "action": "store_true",
+                "dest": "no_cache",
+                "default": False,
+                "help": "Ignore the migration files cache, interpreting all files again."
+            },
+
+            {
+                "opt_str": ("--clear-cache",),
+                "action": "store_true",
+                "dest": "clear_cache",
+                "default": False,
+                "help": "Remove all entries from the migration files cache before loading the files."
+            },
+
+            {
+                "opt_str": ("--single-transaction",),
+                "action": "store_true",
+                "dest": "single_transaction",
+                "default": False,
+                "help": "Execute each migration and its record on version table in the same transaction, committing only once, where the database allows it."
+            },
+
+            {
+                "opt_str": ("--insert-batch-size",),
+                "dest": "insert_batch_size",
+                "default": None,
+                "type": int,
+                "help": "Join consecutive INSERT ... VALUES statements into the same table in multi-row INSERTs of up to this number of rows (mysql and mssql). (default: 1, no batches)"
+            },
+
+            {
+                "opt_str": ("--merge-alter-table",),
+                "action": "store_true",
+                "dest": "merge_alter_table",
+                "default": False,
+                "help": "Merge consecutive ALTER TABLE statements of the same table which add, drop, change, modify or alter columns and indexes in a single ALTER TABLE, so the table is rebuilt only once (mysql)."
+            },
+
+            {
+                "opt_str": ("--targets-concurrency",),
+                "dest": "targets_concurrency",
+                "default": None,
+                "type": int,
+                "help": "Number of databases of DATABASE_TARGETS migrated at the same time. (default: 4)"
+            },
+
+            {
+                "opt_str": ("--continue-on-error",),
+                "action": "store_true",
+                "dest": "continue_on_error",
+                "default": False,
+                "help": "Keep migrating the other databases of DATABASE_TARGETS when one of them fails, instead of not starting the remaining ones."
+            },
+
+            {
+                "opt_str": ("--fast-check",),
+                "action": "store_true",
+                "dest": "fast_check",
+                "default": False,
+                "help": "Compare the fingerprint of the migration files with the one stored on the database with the current version and, when they match, exit without interpreting the files or reading the version table."
+            },
+
+            {
+                "opt_str": ("--advisory-lock",),
+                "action": "store_true",
+                "dest": "advisory_lock",
+                "default": False,
+                "help": "Take an advisory lock of the database while the migrations are planned and executed, so concurrent executions wait for each other and find the database already migrated."
+            },
+
+            {
+                "opt_str": ("--advisory-lock-timeout",),
+                "dest": "advisory_lock_timeout",
+                "default": None,
+                "type": int,
+                "help": "Seconds to wait for the advisory lock before giving up. (default: 300)"
+            },
+
+            {
+                "opt_str": ("--report-top",),
+                "dest": "report_top",
+                "default": None,
+                "type": int,
+                "help": "Show the time of each phase of the execution and this number of the slowest migrations and statements."
+            },
+
+            {
+                "opt_str": ("--report-file",),
+                "dest": "report_file",
+                "default": None,
+                "help": "Write the timings of the phases, migrations and statements of the execution to this JSON file."
+            },
+
+            {
+                "opt_str": ("--version-table-metadata",),
+                "action": "store_true",
+                "dest": "version_table_metadata",
+                "default": False,
+                "help": "Record with each migration executed the time it started, its duration, the number of statements and rows affected, the host and the simple-db-migrate version, adding these columns to the version table when needed."
+            },
+
+            {
+                "opt_str": ("--progress",),
+                "action": "store_true",
+                "dest": "progress",
+                "default": False,
+                "help": "Show the estimated time of the migrations and, after each one, the progress and the time remaining."
+            },
+
+            {
+                "opt_str": ("--durations-file",),
+                "dest": "durations_file",
+                "default": None,
+                "help": "JSON file written with --report-file on other executions, whose durations of the same migrations are used to estimate the time remaining."
+            },
+
+            {
+                "opt_str": ("--profile",),
+                "dest": "profile",
+                "default": None,
+                "help": "Profile the execution, writing the time of every function to this .pstats file and showing the peak memory and the time and memory of loading the migration files, parsing the SQL, calling the database driver and comparing the migrations."
+            },
+
+            {
+                "opt_str": ("--trace-file",),
+                "dest": "trace_file",
+                "default": None,
+                "help": "Write the timeline of the execution to this JSON file in the trace event format, which chrome://tracing and Perfetto open."
+            },
+
             {
                 "opt_str": ("--info",),
                 "dest": "info_database",
@@ -31,6 +31,13 @@ class Config(object):
             config_value = config_value or value
         self.put(config_key, config_value)
 
+    def copy(self, values=None):
+        # the values given replace the copied ones, even when they are empty
+        config = Config(dict(self._config))
+        for key, value in (values or {}).items():
+            config._config[key.lower()] = value
+        return config
+
     def remove(self, config_key):
         try:
             config_key = config_key.lower()
@@ -82,3 +89,8 @@ class FileConfig(Config):
         if migrations_dir:
             config_dir = os.path.split(config_file)[0]
             self.update("database_migrations_dir", FileConfig._parse_migrations_dir(migrations_dir, config_dir))
+
+        cache_dir = self.get("database_migrations_cache_dir", None)
+        if cache_dir and not os.path.isabs(cache_dir):
+            config_dir = os.path.split(config_file)[0]
+            self.update("database_migrations_cache_dir", os.path.abspath(os.path.join(config_dir, cache_dir)))
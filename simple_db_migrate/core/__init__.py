@@ -1,12 +1,19 @@
 from time import strftime, gmtime, localtime
 import codecs
+import hashlib
 import os
 import shutil
 import re
 import imp
 import tempfile
 import sys
+from bisect import bisect_left
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from simple_db_migrate.helpers import Utils
+from simple_db_migrate.report import RunReport
+from simple_db_migrate.sql import SQLFile
+from .cache import MigrationCache
 
 class Migration(object):
 
@@ -14,7 +21,9 @@ class Migration(object):
     MIGRATION_FILES_MASK = r"[0-9]{14}_[\w\-]+%s$" % MIGRATION_FILES_EXTENSION
     TEMPLATE = '#-*- coding:%s -*-\nSQL_UP = u"""\n\n"""\n\nSQL_DOWN = u"""\n\n"""\n'
 
-    def __init__(self, file=None, id=0, file_name="", version="", label=None, sql_up="", sql_down="", script_encoding="utf-8"):
+    def __init__(self, file=None, id=0, file_name="", version="", label=None, sql_up="", sql_down="", script_encoding="utf-8", cache=None, lazy=False):
+        self._commands_pending = False
+        self._cache = cache
         self.id = id
         self.file_name = file_name
         self.version = version
@@ -34,14 +43,58 @@ class Migration(object):
             self.abspath = os.path.abspath(file)
             self.file_name = file_name
             self.version = file_name[0:file_name.find("_")]
-            self.sql_up, self.sql_down = self._get_commands()
+            if lazy:
+                # SQL_UP and SQL_DOWN will be read when accessed for the first time
+                self.sql_up, self.sql_down = None, None
+                self._commands_pending = True
+            else:
+                self.sql_up, self.sql_down = self._get_commands(cache)
+
+    @property
+    def sql_up(self):
+        self._load_pending_commands()
+        return self._sql_up
+
+    @sql_up.setter
+    def sql_up(self, sql_up):
+        self._sql_up = sql_up
+
+    @property
+    def sql_down(self):
+        self._load_pending_commands()
+        return self._sql_down
+
+    @sql_down.setter
+    def sql_down(self, sql_down):
+        self._sql_down = sql_down
+
+    def _load_pending_commands(self):
+        if not self._commands_pending:
+            return
+
+        sql_up, sql_down = self._get_commands(self._cache)
+
+        # keep any value explicitly set before the commands were read
+        if self._sql_up is None:
+            self._sql_up = sql_up
+        if self._sql_down is None:
+            self._sql_down = sql_down
+        # only after the commands are set, as the migration may be shared by threads
+        self._commands_pending = False
+
+    def _get_commands(self, cache=None):
+        if cache:
+            cached_commands = cache.get(self.abspath, self.script_encoding)
+            if cached_commands:
+                return cached_commands
 
-    def _get_commands(self):
         try:
-            variables = Utils.get_variables_from_file(self.abspath, self.script_encoding)
-            SQL_UP = Migration.ensure_sql_unicode(variables['SQL_UP'], self.script_encoding)
-            SQL_DOWN = Migration.ensure_sql_unicode(variables['SQL_DOWN'], self.script_encoding)
-            (SQL_UP, SQL_DOWN)
+            variables = Utils.get_literal_variables_from_file(self.abspath, self.script_encoding)
+            if variables is None:
+                # the file builds its commands dynamically, so it has to be executed
+                variables = Utils.get_variables_from_file(self.abspath, self.script_encoding)
+            SQL_UP = self._get_command(variables, 'SQL_UP')
+            SQL_DOWN = self._get_command(variables, 'SQL_DOWN')
         except KeyError:
             raise Exception("migration file is incorrect; it does not define 'SQL_UP' or 'SQL_DOWN' (%s)" % self.abspath)
 
@@ -51,8 +104,32 @@ class Migration(object):
         if SQL_DOWN is None or SQL_DOWN == "":
             raise Exception("migration command 'SQL_DOWN' is empty (%s)" % self.abspath)
 
+        # commands read from sql files are not cached, the migration file only has their names
+        if cache and not isinstance(SQL_UP, SQLFile) and not isinstance(SQL_DOWN, SQLFile):
+            cache.put(self.abspath, self.script_encoding, SQL_UP, SQL_DOWN)
+
         return SQL_UP, SQL_DOWN
 
+    def _get_command(self, variables, name):
+        # SQL_UP_FILE and SQL_DOWN_FILE name a .sql or .sql.gz file, relative to the migration file
+        sql_file_name = variables.get('%s_FILE' % name)
+        if not sql_file_name:
+            return Migration.ensure_sql_unicode(variables[name], self.script_encoding)
+
+        sql_file_path = os.path.join(os.path.dirname(self.abspath), sql_file_name)
+        if not os.path.isfile(sql_file_path):
+            raise Exception("migration sql file does not exist (%s)" % sql_file_path)
+        return SQLFile(sql_file_path, self.script_encoding)
+
+    @staticmethod
+    def stored_sql(sql):
+        """
+        returns the sql saved on the version table; sql read from files is not saved
+        """
+        if isinstance(sql, SQLFile):
+            return ""
+        return sql
+
     def compare_to(self, another_migration):
         if self.version < another_migration.version:
             return -1
@@ -67,6 +144,13 @@ class Migration(object):
     def __eq__(self, other):
         return self.compare_to(other) == 0
 
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        # migrations are identified only by version and file name, as in compare_to
+        return hash((self.version, self.file_name))
+
     @staticmethod
     def sort_migrations_list(migrations, reverse=False):
         if (sys.version_info > (3, 0)):
@@ -116,18 +200,74 @@ class Migration(object):
 
         return new_file_name
 
+def _load_migration_file(args):
+    # module level function, so it can be pickled and used by a process pool
+    file_name, script_encoding, cache, lazy = args
+    try:
+        return Migration(file_name, script_encoding=script_encoding, cache=cache, lazy=lazy), None
+    except Exception as e:
+        return None, str(e)
+
 class SimpleDBMigrate(object):
 
-    def __init__(self, config):
+    JOBS_MODES = ("thread", "process")
+
+    def __init__(self, config, report=None):
         self._migrations_dir = config.get("database_migrations_dir")
         self._script_encoding=config.get("database_script_encoding", "utf-8")
+        self._jobs = int(config.get("jobs", 1))
+        self._jobs_mode = config.get("jobs_mode", "thread")
+        self._lazy_load = config.get("lazy_load", False)
+        if self._jobs_mode not in SimpleDBMigrate.JOBS_MODES:
+            raise Exception("invalid jobs mode ('%s'); it should be one of: %s" % (self._jobs_mode, ", ".join(SimpleDBMigrate.JOBS_MODES)))
+
+        self._cache = None
+        cache_dir = config.get("database_migrations_cache_dir", None)
+        if cache_dir:
+            if config.get("clear_cache", False):
+                MigrationCache(cache_dir).clear()
+            if not config.get("no_cache", False):
+                self._cache = MigrationCache(cache_dir)
+
+        # the discovery and the parsing of the files are on the timeline of the execution which loads them
+        self.report = report or RunReport()
         self.all_migrations = None
+        # the files are loaded only once, the error of the loading is raised on each use
+        self._load_error = None
+        self._fingerprint = None
+        self._indexed_migrations = None
+        self._migrations_by_version = {}
+        self._sorted_versions = []
 
     def get_all_migrations(self):
         if self.all_migrations:
             return self.all_migrations
+        if self._load_error is not None:
+            raise self._load_error
+
+        try:
+            self.all_migrations = self._load_all_migrations()
+        except Exception as e:
+            self._load_error = e
+            raise
+        return self.all_migrations
+
+    def _load_all_migrations(self):
+        with self.report.span("discovery"):
+            migration_files = self._get_migration_files()
+        with self.report.span("parse"):
+            migrations = self._load_migration_files(migration_files)
+
+        if self._cache:
+            self._cache.evict_all_but([migration.abspath for migration in migrations])
+
+        if len(migrations) == 0:
+            raise Exception("no migration files found")
+
+        return Migration.sort_migrations_list(migrations)
 
-        migrations = []
+    def _get_migration_files(self):
+        migration_files = []
 
         for _dir in self._migrations_dir:
             path = os.path.abspath(_dir)
@@ -140,31 +280,71 @@ class SimpleDBMigrate(object):
 
             for dir_file in dir_list:
                 if dir_file.endswith(Migration.MIGRATION_FILES_EXTENSION) and Migration.is_file_name_valid(dir_file):
-                    migration = Migration('%s/%s' % (path, dir_file), script_encoding=self._script_encoding)
-                    migrations.append(migration)
-
-        if len(migrations) == 0:
-            raise Exception("no migration files found")
-
-        self.all_migrations = Migration.sort_migrations_list(migrations)
-        return self.all_migrations
+                    migration_files.append('%s/%s' % (path, dir_file))
+
+        return migration_files
+
+    def get_migration_files_fingerprint(self):
+        if self._fingerprint:
+            return self._fingerprint
+
+        # the names and the content of the files, not interpreted; the same files
+        # give the same fingerprint in any directory and with any modification time
+        fingerprint = hashlib.sha1()
+        for migration_file in sorted(self._get_migration_files(), key=os.path.basename):
+            fingerprint.update(os.path.basename(migration_file).encode("utf-8"))
+            with open(migration_file, "rb") as f:
+                content = f.read()
+            fingerprint.update(("\n%d\n" % len(content)).encode("utf-8"))
+            fingerprint.update(content)
+        self._fingerprint = fingerprint.hexdigest()
+        return self._fingerprint
+
+    def _load_migration_files(self, migration_files):
+        args = [(migration_file, self._script_encoding, self._cache, self._lazy_load) for migration_file in migration_files]
+
+        # lazy migrations only read their names, there is nothing to gain with a pool
+        if self._jobs <= 1 or len(args) <= 1 or self._lazy_load:
+            results = [_load_migration_file(arg) for arg in args]
+        else:
+            pool = self._jobs_mode == "process" and Pool(self._jobs) or ThreadPool(self._jobs)
+            try:
+                results = pool.map(_load_migration_file, args, max(1, len(args) // (self._jobs * 4)))
+            finally:
+                pool.close()
+                pool.join()
+
+        errors = [error for (_, error) in results if error is not None]
+        if len(errors) == 1:
+            raise Exception(errors[0])
+        if len(errors) > 1:
+            raise Exception("%d migration files could not be loaded:\n%s" % (len(errors), "\n".join(errors)))
+
+        return [migration for (migration, _) in results]
+
+    def _get_versions_index(self):
+        migrations = self.get_all_migrations()
+        if self._indexed_migrations is not migrations:
+            self._migrations_by_version = {}
+            for migration in migrations:
+                # keep the first migration of each version, in the sorted order
+                self._migrations_by_version.setdefault(migration.version, migration)
+            self._sorted_versions = sorted([migration.version for migration in migrations])
+            self._indexed_migrations = migrations
+        return self._migrations_by_version, self._sorted_versions
 
     def get_all_migration_versions(self):
-        return [migration.version for migration in self.get_all_migrations()]
+        return list(self._get_versions_index()[1])
 
     def get_all_migration_versions_up_to(self, limit_version):
-        return [version for version in self.get_all_migration_versions() if version < limit_version]
+        sorted_versions = self._get_versions_index()[1]
+        return sorted_versions[:bisect_left(sorted_versions, limit_version)]
 
     def check_if_version_exists(self, version):
-        return version in self.get_all_migration_versions()
+        return version in self._get_versions_index()[0]
 
     def latest_version_available(self):
-        all_migrations = self.get_all_migrations()
-        all_migrations = Migration.sort_migrations_list(all_migrations, reverse=True)
-        return all_migrations[0].version
+        return self._get_versions_index()[1][-1]
 
     def get_migration_from_version_number(self, version):
-        migrations = [migration for migration in self.get_all_migrations() if migration.version == version]
-        if len(migrations) > 0:
-            return migrations[0]
-        return None
+        return self._get_versions_index()[0].get(version)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import tempfile
+
+class MigrationCache(object):
+
+    CACHE_FILES_EXTENSION = ".json"
+    CACHE_FORMAT_VERSION = 1
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+        if not os.path.exists(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                # another worker may have created it meanwhile
+                if not os.path.isdir(self.cache_dir):
+                    raise Exception("could not create cache directory ('%s')" % self.cache_dir)
+
+    def get(self, abspath, script_encoding):
+        entry_path = self._entry_path(abspath)
+        entry = self._read_entry(entry_path)
+        if entry is None:
+            return None
+
+        if entry.get("format") != MigrationCache.CACHE_FORMAT_VERSION or entry.get("path") != abspath or entry.get("encoding") != script_encoding:
+            self._remove(entry_path)
+            return None
+
+        try:
+            size, mtime = MigrationCache._file_signature(abspath)
+        except OSError:
+            self._remove(entry_path)
+            return None
+
+        if entry.get("size") != size:
+            self._remove(entry_path)
+            return None
+
+        if entry.get("mtime") != mtime:
+            # file was touched, check if its content really changed
+            if entry.get("hash") != MigrationCache._content_hash(abspath):
+                self._remove(entry_path)
+                return None
+            entry["mtime"] = mtime
+            self._write_entry(entry_path, entry)
+
+        return entry["sql_up"], entry["sql_down"]
+
+    def put(self, abspath, script_encoding, sql_up, sql_down):
+        size, mtime = MigrationCache._file_signature(abspath)
+        entry = {
+            "format": MigrationCache.CACHE_FORMAT_VERSION,
+            "path": abspath,
+            "encoding": script_encoding,
+            "size": size,
+            "mtime": mtime,
+            "hash": MigrationCache._content_hash(abspath),
+            "sql_up": sql_up,
+            "sql_down": sql_down,
+        }
+        self._write_entry(self._entry_path(abspath), entry)
+
+    def evict_all_but(self, abspaths):
+        valid_entries = set([os.path.basename(self._entry_path(abspath)) for abspath in abspaths])
+        for entry_file in self._list_entries():
+            if entry_file not in valid_entries:
+                self._remove(os.path.join(self.cache_dir, entry_file))
+
+    def clear(self):
+        for entry_file in self._list_entries():
+            self._remove(os.path.join(self.cache_dir, entry_file))
+
+    def _list_entries(self):
+        return [entry_file for entry_file in os.listdir(self.cache_dir) if entry_file.endswith(MigrationCache.CACHE_FILES_EXTENSION)]
+
+    def _entry_path(self, abspath):
+        key = hashlib.sha1(abspath.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "%s%s" % (key, MigrationCache.CACHE_FILES_EXTENSION))
+
+    def _read_entry(self, entry_path):
+        try:
+            with open(entry_path, "r") as f:
+                return json.load(f)
+        except (IOError, OSError):
+            return None
+        except ValueError:
+            # corrupted entry
+            self._remove(entry_path)
+            return None
+
+    def _write_entry(self, entry_path, entry):
+        # write to a temp file and rename it, so concurrent readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(json.dumps(entry))
+            try:
+                os.rename(temp_path, entry_path)
+            except OSError:
+                # windows does not replace existing files on rename
+                self._remove(entry_path)
+                os.rename(temp_path, entry_path)
+        except (IOError, OSError):
+            self._remove(temp_path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _file_signature(abspath):
+        stat = os.stat(abspath)
+        return stat.st_size, stat.st_mtime
+
+    @staticmethod
+    def _content_hash(abspath):
+        with open(abspath, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
@@ -0,0 +1,80 @@
+from . import Migration
+
+class SchemaHistory(object):
+    """
+    Snapshot of the version table, read once from the sgdb and kept up to date
+    in memory while the migrations are applied, so the lookups done during a run
+    do not need to query the database again.
+    """
+
+    def __init__(self, schema_migrations):
+        # migrations are expected ordered by id, as returned by get_all_schema_migrations
+        self.__migrations = list(schema_migrations)
+        self.__reindex()
+
+    @classmethod
+    def load(cls, sgdb):
+        # engines able to read the sql of some migrations later skip sql_up and sql_down here
+        if hasattr(sgdb, "get_schema_migrations_sql"):
+            return cls(sgdb.get_all_schema_migrations(with_sql=False))
+        return cls(sgdb.get_all_schema_migrations())
+
+    def read_sql(self, sgdb, ids):
+        ids = self.ids_without_sql(ids)
+        if not ids:
+            return
+        self.set_sql(ids, sgdb.get_schema_migrations_sql(ids))
+
+    def ids_without_sql(self, ids):
+        # only the migrations loaded without sql_up and sql_down are read from the sgdb
+        return [id for id in ids if id in self.__migrations_by_id and self.__migrations_by_id[id].sql_up is None and self.__migrations_by_id[id].sql_down is None]
+
+    def set_sql(self, ids, sql_by_id):
+        for id in ids:
+            migration = self.__migrations_by_id[id]
+            migration.sql_up, migration.sql_down = sql_by_id.get(id, ("", ""))
+
+    def __reindex(self):
+        self.__ids_by_version = {}
+        self.__versions_by_label = {}
+        self.__migrations_by_id = {}
+        for migration in self.__migrations:
+            # the most recent register wins, as the 'order by id desc' queries on the sgdb
+            self.__ids_by_version[str(migration.version)] = migration.id
+            self.__migrations_by_id[migration.id] = migration
+            if migration.label:
+                self.__versions_by_label[migration.label] = migration.version
+
+    def get_all_schema_migrations(self):
+        return list(self.__migrations)
+
+    def get_all_schema_versions(self):
+        return sorted([migration.version for migration in self.__migrations])
+
+    def get_current_schema_version(self):
+        if not self.__migrations:
+            return None
+        return self.__migrations[-1].version
+
+    def get_version_id_from_version_number(self, version):
+        return self.__ids_by_version.get(str(version)) or None
+
+    def get_version_number_from_label(self, label):
+        return self.__versions_by_label.get(label)
+
+    def get_migration_from_id(self, id):
+        return self.__migrations_by_id.get(id)
+
+    def record(self, migration, up=True, label_version=None):
+        if up:
+            # the real id is given by the database; a greater one keeps the order
+            last_id = self.__migrations and self.__migrations[-1].id or 0
+            self.__migrations.append(Migration(id=last_id + 1,
+                                               version=migration.version,
+                                               label=label_version,
+                                               file_name=migration.file_name,
+                                               sql_up=Migration.stored_sql(migration.sql_up),
+                                               sql_down=Migration.stored_sql(migration.sql_down)))
+        else:
+            self.__migrations = [schema_migration for schema_migration in self.__migrations if schema_migration.version != migration.version]
+        self.__reindex()
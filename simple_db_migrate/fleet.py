@@ -0,0 +1,171 @@
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from .cli import CLI
+from .log import LOG
+from .core import SimpleDBMigrate
+from .main import Main
+from .report import RunReport
+
+class TargetResult(object):
+
+    OK = "ok"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+    def __init__(self, name, status, version=None, error=None, elapsed=0, report=None):
+        self.name = name
+        self.status = status
+        self.version = version
+        self.error = error
+        self.elapsed = elapsed
+        self.report = report
+
+class TargetMain(Main):
+    """
+    Main executed on one of the databases of a Fleet, logging each message with the target name.
+    """
+
+    def __init__(self, name, fleet, config, sgdb=None, db_migrate=None):
+        self.name = name
+        self.fleet = fleet
+        super(TargetMain, self).__init__(config, sgdb, db_migrate)
+
+    def _execution_log(self, msg, color="CYAN", log_level_limit=2):
+        lines = ["[%s] %s" % (self.name, line) for line in msg.split("\n") if line.strip()]
+        if lines:
+            self.fleet._execution_log("\n".join(lines), color, log_level_limit)
+
+class Fleet(object):
+    """
+    Executes the migrations on many databases at once, listed on database_targets as dicts
+    with the configurations of each database, which replace the ones of the main config.
+    The migration files are loaded only once and shared by all executions.
+    """
+
+    def __init__(self, config, sgdb_factory=None):
+        self.config = config
+        self.targets = [self.__target(values) for values in config.get("database_targets")]
+        if not self.targets:
+            raise Exception("database_targets has no databases")
+        if config.get("paused_mode", False):
+            raise Exception("paused mode can not be used with database_targets")
+
+        self.concurrency = int(config.get("targets_concurrency", 4) or 4)
+        self.continue_on_error = config.get("continue_on_error", False)
+        self.log = LOG(config.get("log_dir", None))
+        # creates the sgdb of a target from its name and config, the engine of the config by default
+        self.sgdb_factory = sgdb_factory
+        # the timings of the loading of the files, each database has its own
+        self.report = RunReport.from_config(config)
+        self.db_migrate = SimpleDBMigrate(config, self.report)
+        self.results = []
+
+        self.__log_lock = threading.Lock()
+        self.__failed = threading.Event()
+
+    def __target(self, values):
+        values = dict([(key.lower(), value) for key, value in values.items()])
+        name = values.pop("name", None) or "%s/%s" % (values.get("database_host", self.config.get("database_host", None)), values.get("database_name", self.config.get("database_name", None)))
+        # the fleet keeps a single log file, a single run report file and a single trace file
+        values["log_dir"] = None
+        values["report_file"] = None
+        values["trace_file"] = None
+        return name, self.config.copy(values)
+
+    def execute(self):
+        self._execution_log("\nStarting DB migration on %d databases, %d at a time..." % (len(self.targets), min(self.concurrency, len(self.targets))), "PINK", log_level_limit=1)
+        # loading the files before the workers start, they only read the shared migrations
+        with self.report.phase("load"):
+            self.db_migrate.get_all_migration_versions()
+
+        self.results = []
+        self.__failed.clear()
+        pool = ThreadPool(min(self.concurrency, len(self.targets)))
+        try:
+            for result in pool.imap_unordered(self._execute_target, self.targets):
+                self.results.append(result)
+                if result.status != TargetResult.SKIPPED:
+                    self._execution_log("- %s %s in %.2fs (%d/%d)" % (result.name, result.status, result.elapsed, len(self.results), len(self.targets)), result.status == TargetResult.OK and "GREEN" or "RED", log_level_limit=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        # the summary follows the order of database_targets
+        order = dict([(name, index) for index, (name, _) in enumerate(self.targets)])
+        self.results.sort(key=lambda result: order[result.name])
+        self.report.finish()
+        self._log_summary()
+        self._write_report()
+        self._write_trace()
+
+        failed = [result for result in self.results if result.status == TargetResult.FAILED]
+        if failed:
+            raise Exception("migration failed on %d of %d databases (%s)" % (len(failed), len(self.targets), ", ".join([result.name for result in failed])))
+        self._execution_log("\nDone.\n", "PINK", log_level_limit=1)
+
+    def _execute_target(self, target):
+        name, config = target
+        # on fail fast the databases not started yet are left as they are
+        if self.__failed.is_set() and not self.continue_on_error:
+            return TargetResult(name, TargetResult.SKIPPED)
+
+        start = time.time()
+        main = None
+        sgdb = None
+        try:
+            sgdb = self.sgdb_factory and self.sgdb_factory(name, config) or None
+            main = TargetMain(name, self, config, sgdb, self.db_migrate)
+            main.execute()
+            return TargetResult(name, TargetResult.OK, self.__version(main), elapsed=time.time() - start, report=main.report)
+        except Exception as e:
+            self.__failed.set()
+            self._execution_log("[%s] [ERROR] %s" % (name, e), "RED", log_level_limit=1)
+            return TargetResult(name, TargetResult.FAILED, main and self.__version(main) or None, str(e), time.time() - start, main and main.report or None)
+        finally:
+            # Main only closes the sgdb it creates
+            if sgdb is not None and hasattr(sgdb, "close"):
+                sgdb.close()
+
+    def __version(self, main):
+        return main.schema_history and main.schema_history.get_current_schema_version() or None
+
+    def _log_summary(self):
+        rows = [("database", "status", "version", "time")]
+        for result in self.results:
+            rows.append((result.name, result.status, result.version or "-", "%.2fs" % result.elapsed))
+        widths = [max([len(str(row[column])) for row in rows]) for column in range(4)]
+
+        self._execution_log("\n__________ Summary __________", "YELLOW", log_level_limit=1)
+        for row in rows:
+            self._execution_log("  ".join([str(value).ljust(width) for value, width in zip(row, widths)]).rstrip(), "YELLOW", log_level_limit=1)
+        for result in self.results:
+            if result.error:
+                self._execution_log("%s: %s" % (result.name, result.error), "RED", log_level_limit=1)
+
+    def _write_report(self):
+        report_file = self.config.get("report_file", None)
+        if not report_file:
+            return
+
+        targets = []
+        for result in self.results:
+            targets.append({"name": result.name, "status": result.status, "report": result.report and result.report.to_dict() or None})
+        RunReport.write_json(report_file, {"targets": targets})
+
+    def _write_trace(self):
+        trace_file = self.config.get("trace_file", None)
+        if not trace_file:
+            return
+
+        # the loading of the files on the first track, then one track for each database
+        tracks = [("database_targets", self.report)]
+        tracks.extend([(result.name, result.report) for result in self.results if result.report is not None])
+        RunReport.write_trace(trace_file, tracks)
+
+    def _execution_log(self, msg, color="CYAN", log_level_limit=2):
+        # the messages of the databases executed at the same time are not mixed
+        with self.__log_lock:
+            if self.config.get("log_level", 1) >= log_level_limit:
+                CLI.msg(msg, color)
+            self.log.debug(msg)
@@ -1,4 +1,7 @@
+import ast
+import codecs
 import os
+import re
 import sys
 import tempfile
 
@@ -6,10 +9,18 @@ class Lists(object):
 
     @staticmethod
     def subtract(list_a, list_b):
-        return [l for l in list_a if l not in list_b]
+        try:
+            items_b = set(list_b)
+        except TypeError:
+            # unhashable items can only be compared one by one
+            items_b = list_b
+        return [l for l in list_a if l not in items_b]
 
 class Utils(object):
 
+    # PEP 263, on the first or the second line of the file
+    CODING_DECLARATION = re.compile(r"^[ \t\f]*#.*?coding[:=][ \t]*[-\w.]+", re.MULTILINE)
+
     @staticmethod
     def encode(string, codec):
         if (sys.version_info > (3, 0)):
@@ -23,6 +34,61 @@ class Utils(object):
             count[char] = count.get(char, 0) + 1
         return count
 
+    @staticmethod
+    def get_literal_variables_from_file(full_filename, file_encoding='utf-8'):
+        """
+        read the variables of a file which only assigns literal values, without executing it
+        returns None when the file has any other kind of code and has to be executed to get its variables
+        """
+        try:
+            if (sys.version_info > (3, 0)):
+                f = codecs.open(full_filename, "r", file_encoding)
+            else:
+                # python 2 uses the coding declaration of the file, as execfile does
+                f = open(full_filename, "rb")
+            try:
+                content = f.read()
+            finally:
+                f.close()
+        except IOError:
+            raise Exception("%s: file not found" % full_filename)
+        except UnicodeError:
+            return None
+
+        if (sys.version_info < (3, 0)) and not Utils.CODING_DECLARATION.search("\n".join(content.split("\n")[:2])):
+            # without a coding declaration python 2 would read the unicode literals as latin-1
+            content = "#-*- coding:%s -*-\n%s" % (file_encoding, content)
+
+        try:
+            tree = ast.parse(content, full_filename)
+        except (SyntaxError, TypeError, ValueError):
+            return None
+
+        variables = {}
+        for node in tree.body:
+            if isinstance(node, ast.Assign) and all(isinstance(target, ast.Name) for target in node.targets):
+                try:
+                    value = ast.literal_eval(node.value)
+                except (ValueError, TypeError, SyntaxError):
+                    return None
+                for target in node.targets:
+                    variables[target.id] = value
+            elif isinstance(node, ast.Expr) and Utils._is_literal(node.value):
+                # a docstring or any other expression without effect
+                continue
+            else:
+                return None
+
+        return variables
+
+    @staticmethod
+    def _is_literal(node):
+        try:
+            ast.literal_eval(node)
+            return True
+        except (ValueError, TypeError, SyntaxError):
+            return False
+
     @staticmethod
     def get_variables_from_file(full_filename, file_encoding='utf-8'):
         path, filename = os.path.split(full_filename)
@@ -2,15 +2,20 @@ import sys
 from .cli import CLI
 from .log import LOG
 from .core import Migration, SimpleDBMigrate
+from .core.history import SchemaHistory
 from .helpers import Lists
+from .progress import MigrationDurations, Progress
+from .report import RunReport
+from .sql import SQLFile
 from .config import Config
 
 """
 The sgbd class should implement the following methods
 - change(self, sql, new_db_version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None)
-  executes the migration (up or down) and records the change on version table
-- get_all_schema_migrations(self)
-  return all migrations saved on version table
+  executes the migration (up or down) and records the change on version table;
+  sql may be a simple_db_migrate.sql.SQLFile, whose statements are read with its statements(lexer) method
+- get_all_schema_migrations(self, with_sql=True)
+  return all migrations saved on version table; without sql_up and sql_down when with_sql is False
 - get_all_schema_versions(self)
   return all versions saved on version table
 - get_current_schema_version(self)
@@ -19,11 +24,31 @@ The sgbd class should implement the following methods
   return the id from an specific version
 - get_version_number_from_label(self, label)
   return the version of the last migration executed under the label
+
+and may implement
+- close(self)
+  closes the connection kept open during the whole execution
+- get_schema_migrations_sql(self, ids)
+  return a dict of (sql_up, sql_down) by id for the given migration ids; when implemented
+  the version table is read without sql_up and sql_down, which are read only for migrations down
+- merged_statements(self, sql)
+  return the statements the sgdb would execute joining others of the sql, each with the list
+  of the statements joined in it; shown when the sql is only logged
+- get_fingerprint(self)
+  return the fingerprint of the migration files stored with the current schema version,
+  in a single query; None when there is none or the version changed since it was stored
+- set_fingerprint(self, fingerprint, version)
+  stores the fingerprint of the migration files the database is up to date with
+- lock(self, timeout)
+  waits at most timeout seconds for an advisory lock of the database, shared by all
+  executions of simple-db-migrate on it, raising an exception when it is not granted
+- unlock(self)
+  releases the advisory lock
 """
 
 class Main(object):
 
-    def __init__(self, config, sgdb=None):
+    def __init__(self, config, sgdb=None, db_migrate=None):
         Main._check_configuration(config)
 
         self.cli = CLI()
@@ -31,6 +56,8 @@ class Main(object):
         self.log = LOG(self.config.get("log_dir", None))
 
         self.sgdb = sgdb
+        # the sgdb is only closed here when it was created here
+        self.__owns_sgdb = sgdb is None
         if self.sgdb is None and not self.config.get("new_migration", None):
             if self.config.get("database_engine") == 'mysql':
                 from .mysql import MySQL
@@ -41,17 +68,36 @@ class Main(object):
             elif self.config.get("database_engine") == 'mssql':
                 from .mssql import MSSQL
                 self.sgdb = MSSQL(config)
+            elif self.config.get("database_engine") == 'sqlite':
+                from .sqlite import SQLite
+                self.sgdb = SQLite(config)
             else:
                 raise Exception("engine not supported '%s'" % self.config.get("database_engine"))
 
-        self.db_migrate = SimpleDBMigrate(self.config)
+        # timings of the execution, with the ones of the connections and statements when the sgdb measures them
+        self.report = RunReport.from_config(self.config)
+        if isinstance(getattr(self.sgdb, "run_report", None), RunReport):
+            self.report = self.sgdb.run_report
+
+        # the migration files may be already loaded, shared by the executions on many databases
+        self.db_migrate = db_migrate or SimpleDBMigrate(self.config, self.report)
+        self.schema_history = None
+        # seconds waited for the advisory lock on the last execution
+        self.lock_wait_time = None
 
     def execute(self):
-        self._execution_log('\nStarting DB migration on host/database "%s/%s" with user "%s"...' % (self.config.get('database_host'), self.config.get('database_name'), self.config.get('database_user')), "PINK", log_level_limit=1)
-        if self.config.get("new_migration", None):
-            self._create_migration()
-        else:
-            self._migrate()
+        self._execution_log('\nStarting DB migration on host/database "%s/%s" with user "%s"...' % (self.config.get('database_host', None), self.config.get('database_name'), self.config.get('database_user', None)), "PINK", log_level_limit=1)
+        # the version table is read again on each execution
+        self.schema_history = None
+        try:
+            if self.config.get("new_migration", None):
+                self._create_migration()
+            else:
+                self._migrate()
+        finally:
+            self._close_sgdb()
+            if not self.config.get("new_migration", None):
+                self._report_run()
         self._execution_log("\nDone.\n", "PINK", log_level_limit=1)
 
     def last_label(self):
@@ -61,13 +107,26 @@ class Main(object):
     def labels(self):
         labels = []
 
-        migrations = self.sgdb.get_all_schema_migrations()
+        try:
+            migrations = SchemaHistory.load(self.sgdb).get_all_schema_migrations()
+        finally:
+            self._close_sgdb()
         for migration in migrations:
             if migration.label and (migration.label not in labels):
                 labels.append(migration.label)
 
         return labels
 
+    def _close_sgdb(self):
+        if not self.__owns_sgdb or self.sgdb is None or not hasattr(self.sgdb, "close"):
+            return
+
+        connection_count = getattr(self.sgdb, "connection_count", None)
+        round_trip_count = getattr(self.sgdb, "round_trip_count", None)
+        if isinstance(connection_count, int) and isinstance(round_trip_count, int):
+            self._execution_log("- %d connection(s) opened, %d round trip(s) to the database" % (connection_count, round_trip_count), log_level_limit=2)
+        self.sgdb.close()
+
     @staticmethod
     def _check_configuration(config):
         if not isinstance(config, Config):
@@ -76,6 +135,9 @@ class Main(object):
         required_configs = ['database_host', 'database_name', 'database_user', 'database_password', 'database_migrations_dir', 'database_engine', 'schema_version']
         if config.get("new_migration", None):
             required_configs = ['database_migrations_dir']
+        elif config.get("database_engine", None) == 'sqlite':
+            # sqlite databases are files, without server or users
+            required_configs = ['database_name', 'database_migrations_dir', 'database_engine', 'schema_version']
 
         for key in required_configs:
             #check if config has the key, if do not have will raise exception
@@ -86,23 +148,123 @@ class Main(object):
         new_file = Migration.create(self.config.get("new_migration", None), migrations_dir[0], self.config.get("database_script_encoding", "utf-8"), self.config.get("utc_timestamp", False))
         self._execution_log("- Created file '%s'" % (new_file), log_level_limit=1)
 
+    def _get_schema_history(self):
+        if self.schema_history is None:
+            self.schema_history = SchemaHistory.load(self.sgdb)
+        return self.schema_history
+
     def _migrate(self):
-        destination_version = self._get_destination_version()
+        fingerprint = None
+        if self._can_fast_check():
+            # neither the migration files nor the version table are read when nothing changed
+            with self.report.phase("load"):
+                fingerprint = self.db_migrate.get_migration_files_fingerprint()
+            if self._is_fingerprint_unchanged(fingerprint):
+                return
+
+        if not self._can_lock():
+            self._migrate_to_destination(fingerprint)
+            return
+
+        self._lock()
+        try:
+            # other execution may have migrated the database while this one waited for the lock
+            with self.report.phase("plan"):
+                is_up_to_date = self._is_up_to_date_after_lock(fingerprint)
+            if not is_up_to_date:
+                self._migrate_to_destination(fingerprint)
+        finally:
+            self._unlock()
+
+    def _is_fingerprint_unchanged(self, fingerprint):
+        with self.report.phase("plan"):
+            stored_fingerprint = self.sgdb.get_fingerprint()
+        if stored_fingerprint != fingerprint:
+            return False
+        self._execution_log("- Migration files unchanged since the last migration (fingerprint %s)" % fingerprint, "GREEN", log_level_limit=1)
+        self._execution_log("\nNothing to do.\n", "PINK", log_level_limit=1)
+        return True
+
+    def _can_lock(self):
+        if not self.config.get("advisory_lock", False) or not hasattr(self.sgdb, "lock"):
+            return False
+        # only showing the sql nothing is changed on the database
+        return not self.config.get("show_sql_only", False)
+
+    def _lock(self):
+        timeout = int(self.config.get("advisory_lock_timeout", 300))
+        start = RunReport.clock()
+        with self.report.phase("lock"):
+            self.sgdb.lock(timeout)
+        self.lock_wait_time = RunReport.clock() - start
+        self._execution_log("- Advisory lock acquired in %.2fs" % self.lock_wait_time, "GREEN", log_level_limit=1)
+
+    def _unlock(self):
+        try:
+            self.sgdb.unlock()
+        except Exception as e:
+            # the lock is released anyway when the connection is closed
+            self._execution_log("- Advisory lock not released: %s" % e, "YELLOW", log_level_limit=1)
+
+    def _is_up_to_date_after_lock(self, fingerprint):
+        if fingerprint is not None:
+            return self._is_fingerprint_unchanged(fingerprint)
+        if self.config.get("schema_version", None) is not None or self.config.get("label_version", None) is not None:
+            return False
+        if self.config.get("force_execute_old_migrations_versions", False):
+            return False
+
+        # only the last version is read, not the whole version table
         current_version = self.sgdb.get_current_schema_version()
+        if current_version != self.db_migrate.latest_version_available():
+            return False
+        self._execution_log("- Current version is: %s" % current_version, "GREEN", log_level_limit=1)
+        self._execution_log("- Destination version is: %s" % current_version, "GREEN", log_level_limit=1)
+        self._execution_log("\nNothing to do.\n", "PINK", log_level_limit=1)
+        return True
+
+    def _migrate_to_destination(self, fingerprint):
+        self._load_migrations()
+        with self.report.phase("plan"):
+            destination_version = self._get_destination_version()
+            current_version = self._get_schema_history().get_current_schema_version()
 
         # do it!
         self._execute_migrations(current_version, destination_version)
 
+        if fingerprint is not None and not self.config.get("show_sql_only", False):
+            with self.report.phase("record"):
+                self.sgdb.set_fingerprint(fingerprint, self._get_schema_history().get_current_schema_version())
+
+    def _load_migrations(self):
+        # the files are loaded on their first use, here to be measured apart from the planning
+        with self.report.phase("load"):
+            try:
+                self.db_migrate.get_all_migrations()
+            except Exception:
+                # kept by db_migrate and raised again, without loading the files again, where they are really needed;
+                # going down they may be not
+                pass
+
+    def _can_fast_check(self):
+        if not self.config.get("fast_check", False) or not hasattr(self.sgdb, "get_fingerprint"):
+            return False
+        # only migrations up to the last version available give the same result for the same files
+        if self.config.get("schema_version", None) is not None or self.config.get("label_version", None) is not None:
+            return False
+        return not self.config.get("force_execute_old_migrations_versions", False)
+
     def _get_destination_version(self):
         label_version = self.config.get("label_version", None)
         schema_version = self.config.get("schema_version", None)
+        schema_history = self._get_schema_history()
 
         destination_version = None
         destination_version_by_label = None
         destination_version_by_schema = None
 
         if label_version is not None:
-            destination_version_by_label = self.sgdb.get_version_number_from_label(label_version)
+            destination_version_by_label = schema_history.get_version_number_from_label(label_version)
             """
             if specified label exists at database and schema version was not specified,
             is equivalent to run simple-db-migrate with schema_version equals to the version with specified label
@@ -111,7 +273,7 @@ class Main(object):
                 schema_version = destination_version_by_label
                 self.config.update("schema_version", destination_version_by_label)
 
-        if schema_version is not None and self.sgdb.get_version_id_from_version_number(schema_version):
+        if schema_version is not None and schema_history.get_version_id_from_version_number(schema_version):
             destination_version_by_schema = schema_version
 
         if label_version is None:
@@ -133,7 +295,7 @@ class Main(object):
         if (schema_version is not None and label_version is not None) and ((destination_version_by_schema is not None and destination_version_by_label is None) or (destination_version_by_schema is None and destination_version_by_label is not None)):
             raise Exception("label (%s) or schema_version (%s), only one of them exists in the database" % (label_version, schema_version))
 
-        if destination_version != '0' and not (self.db_migrate.check_if_version_exists(destination_version) or self.sgdb.get_version_id_from_version_number(destination_version)):
+        if destination_version != '0' and not (self.db_migrate.check_if_version_exists(destination_version) or schema_history.get_version_id_from_version_number(destination_version)):
             raise Exception("version not found (%s)" % destination_version)
 
         return destination_version
@@ -142,7 +304,8 @@ class Main(object):
         if current_version == destination_version and not self.config.get("force_execute_old_migrations_versions", False):
             return []
 
-        schema_migrations = self.sgdb.get_all_schema_migrations()
+        schema_history = self._get_schema_history()
+        schema_migrations = schema_history.get_all_schema_migrations()
 
         # migration up
         if is_migration_up:
@@ -152,13 +315,15 @@ class Main(object):
             return remaining_migrations_to_execute
 
         # migration down...
-        destination_version_id = self.sgdb.get_version_id_from_version_number(destination_version)
+        destination_version_id = schema_history.get_version_id_from_version_number(destination_version)
         try:
-            migration_versions = self.db_migrate.get_all_migration_versions()
+            migration_versions = set(self.db_migrate.get_all_migration_versions())
         except:
-            migration_versions = []
+            migration_versions = set()
         down_migrations_to_execute = [migration for migration in schema_migrations if migration.id > destination_version_id]
         force_files = self.config.get("force_use_files_on_down", False)
+        if not force_files:
+            schema_history.read_sql(self.sgdb, [migration.id for migration in down_migrations_to_execute])
         for migration in down_migrations_to_execute:
             if not migration.sql_down or force_files:
                 if migration.version not in migration_versions:
@@ -181,13 +346,52 @@ class Main(object):
         didn't pass a version -> do migrations up until the last available version
         """
 
+        with self.report.phase("plan"):
+            is_migration_up = self._is_migration_up(current_version, destination_version)
+
+            # getting only the migration sql files to be executed
+            migrations_to_be_executed = self._get_migration_files_to_be_executed(current_version, destination_version, is_migration_up)
+
+        if not self._log_migrations_to_be_executed(current_version, destination_version, is_migration_up, migrations_to_be_executed):
+            return
+
+        with self.report.phase("plan"):
+            progress = self._get_progress(migrations_to_be_executed, is_migration_up)
+        if progress is not None:
+            self._execution_log(progress.estimate_line(), "CYAN", log_level_limit=1)
+
+        sql_statements_executed = []
+        for migration in migrations_to_be_executed:
+            if not self.config.get("show_sql_only", False):
+                self._execute_migration(migration, is_migration_up)
+                if progress is not None:
+                    progress.finished(self.report.migrations[-1].elapsed)
+                    self._execution_log(progress.line(), "CYAN", log_level_limit=1)
+            sql_statements_executed.extend(self._get_sql_statements_executed(migration, is_migration_up))
+
+        self._log_sql_statements_executed(sql_statements_executed)
+
+    def _get_progress(self, migrations, is_migration_up):
+        if not self.config.get("progress", False) or self.config.get("show_sql_only", False):
+            return None
+
+        # the durations of the version table are of the migrations already executed on this database, never
+        # the ones to execute, so only the reports of other executions have the durations of these
+        durations = MigrationDurations()
+        durations_file = self.config.get("durations_file", None)
+        if durations_file:
+            durations.read_report_file(durations_file)
+        return Progress(migrations, is_migration_up, durations)
+
+    def _is_migration_up(self, current_version, destination_version):
         is_migration_up = True
         # check if a version was passed to the program
         if self.config.get("schema_version"):
             # if was passed and this version is present in the database, check if is older than the current version
-            destination_version_id = self.sgdb.get_version_id_from_version_number(destination_version)
+            schema_history = self._get_schema_history()
+            destination_version_id = schema_history.get_version_id_from_version_number(destination_version)
             if destination_version_id:
-                current_version_id = self.sgdb.get_version_id_from_version_number(current_version)
+                current_version_id = schema_history.get_version_id_from_version_number(current_version)
                 # if this version is previous to the current version in database, then will be done a migration down to this version
                 if current_version_id > destination_version_id:
                     is_migration_up = False
@@ -195,16 +399,15 @@ class Main(object):
             # cause is trying to go down to something that never was done
             elif current_version > destination_version:
                 raise Exception("Trying to migrate to a lower version wich is not found on database (%s)" % destination_version)
+        return is_migration_up
 
-        # getting only the migration sql files to be executed
-        migrations_to_be_executed = self._get_migration_files_to_be_executed(current_version, destination_version, is_migration_up)
-
+    def _log_migrations_to_be_executed(self, current_version, destination_version, is_migration_up, migrations_to_be_executed):
         self._execution_log("- Current version is: %s" % current_version, "GREEN", log_level_limit=1)
 
         if migrations_to_be_executed is None or len(migrations_to_be_executed) == 0:
             self._execution_log("- Destination version is: %s" % current_version, "GREEN", log_level_limit=1)
             self._execution_log("\nNothing to do.\n", "PINK", log_level_limit=1)
-            return
+            return False
 
         self._execution_log("- Destination version is: %s" % (is_migration_up and migrations_to_be_executed[-1].version or destination_version), "GREEN", log_level_limit=1)
 
@@ -215,40 +418,71 @@ class Main(object):
             self._execution_log("\nStarting migration %s!" % up_down_label, log_level_limit=1)
 
         self._execution_log("*** versions: %s\n" % ([ migration.version for migration in migrations_to_be_executed]), "CYAN", log_level_limit=1)
+        return True
 
-        sql_statements_executed = []
-        for migration in migrations_to_be_executed:
-            sql = is_migration_up and migration.sql_up or migration.sql_down
+    def _execute_migration(self, migration, is_migration_up):
+        sql = is_migration_up and migration.sql_up or migration.sql_down
+        up_down_label = is_migration_up and "up" or "down"
+        self._execution_log("===== executing %s (%s) =====" % (migration.file_name, up_down_label), log_level_limit=1)
 
-            if not self.config.get("show_sql_only", False):
-                self._execution_log("===== executing %s (%s) =====" % (migration.file_name, up_down_label), log_level_limit=1)
+        label = None
+        if is_migration_up:
+            label = self.config.get("label_version", None)
 
-                label = None
-                if is_migration_up:
-                    label = self.config.get("label_version", None)
+        self.report.start_migration(migration.file_name, migration.version, is_migration_up)
+        try:
+            with self.report.phase("execute"):
+                self.sgdb.change(sql, migration.version, migration.file_name, Migration.stored_sql(migration.sql_up), Migration.stored_sql(migration.sql_down), is_migration_up, self._execution_log, label)
+        except Exception as e:
+            self._execution_log("===== ERROR executing %s (%s) =====" % (migration.abspath, up_down_label), log_level_limit=1)
+            raise e
+        finally:
+            self.report.end_migration()
+        self._get_schema_history().record(migration, is_migration_up, label)
+
+        # paused mode
+        if self.config.get("paused_mode", False):
+            if (sys.version_info > (3, 0)):
+                input("* press <enter> to continue... ")
+            else:
+                raw_input("* press <enter> to continue... ")
 
-                try:
-                    self.sgdb.change(sql, migration.version, migration.file_name, migration.sql_up, migration.sql_down, is_migration_up, self._execution_log, label)
-                except Exception as e:
-                    self._execution_log("===== ERROR executing %s (%s) =====" % (migration.abspath, up_down_label), log_level_limit=1)
-                    raise e
+    def _get_sql_statements_executed(self, migration, is_migration_up):
+        sql = is_migration_up and migration.sql_up or migration.sql_down
 
-                # paused mode
-                if self.config.get("paused_mode", False):
-                    if (sys.version_info > (3, 0)):
-                        input("* press <enter> to continue... ")
-                    else:
-                        raw_input("* press <enter> to continue... ")
+        # recording the last statement executed; sql files are not kept in memory, only their names
+        if isinstance(sql, SQLFile):
+            return [str(sql)]
+        sql_statements_executed = [sql]
 
-            # recording the last statement executed
-            sql_statements_executed.append(sql)
+        if self.config.get("show_sql_only", False) and hasattr(self.sgdb, "merged_statements"):
+            for statement, original_statements in self.sgdb.merged_statements(sql):
+                sql_statements_executed.append("-- %d statements would be merged in:\n%s;" % (len(original_statements), statement))
+        return sql_statements_executed
 
+    def _log_sql_statements_executed(self, sql_statements_executed):
         if self.config.get("show_sql", False) or self.config.get("show_sql_only", False):
             self._execution_log("__________ SQL statements executed __________", "YELLOW", log_level_limit=1)
             for sql in sql_statements_executed:
                 self._execution_log(sql, "YELLOW", log_level_limit=1)
             self._execution_log("_____________________________________________", "YELLOW", log_level_limit=1)
 
+    def _report_run(self):
+        self.report.finish()
+        report_top = int(self.config.get("report_top", 0))
+        if report_top > 0:
+            self._execution_log("\n__________ Run report __________", "YELLOW", log_level_limit=1)
+            for line in self.report.summary(report_top):
+                self._execution_log(line, "YELLOW", log_level_limit=1)
+
+        report_file = self.config.get("report_file", None)
+        if report_file:
+            RunReport.write_json(report_file, self.report.to_dict())
+
+        trace_file = self.config.get("trace_file", None)
+        if trace_file:
+            RunReport.write_trace(trace_file, [(self.config.get("database_name"), self.report)])
+
     def _execution_log(self, msg, color="CYAN", log_level_limit=2):
         if self.config.get("log_level", 1) >= log_level_limit:
             CLI.msg(msg, color)
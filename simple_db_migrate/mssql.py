@@ -1,8 +1,17 @@
 from .core import Migration
 from .core.exceptions import MigrationException
 from .helpers import Utils
+from .report import ExecutionMetadata, RunReport
+from .sql import InsertMerger, SQLDialect, SQLFile, SQLLexer, StatementBatcher
 
 class MSSQL(object):
+    # errors raised by _mssql when the connection to the server was lost
+    __lost_connection_errors = ("DBPROCESS is dead", "Read from the server failed", "Write to the server failed")
+    __sql_lexer = SQLLexer(SQLDialect(quotes={"'": "'", '"': '"', "[": "]"}))
+    # sql server accepts at most 1000 rows in a insert
+    __max_insert_rows = 1000
+    # columns of the version table with the metadata of the executions, in the order of ExecutionMetadata.COLUMNS
+    __metadata_columns = ("started_at datetime", "duration_ms int", "statements_count int", "rows_affected bigint", "hostname varchar(255)", "tool_version varchar(20)")
 
     def __init__(self, config=None, mssql_driver=None):
         self.__mssql_script_encoding = config.get("database_script_encoding", "utf8")
@@ -13,6 +22,20 @@ class MSSQL(object):
         self.__mssql_passwd = config.get("database_password")
         self.__mssql_db = config.get("database_name")
         self.__version_table = config.get("database_version_table")
+        self.__fingerprint_table = "%s_fingerprint" % self.__version_table
+        self.__lock_name = "simple-db-migrate.%s" % self.__version_table
+        self.__single_transaction = config.get("single_transaction", False)
+        self.__version_table_metadata = config.get("version_table_metadata", False)
+        self.__statement_batcher = StatementBatcher([InsertMerger(min(int(config.get("insert_batch_size", 1) or 1), MSSQL.__max_insert_rows))])
+
+        self.__connection = None
+        # if the advisory lock is held by the session
+        self.__locked = False
+        self.__connection_uses_database = False
+        self.connection_count = 0
+        self.round_trip_count = 0
+        # timings of the connections and statements, replaced by the one of the execution
+        self.run_report = RunReport.from_config(config, lambda: self.round_trip_count)
 
         self.__mssql_driver = mssql_driver
         if not mssql_driver:
@@ -26,72 +49,147 @@ class MSSQL(object):
         self._create_version_table_if_not_exists()
 
     def __mssql_connect(self, connect_using_database_name=True):
+        # the same connection is used during the whole execution
+        self.__check_lock_held()
         try:
-            conn = self.__mssql_driver.connect(server=self.__mssql_host, port=self.__mssql_port, user=self.__mssql_user, password=self.__mssql_passwd, charset=self.__mssql_encoding)
-            if connect_using_database_name:
-                conn.select_db(self.__mssql_db)
-            return conn
+            if self.__connection is None:
+                with self.run_report.phase("connect"):
+                    self.__connection = self.__mssql_driver.connect(server=self.__mssql_host, port=self.__mssql_port, user=self.__mssql_user, password=self.__mssql_passwd, charset=self.__mssql_encoding)
+                self.__connection_uses_database = False
+                self.connection_count += 1
+
+            if connect_using_database_name and not self.__connection_uses_database:
+                with self.run_report.phase("connect"):
+                    self.__connection.select_db(self.__mssql_db)
+                self.__connection_uses_database = True
+            return self.__connection
         except Exception as e:
+            self.__discard_connection()
             raise Exception("could not connect to database: %s" % e)
 
-    def __execute(self, sql, execution_log=None):
+    def __discard_connection(self):
+        conn, self.__connection = self.__connection, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def __check_lock_held(self):
+        if self.__locked and self.__connection is None:
+            raise MigrationException("the connection was lost while holding the advisory lock '%s', which was released with it" % self.__lock_name)
+
+    def __is_connection_lost(self, exception):
+        message = str(exception)
+        return any([error in message for error in MSSQL.__lost_connection_errors])
+
+    def __cancel(self, db, exception):
+        if self.__is_connection_lost(exception):
+            self.__discard_connection()
+            return
+        try:
+            db.cancel()
+            self.round_trip_count += 1
+        except Exception:
+            self.__discard_connection()
+
+    def __query(self, read_result):
+        # read only queries are executed again once if the connection was lost
+        for attempt in (1, 2):
+            db = self.__mssql_connect()
+            try:
+                self.round_trip_count += 1
+                return read_result(db)
+            except Exception as e:
+                if attempt == 1 and self.__is_connection_lost(e):
+                    self.__discard_connection()
+                    # the advisory lock is released with the connection, nothing is done without it
+                    self.__check_lock_held()
+                    continue
+                raise
+
+    def close(self):
+        self.__discard_connection()
+
+    def __execute(self, sql, execution_log=None, metadata=None):
         db = self.__mssql_connect()
         curr_statement = None
+        original_statements = []
         try:
-            statments = MSSQL._parse_sql_statements(sql)
-            if len(sql.strip(' \t\n\r')) != 0 and len(statments) == 0:
-                raise Exception("invalid sql syntax '%s'" % Utils.encode(sql, "utf-8"))
+            if isinstance(sql, SQLFile):
+                # the statements of sql files are read while they are executed
+                statments = sql.statements(MSSQL.__sql_lexer)
+            else:
+                statments = MSSQL._parse_sql_statements(sql)
+                if len(sql.strip(' \t\n\r')) != 0 and len(statments) == 0:
+                    raise Exception("invalid sql syntax '%s'" % Utils.encode(sql, "utf-8"))
 
-            for statement in statments:
-                curr_statement = statement
+            for statement, original_statements in self.__statement_batcher.batches(statments):
+                # on errors the statements are shown as they are in the migration
+                curr_statement = ";\n".join(original_statements)
+                self.round_trip_count += 1
+                start = RunReport.clock()
                 db.execute_non_query(statement)
-                affected_rows = db.rows_affected
+                affected_rows = db.rows_affected and int(db.rows_affected) or 0
+                self.run_report.statement(statement, RunReport.clock() - start, affected_rows)
+                if metadata is not None:
+                    metadata.statement(affected_rows)
                 if execution_log:
-                    execution_log("%s\n-- %d row(s) affected\n" % (statement, affected_rows and int(affected_rows) or 0))
+                    execution_log("%s\n-- %d row(s) affected\n" % (statement, affected_rows))
         except Exception as e:
-            db.cancel()
+            failed = None
+            if len(original_statements) > 1 and not self.__is_connection_lost(e):
+                failed = self.__find_failed_statement(db, original_statements)
+            self.__cancel(db, e)
+            if failed is not None:
+                index, error = failed
+                raise MigrationException("error executing migration: %s (statement %d of the %d executed together)" % (error, index + 1, len(original_statements)), original_statements[index])
             raise MigrationException("error executing migration: %s" % e, curr_statement)
-        finally:
-            db.close()
+
+    def __find_failed_statement(self, db, statements):
+        # the statements of a batch which failed are executed again one at a time to show which one failed, in a
+        # transaction rolled back after, or in a savepoint of the transaction of the migration when there is one
+        if not self.__statement_batcher.transactional(statements[0]):
+            return None
+        try:
+            self.round_trip_count += 1
+            db.execute_non_query(self.__single_transaction and "SAVE TRANSACTION simple_db_migrate_batch" or "BEGIN TRANSACTION simple_db_migrate_batch")
+            try:
+                for index, statement in enumerate(statements):
+                    try:
+                        self.round_trip_count += 1
+                        db.execute_non_query(statement)
+                    except Exception as e:
+                        return index, e
+            finally:
+                self.round_trip_count += 1
+                db.execute_non_query("ROLLBACK TRANSACTION simple_db_migrate_batch")
+        except Exception:
+            pass
+        return None
 
     @classmethod
     def _parse_sql_statements(cls, migration_sql):
-        all_statements = []
-        last_statement = ''
-
-        for statement in migration_sql.split(';'):
-            if len(last_statement) > 0:
-                curr_statement = '%s;%s' % (last_statement, statement)
-            else:
-                curr_statement = statement
-
-            count = Utils.count_occurrences(curr_statement)
-            single_quotes = count.get("'", 0)
-            double_quotes = count.get('"', 0)
-            left_parenthesis = count.get('(', 0)
-            right_parenthesis = count.get(')', 0)
-
-            if single_quotes % 2 == 0 and double_quotes % 2 == 0 and left_parenthesis == right_parenthesis:
-                all_statements.append(curr_statement)
-                last_statement = ''
-            else:
-                last_statement = curr_statement
+        return MSSQL.__sql_lexer.split(migration_sql)
 
-        return [s.strip() for s in all_statements if ((s.strip() != "") and (last_statement == ""))]
+    def merged_statements(self, sql):
+        return [batch for batch in self.__statement_batcher.batches(MSSQL._parse_sql_statements(sql)) if len(batch[1]) > 1]
 
     def _drop_database(self):
         db = self.__mssql_connect(False)
         try:
+            self.round_trip_count += 1
             db.execute_non_query("if exists ( select 1 from sysdatabases where name = '%s' ) drop database %s;" % (self.__mssql_db, self.__mssql_db))
         except Exception as e:
             raise Exception("can't drop database '%s'; \n%s" % (self.__mssql_db, str(e)))
         finally:
-            db.close()
+            # the dropped database can not be used anymore
+            self.__discard_connection()
 
     def _create_database_if_not_exists(self):
         db = self.__mssql_connect(False)
+        self.round_trip_count += 1
         db.execute_non_query("if not exists ( select 1 from sysdatabases where name = '%s' ) create database %s;" % (self.__mssql_db, self.__mssql_db))
-        db.close()
 
     def _create_version_table_if_not_exists(self):
         # create version table
@@ -99,16 +197,28 @@ class MSSQL(object):
         self.__execute(sql)
 
         # check if there is a register there
-        db = self.__mssql_connect()
-        count = db.execute_scalar("select count(*) from %s;" % self.__version_table)
-        db.close()
+        count = self.__query(lambda db: db.execute_scalar("select count(*) from %s;" % self.__version_table))
 
         # if there is not a version register, insert one
         if count == 0:
             sql = "insert into %s (version) values ('0');" % self.__version_table
             self.__execute(sql)
 
-    def __change_db_version(self, version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None):
+        if self.__version_table_metadata:
+            self._add_metadata_columns_if_not_exists()
+
+    def _add_metadata_columns_if_not_exists(self):
+        # version tables created without the metadata columns are upgraded in place
+        def read_columns(db):
+            db.execute_query("select name from syscolumns where id = object_id('%s');" % self.__version_table)
+            return [column['name'].lower() for column in db]
+
+        columns = self.__query(read_columns)
+        missing_columns = [column for column in MSSQL.__metadata_columns if column.split(" ")[0] not in columns]
+        if missing_columns:
+            self.__execute("alter table %s add %s;" % (self.__version_table, ", ".join(missing_columns)))
+
+    def __change_db_version(self, version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None, metadata=None):
         params = []
         params.append(version)
 
@@ -119,68 +229,143 @@ class MSSQL(object):
             params.append(migration_file_name)
             params.append(sql_up and Utils.encode(sql_up, self.__mssql_script_encoding) or "")
             params.append(sql_down and Utils.encode(sql_down, self.__mssql_script_encoding) or "")
+            if metadata is not None:
+                sql = "insert into %s (version, label, name, sql_up, sql_down, %s) values (%s);" % (self.__version_table, ", ".join(ExecutionMetadata.COLUMNS), ", ".join(["%s"] * (5 + len(ExecutionMetadata.COLUMNS))))
+                params.extend(metadata.values())
         else:
             # moving down and deleting from history
             sql = "delete from %s where version = %%s;" % (self.__version_table)
 
         db = self.__mssql_connect()
         try:
+            self.round_trip_count += 1
             db.execute_non_query(Utils.encode(sql, self.__mssql_script_encoding), tuple(params))
             if execution_log:
                 execution_log("migration %s registered\n" % (migration_file_name))
         except Exception as e:
-            db.cancel()
+            self.__cancel(db, e)
             raise MigrationException("error logging migration: %s" % e, migration_file_name)
-        finally:
-            db.close()
 
     def change(self, sql, new_db_version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None):
-        self.__execute(sql, execution_log)
-        self.__change_db_version(new_db_version, migration_file_name, sql_up, sql_down, up, execution_log, label_version)
+        if not self.__single_transaction:
+            self.__execute_migration(sql, new_db_version, migration_file_name, sql_up, sql_down, up, execution_log, label_version)
+            return
 
-    def get_current_schema_version(self):
+        # each statement is committed by itself unless an explicit transaction is opened
         db = self.__mssql_connect()
-        version = db.execute_scalar("select top 1 version from %s order by id desc" % self.__version_table) or 0
-        db.close()
-        return version
+        self.round_trip_count += 1
+        db.execute_non_query("BEGIN TRANSACTION")
+        try:
+            self.__execute_migration(sql, new_db_version, migration_file_name, sql_up, sql_down, up, execution_log, label_version)
+        except Exception:
+            self.__rollback_transaction()
+            raise
+
+        try:
+            self.round_trip_count += 1
+            db.execute_non_query("COMMIT TRANSACTION")
+        except Exception as e:
+            self.__rollback_transaction()
+            raise MigrationException("error committing migration: %s" % e, migration_file_name)
+
+    def __execute_migration(self, sql, new_db_version, migration_file_name, sql_up, sql_down, up, execution_log, label_version):
+        metadata = self.__version_table_metadata and up and ExecutionMetadata() or None
+        self.__execute(sql, execution_log, metadata)
+        if metadata is not None:
+            metadata.finish()
+        with self.run_report.phase("record"):
+            self.__change_db_version(new_db_version, migration_file_name, sql_up, sql_down, up, execution_log, label_version, metadata)
+
+    def __rollback_transaction(self):
+        if self.__connection is None:
+            return
+        try:
+            self.round_trip_count += 1
+            self.__connection.execute_non_query("IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION")
+        except Exception:
+            self.__discard_connection()
+
+    def get_current_schema_version(self):
+        return self.__query(lambda db: db.execute_scalar("select top 1 version from %s order by id desc" % self.__version_table)) or 0
 
     def get_all_schema_versions(self):
-        versions = []
-        db = self.__mssql_connect()
-        db.execute_query("select version from %s order by id;" % self.__version_table)
-        all_versions = db
-        for version in all_versions:
-            versions.append(version['version'])
-        db.close()
+        def read_versions(db):
+            db.execute_query("select version from %s order by id;" % self.__version_table)
+            return [version['version'] for version in db]
+
+        versions = self.__query(read_versions)
         versions.sort()
         return versions
 
     def get_version_id_from_version_number(self, version):
-        db = self.__mssql_connect()
-        result = db.execute_row("select id from %s where version = '%s' order by id desc;" % (self.__version_table, version))
-        _id = result and int(result['id']) or None
-        db.close()
-        return _id
+        result = self.__query(lambda db: db.execute_row("select id from %s where version = '%s' order by id desc;" % (self.__version_table, version)))
+        return result and int(result['id']) or None
 
     def get_version_number_from_label(self, label):
-        db = self.__mssql_connect()
-        result = db.execute_row("select version from %s where label = '%s' order by id desc" % (self.__version_table, label))
-        version = result and result['version'] or None
-        db.close()
-        return version
+        result = self.__query(lambda db: db.execute_row("select version from %s where label = '%s' order by id desc" % (self.__version_table, label)))
+        return result and result['version'] or None
+
+    def get_all_schema_migrations(self, with_sql=True):
+        columns = with_sql and "id, version, label, name, cast(sql_up as text) as sql_up, cast(sql_down as text) as sql_down" or "id, version, label, name"
+        def read_migrations(db):
+            db.execute_query("select %s from %s order by id;" % (columns, self.__version_table))
+            return list(db)
 
-    def get_all_schema_migrations(self):
         migrations = []
-        db = self.__mssql_connect()
-        db.execute_query("select id, version, label, name, cast(sql_up as text) as sql_up, cast(sql_down as text) as sql_down from %s order by id;" % self.__version_table)
-        all_migrations = db
+        all_migrations = self.__query(read_migrations)
         for migration_db in all_migrations:
+            # without the sql columns sql_up and sql_down are None, read later by get_schema_migrations_sql
             migration = Migration(id = int(migration_db['id']),
                                   version = migration_db['version'] and str(migration_db['version']) or None,
                                   label = migration_db['label'] and str(migration_db['label']) or None,
                                   file_name = migration_db['name'] and str(migration_db['name']) or None,
-                                  sql_up = Migration.ensure_sql_unicode(migration_db['sql_up'], self.__mssql_script_encoding),
-                                  sql_down = Migration.ensure_sql_unicode(migration_db['sql_down'], self.__mssql_script_encoding))
+                                  sql_up = None,
+                                  sql_down = None)
+            if with_sql:
+                migration.sql_up = Migration.ensure_sql_unicode(migration_db['sql_up'], self.__mssql_script_encoding)
+                migration.sql_down = Migration.ensure_sql_unicode(migration_db['sql_down'], self.__mssql_script_encoding)
             migrations.append(migration)
-        db.close()
         return migrations
+
+    def get_schema_migrations_sql(self, ids):
+        sql_by_id = {}
+        if not ids:
+            return sql_by_id
+
+        def read_sql(db):
+            db.execute_query("select id, cast(sql_up as text) as sql_up, cast(sql_down as text) as sql_down from %s where id in (%s);" % (self.__version_table, ", ".join(["%d" % int(id) for id in ids])))
+            return list(db)
+
+        for sql_db in self.__query(read_sql):
+            sql_by_id[int(sql_db['id'])] = (Migration.ensure_sql_unicode(sql_db['sql_up'], self.__mssql_script_encoding), Migration.ensure_sql_unicode(sql_db['sql_down'], self.__mssql_script_encoding))
+        return sql_by_id
+
+    def get_fingerprint(self):
+        # the fingerprint is valid only while the last version is the one it was stored with
+        sql = "select fingerprint from %s where version = (select top 1 version from %s order by id desc);" % (self.__fingerprint_table, self.__version_table)
+        try:
+            result = self.__query(lambda db: db.execute_row(sql))
+        except Exception:
+            # the table is created when the first fingerprint is stored
+            return None
+        return result and result['fingerprint'] or None
+
+    def set_fingerprint(self, fingerprint, version):
+        self.__execute("if not exists ( select 1 from sysobjects where name = '%s' and type = 'u' ) create table %s ( fingerprint varchar(64) NOT NULL, version varchar(20) NOT NULL );" % (self.__fingerprint_table, self.__fingerprint_table))
+        self.__execute("delete from %s;\ninsert into %s (fingerprint, version) values ('%s', '%s');" % (self.__fingerprint_table, self.__fingerprint_table, fingerprint, str(version)))
+
+    def lock(self, timeout):
+        # the lock belongs to the session, released when the connection is closed
+        sql = "declare @result int; exec @result = sp_getapplock @Resource = '%s', @LockMode = 'Exclusive', @LockOwner = 'Session', @LockTimeout = %d; select @result;" % (self.__lock_name, timeout * 1000)
+        result = self.__query(lambda db: db.execute_scalar(sql))
+        # 0 when the lock was granted at once and 1 after waiting for it
+        if result not in (0, 1):
+            raise Exception("could not get the advisory lock '%s' in %d seconds" % (self.__lock_name, timeout))
+        self.__locked = True
+
+    def unlock(self):
+        self.__locked = False
+        if self.__connection is None:
+            # released with the session lost
+            return
+        self.__query(lambda db: db.execute_non_query("exec sp_releaseapplock @Resource = '%s', @LockOwner = 'Session';" % self.__lock_name))
@@ -1,10 +1,20 @@
-import re
+import hashlib
 from .core import Migration
 from .core.exceptions import MigrationException
 from .helpers import Utils
+from .report import ExecutionMetadata, RunReport
+from .sql import AlterTableMerger, InsertMerger, SQLDialect, SQLFile, SQLLexer, StatementBatcher
 
 class MySQL(object):
-    __re_objects = re.compile("(?ims)(?P<pre>.*?)(?P<main>create[ \n\t\r]*(definer[ \n\t\r]*=[ \n\t\r]*[^ \n\t\r]*[ \n\t\r]*)?(trigger|function|procedure).*?)\n[ \n\t\r]*/([ \n\t\r]+(?P<pos>.*)|$)")
+    # errors raised by MySQLdb when the connection to the server was lost
+    __lost_connection_errors = (2006, 2013, 2055)
+    # procedures, functions and triggers go until a line with only a slash
+    __sql_lexer = SQLLexer(SQLDialect(quotes={"'": "'", '"': '"', "`": "`"},
+                                      backslash_escapes=True,
+                                      line_comments=("--", "#"),
+                                      block_start="create[ \n\t\r]*(definer[ \n\t\r]*=[ \n\t\r]*[^ \n\t\r]*[ \n\t\r]*)?(trigger|function|procedure)"))
+    # columns of the version table with the metadata of the executions, in the order of ExecutionMetadata.COLUMNS
+    __metadata_columns = ("started_at datetime", "duration_ms int(11)", "statements_count int(11)", "rows_affected bigint", "hostname varchar(255)", "tool_version varchar(20)")
 
     def __init__(self, config=None, mysql_driver=None):
         self.__mysql_script_encoding = config.get("database_script_encoding", "utf8")
@@ -15,6 +25,23 @@ class MySQL(object):
         self.__mysql_passwd = config.get("database_password")
         self.__mysql_db = config.get("database_name")
         self.__version_table = config.get("database_version_table")
+        self.__fingerprint_table = "%s_fingerprint" % self.__version_table
+        # locks are of the whole server, so the name has the database; longer names than the 64 characters of mysql are hashed
+        self.__lock_name = "simple-db-migrate.%s.%s" % (self.__mysql_db, self.__version_table)
+        if len(self.__lock_name) > 64:
+            self.__lock_name = "simple-db-migrate.%s" % hashlib.sha1(self.__lock_name.encode("utf-8")).hexdigest()
+        self.__single_transaction = config.get("single_transaction", False)
+        self.__version_table_metadata = config.get("version_table_metadata", False)
+        self.__statement_batcher = MySQL._statement_batcher(config)
+
+        self.__connection = None
+        # if the advisory lock is held by the connection
+        self.__locked = False
+        self.__connection_uses_database = False
+        self.connection_count = 0
+        self.round_trip_count = 0
+        # timings of the connections and statements, replaced by the one of the execution
+        self.run_report = RunReport.from_config(config, lambda: self.round_trip_count)
 
         self.__mysql_driver = mysql_driver
         if not mysql_driver:
@@ -28,42 +55,139 @@ class MySQL(object):
         self._create_version_table_if_not_exists()
 
     def __mysql_connect(self, connect_using_database_name=True):
+        # the same connection is used during the whole execution
+        self.__check_lock_held()
         try:
-            conn = self.__mysql_driver.connect(host=self.__mysql_host, port=self.__mysql_port, user=self.__mysql_user, passwd=self.__mysql_passwd)
+            if self.__connection is None:
+                with self.run_report.phase("connect"):
+                    conn = self.__mysql_driver.connect(host=self.__mysql_host, port=self.__mysql_port, user=self.__mysql_user, passwd=self.__mysql_passwd)
+                    self.connection_count += 1
 
-            conn.set_character_set(self.__mysql_encoding)
+                    conn.set_character_set(self.__mysql_encoding)
+                self.__connection = conn
+                self.__connection_uses_database = False
 
-            if connect_using_database_name:
-                conn.select_db(self.__mysql_db)
-            return conn
+            if connect_using_database_name and not self.__connection_uses_database:
+                with self.run_report.phase("connect"):
+                    self.__connection.select_db(self.__mysql_db)
+                self.__connection_uses_database = True
+            return self.__connection
         except Exception as e:
+            self.__discard_connection()
             raise Exception("could not connect to database: %s" % e)
 
-    def __execute(self, sql, execution_log=None):
+    def __discard_connection(self):
+        conn, self.__connection = self.__connection, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def __check_lock_held(self):
+        if self.__locked and self.__connection is None:
+            raise MigrationException("the connection was lost while holding the advisory lock '%s', which was released with it" % self.__lock_name)
+
+    def __is_connection_lost(self, exception):
+        args = getattr(exception, "args", None) or (None,)
+        return args[0] in MySQL.__lost_connection_errors
+
+    def __rollback(self, db, exception):
+        if self.__is_connection_lost(exception):
+            self.__discard_connection()
+            return
+        try:
+            db.rollback()
+            self.round_trip_count += 1
+        except Exception:
+            self.__discard_connection()
+
+    def __query(self, sql, fetch_all=False):
+        # read only queries are executed again once if the connection was lost
+        for attempt in (1, 2):
+            db = self.__mysql_connect()
+            cursor = db.cursor()
+            try:
+                self.round_trip_count += 1
+                cursor.execute(sql)
+                return cursor.fetchall() if fetch_all else cursor.fetchone()
+            except Exception as e:
+                if attempt == 1 and self.__is_connection_lost(e):
+                    self.__discard_connection()
+                    # the advisory lock is released with the connection, nothing is done without it
+                    self.__check_lock_held()
+                    continue
+                raise
+            finally:
+                cursor.close()
+
+    def close(self):
+        self.__discard_connection()
+
+    def __execute(self, sql, execution_log=None, commit=True, metadata=None):
         db = self.__mysql_connect()
         cursor = db.cursor()
         cursor._defer_warnings = True
         curr_statement = None
+        original_statements = []
         try:
-            statments = MySQL._parse_sql_statements(sql)
-            if len(sql.strip(' \t\n\r')) != 0 and len(statments) == 0:
-                raise Exception("invalid sql syntax '%s'" % Utils.encode(sql, "utf-8"))
-
-            for statement in statments:
-                curr_statement = statement
+            statments = MySQL._sql_statements(sql)
+            for statement, original_statements in self.__statement_batcher.batches(statments):
+                # on errors the statements are shown as they are in the migration
+                curr_statement = ";\n".join(original_statements)
+                self.round_trip_count += 1
+                start = RunReport.clock()
                 affected_rows = cursor.execute(Utils.encode(statement, self.__mysql_script_encoding))
+                affected_rows = affected_rows and int(affected_rows) or 0
+                self.run_report.statement(statement, RunReport.clock() - start, affected_rows)
+                if metadata is not None:
+                    metadata.statement(affected_rows)
                 if execution_log:
-                    execution_log("%s\n-- %d row(s) affected\n" % (statement, affected_rows and int(affected_rows) or 0))
+                    execution_log("%s\n-- %d row(s) affected\n" % (statement, affected_rows))
             cursor.close()
-            db.commit()
+            if commit:
+                db.commit()
+                self.round_trip_count += 1
         except Exception as e:
-            db.rollback()
+            failed = None
+            if len(original_statements) > 1 and not self.__is_connection_lost(e):
+                failed = self.__find_failed_statement(cursor, original_statements)
+            self.__rollback(db, e)
+            if failed is not None:
+                index, error = failed
+                raise MigrationException("error executing migration: %s (statement %d of the %d executed together)" % (error, index + 1, len(original_statements)), original_statements[index])
             raise MigrationException("error executing migration: %s" % e, curr_statement)
-        finally:
-            db.close()
 
-    def __change_db_version(self, version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None):
-        if up:
+    def __find_failed_statement(self, cursor, statements):
+        # the statements of a batch which failed are executed again one at a time to show which one failed,
+        # in a savepoint rolled back after; the statements which commit by themselves are not executed again
+        if not self.__statement_batcher.transactional(statements[0]):
+            return None
+        try:
+            self.round_trip_count += 1
+            cursor.execute("savepoint simple_db_migrate_batch")
+            try:
+                for index, statement in enumerate(statements):
+                    try:
+                        self.round_trip_count += 1
+                        cursor.execute(Utils.encode(statement, self.__mysql_script_encoding))
+                    except Exception as e:
+                        return index, e
+            finally:
+                self.round_trip_count += 1
+                cursor.execute("rollback to savepoint simple_db_migrate_batch")
+        except Exception:
+            pass
+        return None
+
+    def __change_db_version(self, version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None, metadata=None):
+        params = None
+        if up and metadata is not None:
+            # moving up and storing history with the metadata, as parameters escaped by the driver
+            columns = ("version", "label", "name", "sql_up", "sql_down") + ExecutionMetadata.COLUMNS
+            sql = "insert into %s (%s) values (%s);" % (self.__version_table, ", ".join(columns), ", ".join(["%s"] * len(columns)))
+            params = (str(version), label_version and str(label_version) or None, migration_file_name, sql_up, sql_down) + metadata.values()
+        elif up:
             if not label_version:
                 label_version = "NULL"
             else:
@@ -78,66 +202,60 @@ class MySQL(object):
         cursor = db.cursor()
         cursor._defer_warnings = True
         try:
-            cursor.execute(Utils.encode(sql, self.__mysql_script_encoding))
+            self.round_trip_count += 1
+            if params is None:
+                cursor.execute(Utils.encode(sql, self.__mysql_script_encoding))
+            else:
+                cursor.execute(Utils.encode(sql, self.__mysql_script_encoding), params)
             cursor.close()
             db.commit()
+            self.round_trip_count += 1
             if execution_log:
                 execution_log("migration %s registered\n" % (migration_file_name))
         except Exception as e:
-            db.rollback()
+            self.__rollback(db, e)
             raise MigrationException("error logging migration: %s" % e, migration_file_name)
-        finally:
-            db.close()
 
     @classmethod
     def _parse_sql_statements(cls, migration_sql):
-        all_statements = []
-        last_statement = ''
+        return MySQL.__sql_lexer.split(migration_sql)
 
-        match_stmt = MySQL.__re_objects.match(migration_sql)
+    @classmethod
+    def _sql_statements(cls, sql):
+        if isinstance(sql, SQLFile):
+            # the statements of sql files are read while they are executed
+            return sql.statements(MySQL.__sql_lexer)
 
-        if match_stmt and match_stmt.re.groups > 0:
-            if match_stmt.group('pre'):
-                all_statements = all_statements + MySQL._parse_sql_statements(match_stmt.group('pre'))
-            if match_stmt.group('main'):
-                all_statements.append(match_stmt.group('main'))
-            if match_stmt.group('pos'):
-                all_statements = all_statements + MySQL._parse_sql_statements(match_stmt.group('pos'))
+        statments = MySQL._parse_sql_statements(sql)
+        if len(sql.strip(' \t\n\r')) != 0 and len(statments) == 0:
+            raise Exception("invalid sql syntax '%s'" % Utils.encode(sql, "utf-8"))
+        return statments
 
-        else:
-            for statement in migration_sql.split(';'):
-                if len(last_statement) > 0:
-                    curr_statement = '%s;%s' % (last_statement, statement)
-                else:
-                    curr_statement = statement
-
-                count = Utils.count_occurrences(curr_statement)
-                single_quotes = count.get("'", 0)
-                double_quotes = count.get('"', 0)
-                left_parenthesis = count.get('(', 0)
-                right_parenthesis = count.get(')', 0)
-
-                if single_quotes % 2 == 0 and double_quotes % 2 == 0 and left_parenthesis == right_parenthesis:
-                    all_statements.append(curr_statement)
-                    last_statement = ''
-                else:
-                    last_statement = curr_statement
-
-        return [s.strip() for s in all_statements if ((s.strip() != "") and (last_statement == ""))]
+    @classmethod
+    def _statement_batcher(cls, config):
+        mergers = [InsertMerger(config.get("insert_batch_size", 1), backslash_escapes=True)]
+        if config.get("merge_alter_table", False):
+            mergers.append(AlterTableMerger(backslash_escapes=True))
+        return StatementBatcher(mergers)
+
+    def merged_statements(self, sql):
+        return [batch for batch in self.__statement_batcher.batches(MySQL._parse_sql_statements(sql)) if len(batch[1]) > 1]
 
     def _drop_database(self):
         db = self.__mysql_connect(False)
         try:
+            self.round_trip_count += 1
             db.query("set foreign_key_checks=0; drop database if exists `%s`;" % self.__mysql_db)
         except Exception as e:
             raise Exception("can't drop database '%s'; \n%s" % (self.__mysql_db, str(e)))
         finally:
-            db.close()
+            # the dropped database can not be used anymore, neither the multi statement results
+            self.__discard_connection()
 
     def _create_database_if_not_exists(self):
         db = self.__mysql_connect(False)
+        self.round_trip_count += 1
         db.query("create database if not exists `%s`;" % self.__mysql_db)
-        db.close()
 
     def _create_version_table_if_not_exists(self):
         # create version table
@@ -145,78 +263,103 @@ class MySQL(object):
         self.__execute(sql)
 
         # check if there is a register there
-        db = self.__mysql_connect()
-        cursor = db.cursor()
-        cursor.execute("select count(*) from %s;" % self.__version_table)
-        count = cursor.fetchone()[0]
-        cursor.close()
-        db.close()
+        count = self.__query("select count(*) from %s;" % self.__version_table)[0]
 
         # if there is not a version register, insert one
         if count == 0:
             sql = "insert into %s (version) values (\"0\");" % self.__version_table
             self.__execute(sql)
 
+        if self.__version_table_metadata:
+            self._add_metadata_columns_if_not_exists()
+
+    def _add_metadata_columns_if_not_exists(self):
+        # version tables created without the metadata columns are upgraded in place
+        columns = [column[0].lower() for column in self.__query("select column_name from information_schema.columns where table_schema = database() and table_name = '%s';" % self.__version_table, fetch_all=True)]
+        missing_columns = [column for column in MySQL.__metadata_columns if column.split(" ")[0] not in columns]
+        if missing_columns:
+            self.__execute("alter table %s %s;" % (self.__version_table, ", ".join(["add column %s" % column for column in missing_columns])))
+
     def change(self, sql, new_db_version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None):
-        self.__execute(sql, execution_log)
-        self.__change_db_version(new_db_version, migration_file_name, sql_up, sql_down, up, execution_log, label_version)
+        metadata = self.__version_table_metadata and up and ExecutionMetadata() or None
+        # on single transaction the commit of the version table record also commits the migration
+        self.__execute(sql, execution_log, commit=not self.__single_transaction, metadata=metadata)
+        if metadata is not None:
+            metadata.finish()
+        with self.run_report.phase("record"):
+            self.__change_db_version(new_db_version, migration_file_name, sql_up, sql_down, up, execution_log, label_version, metadata)
 
     def get_current_schema_version(self):
-        db = self.__mysql_connect()
-        cursor = db.cursor()
-        cursor.execute("select version from %s order by id desc limit 0,1;" % self.__version_table)
-        version = cursor.fetchone()[0]
-        cursor.close()
-        db.close()
-        return version
+        return self.__query("select version from %s order by id desc limit 0,1;" % self.__version_table)[0]
 
     def get_all_schema_versions(self):
         versions = []
-        db = self.__mysql_connect()
-        cursor = db.cursor()
-        cursor.execute("select version from %s order by id;" % self.__version_table)
-        all_versions = cursor.fetchall()
+        all_versions = self.__query("select version from %s order by id;" % self.__version_table, fetch_all=True)
         for version in all_versions:
             versions.append(version[0])
-        cursor.close()
-        db.close()
         versions.sort()
         return versions
 
     def get_version_id_from_version_number(self, version):
-        db = self.__mysql_connect()
-        cursor = db.cursor()
-        cursor.execute("select id from %s where version = '%s' order by id desc;" % (self.__version_table, version))
-        result = cursor.fetchone()
-        _id = result and int(result[0]) or None
-        cursor.close()
-        db.close()
-        return _id
+        result = self.__query("select id from %s where version = '%s' order by id desc;" % (self.__version_table, version))
+        return result and int(result[0]) or None
 
     def get_version_number_from_label(self, label):
-        db = self.__mysql_connect()
-        cursor = db.cursor()
-        cursor.execute("select version from %s where label = '%s' order by id desc" % (self.__version_table, label))
-        result = cursor.fetchone()
-        version = result and result[0] or None
-        cursor.close()
-        db.close()
-        return version
-
-    def get_all_schema_migrations(self):
+        result = self.__query("select version from %s where label = '%s' order by id desc" % (self.__version_table, label))
+        return result and result[0] or None
+
+    def get_all_schema_migrations(self, with_sql=True):
         migrations = []
-        db = self.__mysql_connect()
-        cursor = db.cursor()
-        cursor.execute("select id, version, label, name, sql_up, sql_down from %s order by id;" % self.__version_table)
-        all_migrations = cursor.fetchall()
+        columns = with_sql and "id, version, label, name, sql_up, sql_down" or "id, version, label, name"
+        all_migrations = self.__query("select %s from %s order by id;" % (columns, self.__version_table), fetch_all=True)
         for migration_db in all_migrations:
+            # without the sql columns sql_up and sql_down are None, read later by get_schema_migrations_sql
             migration = Migration(id = int(migration_db[0]),
                                   version = migration_db[1] and str(migration_db[1]) or None,
                                   label = migration_db[2] and str(migration_db[2]) or None,
                                   file_name = migration_db[3] and str(migration_db[3]) or None,
-                                  sql_up = Migration.ensure_sql_unicode(migration_db[4], self.__mysql_script_encoding),
-                                  sql_down = Migration.ensure_sql_unicode(migration_db[5], self.__mysql_script_encoding))
+                                  sql_up = None,
+                                  sql_down = None)
+            if with_sql:
+                migration.sql_up = Migration.ensure_sql_unicode(migration_db[4], self.__mysql_script_encoding)
+                migration.sql_down = Migration.ensure_sql_unicode(migration_db[5], self.__mysql_script_encoding)
             migrations.append(migration)
-        cursor.close()
-        db.close()
         return migrations
+
+    def get_schema_migrations_sql(self, ids):
+        sql_by_id = {}
+        if not ids:
+            return sql_by_id
+
+        all_sql = self.__query("select id, sql_up, sql_down from %s where id in (%s);" % (self.__version_table, ", ".join(["%d" % int(id) for id in ids])), fetch_all=True)
+        for sql_db in all_sql:
+            sql_by_id[int(sql_db[0])] = (Migration.ensure_sql_unicode(sql_db[1], self.__mysql_script_encoding), Migration.ensure_sql_unicode(sql_db[2], self.__mysql_script_encoding))
+        return sql_by_id
+
+    def get_fingerprint(self):
+        # the fingerprint is valid only while the last version is the one it was stored with
+        sql = "select fingerprint from %s where version = (select version from %s order by id desc limit 0,1);" % (self.__fingerprint_table, self.__version_table)
+        try:
+            result = self.__query(sql)
+        except Exception:
+            # the table is created when the first fingerprint is stored
+            return None
+        return result and result[0] or None
+
+    def set_fingerprint(self, fingerprint, version):
+        self.__execute("create table if not exists %s ( fingerprint varchar(64) NOT NULL, version varchar(20) NOT NULL );" % self.__fingerprint_table)
+        self.__execute("delete from %s;\ninsert into %s (fingerprint, version) values (\"%s\", \"%s\");" % (self.__fingerprint_table, self.__fingerprint_table, fingerprint, str(version)))
+
+    def lock(self, timeout):
+        # the lock belongs to the connection, released when it is closed
+        result = self.__query("select get_lock('%s', %d);" % (self.__lock_name, timeout))
+        if not result or result[0] != 1:
+            raise Exception("could not get the advisory lock '%s' in %d seconds" % (self.__lock_name, timeout))
+        self.__locked = True
+
+    def unlock(self):
+        self.__locked = False
+        if self.__connection is None:
+            # released with the connection lost
+            return
+        self.__query("select release_lock('%s');" % self.__lock_name)
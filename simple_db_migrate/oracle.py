@@ -1,16 +1,24 @@
+import hashlib
 import os
-import re
 import sys
 
 from .core import Migration
 from .core.exceptions import MigrationException
 from .helpers import Utils
+from .report import ExecutionMetadata, RunReport
+from .sql import SQLDialect, SQLFile, SQLLexer
 from getpass import getpass
 from .cli import CLI
 
 class Oracle(object):
-    __re_objects = re.compile("(?ims)(?P<pre>.*?)(?P<main>create[ \n\t\r]*(or[ \n\t\r]+replace[ \n\t\r]*)?(trigger|function|procedure|package|package body).*?)\n[ \n\t\r]*/([ \n\t\r]+(?P<pos>.*)|$)")
-    __re_anonymous = re.compile("(?ims)(?P<pre>.*?)(?P<main>(declare[ \n\t\r]+.*?)?begin.*?\n[ \n\t\r]*)/([ \n\t\r]+(?P<pos>.*)|$)")
+    # errors raised by cx_Oracle when the connection to the server was lost
+    __lost_connection_errors = ("ORA-03113", "ORA-03114", "ORA-03135", "DPI-1080")
+    # oracle accepts at most 1000 expressions in a list
+    __max_in_list_size = 1000
+    # stored objects and anonymous blocks go until a line with only a slash
+    __sql_lexer = SQLLexer(SQLDialect(block_start="create[ \n\t\r]*(or[ \n\t\r]+replace[ \n\t\r]*)?(trigger|function|procedure|package)|declare[ \n\t\r]|begin"))
+    # columns of the version table with the metadata of the executions, in the order of ExecutionMetadata.COLUMNS
+    __metadata_columns = ("started_at timestamp", "duration_ms number(11)", "statements_count number(11)", "rows_affected number(19)", "hostname varchar2(255)", "tool_version varchar2(20)")
 
     def __init__(self, config=None, driver=None, get_pass=getpass, std_in=sys.stdin):
         self.__script_encoding = config.get("database_script_encoding", "utf8")
@@ -21,6 +29,19 @@ class Oracle(object):
         self.__passwd = config.get("database_password")
         self.__db = config.get("database_name")
         self.__version_table = config.get("database_version_table")
+        self.__fingerprint_table = "%s_fingerprint" % self.__version_table
+        # dbms_lock user locks are identified by numbers from 0 to 1073741823
+        self.__lock_id = int(hashlib.sha1(("simple-db-migrate.%s.%s" % (self.__user, self.__version_table)).encode("utf-8")).hexdigest(), 16) % 1073741824
+        self.__single_transaction = config.get("single_transaction", False)
+        self.__version_table_metadata = config.get("version_table_metadata", False)
+
+        self.__connection = None
+        # if the advisory lock is held by the session
+        self.__locked = False
+        self.connection_count = 0
+        self.round_trip_count = 0
+        # timings of the connections and statements, replaced by the one of the execution
+        self.run_report = RunReport.from_config(config, lambda: self.round_trip_count)
 
         self.__driver = driver
         if not driver:
@@ -39,40 +60,105 @@ class Oracle(object):
         self._create_version_table_if_not_exists()
 
     def __connect(self):
+        # the same connection is used during the whole execution
+        self.__check_lock_held()
+        if self.__connection is not None:
+            return self.__connection
+
         try:
             dsn = self.__db
             if self.__host:
                 dsn = self.__driver.makedsn(self.__host, self.__port, self.__db)
 
-            return self.__driver.connect(dsn=dsn, user=self.__user, password=self.__passwd)
+            with self.run_report.phase("connect"):
+                self.__connection = self.__driver.connect(dsn=dsn, user=self.__user, password=self.__passwd)
+            self.connection_count += 1
+            return self.__connection
         except Exception as e:
             raise Exception("could not connect to database: %s" % e)
 
-    def __execute(self, sql, execution_log=None):
+    def __discard_connection(self):
+        conn, self.__connection = self.__connection, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def __check_lock_held(self):
+        if self.__locked and self.__connection is None:
+            raise MigrationException("the connection was lost while holding the advisory lock %d, which was released with it" % self.__lock_id)
+
+    def __is_connection_lost(self, exception):
+        message = str(exception)
+        return any([error in message for error in Oracle.__lost_connection_errors])
+
+    def __rollback(self, conn, exception):
+        if self.__is_connection_lost(exception):
+            self.__discard_connection()
+            return
+        try:
+            conn.rollback()
+            self.round_trip_count += 1
+        except Exception:
+            self.__discard_connection()
+
+    def __query(self, sql, read_result):
+        # read only queries are executed again once if the connection was lost
+        for attempt in (1, 2):
+            conn = self.__connect()
+            cursor = conn.cursor()
+            try:
+                self.round_trip_count += 1
+                cursor.execute(sql)
+                return read_result(cursor)
+            except Exception as e:
+                if attempt == 1 and self.__is_connection_lost(e):
+                    self.__discard_connection()
+                    # the advisory lock is released with the connection, nothing is done without it
+                    self.__check_lock_held()
+                    continue
+                raise
+            finally:
+                cursor.close()
+
+    def close(self):
+        self.__discard_connection()
+
+    def __execute(self, sql, execution_log=None, commit=True, metadata=None):
         conn = self.__connect()
         cursor = conn.cursor()
         curr_statement = None
         try:
-            statments = Oracle._parse_sql_statements(sql)
-            if len(sql.strip(' \t\n\r')) != 0 and len(statments) == 0:
-                raise Exception("invalid sql syntax '%s'" % Utils.encode(sql, "utf-8"))
+            if isinstance(sql, SQLFile):
+                # the statements of sql files are read while they are executed
+                statments = sql.statements(Oracle.__sql_lexer)
+            else:
+                statments = Oracle._parse_sql_statements(sql)
+                if len(sql.strip(' \t\n\r')) != 0 and len(statments) == 0:
+                    raise Exception("invalid sql syntax '%s'" % Utils.encode(sql, "utf-8"))
 
             for statement in statments:
                 curr_statement = Utils.encode(statement, self.__script_encoding)
+                self.round_trip_count += 1
+                start = RunReport.clock()
                 cursor.execute(curr_statement)
                 affected_rows = max(cursor.rowcount, 0)
+                self.run_report.statement(statement, RunReport.clock() - start, affected_rows)
+                if metadata is not None:
+                    metadata.statement(affected_rows)
                 if execution_log:
                     execution_log("%s\n-- %d row(s) affected\n" % (curr_statement, affected_rows))
-            conn.commit()
+            if commit:
+                conn.commit()
+                self.round_trip_count += 1
             cursor.close()
-            conn.close()
         except Exception as e:
-            conn.rollback()
+            self.__rollback(conn, e)
             cursor.close()
-            conn.close()
             raise MigrationException(("error executing migration: %s" % e), curr_statement)
 
-    def __change_db_version(self, version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None):
+    def __change_db_version(self, version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None, metadata=None):
         params = {}
         params['version'] = version
 
@@ -88,60 +174,30 @@ class Oracle(object):
             params['migration_file_name'] = migration_file_name
             params['label'] = label_version
 
+            if metadata is not None:
+                sql = "insert into %s (id, version, label, name, sql_up, sql_down, %s) values (%s_seq.nextval, :version, :label, :migration_file_name, :sql_up, :sql_down, %s)" % (self.__version_table, ", ".join(ExecutionMetadata.COLUMNS), self.__version_table, ", ".join([":%s" % column for column in ExecutionMetadata.COLUMNS]))
+                params.update(zip(ExecutionMetadata.COLUMNS, metadata.values()))
+
             cursor.setinputsizes(sql_up=self.__driver.CLOB, sql_down=self.__driver.CLOB)
         else:
             # moving down and deleting from history
             sql = "delete from %s where version = :version" % (self.__version_table)
 
         try:
+            self.round_trip_count += 1
             cursor.execute(Utils.encode(sql, self.__script_encoding), params)
             cursor.close()
             conn.commit()
+            self.round_trip_count += 1
             if execution_log:
                 execution_log("migration %s registered\n" % (migration_file_name))
         except Exception as e:
-            conn.rollback()
+            self.__rollback(conn, e)
             raise MigrationException(("error logging migration: %s" % e), migration_file_name)
-        finally:
-            conn.close()
 
     @classmethod
     def _parse_sql_statements(self, migration_sql):
-        all_statements = []
-        last_statement = ''
-
-        match_stmt = Oracle.__re_objects.match(migration_sql)
-        if not match_stmt:
-            match_stmt = Oracle.__re_anonymous.match(migration_sql)
-
-        if match_stmt and match_stmt.re.groups > 0:
-            if match_stmt.group('pre'):
-                all_statements = all_statements + Oracle._parse_sql_statements(match_stmt.group('pre'))
-            if match_stmt.group('main'):
-                all_statements.append(match_stmt.group('main'))
-            if match_stmt.group('pos'):
-                all_statements = all_statements + Oracle._parse_sql_statements(match_stmt.group('pos'))
-
-        else:
-            for statement in migration_sql.split(';'):
-                if len(last_statement) > 0:
-                    curr_statement = '%s;%s' % (last_statement, statement)
-                else:
-                    curr_statement = statement
-
-                count = Utils.count_occurrences(curr_statement)
-                single_quotes = count.get("'", 0)
-                double_quotes = count.get('"', 0)
-                left_parenthesis = count.get('(', 0)
-                right_parenthesis = count.get(')', 0)
-
-                if single_quotes % 2 == 0 and double_quotes % 2 == 0 and left_parenthesis == right_parenthesis:
-                    all_statements.append(curr_statement)
-                    last_statement = ''
-                else:
-                    last_statement = curr_statement
-
-        return [s.strip() for s in all_statements if ((s.strip() != "") and (last_statement == ""))]
+        return Oracle.__sql_lexer.split(migration_sql)
 
     def _drop_database(self):
         sql = """\
@@ -161,6 +217,7 @@ class Oracle(object):
         conn = self.__connect()
         cursor = conn.cursor()
         try:
+            self.round_trip_count += 1
             cursor.execute(sql)
             failed_sqls = ''
             while True:
@@ -185,13 +242,11 @@ class Oracle(object):
             self._verify_if_exception_is_invalid_user(e)
         finally:
             cursor.close()
-            conn.close()
 
 
     def _create_database_if_not_exists(self):
         try:
-            conn = self.__connect()
-            conn.close()
+            self.__connect()
         except Exception as e:
             self._verify_if_exception_is_invalid_user(e)
 
@@ -231,83 +286,139 @@ class Oracle(object):
                 self.__execute("create sequence %s_seq start with 1 increment by 1 nomaxvalue" % self.__version_table)
 
         # check if there is a register there
-        conn = self.__connect()
-        cursor = conn.cursor()
-        cursor.execute("select count(*) from %s" % self.__version_table)
-        count = cursor.fetchone()[0]
-        cursor.close()
-        conn.close()
+        count = self.__query("select count(*) from %s" % self.__version_table, lambda cursor: cursor.fetchone()[0])
 
         # if there is not a version register, insert one
         if count == 0:
             sql = "insert into %s (id, version) values (%s_seq.nextval, '0')" % (self.__version_table, self.__version_table)
             self.__execute(sql)
 
+        if self.__version_table_metadata:
+            self._add_metadata_columns_if_not_exists()
+
+    def _add_metadata_columns_if_not_exists(self):
+        # version tables created without the metadata columns are upgraded in place
+        columns = self.__query("select column_name from user_tab_columns where table_name = upper('%s')" % self.__version_table, lambda cursor: [column[0].lower() for column in cursor.fetchall()])
+        missing_columns = [column for column in Oracle.__metadata_columns if column.split(" ")[0] not in columns]
+        if missing_columns:
+            self.__execute("alter table %s add (%s)" % (self.__version_table, ", ".join(missing_columns)))
+
     def change(self, sql, new_db_version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None):
-        self.__execute(sql, execution_log)
-        self.__change_db_version(new_db_version, migration_file_name, sql_up, sql_down, up, execution_log, label_version)
+        metadata = self.__version_table_metadata and up and ExecutionMetadata() or None
+        # on single transaction the commit of the version table record also commits the migration
+        self.__execute(sql, execution_log, commit=not self.__single_transaction, metadata=metadata)
+        if metadata is not None:
+            metadata.finish()
+        with self.run_report.phase("record"):
+            self.__change_db_version(new_db_version, migration_file_name, sql_up, sql_down, up, execution_log, label_version, metadata)
 
     def get_current_schema_version(self):
-        conn = self.__connect()
-        cursor = conn.cursor()
-        cursor.execute("select version from %s order by id desc" % self.__version_table)
-        version = cursor.fetchone()[0]
-        cursor.close()
-        conn.close()
-        return version
+        return self.__query("select version from %s order by id desc" % self.__version_table, lambda cursor: cursor.fetchone()[0])
 
     def get_all_schema_versions(self):
-        versions = []
-        conn = self.__connect()
-        cursor = conn.cursor()
-        cursor.execute("select version from %s order by id" % self.__version_table)
-        while True:
-            version = cursor.fetchone()
-            if version is None:
-                break
-            versions.append(version[0])
-        cursor.close()
-        conn.close()
+        def read_versions(cursor):
+            versions = []
+            while True:
+                version = cursor.fetchone()
+                if version is None:
+                    break
+                versions.append(version[0])
+            return versions
+
+        versions = self.__query("select version from %s order by id" % self.__version_table, read_versions)
         versions.sort()
         return versions
 
     def get_version_id_from_version_number(self, version):
-        conn = self.__connect()
-        cursor = conn.cursor()
-        cursor.execute("select id from %s where version = '%s' order by id desc" % (self.__version_table, version))
-        result = cursor.fetchone()
-        _id = result and int(result[0]) or None
-        cursor.close()
-        conn.close()
-        return _id
+        result = self.__query("select id from %s where version = '%s' order by id desc" % (self.__version_table, version), lambda cursor: cursor.fetchone())
+        return result and int(result[0]) or None
 
     def get_version_number_from_label(self, label):
-        conn = self.__connect()
-        cursor = conn.cursor()
-        cursor.execute("select version from %s where label = '%s' order by id desc" % (self.__version_table, label))
-        result = cursor.fetchone()
-        version = result and result[0] or None
-        cursor.close()
-        conn.close()
-        return version
-
-    def get_all_schema_migrations(self):
+        result = self.__query("select version from %s where label = '%s' order by id desc" % (self.__version_table, label), lambda cursor: cursor.fetchone())
+        return result and result[0] or None
+
+    def get_all_schema_migrations(self, with_sql=True):
+        columns = with_sql and "id, version, label, name, sql_up, sql_down" or "id, version, label, name"
+        return self.__query("select %s from %s order by id" % (columns, self.__version_table), lambda cursor: self.__read_schema_migrations(cursor, with_sql))
+
+    def get_schema_migrations_sql(self, ids):
+        sql_by_id = {}
+        ids = ["%d" % int(id) for id in ids]
+        for start in range(0, len(ids), Oracle.__max_in_list_size):
+            sql = "select id, sql_up, sql_down from %s where id in (%s)" % (self.__version_table, ", ".join(ids[start:start + Oracle.__max_in_list_size]))
+            sql_by_id.update(self.__query(sql, self.__read_schema_migrations_sql))
+        return sql_by_id
+
+    def __read_schema_migrations_sql(self, cursor):
+        sql_by_id = {}
+        while True:
+            sql_db = cursor.fetchone()
+            if sql_db is None:
+                break
+            sql_by_id[int(sql_db[0])] = (Migration.ensure_sql_unicode(sql_db[1] and sql_db[1].read() or None, self.__script_encoding),
+                                         Migration.ensure_sql_unicode(sql_db[2] and sql_db[2].read() or None, self.__script_encoding))
+        return sql_by_id
+
+    def __read_schema_migrations(self, cursor, with_sql):
+        # clobs must be read before fetching the next row
         migrations = []
-        conn = self.__connect()
-        cursor = conn.cursor()
-        cursor.execute("select id, version, label, name, sql_up, sql_down from %s order by id" % self.__version_table)
         while True:
             migration_db = cursor.fetchone()
             if migration_db is None:
                 break
 
+            # without the sql columns sql_up and sql_down are None, read later by get_schema_migrations_sql
             migration = Migration(id = int(migration_db[0]),
                                   version = migration_db[1] and str(migration_db[1]) or None,
                                   label = migration_db[2] and str(migration_db[2]) or None,
                                   file_name = migration_db[3] and str(migration_db[3]) or None,
-                                  sql_up = Migration.ensure_sql_unicode(migration_db[4] and migration_db[4].read() or None, self.__script_encoding),
-                                  sql_down = Migration.ensure_sql_unicode(migration_db[5] and migration_db[5].read() or None, self.__script_encoding))
+                                  sql_up = None,
+                                  sql_down = None)
+            if with_sql:
+                migration.sql_up = Migration.ensure_sql_unicode(migration_db[4] and migration_db[4].read() or None, self.__script_encoding)
+                migration.sql_down = Migration.ensure_sql_unicode(migration_db[5] and migration_db[5].read() or None, self.__script_encoding)
             migrations.append(migration)
-        cursor.close()
-        conn.close()
         return migrations
+
+    def get_fingerprint(self):
+        # the fingerprint is valid only while the last version is the one it was stored with
+        sql = "select fingerprint from %s where version = (select version from (select version from %s order by id desc) where rownum = 1)" % (self.__fingerprint_table, self.__version_table)
+        try:
+            result = self.__query(sql, lambda cursor: cursor.fetchone())
+        except Exception:
+            # the table is created when the first fingerprint is stored
+            return None
+        return result and result[0] or None
+
+    def set_fingerprint(self, fingerprint, version):
+        try:
+            self.__query("select fingerprint from %s" % self.__fingerprint_table, lambda cursor: cursor.fetchone())
+        except Exception:
+            self.__execute("create table %s ( fingerprint varchar2(64) NOT NULL, version varchar2(20) NOT NULL )" % self.__fingerprint_table)
+        self.__execute("delete from %s;\ninsert into %s (fingerprint, version) values ('%s', '%s');" % (self.__fingerprint_table, self.__fingerprint_table, fingerprint, str(version)))
+
+    def __call_lock_function(self, sql):
+        conn = self.__connect()
+        cursor = conn.cursor()
+        try:
+            result = cursor.var(int)
+            self.round_trip_count += 1
+            cursor.execute(sql, result=result)
+            return result.getvalue()
+        finally:
+            cursor.close()
+
+    def lock(self, timeout):
+        # the lock belongs to the session and is not released by the commits of the migrations
+        result = self.__call_lock_function("begin :result := dbms_lock.request(%d, dbms_lock.x_mode, %d, false); end;" % (self.__lock_id, timeout))
+        # 4 when the session already has the lock
+        if result not in (0, 4):
+            raise Exception("could not get the advisory lock %d in %d seconds (dbms_lock.request returned %s)" % (self.__lock_id, timeout, result))
+        self.__locked = True
+
+    def unlock(self):
+        self.__locked = False
+        if self.__connection is None:
+            # released with the session lost
+            return
+        self.__call_lock_function("begin :result := dbms_lock.release(%d); end;" % self.__lock_id)
@@ -0,0 +1,181 @@
+import cProfile
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+try:
+    import tracemalloc
+except ImportError:
+    # python 2 has no tracemalloc, only the time is profiled
+    tracemalloc = None
+
+from .core import SimpleDBMigrate
+from .helpers import Lists
+from .mssql import MSSQL
+from .mysql import MySQL
+from .oracle import Oracle
+from .sqlite import SQLite
+
+class Profiler(object):
+    """
+    Profile of a whole execution: the time of every function, measured with cProfile in every thread and
+    written to a .pstats file, and the peak memory, measured with tracemalloc, with a breakdown of the
+    functions where the executions with few or no migrations to execute spend most of their time.
+    """
+
+    DRIVER_CALLS = "driver calls"
+    ENGINES = (MySQL, MSSQL, Oracle, SQLite)
+    # the functions of each line of the breakdown; the driver calls are the calls of the engines to the methods
+    # of the connections and cursors of the drivers which go to the database
+    BREAKDOWN = (
+        ("SimpleDBMigrate.get_all_migrations", ((SimpleDBMigrate, "get_all_migrations"),)),
+        ("_parse_sql_statements", tuple([(engine, "_parse_sql_statements") for engine in ENGINES])),
+        (DRIVER_CALLS, ()),
+        ("Lists.subtract", ((Lists, "subtract"),)),
+    )
+    PACKAGE_DIR = os.path.normcase(os.path.dirname(os.path.abspath(__file__)))
+    DRIVER_METHOD = re.compile(r"^(execute|executemany|commit|rollback|fetch[a-z]*)$")
+    # methods implemented in C are named as "<method 'execute' of 'sqlite3.Cursor' objects>"
+    BUILTIN_METHOD = re.compile(r"^<(?:method|built-in method) '?([a-zA-Z_]+)")
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.elapsed = None
+        # None when tracemalloc is not available
+        self.peak_memory = None
+        self.memory = {}
+
+        self.__profile = cProfile.Profile()
+        # the profiles of the threads started during the execution, the jobs and the database targets
+        self.__thread_profiles = []
+        self.__stats = None
+        self.__started = None
+        self.__started_tracing = False
+        self.__originals = []
+        self.__lock = threading.Lock()
+
+    def start(self):
+        if tracemalloc is not None:
+            self.__started_tracing = not tracemalloc.is_tracing()
+            if self.__started_tracing:
+                tracemalloc.start()
+            for label, functions in Profiler.BREAKDOWN:
+                for cls, name in functions:
+                    self.__measure_memory(label, cls, name)
+
+        self.__started = time.time()
+        # before python 3.12 cProfile only profiles the thread which enables it
+        if sys.version_info < (3, 12):
+            threading.setprofile(self.__profile_thread)
+        self.__profile.enable()
+
+    def __profile_thread(self, frame, event, arg):
+        # called by the first event of each new thread, the profile enabled replaces this function
+        profile = cProfile.Profile()
+        with self.__lock:
+            self.__thread_profiles.append(profile)
+        profile.enable()
+
+    def __measure_memory(self, label, cls, name):
+        # the memory allocated by the calls and still kept when they return
+        original = cls.__dict__[name]
+        function = getattr(original, "__func__", original)
+        self.memory.setdefault(label, 0)
+
+        def measured(*args, **kwargs):
+            before = tracemalloc.get_traced_memory()[0]
+            try:
+                return function(*args, **kwargs)
+            finally:
+                allocated = tracemalloc.get_traced_memory()[0] - before
+                with self.__lock:
+                    self.memory[label] += allocated
+
+        if isinstance(original, (classmethod, staticmethod)):
+            measured = type(original)(measured)
+        self.__originals.append((cls, name, original))
+        setattr(cls, name, measured)
+
+    def stop(self):
+        self.__profile.disable()
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        self.elapsed = time.time() - self.__started
+
+        for cls, name, original in reversed(self.__originals):
+            setattr(cls, name, original)
+        self.__originals = []
+
+        if tracemalloc is not None:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            if self.__started_tracing:
+                tracemalloc.stop()
+
+        self.__stats = pstats.Stats(self.__profile)
+        with self.__lock:
+            for profile in self.__thread_profiles:
+                self.__stats.add(profile)
+
+        try:
+            self.__stats.dump_stats(self.file_name)
+        except (IOError, OSError) as e:
+            raise Exception("could not write the profile ('%s'): %s" % (self.file_name, e))
+
+    @staticmethod
+    def __key(cls, name):
+        # functions are identified by cProfile by the file, first line and name of their code
+        function = cls.__dict__[name]
+        code = getattr(function, "__func__", function).__code__
+        return (code.co_filename, code.co_firstlineno, code.co_name)
+
+    @staticmethod
+    def __is_driver_method(function):
+        name = function[2]
+        if function[0] == "~":
+            builtin = Profiler.BUILTIN_METHOD.match(name)
+            name = builtin and builtin.group(1) or ""
+        return Profiler.DRIVER_METHOD.match(name) is not None
+
+    def breakdown(self):
+        """
+        return a list of (label, calls, cumulative seconds, memory kept in bytes or None)
+        """
+        stats = self.__stats.stats
+        engine_files = set([Profiler.__key(engine, "_parse_sql_statements")[0] for engine in Profiler.ENGINES])
+
+        breakdown = []
+        for label, functions in Profiler.BREAKDOWN:
+            calls, cumulative = 0, 0.0
+            if label == Profiler.DRIVER_CALLS:
+                for function, (_, _, _, _, callers) in stats.items():
+                    if os.path.normcase(function[0]).startswith(Profiler.PACKAGE_DIR) or not Profiler.__is_driver_method(function):
+                        continue
+                    for caller, caller_stats in callers.items():
+                        if caller[0] in engine_files:
+                            calls += caller_stats[1]
+                            cumulative += caller_stats[3]
+            else:
+                for key in [Profiler.__key(cls, name) for cls, name in functions]:
+                    if key in stats:
+                        calls += stats[key][1]
+                        cumulative += stats[key][3]
+            breakdown.append((label, calls, cumulative, self.memory.get(label)))
+        return breakdown
+
+    def summary(self):
+        lines = ["time profile written to '%s' (python -m pstats %s)" % (self.file_name, self.file_name)]
+        if self.peak_memory is None:
+            lines.append("total %.2fs, peak memory not measured (tracemalloc needs python 3.4 or newer)" % self.elapsed)
+        else:
+            lines.append("total %.2fs, peak memory %s" % (self.elapsed, Profiler.format_memory(self.peak_memory)))
+
+        lines.append("%-36s %8s %11s %11s" % ("", "calls", "cumulative", "memory kept"))
+        for label, calls, cumulative, memory in self.breakdown():
+            lines.append("%-36s %8d %10.3fs %11s" % (label, calls, cumulative, memory is None and "-" or Profiler.format_memory(memory)))
+        return lines
+
+    @staticmethod
+    def format_memory(size):
+        return "%.1f MiB" % (size / 1048576.0)
@@ -0,0 +1,117 @@
+import json
+import os
+from .sql import SQLDialect, SQLFile, SQLLexer
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return "%dh%02dm%02ds" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+    if seconds >= 60:
+        return "%dm%02ds" % (seconds // 60, seconds % 60)
+    return "%ds" % seconds
+
+class MigrationDurations(object):
+    """
+    Durations in seconds of previous executions of the migration files, by file name and direction,
+    read from the run reports of other environments.
+    """
+
+    def __init__(self):
+        self.__durations = {}
+
+    def add(self, file_name, up, seconds):
+        self.__durations.setdefault((file_name, up), []).append(float(seconds))
+
+    def get(self, file_name, up=True):
+        durations = self.__durations.get((file_name, up))
+        if not durations:
+            return None
+        # the same file may have been executed on many environments
+        return sum(durations) / len(durations)
+
+    def read_report_file(self, file_name):
+        try:
+            with open(file_name) as f:
+                content = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            raise Exception("could not read the durations file ('%s'): %s" % (file_name, e))
+
+        # the reports of many databases have one report for each of them, none for the ones skipped
+        reports = [content]
+        if "targets" in content:
+            reports = [target.get("report") or {} for target in content["targets"]]
+        for report in reports:
+            for migration in report.get("migrations", []):
+                self.add(migration["file_name"], migration.get("direction", "up") == "up", migration["elapsed"])
+
+class Progress(object):
+    """
+    Progress of the migrations of an execution, with the time remaining estimated from the durations of
+    previous executions of the same files or, for the files without them, from their number of statements.
+    The estimates are corrected by how much faster or slower the migrations already finished were.
+    """
+
+    # seconds of each statement until the first migration finishes
+    STATEMENT_TIME = 0.05
+    # sql files are too big to be read only to count their statements
+    BYTES_PER_STATEMENT = 200
+    # the engine is not known here, the semicolons in quotes, comments and parenthesis of the most common dialect are skipped
+    __sql_lexer = SQLLexer(SQLDialect())
+
+    def __init__(self, migrations, is_migration_up, durations):
+        self.total = len(migrations)
+        self.done = 0
+        self.elapsed = 0.0
+        self.__history = [durations.get(migration.file_name, is_migration_up) for migration in migrations]
+        self.__statements = [Progress.count_statements(is_migration_up and migration.sql_up or migration.sql_down) for migration in migrations]
+        self.from_history = len([duration for duration in self.__history if duration is not None])
+
+        self.__history_elapsed = 0.0
+        self.__history_estimated = 0.0
+        self.__statements_executed = 0
+
+    @staticmethod
+    def count_statements(sql):
+        if isinstance(sql, SQLFile):
+            try:
+                return max(1, os.path.getsize(sql.path) // Progress.BYTES_PER_STATEMENT)
+            except OSError:
+                return 1
+        # an unbalanced sql has no statements for the lexer, it is estimated as one
+        return max(1, len(Progress.__sql_lexer.split(sql or "")))
+
+    def finished(self, elapsed):
+        index = self.done
+        self.done += 1
+        self.elapsed += elapsed
+        self.__statements_executed += self.__statements[index]
+        if self.__history[index] is not None:
+            self.__history_elapsed += elapsed
+            self.__history_estimated += self.__history[index]
+
+    def remaining(self):
+        # how much slower or faster than on the previous executions the migrations are here
+        history_factor = 1.0
+        if self.__history_estimated > 0:
+            history_factor = self.__history_elapsed / self.__history_estimated
+
+        statement_time = Progress.STATEMENT_TIME
+        if self.__statements_executed > 0:
+            statement_time = self.elapsed / self.__statements_executed
+
+        remaining = 0.0
+        for index in range(self.done, self.total):
+            if self.__history[index] is not None:
+                remaining += self.__history[index] * history_factor
+            else:
+                remaining += self.__statements[index] * statement_time
+        return remaining
+
+    def estimate_line(self):
+        return "- Estimated time: about %s for %d migration(s), %d of them timed on previous executions" % (format_duration(self.remaining()), self.total, self.from_history)
+
+    def line(self):
+        remaining = self.remaining()
+        total = self.elapsed + remaining
+        percent = total > 0 and 100 * self.elapsed / total or 100
+        return "- Progress: %d/%d migration(s) (%d%%), %s elapsed, about %s remaining" % (self.done, self.total, percent, format_duration(self.elapsed), format_duration(remaining))
@@ -0,0 +1,3 @@
+"""
+Modules written with the syntax of python 3 only, like async and await; they are not compiled on python 2.
+"""
@@ -0,0 +1,452 @@
+"""
+asyncio variants of the sgdb contract, Main and Fleet, so the status and the migrations of many databases
+are multiplexed on one event loop; python 3 only, this module is not imported by the package.
+
+An async sgdb implements the same methods described in simple_db_migrate.main as coroutines, and may implement
+- open(self)
+  creates the database and the version table, awaited before the first query
+"""
+import asyncio
+import time
+from ..core import Migration
+from ..core.exceptions import MigrationException
+from ..core.history import SchemaHistory
+from ..fleet import Fleet, TargetMain, TargetResult
+from ..helpers import Utils
+from ..main import Main
+from ..mysql import MySQL
+
+class AsyncMySQL(object):
+    """
+    MySQL engine on an asyncio driver with the interface of aiomysql.
+    """
+
+    def __init__(self, config=None, mysql_driver=None):
+        self.__mysql_script_encoding = config.get("database_script_encoding", "utf8")
+        self.__mysql_encoding = config.get("database_encoding", "utf8")
+        self.__mysql_host = config.get("database_host")
+        self.__mysql_port = config.get("database_port", 3306)
+        self.__mysql_user = config.get("database_user")
+        self.__mysql_passwd = config.get("database_password")
+        self.__mysql_db = config.get("database_name")
+        self.__version_table = config.get("database_version_table")
+        self.__single_transaction = config.get("single_transaction", False)
+        self.__drop_db_first = config.get("drop_db_first", False)
+        self.__statement_batcher = MySQL._statement_batcher(config)
+
+        self.__connection = None
+        self.__connection_uses_database = False
+        self.connection_count = 0
+        self.round_trip_count = 0
+
+        self.__mysql_driver = mysql_driver
+        if not mysql_driver:
+            import aiomysql
+            self.__mysql_driver = aiomysql
+
+    async def open(self):
+        if self.__drop_db_first:
+            await self._drop_database()
+
+        await self._create_database_if_not_exists()
+        await self._create_version_table_if_not_exists()
+
+    async def __mysql_connect(self, connect_using_database_name=True):
+        # the same connection is used during the whole execution
+        try:
+            if self.__connection is None:
+                self.__connection = await self.__mysql_driver.connect(host=self.__mysql_host, port=self.__mysql_port, user=self.__mysql_user, password=self.__mysql_passwd, charset=self.__mysql_encoding)
+                self.__connection_uses_database = False
+                self.connection_count += 1
+
+            if connect_using_database_name and not self.__connection_uses_database:
+                self.round_trip_count += 1
+                await self.__connection.select_db(self.__mysql_db)
+                self.__connection_uses_database = True
+            return self.__connection
+        except Exception as e:
+            await self.close()
+            raise Exception("could not connect to database: %s" % e)
+
+    async def close(self):
+        conn, self.__connection = self.__connection, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    async def __rollback(self, db):
+        try:
+            self.round_trip_count += 1
+            await db.rollback()
+        except Exception:
+            await self.close()
+
+    async def __query(self, sql, params=None, fetch_all=False):
+        db = await self.__mysql_connect()
+        cursor = await db.cursor()
+        try:
+            self.round_trip_count += 1
+            await cursor.execute(sql, params)
+            return (await cursor.fetchall()) if fetch_all else (await cursor.fetchone())
+        finally:
+            await cursor.close()
+
+    async def __execute(self, sql, execution_log=None, commit=True):
+        db = await self.__mysql_connect()
+        cursor = await db.cursor()
+        curr_statement = None
+        try:
+            statments = MySQL._sql_statements(sql)
+            for statement, original_statements in self.__statement_batcher.batches(statments):
+                # on errors the statements are shown as they are in the migration
+                curr_statement = ";\n".join(original_statements)
+                self.round_trip_count += 1
+                affected_rows = await cursor.execute(Utils.encode(statement, self.__mysql_script_encoding))
+                if execution_log:
+                    execution_log("%s\n-- %d row(s) affected\n" % (statement, affected_rows and int(affected_rows) or 0))
+            await cursor.close()
+            if commit:
+                self.round_trip_count += 1
+                await db.commit()
+        except Exception as e:
+            await self.__rollback(db)
+            raise MigrationException("error executing migration: %s" % e, curr_statement)
+
+    async def __change_db_version(self, version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None):
+        if up:
+            # moving up and storing history
+            sql = "insert into %s (version, label, name, sql_up, sql_down) values (%%s, %%s, %%s, %%s, %%s);" % self.__version_table
+            params = (str(version), label_version or None, migration_file_name, sql_up or "", sql_down or "")
+        else:
+            # moving down and deleting from history
+            sql = "delete from %s where version = %%s;" % self.__version_table
+            params = (str(version),)
+
+        db = await self.__mysql_connect()
+        cursor = await db.cursor()
+        try:
+            self.round_trip_count += 1
+            await cursor.execute(sql, params)
+            await cursor.close()
+            self.round_trip_count += 1
+            await db.commit()
+            if execution_log:
+                execution_log("migration %s registered\n" % (migration_file_name))
+        except Exception as e:
+            await self.__rollback(db)
+            raise MigrationException("error logging migration: %s" % e, migration_file_name)
+
+    async def _drop_database(self):
+        db = await self.__mysql_connect(False)
+        cursor = await db.cursor()
+        try:
+            self.round_trip_count += 1
+            await cursor.execute("drop database if exists `%s`;" % self.__mysql_db)
+        except Exception as e:
+            raise Exception("can't drop database '%s'; \n%s" % (self.__mysql_db, str(e)))
+        finally:
+            await cursor.close()
+            # the dropped database can not be used anymore
+            await self.close()
+
+    async def _create_database_if_not_exists(self):
+        db = await self.__mysql_connect(False)
+        cursor = await db.cursor()
+        try:
+            self.round_trip_count += 1
+            await cursor.execute("create database if not exists `%s`;" % self.__mysql_db)
+        finally:
+            await cursor.close()
+
+    async def _create_version_table_if_not_exists(self):
+        # create version table
+        sql = "create table if not exists %s ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default \"0\", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id));" % self.__version_table
+        await self.__execute(sql)
+
+        # check if there is a register there
+        count = (await self.__query("select count(*) from %s;" % self.__version_table))[0]
+
+        # if there is not a version register, insert one
+        if count == 0:
+            await self.__execute("insert into %s (version) values (\"0\");" % self.__version_table)
+
+    async def change(self, sql, new_db_version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None):
+        # on single transaction the commit of the version table record also commits the migration
+        await self.__execute(sql, execution_log, commit=not self.__single_transaction)
+        await self.__change_db_version(new_db_version, migration_file_name, sql_up, sql_down, up, execution_log, label_version)
+
+    async def get_current_schema_version(self):
+        return (await self.__query("select version from %s order by id desc limit 0,1;" % self.__version_table))[0]
+
+    async def get_all_schema_versions(self):
+        all_versions = await self.__query("select version from %s order by id;" % self.__version_table, fetch_all=True)
+        return sorted([version[0] for version in all_versions])
+
+    async def get_version_id_from_version_number(self, version):
+        result = await self.__query("select id from %s where version = %%s order by id desc;" % self.__version_table, (str(version),))
+        return result and int(result[0]) or None
+
+    async def get_version_number_from_label(self, label):
+        result = await self.__query("select version from %s where label = %%s order by id desc;" % self.__version_table, (label,))
+        return result and result[0] or None
+
+    async def get_all_schema_migrations(self, with_sql=True):
+        migrations = []
+        columns = with_sql and "id, version, label, name, sql_up, sql_down" or "id, version, label, name"
+        all_migrations = await self.__query("select %s from %s order by id;" % (columns, self.__version_table), fetch_all=True)
+        for migration_db in all_migrations:
+            # without the sql columns sql_up and sql_down are None, read later by get_schema_migrations_sql
+            migration = Migration(id = int(migration_db[0]),
+                                  version = migration_db[1] and str(migration_db[1]) or None,
+                                  label = migration_db[2] and str(migration_db[2]) or None,
+                                  file_name = migration_db[3] and str(migration_db[3]) or None,
+                                  sql_up = None,
+                                  sql_down = None)
+            if with_sql:
+                migration.sql_up = Migration.ensure_sql_unicode(migration_db[4], self.__mysql_script_encoding)
+                migration.sql_down = Migration.ensure_sql_unicode(migration_db[5], self.__mysql_script_encoding)
+            migrations.append(migration)
+        return migrations
+
+    async def get_schema_migrations_sql(self, ids):
+        sql_by_id = {}
+        if not ids:
+            return sql_by_id
+
+        all_sql = await self.__query("select id, sql_up, sql_down from %s where id in (%s);" % (self.__version_table, ", ".join(["%d" % int(id) for id in ids])), fetch_all=True)
+        for sql_db in all_sql:
+            sql_by_id[int(sql_db[0])] = (Migration.ensure_sql_unicode(sql_db[1], self.__mysql_script_encoding), Migration.ensure_sql_unicode(sql_db[2], self.__mysql_script_encoding))
+        return sql_by_id
+
+class AsyncMain(Main):
+    """
+    Main with an async sgdb: the migrations are planned as on Main, and every query is awaited.
+    """
+
+    # options of Main not implemented on the event loop, rejected instead of being ignored
+    UNSUPPORTED_OPTIONS = ("advisory_lock", "fast_check", "progress", "report_file", "trace_file", "version_table_metadata")
+
+    def __init__(self, config, sgdb=None, db_migrate=None):
+        Main._check_configuration(config)
+        if config.get("paused_mode", False):
+            raise Exception("paused mode can not be used with AsyncMain")
+        AsyncMain._check_unsupported_options(config, "AsyncMain")
+
+        # the sgdb is only closed here when it was created here
+        self.__owns_async_sgdb = sgdb is None
+        if sgdb is None and not config.get("new_migration", None):
+            if config.get("database_engine") == 'mysql':
+                sgdb = AsyncMySQL(config)
+            else:
+                raise Exception("engine not supported by AsyncMain '%s'" % config.get("database_engine"))
+        super(AsyncMain, self).__init__(config, sgdb, db_migrate)
+
+    @staticmethod
+    def _check_unsupported_options(config, name):
+        for option in AsyncMain.UNSUPPORTED_OPTIONS:
+            if config.get(option, None):
+                raise Exception("%s can not be used with %s" % (option, name))
+
+    async def execute(self):
+        self._execution_log('\nStarting DB migration on host/database "%s/%s" with user "%s"...' % (self.config.get('database_host', None), self.config.get('database_name'), self.config.get('database_user', None)), "PINK", log_level_limit=1)
+        # the version table is read again on each execution
+        self.schema_history = None
+        try:
+            if self.config.get("new_migration", None):
+                self._create_migration()
+            else:
+                await self._migrate()
+        finally:
+            await self._close_async_sgdb()
+        self._execution_log("\nDone.\n", "PINK", log_level_limit=1)
+
+    async def last_label(self):
+        labels = await self.labels()
+        return labels and labels[-1] or None
+
+    async def labels(self):
+        labels = []
+
+        try:
+            await self._open_sgdb()
+            migrations = (await self._load_schema_history()).get_all_schema_migrations()
+        finally:
+            await self._close_async_sgdb()
+        for migration in migrations:
+            if migration.label and (migration.label not in labels):
+                labels.append(migration.label)
+
+        return labels
+
+    async def _open_sgdb(self):
+        if hasattr(self.sgdb, "open"):
+            await self.sgdb.open()
+
+    async def _close_async_sgdb(self):
+        if not self.__owns_async_sgdb or self.sgdb is None or not hasattr(self.sgdb, "close"):
+            return
+
+        connection_count = getattr(self.sgdb, "connection_count", None)
+        round_trip_count = getattr(self.sgdb, "round_trip_count", None)
+        if isinstance(connection_count, int) and isinstance(round_trip_count, int):
+            self._execution_log("- %d connection(s) opened, %d round trip(s) to the database" % (connection_count, round_trip_count), log_level_limit=2)
+        await self.sgdb.close()
+
+    async def _load_schema_history(self):
+        # as SchemaHistory.load, awaiting the sgdb
+        if hasattr(self.sgdb, "get_schema_migrations_sql"):
+            return SchemaHistory(await self.sgdb.get_all_schema_migrations(with_sql=False))
+        return SchemaHistory(await self.sgdb.get_all_schema_migrations())
+
+    async def _migrate(self):
+        await self._open_sgdb()
+        self.schema_history = await self._load_schema_history()
+
+        destination_version = self._get_destination_version()
+        current_version = self._get_schema_history().get_current_schema_version()
+
+        # do it!
+        await self._execute_migrations(current_version, destination_version)
+
+    async def _execute_migrations(self, current_version, destination_version):
+        is_migration_up = self._is_migration_up(current_version, destination_version)
+        if not is_migration_up:
+            await self._read_sql_down(destination_version)
+
+        # getting only the migration sql files to be executed
+        migrations_to_be_executed = self._get_migration_files_to_be_executed(current_version, destination_version, is_migration_up)
+
+        if not self._log_migrations_to_be_executed(current_version, destination_version, is_migration_up, migrations_to_be_executed):
+            return
+
+        sql_statements_executed = []
+        for migration in migrations_to_be_executed:
+            if not self.config.get("show_sql_only", False):
+                await self._execute_migration(migration, is_migration_up)
+            sql_statements_executed.extend(self._get_sql_statements_executed(migration, is_migration_up))
+
+        self._log_sql_statements_executed(sql_statements_executed)
+
+    async def _read_sql_down(self, destination_version):
+        # the sql of the migrations down is read before they are planned, which does not query the sgdb then
+        if self.config.get("force_use_files_on_down", False) or not hasattr(self.sgdb, "get_schema_migrations_sql"):
+            return
+
+        schema_history = self._get_schema_history()
+        destination_version_id = schema_history.get_version_id_from_version_number(destination_version)
+        ids = schema_history.ids_without_sql([migration.id for migration in schema_history.get_all_schema_migrations() if migration.id > destination_version_id])
+        if ids:
+            schema_history.set_sql(ids, await self.sgdb.get_schema_migrations_sql(ids))
+
+    async def _execute_migration(self, migration, is_migration_up):
+        sql = is_migration_up and migration.sql_up or migration.sql_down
+        up_down_label = is_migration_up and "up" or "down"
+        self._execution_log("===== executing %s (%s) =====" % (migration.file_name, up_down_label), log_level_limit=1)
+
+        label = None
+        if is_migration_up:
+            label = self.config.get("label_version", None)
+
+        try:
+            await self.sgdb.change(sql, migration.version, migration.file_name, Migration.stored_sql(migration.sql_up), Migration.stored_sql(migration.sql_down), is_migration_up, self._execution_log, label)
+        except Exception as e:
+            self._execution_log("===== ERROR executing %s (%s) =====" % (migration.abspath, up_down_label), log_level_limit=1)
+            raise e
+        self._get_schema_history().record(migration, is_migration_up, label)
+
+class AsyncTargetMain(AsyncMain):
+    """
+    AsyncMain executed on one of the databases of an AsyncFleet, logging each message with the target name.
+    """
+
+    def __init__(self, name, fleet, config, sgdb=None, db_migrate=None):
+        self.name = name
+        self.fleet = fleet
+        super(AsyncTargetMain, self).__init__(config, sgdb, db_migrate)
+
+    _execution_log = TargetMain._execution_log
+
+class AsyncFleet(Fleet):
+    """
+    Fleet executed on one event loop: at most targets_concurrency databases are migrated, or queried, at the same time.
+    """
+
+    def __init__(self, config, sgdb_factory=None):
+        super(AsyncFleet, self).__init__(config, sgdb_factory)
+        AsyncMain._check_unsupported_options(config, "AsyncFleet")
+
+    async def execute(self):
+        self._execution_log("\nStarting DB migration on %d databases, %d at a time..." % (len(self.targets), min(self.concurrency, len(self.targets))), "PINK", log_level_limit=1)
+        # loading the files before the targets start, they only read the shared migrations
+        self.db_migrate.get_all_migration_versions()
+
+        self.results = []
+        self.__failed = False
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # gather keeps the order of database_targets
+        self.results = list(await asyncio.gather(*[self._execute_target(target, semaphore) for target in self.targets]))
+        self._log_summary()
+
+        failed = [result for result in self.results if result.status == TargetResult.FAILED]
+        if failed:
+            raise Exception("migration failed on %d of %d databases (%s)" % (len(failed), len(self.targets), ", ".join([result.name for result in failed])))
+        self._execution_log("\nDone.\n", "PINK", log_level_limit=1)
+
+    async def labels(self):
+        """
+        returns the labels of each database, as (name, labels), in the order of database_targets
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def target_labels(target):
+            name, config = target
+            async with semaphore:
+                sgdb = await self.__create_sgdb(name, config)
+                try:
+                    return name, await AsyncTargetMain(name, self, config, sgdb, self.db_migrate).labels()
+                finally:
+                    await self.__close_sgdb(sgdb)
+
+        return list(await asyncio.gather(*[target_labels(target) for target in self.targets]))
+
+    async def _execute_target(self, target, semaphore):
+        name, config = target
+        async with semaphore:
+            # on fail fast the databases not started yet are left as they are
+            if self.__failed and not self.continue_on_error:
+                return TargetResult(name, TargetResult.SKIPPED)
+
+            start = time.time()
+            main = None
+            sgdb = None
+            try:
+                sgdb = await self.__create_sgdb(name, config)
+                main = AsyncTargetMain(name, self, config, sgdb, self.db_migrate)
+                await main.execute()
+                result = TargetResult(name, TargetResult.OK, self.__version(main), elapsed=time.time() - start)
+            except Exception as e:
+                self.__failed = True
+                self._execution_log("[%s] [ERROR] %s" % (name, e), "RED", log_level_limit=1)
+                result = TargetResult(name, TargetResult.FAILED, main and self.__version(main) or None, str(e), time.time() - start)
+            finally:
+                await self.__close_sgdb(sgdb)
+
+        self._execution_log("- %s %s in %.2fs" % (result.name, result.status, result.elapsed), result.status == TargetResult.OK and "GREEN" or "RED", log_level_limit=1)
+        return result
+
+    async def __create_sgdb(self, name, config):
+        # the sgdb_factory may be a coroutine function
+        sgdb = self.sgdb_factory and self.sgdb_factory(name, config) or None
+        if asyncio.iscoroutine(sgdb):
+            sgdb = await sgdb
+        return sgdb
+
+    async def __close_sgdb(self, sgdb):
+        # AsyncMain only closes the sgdb it creates
+        if sgdb is not None and hasattr(sgdb, "close"):
+            await sgdb.close()
+
+    def __version(self, main):
+        return main.schema_history and main.schema_history.get_current_schema_version() or None
@@ -0,0 +1,311 @@
+import heapq
+import itertools
+import json
+import socket
+import time
+from contextlib import contextmanager
+from datetime import datetime
+try:
+    from datetime import timezone
+except ImportError:
+    # python 2 has no timezone
+    timezone = None
+
+class StatementTiming(object):
+    # only the beginning of each statement is kept, data migrations have many long statements
+    MAX_SQL_LENGTH = 200
+
+    def __init__(self, sql, elapsed, rows=0, started=None):
+        if not isinstance(sql, (type(""), type(u""))):
+            sql = "%s" % sql
+        # cut before the blanks are joined, so long statements are not copied as a whole
+        head = sql[:StatementTiming.MAX_SQL_LENGTH * 4]
+        text = " ".join(head.split())
+        if len(text) > StatementTiming.MAX_SQL_LENGTH or len(head) < len(sql):
+            text = "%s..." % text[:StatementTiming.MAX_SQL_LENGTH]
+        self.sql = text
+        self.elapsed = elapsed
+        self.rows = rows and int(rows) or 0
+        self.started = started
+
+    def to_dict(self):
+        return {"sql": self.sql, "elapsed": self.elapsed, "rows": self.rows}
+
+class MigrationTiming(object):
+
+    def __init__(self, file_name, version, up=True):
+        self.file_name = file_name
+        self.version = version
+        self.up = up
+        self.started = None
+        self.elapsed = 0.0
+        self.phases = {}
+        # the statements are counted even when they are not kept
+        self.statements = []
+        self.statements_count = 0
+        self.rows = 0
+
+    def to_dict(self):
+        return {
+            "file_name": self.file_name,
+            "version": self.version,
+            "direction": self.up and "up" or "down",
+            "elapsed": self.elapsed,
+            "phases": self.phases,
+            "rows": self.rows,
+            "statements": [statement.to_dict() for statement in self.statements]
+        }
+
+class RunReport(object):
+    """
+    Timings of an execution, measured with a monotonic clock: the time of each phase, of each
+    migration and of each statement executed by the sgdb, with the rows affected by them.
+    They are also kept as spans on a timeline, which can be written as a trace of Chrome's
+    trace event format, opened by chrome://tracing and Perfetto.
+
+    Each statement is kept only with keep_statements, for the report file and the trace; otherwise
+    only the top slowest ones are, so the memory does not grow with the statements of big sql files.
+    """
+
+    PHASES = ("load", "plan", "lock", "connect", "execute", "record")
+
+    # monotonic on python 3, not affected by changes of the system clock
+    clock = staticmethod(getattr(time, "monotonic", time.time))
+
+    def __init__(self, round_trips=None, keep_statements=True, top=0):
+        self.started = RunReport.clock()
+        self.finished = None
+        self.phases = dict([(phase, 0.0) for phase in RunReport.PHASES])
+        self.migrations = []
+        # statements executed out of the migrations, like the creation of the version table
+        self.statements = []
+        # (name, category, start, end) of the phases and of the steps inside them
+        self.spans = []
+        # returns the number of round trips to the database, sampled at the end of each span and statement
+        self.round_trips = round_trips
+        self.round_trip_samples = []
+        self.keep_statements = keep_statements
+        self.top = top
+
+        # heap of (elapsed, order, statement, migration) of the top slowest statements not kept
+        self.__slowest = []
+        self.__order = itertools.count()
+
+        self.__phase_stack = []
+        self.__phase_started = None
+        self.__migration = None
+        self.__migration_started = None
+
+    @staticmethod
+    def from_config(config, round_trips=None):
+        """
+        returns the report of an execution with config: each statement is kept only for the report file and the trace,
+        and the round trips are sampled only for the trace
+        """
+        trace = bool(config.get("trace_file", None))
+        keep_statements = trace or bool(config.get("report_file", None))
+        return RunReport(trace and round_trips or None, keep_statements, int(config.get("report_top", 0) or 0))
+
+    @property
+    def elapsed(self):
+        return (self.finished or RunReport.clock()) - self.started
+
+    @contextmanager
+    def phase(self, name):
+        # the time of a phase inside another is counted only for the inner one
+        self.__stop_current_phase()
+        self.__phase_stack.append(name)
+        start = RunReport.clock()
+        try:
+            yield
+        finally:
+            self.__stop_current_phase()
+            self.__phase_stack.pop()
+            self.add_span(name, start, RunReport.clock())
+
+    @contextmanager
+    def span(self, name, category="step"):
+        # only on the timeline, not counted as a phase
+        start = RunReport.clock()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, RunReport.clock(), category)
+
+    def add_span(self, name, start, end, category="phase"):
+        self.spans.append((name, category, start, end))
+        self.__sample_round_trips(end)
+
+    def __sample_round_trips(self, now):
+        if self.round_trips is not None:
+            self.round_trip_samples.append((now, self.round_trips()))
+
+    def __stop_current_phase(self):
+        now = RunReport.clock()
+        if self.__phase_stack:
+            elapsed = now - self.__phase_started
+            name = self.__phase_stack[-1]
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            if self.__migration is not None:
+                self.__migration.phases[name] = self.__migration.phases.get(name, 0.0) + elapsed
+        self.__phase_started = now
+
+    def start_migration(self, file_name, version, up=True):
+        self.__migration = MigrationTiming(file_name, version, up)
+        self.__migration_started = RunReport.clock()
+        self.__migration.started = self.__migration_started
+        self.migrations.append(self.__migration)
+        return self.__migration
+
+    def end_migration(self):
+        if self.__migration is not None:
+            self.__migration.elapsed = RunReport.clock() - self.__migration_started
+        self.__migration = None
+
+    def statement(self, sql, elapsed, rows=0):
+        # recorded as soon as the statement is executed
+        now = RunReport.clock()
+        migration = self.__migration
+        if migration is not None:
+            migration.statements_count += 1
+            migration.rows += rows and int(rows) or 0
+
+        if self.keep_statements:
+            timing = StatementTiming(sql, elapsed, rows, now - elapsed)
+            if migration is not None:
+                migration.statements.append(timing)
+            else:
+                self.statements.append(timing)
+        elif migration is not None and self.top > 0 and (len(self.__slowest) < self.top or elapsed > self.__slowest[0][0]):
+            item = (elapsed, next(self.__order), StatementTiming(sql, elapsed, rows, now - elapsed), migration)
+            if len(self.__slowest) < self.top:
+                heapq.heappush(self.__slowest, item)
+            else:
+                heapq.heapreplace(self.__slowest, item)
+        self.__sample_round_trips(now)
+
+    def finish(self):
+        self.finished = RunReport.clock()
+
+    def slowest_migrations(self, top):
+        return sorted(self.migrations, key=lambda migration: migration.elapsed, reverse=True)[:top]
+
+    def slowest_statements(self, top):
+        if self.keep_statements:
+            statements = [(statement, migration) for migration in self.migrations for statement in migration.statements]
+        else:
+            statements = [(statement, migration) for _, _, statement, migration in self.__slowest]
+        return sorted(statements, key=lambda item: item[0].elapsed, reverse=True)[:top]
+
+    def summary(self, top=10):
+        lines = ["total %.2fs: %s" % (self.elapsed, ", ".join(["%s %.2fs" % (phase, self.phases[phase]) for phase in RunReport.PHASES]))]
+
+        if self.migrations:
+            lines.append("slowest migrations:")
+            for migration in self.slowest_migrations(top):
+                lines.append("  %8.3fs  %s (%s), %d statement(s), %d row(s)" % (migration.elapsed, migration.file_name, migration.up and "up" or "down", migration.statements_count, migration.rows))
+
+            lines.append("slowest statements:")
+            for statement, migration in self.slowest_statements(top):
+                lines.append("  %8.3fs  %s: %s" % (statement.elapsed, migration.file_name, statement.sql))
+        return lines
+
+    def to_dict(self):
+        return {
+            "elapsed": self.elapsed,
+            "phases": self.phases,
+            "migrations": [migration.to_dict() for migration in self.migrations],
+            "statements": [statement.to_dict() for statement in self.statements]
+        }
+
+    @staticmethod
+    def write_json(file_name, content):
+        try:
+            with open(file_name, "w") as f:
+                json.dump(content, f, indent=2, sort_keys=True)
+        except (IOError, OSError) as e:
+            raise Exception("could not write the run report ('%s'): %s" % (file_name, e))
+
+    def trace_events(self, tid, name, origin):
+        """
+        return the trace events of the timeline of this report on the thread tid, named name,
+        with the times in microseconds since origin
+        """
+        def timestamp(value):
+            return (value - origin) * 1000000.0
+
+        def complete(name, category, start, elapsed, args=None):
+            event = {"name": name, "cat": category, "ph": "X", "pid": 1, "tid": tid, "ts": timestamp(start), "dur": elapsed * 1000000.0}
+            if args:
+                event["args"] = args
+            return event
+
+        events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}},
+                  {"name": "thread_sort_index", "ph": "M", "pid": 1, "tid": tid, "args": {"sort_index": tid}}]
+        for span_name, category, start, end in self.spans:
+            events.append(complete(span_name, category, start, end - start))
+        for migration in self.migrations:
+            if migration.started is not None:
+                events.append(complete(migration.file_name, "migration", migration.started, migration.elapsed, {"version": migration.version, "direction": migration.up and "up" or "down", "rows": migration.rows}))
+        statements = self.statements + [statement for migration in self.migrations for statement in migration.statements]
+        for statement in statements:
+            if statement.started is not None:
+                events.append(complete(statement.sql[:50], "statement", statement.started, statement.elapsed, {"sql": statement.sql, "rows": statement.rows}))
+        # each round trip to the database is a step of the counter
+        for now, count in self.round_trip_samples:
+            events.append({"name": "round trips (%s)" % name, "cat": "db", "ph": "C", "pid": 1, "ts": timestamp(now), "args": {"round trips": count}})
+        return events
+
+    def first_timestamp(self):
+        return min([self.started] + [start for _, _, start, _ in self.spans])
+
+    @staticmethod
+    def write_trace(file_name, tracks):
+        """
+        writes the trace of the reports of tracks, a list of (name, report), each report on its own track
+        """
+        origin = min([report.first_timestamp() for _, report in tracks])
+        events = [{"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "simple-db-migrate"}}]
+        for tid, (name, report) in enumerate(tracks):
+            events.extend(report.trace_events(tid + 1, name, origin))
+
+        try:
+            with open(file_name, "w") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        except (IOError, OSError) as e:
+            raise Exception("could not write the trace ('%s'): %s" % (file_name, e))
+
+class ExecutionMetadata(object):
+    """
+    Metadata of the execution of a migration up, recorded with it on the version table.
+    """
+
+    COLUMNS = ("started_at", "duration_ms", "statements_count", "rows_affected", "hostname", "tool_version")
+
+    def __init__(self):
+        from simple_db_migrate import SIMPLE_DB_MIGRATE_VERSION
+        # in UTC, the databases of many environments are compared
+        self.started_at = ExecutionMetadata.utc_now().replace(microsecond=0)
+        self.duration_ms = 0
+        self.statements_count = 0
+        self.rows_affected = 0
+        self.hostname = socket.gethostname()
+        self.tool_version = SIMPLE_DB_MIGRATE_VERSION
+        self.__started = RunReport.clock()
+
+    @staticmethod
+    def utc_now():
+        # without the time zone, as stored on the version tables; datetime.utcnow is deprecated since python 3.12
+        if timezone is None:
+            return datetime.utcnow()
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def statement(self, rows=0):
+        self.statements_count += 1
+        self.rows_affected += rows and int(rows) or 0
+
+    def finish(self):
+        self.duration_ms = int(round((RunReport.clock() - self.__started) * 1000))
+
+    def values(self):
+        return tuple([getattr(self, column) for column in ExecutionMetadata.COLUMNS])
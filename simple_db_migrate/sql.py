@@ -0,0 +1,430 @@
+import gzip
+import mmap
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+class UnbalancedSQLException(Exception):
+    pass
+
+class SQLDialect(object):
+    """
+    Lexical rules of a database engine used to split migrations in statements.
+
+    - quotes: dict of the characters opening a string or quoted identifier and the ones closing it;
+      the closing character is escaped by doubling it
+    - backslash_escapes: if a backslash escapes the next character inside quotes
+    - line_comments: prefixes of the comments ending at the end of the line
+    - block_start: regex matching the beginning of a statement with semicolons inside it
+      (procedures, triggers, ...), which goes until the block_terminator
+    - block_terminator: regex matching the end of a block, not included in the statement
+    """
+
+    def __init__(self, quotes=None, backslash_escapes=False, line_comments=("--",), block_start=None, block_terminator="\n[ \n\t\r]*/(?=[ \n\t\r]|$)"):
+        self.quotes = quotes or {"'": "'", '"': '"'}
+        self.backslash_escapes = backslash_escapes
+        self.line_comments = line_comments
+        self.block_start = block_start
+        self.block_terminator = block_terminator
+
+class SQLLexer(object):
+    """
+    Splits a migration in statements by the semicolons outside quotes, comments, parenthesis and blocks,
+    reading the sql only once and yielding each statement as soon as it ends.
+    The sql may be a string or, to read big files, bytes or a mmap.
+    """
+
+    def __init__(self, dialect):
+        self.__dialect = dialect
+        self.__text_rules = self.__build_rules(lambda pattern: pattern)
+        self.__bytes_rules = self.__text_rules
+        if (sys.version_info > (3, 0)):
+            # the bytes of files are read with the same rules, so their encoding must be ascii compatible
+            self.__bytes_rules = self.__build_rules(lambda pattern: pattern.encode("latin-1"))
+
+    def __build_rules(self, native):
+        dialect = self.__dialect
+        tokens = [";", r"\(", r"\)", r"/\*"] + [re.escape(prefix) for prefix in dialect.line_comments] + [re.escape(quote) for quote in dialect.quotes]
+        rules = {
+            "tokens": re.compile(native("|".join(tokens))),
+            "comment_end": native("*/"),
+            "line_end": native("\n"),
+            "blanks_and_comments": re.compile(native(r"(?:[ \n\t\r]+|%s/\*.*?\*/)*" % "".join([r"%s[^\n]*(?:\n|$)|" % re.escape(prefix) for prefix in dialect.line_comments])), re.S),
+            "block_start": dialect.block_start and re.compile(native(dialect.block_start), re.I) or None,
+            "block_terminator": dialect.block_terminator and re.compile(native(dialect.block_terminator)) or None,
+            "quote_ends": {},
+        }
+        for quote, closing in dialect.quotes.items():
+            if dialect.backslash_escapes and quote in ("'", '"'):
+                quote_end = re.compile(native(r"\\.|%s" % re.escape(closing)), re.S)
+            else:
+                quote_end = re.compile(native(re.escape(closing)))
+            rules["quote_ends"][quote] = (native(closing), quote_end)
+        return rules
+
+    def split(self, sql):
+        """
+        returns the statements of the sql, stripped and without the semicolon which ends them;
+        returns an empty list if the sql ends with an unclosed quote, comment or parenthesis
+        """
+        try:
+            return list(self.statements(sql))
+        except UnbalancedSQLException:
+            return []
+
+    def statements(self, sql):
+        """
+        yields the statements of the sql as they are read, stripped and without the semicolon which ends them;
+        raises UnbalancedSQLException at the end if the sql has an unclosed quote, comment or parenthesis
+        """
+        rules = self.__text_rules
+        if not isinstance(sql, type(u"")) and not isinstance(sql, type("")):
+            rules = self.__bytes_rules
+
+        length = len(sql)
+        start = pos = 0
+        depth = 0
+        # once a block was not terminated none of the following ones will be
+        search_blocks = rules["block_start"] is not None
+
+        while pos < length:
+            if start == pos and search_blocks:
+                block_end, search_blocks = self.__read_block(sql, start, rules)
+                if block_end is not None:
+                    statement = sql[start:block_end[0]].strip()
+                    if statement:
+                        yield statement
+                    start = pos = block_end[1]
+                    continue
+
+            match = rules["tokens"].search(sql, pos)
+            if match is None:
+                break
+
+            token = match.group()
+            if (sys.version_info > (3, 0)) and isinstance(token, bytes):
+                token = token.decode("latin-1")
+            pos = match.end()
+            if token == ";":
+                if depth == 0:
+                    statement = sql[start:match.start()].strip()
+                    if statement:
+                        yield statement
+                    start = pos
+            elif token == "(":
+                depth += 1
+            elif token == ")":
+                depth -= 1
+            elif token == "/*":
+                pos = sql.find(rules["comment_end"], pos)
+                if pos == -1:
+                    raise UnbalancedSQLException("comment not closed")
+                pos += 2
+            elif token in rules["quote_ends"]:
+                pos = self.__read_quote(sql, pos, rules["quote_ends"][token])
+                if pos == -1:
+                    raise UnbalancedSQLException("quote not closed (%s)" % token)
+            else:
+                # line comment
+                pos = sql.find(rules["line_end"], pos)
+                if pos == -1:
+                    pos = length
+
+        if depth != 0:
+            raise UnbalancedSQLException("parenthesis not balanced")
+
+        statement = sql[start:].strip()
+        if statement:
+            yield statement
+
+    def __read_quote(self, sql, pos, quote_end):
+        closing, closing_regex = quote_end
+        while True:
+            match = closing_regex.search(sql, pos)
+            if match is None:
+                return -1
+            pos = match.end()
+            if match.group() != closing:
+                # escaped by a backslash
+                continue
+            if sql[pos:pos + len(closing)] == closing:
+                # escaped by doubling it
+                pos += len(closing)
+                continue
+            return pos
+
+    def __read_block(self, sql, start, rules):
+        """
+        returns the end of the block statement and of its terminator when the statement starting at start is a block,
+        and if blocks should still be searched
+        """
+        pos = rules["blanks_and_comments"].match(sql, start).end()
+        if not rules["block_start"].match(sql, pos):
+            return None, True
+
+        terminator = rules["block_terminator"].search(sql, pos)
+        if terminator is None:
+            return None, False
+        return (terminator.start(), terminator.end()), True
+
+class SQLFile(object):
+    """
+    SQL of a migration kept in a .sql or .sql.gz file, which is never read as a whole;
+    the file is mapped in memory and its statements are decoded and yielded one at a time.
+    """
+
+    GZIP_EXTENSION = ".gz"
+
+    def __init__(self, path, encoding="utf-8"):
+        self.path = os.path.abspath(path)
+        self.encoding = encoding
+
+    def statements(self, lexer):
+        sql_file = self.__open()
+        try:
+            if os.fstat(sql_file.fileno()).st_size == 0:
+                return
+
+            sql = mmap.mmap(sql_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                try:
+                    for statement in lexer.statements(sql):
+                        yield statement.decode(self.encoding)
+                except UnbalancedSQLException as e:
+                    raise UnbalancedSQLException("invalid sql syntax in file '%s' (%s)" % (self.path, e))
+            finally:
+                sql.close()
+        finally:
+            sql_file.close()
+
+    def __open(self):
+        if not self.path.endswith(SQLFile.GZIP_EXTENSION):
+            return open(self.path, "rb")
+
+        # compressed files are uncompressed to a temporary file, which can be mapped in memory
+        sql_file = tempfile.TemporaryFile()
+        compressed_file = gzip.open(self.path, "rb")
+        try:
+            shutil.copyfileobj(compressed_file, sql_file, 1024 * 1024)
+        finally:
+            compressed_file.close()
+        sql_file.flush()
+        return sql_file
+
+    def __str__(self):
+        return "-- statements read from file %s" % self.path
+
+    def __eq__(self, other):
+        return isinstance(other, SQLFile) and self.path == other.path and self.encoding == other.encoding
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.path, self.encoding))
+
+class StatementBatcher(object):
+    """
+    Joins runs of consecutive statements which one of the mergers parses with the same key in a single statement,
+    with the text before the parts of the first statement and the parts of all of them separated by commas;
+    any other statement is kept as it is.
+    """
+
+    def __init__(self, mergers):
+        self.mergers = mergers
+
+    def batches(self, statements):
+        """
+        yields each sql to be executed with the list of the original statements in it
+        """
+        batch_key, batch_prefix, batch_parts, batch_statements, batch_size = None, None, [], [], 0
+        for statement in statements:
+            merger, parsed = self.__parse(statement)
+            if parsed is None or (merger, parsed[0]) != batch_key or (merger.max_size and batch_size + parsed[3] > merger.max_size) or not merger.joins(batch_parts, parsed[2]):
+                if batch_statements:
+                    yield self.__join(batch_prefix, batch_parts, batch_statements)
+                batch_key, batch_prefix, batch_parts, batch_statements, batch_size = None, None, [], [], 0
+
+            if parsed is None:
+                yield statement, [statement]
+                continue
+
+            batch_key = (merger, parsed[0])
+            batch_prefix = batch_prefix or parsed[1]
+            batch_parts.append(parsed[2])
+            batch_statements.append(statement)
+            batch_size += parsed[3]
+
+        if batch_statements:
+            yield self.__join(batch_prefix, batch_parts, batch_statements)
+
+    def __parse(self, statement):
+        for merger in self.mergers:
+            parsed = merger.parse(statement)
+            if parsed is not None:
+                return merger, parsed
+        return None, None
+
+    def transactional(self, statement):
+        """
+        returns if the statement is joined by a merger whose statements are undone by a rollback
+        """
+        merger, parsed = self.__parse(statement)
+        return merger is not None and merger.transactional
+
+    def __join(self, prefix, parts, statements):
+        if len(statements) == 1:
+            return statements[0], statements
+        return "%s%s" % (prefix, ",\n".join(parts)), statements
+
+class StatementMerger(object):
+    """
+    Rule of a StatementBatcher: parse returns the key of the statements which can be joined with the statement,
+    the text before its parts, the parts and their size, or None if the statement can not be joined;
+    a joined statement has at most max_size, with 0 for no limit, and joins cuts the batch before parts
+    which depend on the parts already in it; the statements of a transactional merger are undone by a rollback.
+    """
+
+    max_size = 0
+    transactional = False
+
+    def __init__(self, backslash_escapes=False):
+        if backslash_escapes:
+            self._tokens = re.compile(r"'(?:[^'\\]+|\\.|'')*'|\"(?:[^\"\\]+|\\.|\"\")*\"|`(?:[^`]+|``)*`|[(),]|[^'\"`(),]+", re.S)
+        else:
+            self._tokens = re.compile(r"'(?:[^']+|'')*'|\"(?:[^\"]+|\"\")*\"|[(),]|[^'\"(),]+")
+
+    def parse(self, statement):
+        return None
+
+    def joins(self, batch_parts, parts):
+        """
+        returns if the parts of a statement can be joined after the parts of the statements already in the batch
+        """
+        return True
+
+    def _split(self, statement, pos):
+        """
+        returns the parts of the statement after pos separated by commas outside quotes and parenthesis,
+        or None if a quote or parenthesis is not closed
+        """
+        depth = 0
+        parts = []
+        start = pos
+        for token in self._tokens.finditer(statement, pos):
+            if token.start() != pos:
+                # a quote which is not closed
+                return None
+            pos = token.end()
+            text = token.group()
+            if text == "(":
+                depth += 1
+            elif text == ")":
+                depth -= 1
+                if depth < 0:
+                    return None
+            elif text == "," and depth == 0:
+                parts.append(statement[start:token.start()])
+                start = pos
+        if pos != len(statement) or depth != 0:
+            return None
+        parts.append(statement[start:])
+        return parts
+
+class InsertMerger(StatementMerger):
+    """
+    Joins INSERT ... VALUES statements into the same table and columns in multi-row INSERTs of at most batch_size rows.
+    """
+
+    transactional = True
+
+    __insert = re.compile(r"insert[ \n\t\r]+into[ \n\t\r]+(?P<table>[^ \n\t\r(]+)[ \n\t\r]*(?P<columns>\([^()'\"]*\))?[ \n\t\r]*values[ \n\t\r]*(?=\()", re.I)
+    __row = re.compile(r"[ \n\t\r]*\(.*\)[ \n\t\r]*$", re.S)
+    __blanks = re.compile(r"[ \n\t\r]+")
+
+    def __init__(self, batch_size=1, backslash_escapes=False):
+        super(InsertMerger, self).__init__(backslash_escapes)
+        self.max_size = int(batch_size or 1)
+
+    def parse(self, statement):
+        if self.max_size <= 1:
+            return None
+        match = InsertMerger.__insert.match(statement)
+        if not match:
+            return None
+
+        # only rows, as "(...), (...)", until the end of the statement
+        rows = self._split(statement, match.end())
+        if not rows or not all([self.__is_row(row) for row in rows]):
+            return None
+        key = (match.group('table'), InsertMerger.__blanks.sub("", match.group('columns') or ""))
+        return key, statement[:match.end()], statement[match.end():], len(rows)
+
+    def __is_row(self, row):
+        # a single parenthesis from the beginning to the end of the row
+        if not InsertMerger.__row.match(row):
+            return False
+        parts = self._split(row.strip()[1:-1], 0)
+        return parts is not None
+
+class AlterTableMerger(StatementMerger):
+    """
+    Joins ALTER TABLE statements of the same table which only add, drop, change, modify or alter columns,
+    indexes and keys in a single ALTER TABLE with all their clauses, so the table is rebuilt only once.
+    A statement which refers to a column added, renamed or dropped by a statement of the batch starts another one,
+    as all the clauses of an ALTER TABLE are checked against the table as it was before it.
+    """
+
+    __alter = re.compile(r"alter[ \n\t\r]+table[ \n\t\r]+(?P<table>(?:`[^`]+`|[^ \n\t\r`.]+)(?:\.(?:`[^`]+`|[^ \n\t\r`.]+))?)[ \n\t\r]+", re.I)
+    __clause = re.compile(r"[ \n\t\r]*(add|drop|change|modify|alter)(?![a-z0-9_$])", re.I)
+    # partitions can not be changed with other clauses, and a foreign key can not be dropped and added again in the same statement
+    __unsafe_clause = re.compile(r"[ \n\t\r]*((add|drop)[ \n\t\r]+partition|drop[ \n\t\r]+foreign[ \n\t\r]+key)(?![a-z0-9_$])", re.I)
+    __identifier = re.compile(r"`(?:[^`]|``)+`|[a-z0-9_$]+", re.I)
+    # the other objects added or dropped, whose names are not columns
+    __not_columns = ("index", "key", "unique", "fulltext", "spatial", "primary", "foreign", "constraint", "check", "partition")
+    __columns = re.compile(r"[ \n\t\r]*add(?:[ \n\t\r]+column)?(?:[ \n\t\r]+if[ \n\t\r]+not[ \n\t\r]+exists)?[ \n\t\r]*\((?P<columns>.*)\)[ \n\t\r]*$", re.I | re.S)
+
+    def parse(self, statement):
+        match = AlterTableMerger.__alter.match(statement)
+        if not match:
+            return None
+
+        clauses = self._split(statement, match.end())
+        if not clauses or not all([AlterTableMerger.__clause.match(clause) and not AlterTableMerger.__unsafe_clause.match(clause) for clause in clauses]):
+            return None
+        return match.group('table').replace("`", ""), statement[:match.end()], statement[match.end():], 1
+
+    def joins(self, batch_parts, parts):
+        clauses = self._split(parts, 0) or []
+        names = set()
+        for batch_clauses in [self._split(batch_part, 0) or [] for batch_part in batch_parts]:
+            for clause in batch_clauses:
+                names.update(self.__columns_defined(clause))
+        # any word of the clauses, conservatively, as a column may appear on expressions, positions and indexes
+        return not any([names.intersection(self.__words(clause)) for clause in clauses])
+
+    def __words(self, clause):
+        # the identifiers out of quotes, in lower case as the column names of mysql are case insensitive
+        words = []
+        for token in self._tokens.finditer(clause):
+            if token.group()[0] not in "'\"":
+                words.extend([word.replace("`", "").lower() for word in AlterTableMerger.__identifier.findall(token.group())])
+        return words
+
+    def __columns_defined(self, clause):
+        # the columns added, renamed or dropped by the clause, as "add (a int, b int)", "change a b int" or "drop column if exists a"
+        words = self.__words(clause)
+        if not words or words[0] not in ("add", "drop", "change"):
+            return []
+        names = [word for word in words[1:] if word not in ("column", "if", "not", "exists")]
+        if not names or names[0] in AlterTableMerger.__not_columns:
+            return []
+
+        columns = AlterTableMerger.__columns.match(clause)
+        if words[0] == "add" and columns:
+            return [self.__words(column)[0] for column in self._split(columns.group('columns'), 0) or [] if column.strip()]
+        if words[0] == "change":
+            return names[:2]
+        return names[:1]
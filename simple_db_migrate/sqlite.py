@@ -0,0 +1,311 @@
+import os
+import time
+from .core import Migration
+from .core.exceptions import MigrationException
+from .helpers import Utils
+from .report import ExecutionMetadata, RunReport
+from .sql import SQLDialect, SQLFile, SQLLexer
+
+class SQLite(object):
+    # triggers go until a line with only a slash
+    __sql_lexer = SQLLexer(SQLDialect(quotes={"'": "'", '"': '"', "`": "`", "[": "]"},
+                                      block_start="create[ \n\t\r]+(temp[ \n\t\r]+|temporary[ \n\t\r]+)?trigger"))
+    __memory_database = ":memory:"
+    # seconds between the attempts to lock the database file
+    __lock_retry_interval = 0.1
+    # columns of the version table with the metadata of the executions, in the order of ExecutionMetadata.COLUMNS
+    __metadata_columns = ("started_at text", "duration_ms integer", "statements_count integer", "rows_affected integer", "hostname varchar(255)", "tool_version varchar(20)")
+
+    def __init__(self, config=None, sqlite_driver=None):
+        self.__sqlite_script_encoding = config.get("database_script_encoding", "utf8")
+        # the database name is the path of the database file
+        self.__sqlite_db = config.get("database_name")
+        self.__version_table = config.get("database_version_table")
+        self.__fingerprint_table = "%s_fingerprint" % self.__version_table
+        self.__version_table_metadata = config.get("version_table_metadata", False)
+        # the file locked by the executions on the same database
+        self.__lock_file_name = "%s.lock" % self.__sqlite_db
+        self.__lock_file = None
+
+        self.__connection = None
+        self.connection_count = 0
+        self.round_trip_count = 0
+        # timings of the connections and statements, replaced by the one of the execution
+        self.run_report = RunReport.from_config(config, lambda: self.round_trip_count)
+
+        self.__sqlite_driver = sqlite_driver
+        if not sqlite_driver:
+            import sqlite3
+            self.__sqlite_driver = sqlite3
+
+        if config.get("drop_db_first"):
+            self._drop_database()
+
+        self._create_version_table_if_not_exists()
+
+    def __sqlite_connect(self):
+        # the same connection is used during the whole execution
+        try:
+            if self.__connection is None:
+                # without an isolation level the driver never opens transactions by itself,
+                # they are opened and committed here, with the DDL statements inside them
+                with self.run_report.phase("connect"):
+                    conn = self.__sqlite_driver.connect(self.__sqlite_db, isolation_level=None)
+                self.connection_count += 1
+                if self.__sqlite_db != SQLite.__memory_database:
+                    # readers are not blocked while the migrations are written
+                    self.round_trip_count += 1
+                    conn.execute("pragma journal_mode=wal")
+                self.__connection = conn
+            return self.__connection
+        except Exception as e:
+            self.__discard_connection()
+            raise Exception("could not connect to database: %s" % e)
+
+    def __discard_connection(self):
+        conn, self.__connection = self.__connection, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def __query(self, sql, params=(), fetch_all=False):
+        db = self.__sqlite_connect()
+        cursor = db.cursor()
+        try:
+            self.round_trip_count += 1
+            cursor.execute(sql, params)
+            return cursor.fetchall() if fetch_all else cursor.fetchone()
+        finally:
+            cursor.close()
+
+    def close(self):
+        self.unlock()
+        self.__discard_connection()
+
+    def __begin(self, db):
+        # the write lock is taken at once, so a concurrent writer fails before any statement is executed
+        self.round_trip_count += 1
+        db.execute("begin immediate")
+
+    def __commit(self, db):
+        self.round_trip_count += 1
+        db.execute("commit")
+
+    def __rollback(self, db):
+        try:
+            self.round_trip_count += 1
+            db.execute("rollback")
+        except Exception:
+            # some errors make sqlite roll the transaction back by itself
+            pass
+
+    def __execute(self, db, sql, execution_log=None, metadata=None):
+        curr_statement = None
+        try:
+            if isinstance(sql, SQLFile):
+                # the statements of sql files are read while they are executed
+                statments = sql.statements(SQLite.__sql_lexer)
+            else:
+                statments = SQLite._parse_sql_statements(sql)
+                if len(sql.strip(' \t\n\r')) != 0 and len(statments) == 0:
+                    raise Exception("invalid sql syntax '%s'" % Utils.encode(sql, "utf-8"))
+
+            cursor = db.cursor()
+            try:
+                for statement in statments:
+                    curr_statement = statement
+                    self.round_trip_count += 1
+                    start = RunReport.clock()
+                    cursor.execute(statement)
+                    affected_rows = cursor.rowcount > 0 and int(cursor.rowcount) or 0
+                    self.run_report.statement(statement, RunReport.clock() - start, affected_rows)
+                    if metadata is not None:
+                        metadata.statement(affected_rows)
+                    if execution_log:
+                        execution_log("%s\n-- %d row(s) affected\n" % (statement, affected_rows))
+            finally:
+                cursor.close()
+        except Exception as e:
+            raise MigrationException("error executing migration: %s" % e, curr_statement)
+
+    def __change_db_version(self, db, version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None, metadata=None):
+        if up:
+            # moving up and storing history
+            sql = "insert into %s (version, label, name, sql_up, sql_down) values (?, ?, ?, ?, ?);" % self.__version_table
+            params = (str(version), label_version or None, migration_file_name, sql_up or "", sql_down or "")
+            if metadata is not None:
+                sql = "insert into %s (version, label, name, sql_up, sql_down, %s) values (?, ?, ?, ?, ?, %s);" % (self.__version_table, ", ".join(ExecutionMetadata.COLUMNS), ", ".join(["?"] * len(ExecutionMetadata.COLUMNS)))
+                values = metadata.values()
+                params = params + (values[0].strftime("%Y-%m-%d %H:%M:%S"),) + values[1:]
+        else:
+            # moving down and deleting from history
+            sql = "delete from %s where version = ?;" % self.__version_table
+            params = (str(version),)
+
+        try:
+            self.round_trip_count += 1
+            db.execute(sql, params)
+            if execution_log:
+                execution_log("migration %s registered\n" % (migration_file_name))
+        except Exception as e:
+            raise MigrationException("error logging migration: %s" % e, migration_file_name)
+
+    @classmethod
+    def _parse_sql_statements(cls, migration_sql):
+        return SQLite.__sql_lexer.split(migration_sql)
+
+    def _drop_database(self):
+        self.__discard_connection()
+        if self.__sqlite_db == SQLite.__memory_database:
+            return
+
+        # the write ahead log and its index go with the database
+        for path in (self.__sqlite_db, "%s-wal" % self.__sqlite_db, "%s-shm" % self.__sqlite_db):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                raise Exception("can't drop database '%s'; \n%s" % (self.__sqlite_db, str(e)))
+
+    def _create_version_table_if_not_exists(self):
+        # create version table
+        db = self.__sqlite_connect()
+        self.round_trip_count += 1
+        db.execute("create table if not exists %s ( id integer NOT NULL PRIMARY KEY AUTOINCREMENT, version varchar(20) NOT NULL default '0', label varchar(255), name varchar(255), sql_up text, sql_down text);" % self.__version_table)
+
+        # check if there is a register there
+        count = self.__query("select count(*) from %s;" % self.__version_table)[0]
+
+        # if there is not a version register, insert one
+        if count == 0:
+            self.round_trip_count += 1
+            db.execute("insert into %s (version) values ('0');" % self.__version_table)
+
+        if self.__version_table_metadata:
+            self._add_metadata_columns_if_not_exists()
+
+    def _add_metadata_columns_if_not_exists(self):
+        # version tables created without the metadata columns are upgraded in place
+        columns = [column[1] for column in self.__query("pragma table_info(%s);" % self.__version_table, fetch_all=True)]
+        db = self.__sqlite_connect()
+        for column in SQLite.__metadata_columns:
+            if column.split(" ")[0] not in columns:
+                self.round_trip_count += 1
+                db.execute("alter table %s add column %s;" % (self.__version_table, column))
+
+    def change(self, sql, new_db_version, migration_file_name, sql_up, sql_down, up=True, execution_log=None, label_version=None):
+        # sqlite has transactional DDL: the migration and its record on version table are always committed together
+        metadata = self.__version_table_metadata and up and ExecutionMetadata() or None
+        db = self.__sqlite_connect()
+        self.__begin(db)
+        try:
+            self.__execute(db, sql, execution_log, metadata)
+            if metadata is not None:
+                metadata.finish()
+            with self.run_report.phase("record"):
+                self.__change_db_version(db, new_db_version, migration_file_name, sql_up, sql_down, up, execution_log, label_version, metadata)
+        except Exception:
+            self.__rollback(db)
+            raise
+
+        try:
+            self.__commit(db)
+        except Exception as e:
+            self.__rollback(db)
+            raise MigrationException("error committing migration: %s" % e, migration_file_name)
+
+    def get_current_schema_version(self):
+        return self.__query("select version from %s order by id desc limit 1;" % self.__version_table)[0]
+
+    def get_all_schema_versions(self):
+        versions = []
+        all_versions = self.__query("select version from %s order by id;" % self.__version_table, fetch_all=True)
+        for version in all_versions:
+            versions.append(version[0])
+        versions.sort()
+        return versions
+
+    def get_version_id_from_version_number(self, version):
+        result = self.__query("select id from %s where version = ? order by id desc;" % self.__version_table, (str(version),))
+        return result and int(result[0]) or None
+
+    def get_version_number_from_label(self, label):
+        result = self.__query("select version from %s where label = ? order by id desc;" % self.__version_table, (label,))
+        return result and result[0] or None
+
+    def get_all_schema_migrations(self, with_sql=True):
+        migrations = []
+        columns = with_sql and "id, version, label, name, sql_up, sql_down" or "id, version, label, name"
+        all_migrations = self.__query("select %s from %s order by id;" % (columns, self.__version_table), fetch_all=True)
+        for migration_db in all_migrations:
+            # without the sql columns sql_up and sql_down are None, read later by get_schema_migrations_sql
+            migration = Migration(id = int(migration_db[0]),
+                                  version = migration_db[1] and str(migration_db[1]) or None,
+                                  label = migration_db[2] and str(migration_db[2]) or None,
+                                  file_name = migration_db[3] and str(migration_db[3]) or None,
+                                  sql_up = None,
+                                  sql_down = None)
+            if with_sql:
+                migration.sql_up = Migration.ensure_sql_unicode(migration_db[4], self.__sqlite_script_encoding)
+                migration.sql_down = Migration.ensure_sql_unicode(migration_db[5], self.__sqlite_script_encoding)
+            migrations.append(migration)
+        return migrations
+
+    def get_schema_migrations_sql(self, ids):
+        sql_by_id = {}
+        if not ids:
+            return sql_by_id
+
+        all_sql = self.__query("select id, sql_up, sql_down from %s where id in (%s);" % (self.__version_table, ", ".join(["%d" % int(id) for id in ids])), fetch_all=True)
+        for sql_db in all_sql:
+            sql_by_id[int(sql_db[0])] = (Migration.ensure_sql_unicode(sql_db[1], self.__sqlite_script_encoding), Migration.ensure_sql_unicode(sql_db[2], self.__sqlite_script_encoding))
+        return sql_by_id
+
+    def get_fingerprint(self):
+        # the fingerprint is valid only while the last version is the one it was stored with
+        sql = "select fingerprint from %s where version = (select version from %s order by id desc limit 1);" % (self.__fingerprint_table, self.__version_table)
+        try:
+            result = self.__query(sql)
+        except Exception:
+            # the table is created when the first fingerprint is stored
+            return None
+        return result and result[0] or None
+
+    def set_fingerprint(self, fingerprint, version):
+        db = self.__sqlite_connect()
+        self.__begin(db)
+        try:
+            self.round_trip_count += 3
+            db.execute("create table if not exists %s ( fingerprint varchar(64) NOT NULL, version varchar(20) NOT NULL );" % self.__fingerprint_table)
+            db.execute("delete from %s;" % self.__fingerprint_table)
+            db.execute("insert into %s (fingerprint, version) values (?, ?);" % self.__fingerprint_table, (fingerprint, str(version)))
+        except Exception:
+            self.__rollback(db)
+            raise
+        self.__commit(db)
+
+    def lock(self, timeout):
+        if self.__sqlite_db == SQLite.__memory_database:
+            return
+
+        import fcntl
+        lock_file = open(self.__lock_file_name, "a")
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except (IOError, OSError):
+                if time.time() >= deadline:
+                    lock_file.close()
+                    raise Exception("could not get the advisory lock '%s' in %d seconds" % (self.__lock_file_name, timeout))
+                time.sleep(SQLite.__lock_retry_interval)
+        self.__lock_file = lock_file
+
+    def unlock(self):
+        # closing the file releases the lock
+        lock_file, self.__lock_file = self.__lock_file, None
+        if lock_file is not None:
+            lock_file.close()
@@ -0,0 +1,9 @@
+import sys
+import unittest
+
+# the tests of the asyncio variants use async and await, only compiled on python 3
+if (sys.version_info >= (3, 5)):
+    from tests.py3.aio_cases import AsyncTest
+
+if __name__ == "__main__":
+    unittest.main()
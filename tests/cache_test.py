@@ -0,0 +1,67 @@
+import os
+import shutil
+import unittest
+from simple_db_migrate.core.cache import MigrationCache
+from tests import create_migration_file, delete_files
+
+class MigrationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.migration_file = os.path.abspath(create_migration_file('20090214115100_01_test_migration.migration', 'foo', 'bar'))
+        self.cache = MigrationCache('test_migrations_cache')
+
+    def tearDown(self):
+        delete_files('*test_migration.migration')
+        if os.path.exists('test_migrations_cache'):
+            shutil.rmtree('test_migrations_cache')
+
+    def test_it_should_create_the_cache_dir(self):
+        self.assertTrue(os.path.isdir(os.path.abspath('test_migrations_cache')))
+
+    def test_it_should_return_none_for_files_not_cached(self):
+        self.assertEqual(None, self.cache.get(self.migration_file, 'utf-8'))
+
+    def test_it_should_return_cached_commands(self):
+        self.cache.put(self.migration_file, 'utf-8', u'foo', u'bar')
+        self.assertEqual((u'foo', u'bar'), tuple(self.cache.get(self.migration_file, 'utf-8')))
+
+    def test_it_should_not_return_commands_cached_with_other_encoding(self):
+        self.cache.put(self.migration_file, 'utf-8', u'foo', u'bar')
+        self.assertEqual(None, self.cache.get(self.migration_file, 'iso8859-1'))
+
+    def test_it_should_evict_entries_of_changed_files(self):
+        self.cache.put(self.migration_file, 'utf-8', u'foo', u'bar')
+        create_migration_file('20090214115100_01_test_migration.migration', 'foo changed', 'bar')
+        self.assertEqual(None, self.cache.get(self.migration_file, 'utf-8'))
+        self.assertEqual([], os.listdir('test_migrations_cache'))
+
+    def test_it_should_keep_entries_of_touched_files_with_same_content(self):
+        self.cache.put(self.migration_file, 'utf-8', u'foo', u'bar')
+        stat = os.stat(self.migration_file)
+        os.utime(self.migration_file, (stat.st_atime, stat.st_mtime + 10))
+        self.assertEqual((u'foo', u'bar'), tuple(self.cache.get(self.migration_file, 'utf-8')))
+
+    def test_it_should_ignore_corrupted_entries(self):
+        self.cache.put(self.migration_file, 'utf-8', u'foo', u'bar')
+        entry_file = os.path.join('test_migrations_cache', os.listdir('test_migrations_cache')[0])
+        f = open(entry_file, 'w')
+        f.write('{corrupted')
+        f.close()
+        self.assertEqual(None, self.cache.get(self.migration_file, 'utf-8'))
+        self.assertFalse(os.path.exists(entry_file))
+
+    def test_it_should_evict_all_entries_but_the_given_ones(self):
+        other_file = os.path.abspath(create_migration_file('20090214115200_02_test_migration.migration', 'foo', 'bar'))
+        self.cache.put(self.migration_file, 'utf-8', u'foo', u'bar')
+        self.cache.put(other_file, 'utf-8', u'foo', u'bar')
+        self.cache.evict_all_but([other_file])
+        self.assertEqual(None, self.cache.get(self.migration_file, 'utf-8'))
+        self.assertEqual((u'foo', u'bar'), tuple(self.cache.get(other_file, 'utf-8')))
+
+    def test_it_should_clear_all_entries(self):
+        self.cache.put(self.migration_file, 'utf-8', u'foo', u'bar')
+        self.cache.clear()
+        self.assertEqual([], os.listdir('test_migrations_cache'))
+
+if __name__ == '__main__':
+    unittest.main()
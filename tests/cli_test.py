@@ -211,6 +211,132 @@ class CLITest(unittest.TestCase):
     def test_it_should_accept_database_info_options(self):
         self.assertEqual("labels", CLI.parse(["--info", "labels"])[0].info_database)
 
+    def test_it_should_has_a_default_value_for_lazy_load(self):
+        self.assertEqual(False, CLI.parse([])[0].lazy_load)
+
+    def test_it_should_accept_lazy_load_options(self):
+        self.assertEqual(True, CLI.parse(["--lazy-load"])[0].lazy_load)
+
+    def test_it_should_not_has_a_default_value_for_cache_dir(self):
+        self.assertEqual(None, CLI.parse([])[0].database_migrations_cache_dir)
+
+    def test_it_should_accept_cache_dir_options(self):
+        self.assertEqual("cache", CLI.parse(["--cache-dir", "cache"])[0].database_migrations_cache_dir)
+
+    def test_it_should_has_a_default_value_for_no_cache(self):
+        self.assertEqual(False, CLI.parse([])[0].no_cache)
+
+    def test_it_should_accept_no_cache_options(self):
+        self.assertEqual(True, CLI.parse(["--no-cache"])[0].no_cache)
+
+    def test_it_should_has_a_default_value_for_clear_cache(self):
+        self.assertEqual(False, CLI.parse([])[0].clear_cache)
+
+    def test_it_should_accept_clear_cache_options(self):
+        self.assertEqual(True, CLI.parse(["--clear-cache"])[0].clear_cache)
+
+    def test_it_should_has_a_default_value_for_single_transaction(self):
+        self.assertEqual(False, CLI.parse([])[0].single_transaction)
+
+    def test_it_should_accept_single_transaction_options(self):
+        self.assertEqual(True, CLI.parse(["--single-transaction"])[0].single_transaction)
+
+    def test_it_should_not_has_a_default_value_for_insert_batch_size(self):
+        self.assertEqual(None, CLI.parse([])[0].insert_batch_size)
+
+    def test_it_should_accept_insert_batch_size_options(self):
+        self.assertEqual(500, CLI.parse(["--insert-batch-size", "500"])[0].insert_batch_size)
+
+    def test_it_should_has_a_default_value_for_merge_alter_table(self):
+        self.assertEqual(False, CLI.parse([])[0].merge_alter_table)
+
+    def test_it_should_accept_merge_alter_table_options(self):
+        self.assertEqual(True, CLI.parse(["--merge-alter-table"])[0].merge_alter_table)
+
+    def test_it_should_not_has_a_default_value_for_targets_concurrency(self):
+        self.assertEqual(None, CLI.parse([])[0].targets_concurrency)
+
+    def test_it_should_accept_targets_concurrency_options(self):
+        self.assertEqual(16, CLI.parse(["--targets-concurrency", "16"])[0].targets_concurrency)
+
+    def test_it_should_has_a_default_value_for_continue_on_error(self):
+        self.assertEqual(False, CLI.parse([])[0].continue_on_error)
+
+    def test_it_should_accept_continue_on_error_options(self):
+        self.assertEqual(True, CLI.parse(["--continue-on-error"])[0].continue_on_error)
+
+    def test_it_should_has_a_default_value_for_fast_check(self):
+        self.assertEqual(False, CLI.parse([])[0].fast_check)
+
+    def test_it_should_accept_fast_check_options(self):
+        self.assertEqual(True, CLI.parse(["--fast-check"])[0].fast_check)
+
+    def test_it_should_has_a_default_value_for_advisory_lock(self):
+        self.assertEqual(False, CLI.parse([])[0].advisory_lock)
+
+    def test_it_should_accept_advisory_lock_options(self):
+        self.assertEqual(True, CLI.parse(["--advisory-lock"])[0].advisory_lock)
+
+    def test_it_should_not_has_a_default_value_for_advisory_lock_timeout(self):
+        self.assertEqual(None, CLI.parse([])[0].advisory_lock_timeout)
+
+    def test_it_should_accept_advisory_lock_timeout_options(self):
+        self.assertEqual(60, CLI.parse(["--advisory-lock-timeout", "60"])[0].advisory_lock_timeout)
+
+    def test_it_should_not_has_a_default_value_for_report_top(self):
+        self.assertEqual(None, CLI.parse([])[0].report_top)
+
+    def test_it_should_accept_report_top_options(self):
+        self.assertEqual(5, CLI.parse(["--report-top", "5"])[0].report_top)
+
+    def test_it_should_not_has_a_default_value_for_report_file(self):
+        self.assertEqual(None, CLI.parse([])[0].report_file)
+
+    def test_it_should_accept_report_file_options(self):
+        self.assertEqual("report.json", CLI.parse(["--report-file", "report.json"])[0].report_file)
+
+    def test_it_should_has_a_default_value_for_version_table_metadata(self):
+        self.assertEqual(False, CLI.parse([])[0].version_table_metadata)
+
+    def test_it_should_accept_version_table_metadata_options(self):
+        self.assertEqual(True, CLI.parse(["--version-table-metadata"])[0].version_table_metadata)
+
+    def test_it_should_has_a_default_value_for_progress(self):
+        self.assertEqual(False, CLI.parse([])[0].progress)
+
+    def test_it_should_accept_progress_options(self):
+        self.assertEqual(True, CLI.parse(["--progress"])[0].progress)
+
+    def test_it_should_not_has_a_default_value_for_durations_file(self):
+        self.assertEqual(None, CLI.parse([])[0].durations_file)
+
+    def test_it_should_accept_durations_file_options(self):
+        self.assertEqual("report.json", CLI.parse(["--durations-file", "report.json"])[0].durations_file)
+
+    def test_it_should_not_has_a_default_value_for_profile(self):
+        self.assertEqual(None, CLI.parse([])[0].profile)
+
+    def test_it_should_accept_profile_options(self):
+        self.assertEqual("run.pstats", CLI.parse(["--profile", "run.pstats"])[0].profile)
+
+    def test_it_should_not_has_a_default_value_for_trace_file(self):
+        self.assertEqual(None, CLI.parse([])[0].trace_file)
+
+    def test_it_should_accept_trace_file_options(self):
+        self.assertEqual("trace.json", CLI.parse(["--trace-file", "trace.json"])[0].trace_file)
+
+    def test_it_should_not_has_a_default_value_for_jobs(self):
+        self.assertEqual(None, CLI.parse([])[0].jobs)
+
+    def test_it_should_accept_jobs_options(self):
+        self.assertEqual(4, CLI.parse(["--jobs", "4"])[0].jobs)
+
+    def test_it_should_not_has_a_default_value_for_jobs_mode(self):
+        self.assertEqual(None, CLI.parse([])[0].jobs_mode)
+
+    def test_it_should_accept_jobs_mode_options(self):
+        self.assertEqual("process", CLI.parse(["--jobs-mode", "process"])[0].jobs_mode)
+
     @patch('sys.stdout', new_callable=StringIO)
     def test_it_should_call_print_statment_with_the_given_message(self, stdout_mock):
         CLI.msg("message to print")
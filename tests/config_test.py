@@ -140,6 +140,15 @@ class ConfigTest(unittest.TestCase):
         self.assertEqual("", config.get("ANOTHER_KEY", ""))
         self.assertEqual(False, config.get("ANOTHER_KEY", False))
 
+    def test_it_should_copy_the_config_replacing_the_given_values(self):
+        config = Config({"SOME_KEY": "some_value", "other_key": "other_value"})
+        copy = config.copy({"Other_Key": None, "new_key": "new_value"})
+        self.assertEqual("some_value", copy.get("some_key"))
+        self.assertEqual(None, copy.get("other_key"))
+        self.assertEqual("new_value", copy.get("new_key"))
+        self.assertEqual("other_value", config.get("other_key"))
+        self.assertEqual(None, config.get("new_key", None))
+
     def test_it_should_update_value_to_a_non_existing_key(self):
         config = Config()
         config.update("some_key", "some_value")
@@ -252,6 +261,13 @@ DATABASE_OTHER_CUSTOM_VARIABLE = 'Value'
         self.assertEqual('Other Value', config.get('database_any_custom_variable'))
         self.assertEqual('Value', config.get('database_other_custom_variable'))
 
+    def test_it_should_resolve_migrations_cache_dir_relative_to_config_file(self):
+        f = open('sample2.conf', 'a')
+        f.write("\nDATABASE_MIGRATIONS_CACHE_DIR = 'cache'")
+        f.close()
+        config = FileConfig(os.path.abspath('sample2.conf'))
+        self.assertEqual(os.path.abspath('cache'), config.get('database_migrations_cache_dir'))
+
     def test_it_should_accept_a_configuration_file_without_migrations_dir_key(self):
         config_path = os.path.abspath('sample2.conf')
         config = FileConfig(config_path)
@@ -1,10 +1,12 @@
 # coding: utf-8
 import os
+import shutil
 import unittest
 import sys
 from mock import patch, Mock
 from simple_db_migrate.core import Migration
 from simple_db_migrate.core import SimpleDBMigrate
+from simple_db_migrate.sql import SQLFile
 from tests import BaseTest, create_file, create_migration_file, delete_files, create_config
 
 class SimpleDBMigrateTest(BaseTest):
@@ -23,6 +25,11 @@ class SimpleDBMigrateTest(BaseTest):
         self.test_migration_files.append(os.path.abspath(create_migration_file('migrations/20090214115500_05_test_migration.migration', 'foo', 'bar')))
         self.test_migration_files.append(os.path.abspath(create_migration_file('migrations/20090214115600_06_test_migration.migration', 'foo', 'bar')))
 
+    def tearDown(self):
+        super(SimpleDBMigrateTest, self).tearDown()
+        if os.path.exists('test_migrations_cache'):
+            shutil.rmtree('test_migrations_cache')
+
     def test_it_should_use_migrations_dir_from_configuration(self):
         db_migrate = SimpleDBMigrate(self.config)
         self.assertEqual(self.config.get("database_migrations_dir"), db_migrate._migrations_dir)
@@ -69,6 +76,110 @@ class SimpleDBMigrateTest(BaseTest):
         db_migrate.get_all_migrations()
         self.assertEqual((len(self.test_migration_files) * 2), is_file_name_valid_mock.call_count)
 
+    def test_it_should_use_one_job_in_thread_mode_by_default(self):
+        db_migrate = SimpleDBMigrate(self.config)
+        self.assertEqual(1, db_migrate._jobs)
+        self.assertEqual('thread', db_migrate._jobs_mode)
+
+    def test_it_should_raise_error_if_jobs_mode_is_invalid(self):
+        self.config.put('jobs_mode', 'invalid')
+        self.assertRaisesWithMessage(Exception, "invalid jobs mode ('invalid'); it should be one of: thread, process", SimpleDBMigrate, self.config)
+
+    @patch('simple_db_migrate.core.ThreadPool')
+    def test_it_should_not_create_a_pool_when_using_only_one_job(self, thread_pool_mock):
+        db_migrate = SimpleDBMigrate(self.config)
+        db_migrate.get_all_migrations()
+        self.assertEqual(0, thread_pool_mock.call_count)
+
+    def test_it_should_get_all_migrations_sorted_using_a_thread_pool(self):
+        self.config.put('jobs', 3)
+        serial_migrations = SimpleDBMigrate(create_config(migrations_dir='.:migrations')).get_all_migrations()
+        migrations = SimpleDBMigrate(self.config).get_all_migrations()
+        self.assertEqual([m.abspath for m in serial_migrations], [m.abspath for m in migrations])
+        self.assertEqual([m.sql_up for m in serial_migrations], [m.sql_up for m in migrations])
+
+    def test_it_should_get_all_migrations_sorted_using_a_process_pool(self):
+        self.config.put('jobs', '2')
+        self.config.put('jobs_mode', 'process')
+        migrations = SimpleDBMigrate(self.config).get_all_migrations()
+        self.assertEqual(sorted(self.test_migration_files, key=os.path.basename), [m.abspath for m in migrations])
+        self.assertEqual(['foo'] * len(self.test_migration_files), [m.sql_up for m in migrations])
+
+    def test_it_should_raise_the_error_of_the_only_invalid_migration_file(self):
+        create_file('20090214115700_07_test_migration.migration', 'SQL_UP=u"foo"')
+        db_migrate = SimpleDBMigrate(self.config)
+        self.assertRaisesWithMessage(Exception, "migration file is incorrect; it does not define 'SQL_UP' or 'SQL_DOWN' (%s)" % os.path.abspath('20090214115700_07_test_migration.migration'), db_migrate.get_all_migrations)
+
+    def test_it_should_report_all_invalid_migration_files_together(self):
+        self.config.put('jobs', 2)
+        create_file('20090214115700_07_test_migration.migration', 'SQL_UP=u"foo"')
+        create_file('migrations/20090214115800_08_test_migration.migration', 'SQL_UP=u""\nSQL_DOWN=u"bar"')
+        db_migrate = SimpleDBMigrate(self.config)
+        try:
+            db_migrate.get_all_migrations()
+            self.fail("it should not get here")
+        except Exception as e:
+            lines = str(e).split('\n')
+            self.assertEqual("2 migration files could not be loaded:", lines[0])
+            self.assertTrue("migration file is incorrect; it does not define 'SQL_UP' or 'SQL_DOWN' (%s)" % os.path.abspath('20090214115700_07_test_migration.migration') in lines)
+            self.assertTrue("migration command 'SQL_UP' is empty (%s)" % os.path.abspath('migrations/20090214115800_08_test_migration.migration') in lines)
+
+    def test_it_should_not_use_a_cache_by_default(self):
+        db_migrate = SimpleDBMigrate(self.config)
+        self.assertEqual(None, db_migrate._cache)
+
+    def test_it_should_load_unchanged_migrations_from_cache_without_interpreting_them(self):
+        self.config.put('database_migrations_cache_dir', 'test_migrations_cache')
+        SimpleDBMigrate(self.config).get_all_migrations()
+        self.assertEqual(len(self.test_migration_files), len(os.listdir('test_migrations_cache')))
+
+        with patch('simple_db_migrate.core.Utils.get_literal_variables_from_file') as get_literal_variables_from_file_mock:
+            migrations = SimpleDBMigrate(self.config).get_all_migrations()
+            self.assertEqual(0, get_literal_variables_from_file_mock.call_count)
+        self.assertEqual(['foo'] * len(self.test_migration_files), [m.sql_up for m in migrations])
+        self.assertEqual(['bar'] * len(self.test_migration_files), [m.sql_down for m in migrations])
+
+    def test_it_should_interpret_again_changed_migrations(self):
+        self.config.put('database_migrations_cache_dir', 'test_migrations_cache')
+        SimpleDBMigrate(self.config).get_all_migrations()
+        create_migration_file('20090214115100_01_test_migration.migration', 'changed foo', 'bar')
+
+        migrations = SimpleDBMigrate(self.config).get_all_migrations()
+        self.assertEqual('changed foo', migrations[0].sql_up)
+
+    def test_it_should_evict_cache_entries_of_removed_migrations(self):
+        self.config.put('database_migrations_cache_dir', 'test_migrations_cache')
+        SimpleDBMigrate(self.config).get_all_migrations()
+        os.remove(self.test_migration_files.pop())
+
+        SimpleDBMigrate(self.config).get_all_migrations()
+        self.assertEqual(len(self.test_migration_files), len(os.listdir('test_migrations_cache')))
+
+    def test_it_should_bypass_the_cache_when_asked(self):
+        self.config.put('database_migrations_cache_dir', 'test_migrations_cache')
+        self.config.put('no_cache', True)
+        db_migrate = SimpleDBMigrate(self.config)
+        db_migrate.get_all_migrations()
+        self.assertEqual(None, db_migrate._cache)
+        self.assertFalse(os.path.exists('test_migrations_cache'))
+
+    def test_it_should_clear_the_cache_when_asked(self):
+        self.config.put('database_migrations_cache_dir', 'test_migrations_cache')
+        SimpleDBMigrate(self.config).get_all_migrations()
+        self.config.put('clear_cache', True)
+        self.config.put('no_cache', True)
+        SimpleDBMigrate(self.config)
+        self.assertEqual([], os.listdir('test_migrations_cache'))
+
+    @patch('simple_db_migrate.core.Migration._get_commands')
+    def test_it_should_not_read_migration_commands_when_lazy_load_is_set(self, get_commands_mock):
+        self.config.put('lazy_load', True)
+        self.config.put('jobs', 4)
+        migrations = SimpleDBMigrate(self.config).get_all_migrations()
+        self.assertEqual(len(self.test_migration_files), len(migrations))
+        self.assertEqual('20090214115100', migrations[0].version)
+        self.assertEqual(0, get_commands_mock.call_count)
+
     def test_it_should_raise_error_if_has_an_invalid_dir_on_migrations_dir_list(self):
         self.config.update("database_migrations_dir", ['invalid_path_it_does_not_exist'])
         db_migrate = SimpleDBMigrate(self.config)
@@ -79,6 +190,21 @@ class SimpleDBMigrateTest(BaseTest):
         db_migrate = SimpleDBMigrate(self.config)
         self.assertRaisesWithMessage(Exception, "no migration files found", db_migrate.get_all_migrations)
 
+    @patch('simple_db_migrate.core.Migration.is_file_name_valid', return_value=False)
+    def test_it_should_raise_the_error_of_the_first_load_without_loading_the_files_again(self, is_file_name_valid_mock):
+        db_migrate = SimpleDBMigrate(self.config)
+        errors = []
+        for attempt in (1, 2):
+            try:
+                db_migrate.get_all_migrations()
+                self.fail("it should not get here")
+            except Exception as e:
+                errors.append(e)
+        self.assertTrue(errors[0] is errors[1])
+        self.assertEqual("no migration files found", str(errors[1]))
+        # the files were discovered and parsed only once
+        self.assertEqual(['discovery', 'parse'], [span[0] for span in db_migrate.report.spans])
+
     def test_it_should_get_all_migration_versions_available(self):
         db_migrate = SimpleDBMigrate(self.config)
         migrations = db_migrate.get_all_migrations()
@@ -104,22 +230,22 @@ class SimpleDBMigrateTest(BaseTest):
         self.assertEqual(1, len(migration_versions))
         self.assertEqual('20090214115100', migration_versions[0])
 
-    @patch('simple_db_migrate.core.SimpleDBMigrate.get_all_migration_versions', return_value=[])
-    def test_it_should_use_get_all_migrations_versions_method_to_get_all_migration_versions_up_to_a_version(self, get_all_migration_versions_mock):
+    @patch('simple_db_migrate.core.SimpleDBMigrate.get_all_migrations', return_value=[])
+    def test_it_should_use_get_all_migrations_method_to_get_all_migration_versions_up_to_a_version(self, get_all_migrations_mock):
         db_migrate = SimpleDBMigrate(self.config)
         db_migrate.get_all_migration_versions_up_to('20090214115200')
-        self.assertEqual(1, get_all_migration_versions_mock.call_count)
+        self.assertEqual(1, get_all_migrations_mock.call_count)
 
     def test_it_should_check_if_migration_version_exists(self):
         db_migrate = SimpleDBMigrate(self.config)
         self.assertTrue(db_migrate.check_if_version_exists('20090214115100'))
         self.assertFalse(db_migrate.check_if_version_exists('19000101000000'))
 
-    @patch('simple_db_migrate.core.SimpleDBMigrate.get_all_migration_versions', return_value=[])
-    def test_it_should_use_get_all_migrations_versions_method_to_check_if_migration_version_exists(self, get_all_migration_versions_mock):
+    @patch('simple_db_migrate.core.SimpleDBMigrate.get_all_migrations', return_value=[])
+    def test_it_should_use_get_all_migrations_method_to_check_if_migration_version_exists(self, get_all_migrations_mock):
         db_migrate = SimpleDBMigrate(self.config)
         db_migrate.check_if_version_exists('20090214115100')
-        self.assertEqual(1, get_all_migration_versions_mock.call_count)
+        self.assertEqual(1, get_all_migrations_mock.call_count)
 
     def test_it_should_not_inform_that_migration_version_exists_just_matching_the_beggining_of_version_number(self):
         db_migrate = SimpleDBMigrate(self.config)
@@ -135,6 +261,39 @@ class SimpleDBMigrateTest(BaseTest):
         db_migrate.latest_version_available()
         self.assertEqual(1, get_all_migrations_mock.call_count)
 
+    def test_it_should_get_the_first_migration_file_of_a_version_number(self):
+        create_migration_file('20090214115100_00_test_migration.migration', 'foo', 'bar')
+        db_migrate = SimpleDBMigrate(self.config)
+        migration = db_migrate.get_migration_from_version_number('20090214115100')
+        self.assertEqual('20090214115100_00_test_migration.migration', migration.file_name)
+        self.assertEqual(['20090214115100', '20090214115100'], db_migrate.get_all_migration_versions_up_to('20090214115200'))
+
+    def test_it_should_compute_the_fingerprint_of_the_migration_files_without_loading_them(self):
+        with patch('simple_db_migrate.core._load_migration_file') as load_mock:
+            fingerprint = SimpleDBMigrate(self.config).get_migration_files_fingerprint()
+        self.assertEqual(0, load_mock.call_count)
+        self.assertEqual(40, len(fingerprint))
+        self.assertEqual(fingerprint, SimpleDBMigrate(self.config).get_migration_files_fingerprint())
+
+    def test_it_should_change_the_fingerprint_when_a_migration_file_is_added_or_changed(self):
+        fingerprint = SimpleDBMigrate(self.config).get_migration_files_fingerprint()
+        create_migration_file('20090214115400_04_test_migration.migration', 'foo', 'baz')
+        changed_fingerprint = SimpleDBMigrate(self.config).get_migration_files_fingerprint()
+        self.assertNotEqual(fingerprint, changed_fingerprint)
+        create_migration_file('migrations/20090214115700_07_test_migration.migration', 'foo', 'bar')
+        self.assertNotEqual(changed_fingerprint, SimpleDBMigrate(self.config).get_migration_files_fingerprint())
+
+    def test_it_should_not_change_the_fingerprint_when_the_migration_files_are_only_touched(self):
+        fingerprint = SimpleDBMigrate(self.config).get_migration_files_fingerprint()
+        os.utime(self.test_migration_files[0], (0, 0))
+        self.assertEqual(fingerprint, SimpleDBMigrate(self.config).get_migration_files_fingerprint())
+
+    def test_it_should_index_migrations_only_once(self):
+        db_migrate = SimpleDBMigrate(self.config)
+        migrations_by_version, sorted_versions = db_migrate._get_versions_index()
+        self.assertTrue(migrations_by_version is db_migrate._get_versions_index()[0])
+        self.assertTrue(sorted_versions is db_migrate._get_versions_index()[1])
+
     def test_it_should_get_migration_from_version_number(self):
         db_migrate = SimpleDBMigrate(self.config)
         migration = db_migrate.get_migration_from_version_number('20090214115100')
@@ -170,6 +329,22 @@ class MigrationTest(BaseTest):
     def tearDown(self):
         delete_files('*test_migration.migration')
 
+    def test_it_should_read_sql_up_and_sql_down_from_sql_files(self):
+        create_file('20090214120700_sql_files_test_migration.migration', 'SQL_UP_FILE="20090214120700_up_test_migration.sql.gz"\nSQL_DOWN_FILE="20090214120700_down_test_migration.sql"')
+        create_file('20090214120700_up_test_migration.sql.gz')
+        create_file('20090214120700_down_test_migration.sql')
+        try:
+            migration = Migration('20090214120700_sql_files_test_migration.migration')
+            self.assertEqual(SQLFile(os.path.abspath('20090214120700_up_test_migration.sql.gz')), migration.sql_up)
+            self.assertEqual(SQLFile(os.path.abspath('20090214120700_down_test_migration.sql')), migration.sql_down)
+            self.assertEqual("", Migration.stored_sql(migration.sql_up))
+        finally:
+            delete_files('*test_migration.sql*')
+
+    def test_it_should_raise_exception_when_the_sql_file_does_not_exist(self):
+        create_file('20090214120700_sql_files_test_migration.migration', 'SQL_UP_FILE="20090214120700_up_test_migration.sql"\nSQL_DOWN="yyy"')
+        self.assertRaisesWithMessage(Exception, "migration sql file does not exist (%s)" % os.path.abspath('20090214120700_up_test_migration.sql'), Migration, '20090214120700_sql_files_test_migration.migration')
+
     def test_it_should_get_migration_version_from_file(self):
         migration = Migration('20090214120600_example_file_name_test_migration.migration')
         self.assertEqual('20090214120600', migration.version)
@@ -283,6 +458,36 @@ class MigrationTest(BaseTest):
             self.assertEqual(u"some sql command \xc3\xa7 %s" % os.path.abspath('.'), migration.sql_up)
             self.assertEqual(u"other sql command \xc3\xa3 %s" % os.path.abspath('.'), migration.sql_down)
 
+    @patch('simple_db_migrate.core.Utils.get_literal_variables_from_file', return_value={'SQL_UP': 'xxx', 'SQL_DOWN': 'yyy'})
+    def test_it_should_read_commands_of_lazy_migration_only_once_when_first_accessed(self, get_literal_variables_from_file_mock):
+        migration = Migration(file='20090727104700_test_migration.migration', lazy=True)
+        self.assertEqual('20090727104700', migration.version)
+        self.assertEqual(0, get_literal_variables_from_file_mock.call_count)
+        self.assertEqual('yyy', migration.sql_down)
+        self.assertEqual('xxx', migration.sql_up)
+        self.assertEqual(1, get_literal_variables_from_file_mock.call_count)
+
+    def test_it_should_keep_commands_set_on_lazy_migration_before_they_are_read(self):
+        migration = Migration(file='20090727104700_test_migration.migration', lazy=True)
+        migration.sql_up = 'changed'
+        self.assertEqual('changed', migration.sql_up)
+        self.assertEqual('yyy', migration.sql_down)
+
+    def test_it_should_raise_exception_when_lazy_migration_commands_are_read_and_are_empty(self):
+        migration = Migration('20090727113900_empty_sql_up_test_migration.migration', lazy=True)
+        try:
+            migration.sql_up
+            self.fail('it should not pass here')
+        except Exception as e:
+            self.assertEqual("migration command 'SQL_UP' is empty (%s)" % os.path.abspath('20090727113900_empty_sql_up_test_migration.migration'), str(e))
+
+    @patch('simple_db_migrate.core.Utils.get_variables_from_file')
+    def test_it_should_not_execute_migration_files_which_only_assign_literal_commands(self, get_variables_from_file_mock):
+        migration = Migration(file='20090727104700_test_migration.migration')
+        self.assertEqual('xxx', migration.sql_up)
+        self.assertEqual('yyy', migration.sql_down)
+        self.assertEqual(0, get_variables_from_file_mock.call_count)
+
     def test_it_should_raise_exception_when_migration_commands_are_empty(self):
         self.assertRaisesWithMessage(Exception, "migration command 'SQL_UP' is empty (%s)" % os.path.abspath('20090727113900_empty_sql_up_test_migration.migration'), Migration, '20090727113900_empty_sql_up_test_migration.migration')
         self.assertRaisesWithMessage(Exception, "migration command 'SQL_DOWN' is empty (%s)" % os.path.abspath('20090727113900_empty_sql_down_test_migration.migration'), Migration, '20090727113900_empty_sql_down_test_migration.migration')
@@ -319,6 +524,17 @@ class MigrationTest(BaseTest):
         self.assertEqual(0, m4.compare_to(m4))
         self.assertEqual(0, m5.compare_to(m5))
 
+    def test_it_should_use_version_and_file_name_as_migration_identity(self):
+        m1 = Migration(version='20090727104700', file_name='20090727104700_test_migration.migration', sql_up='xxx')
+        m2 = Migration(id=5, version='20090727104700', file_name='20090727104700_test_migration.migration', sql_up='zzz')
+        m3 = Migration(version='20090727104700', file_name='20090727104700_other_test_migration.migration', sql_up='xxx')
+
+        self.assertTrue(m1 == m2)
+        self.assertFalse(m1 != m2)
+        self.assertTrue(m1 != m3)
+        self.assertEqual(hash(m1), hash(m2))
+        self.assertEqual(2, len(set([m1, m2, m3])))
+
     def test_it_should_raise_exception_when_file_does_not_exist(self):
         try:
             Migration('20090727104700_this_file_does_not_exist.migration')
@@ -0,0 +1,157 @@
+import json
+import os
+import sqlite3
+import threading
+import unittest
+from mock import patch, Mock
+from simple_db_migrate.config import Config
+from simple_db_migrate.core import Migration
+from simple_db_migrate.fleet import Fleet, TargetResult
+from tests import BaseTest, create_migration_file, delete_files
+
+class FleetTest(BaseTest):
+
+    def setUp(self):
+        super(FleetTest, self).setUp()
+        self.initial_config = {
+            'database_migrations_dir': ['.'],
+            'database_engine': 'sqlite',
+            'database_version_table': '__db_version__',
+            'schema_version': None,
+            'drop_db_first': False,
+            'log_level': 0,
+            'database_targets': [{'name': 'shard%02d' % index, 'database_name': 'fleet_test_%02d.db' % index} for index in range(1, 6)]
+        }
+        create_migration_file('20090214115100_01_test_migration.migration', 'create table spam (id int);', 'drop table spam;')
+        create_migration_file('20090214115200_02_test_migration.migration', 'insert into spam values (1);', 'delete from spam;')
+
+    def tearDown(self):
+        super(FleetTest, self).tearDown()
+        delete_files('fleet_test_*.db*')
+        delete_files('fleet_test_report.json')
+
+    def query(self, database_name, sql):
+        db = sqlite3.connect(database_name)
+        try:
+            return db.execute(sql).fetchall()
+        finally:
+            db.close()
+
+    def test_it_should_migrate_all_databases(self):
+        fleet = Fleet(Config(self.initial_config))
+        fleet.execute()
+
+        for index in range(1, 6):
+            self.assertEqual([(1,)], self.query('fleet_test_%02d.db' % index, "select id from spam"))
+        self.assertEqual(['shard01', 'shard02', 'shard03', 'shard04', 'shard05'], [result.name for result in fleet.results])
+        self.assertEqual([TargetResult.OK] * 5, [result.status for result in fleet.results])
+        self.assertEqual(['20090214115200'] * 5, [result.version for result in fleet.results])
+
+    def test_it_should_load_the_migration_files_only_once(self):
+        with patch('simple_db_migrate.core._load_migration_file', side_effect=lambda args: (Migration(args[0], script_encoding=args[1]), None)) as load_mock:
+            Fleet(Config(self.initial_config)).execute()
+        self.assertEqual(2, load_mock.call_count)
+
+    def test_it_should_replace_the_configurations_of_each_database(self):
+        fleet = Fleet(Config(dict(self.initial_config, database_name='main.db', database_host='localhost', database_targets=[{'DATABASE_NAME': 'fleet_test_01.db'}])))
+        name, config = fleet.targets[0]
+        self.assertEqual('localhost/fleet_test_01.db', name)
+        self.assertEqual('fleet_test_01.db', config.get('database_name'))
+        self.assertEqual(None, config.get('log_dir'))
+        self.assertEqual('main.db', fleet.config.get('database_name'))
+
+    def test_it_should_migrate_at_most_targets_concurrency_databases_at_the_same_time(self):
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def change(*args, **kwargs):
+            with lock:
+                running.append(1)
+                max_running.append(len(running))
+            threading.Event().wait(0.02)
+            with lock:
+                running.pop()
+
+        self.initial_config['targets_concurrency'] = 2
+        sgdb_factory = lambda name, config: Mock(**{'get_all_schema_migrations.return_value': [Migration(id=1, version='0')], 'change.side_effect': change})
+        Fleet(Config(self.initial_config), sgdb_factory).execute()
+        self.assertEqual(2, max(max_running))
+
+    def test_it_should_skip_the_databases_not_started_when_one_fails(self):
+        self.initial_config['targets_concurrency'] = 1
+        self.initial_config['database_targets'][1]['database_name'] = 'fleet_test_missing/02.db'
+        fleet = Fleet(Config(self.initial_config))
+        self.assertRaisesWithMessage(Exception, "migration failed on 1 of 5 databases (shard02)", fleet.execute)
+
+        self.assertEqual([TargetResult.OK, TargetResult.FAILED, TargetResult.SKIPPED, TargetResult.SKIPPED, TargetResult.SKIPPED], [result.status for result in fleet.results])
+        self.assertEqual("could not connect to database: unable to open database file", fleet.results[1].error)
+        self.assertFalse(os.path.exists('fleet_test_03.db'))
+
+    def test_it_should_migrate_the_other_databases_when_continue_on_error_is_set(self):
+        self.initial_config['targets_concurrency'] = 1
+        self.initial_config['continue_on_error'] = True
+        self.initial_config['database_targets'][1]['database_name'] = 'fleet_test_missing/02.db'
+        fleet = Fleet(Config(self.initial_config))
+        self.assertRaisesWithMessage(Exception, "migration failed on 1 of 5 databases (shard02)", fleet.execute)
+
+        self.assertEqual([TargetResult.OK, TargetResult.FAILED, TargetResult.OK, TargetResult.OK, TargetResult.OK], [result.status for result in fleet.results])
+        self.assertEqual([(1,)], self.query('fleet_test_05.db', "select id from spam"))
+
+    @patch('simple_db_migrate.fleet.CLI.msg')
+    def test_it_should_log_each_database_and_a_summary(self, msg_mock):
+        self.initial_config['log_level'] = 1
+        self.initial_config['database_targets'] = self.initial_config['database_targets'][:2]
+        fleet = Fleet(Config(self.initial_config))
+        fleet.execute()
+
+        messages = [call_args[0][0] for call_args in msg_mock.call_args_list]
+        self.assertTrue('[shard01] - Current version is: 0' in messages)
+        self.assertTrue('[shard02] ===== executing 20090214115200_02_test_migration.migration (up) =====' in messages)
+        summary = messages[messages.index('\n__________ Summary __________') + 1:]
+        self.assertEqual('database  status  version         time', summary[0])
+        self.assertTrue(summary[1].startswith('shard01   ok      20090214115200  '))
+        self.assertTrue(summary[2].startswith('shard02   ok      20090214115200  '))
+
+    def test_it_should_write_the_run_report_of_each_database(self):
+        self.initial_config['report_file'] = 'fleet_test_report.json'
+        self.initial_config['database_targets'] = self.initial_config['database_targets'][:2]
+        Fleet(Config(self.initial_config)).execute()
+        with open('fleet_test_report.json') as f:
+            report = json.load(f)
+
+        self.assertEqual(['shard01', 'shard02'], [target['name'] for target in report['targets']])
+        self.assertEqual(['ok', 'ok'], [target['status'] for target in report['targets']])
+        self.assertEqual(['20090214115100_01_test_migration.migration', '20090214115200_02_test_migration.migration'], [migration['file_name'] for migration in report['targets'][1]['report']['migrations']])
+
+    def test_it_should_write_a_trace_with_a_track_for_each_database(self):
+        self.initial_config['trace_file'] = 'fleet_test_report.json'
+        self.initial_config['database_targets'] = self.initial_config['database_targets'][:2]
+        Fleet(Config(self.initial_config)).execute()
+        with open('fleet_test_report.json') as f:
+            events = json.load(f)['traceEvents']
+
+        self.assertEqual([(1, 'database_targets'), (2, 'shard01'), (3, 'shard02')], [(event['tid'], event['args']['name']) for event in events if event['name'] == 'thread_name'])
+        # the files are loaded only once, before the databases are migrated
+        self.assertEqual([1], [event['tid'] for event in events if event['name'] == 'parse'])
+        self.assertEqual([2, 3], [event['tid'] for event in events if event['name'] == '20090214115200_02_test_migration.migration'])
+
+    def test_it_should_raise_exception_when_there_are_no_databases(self):
+        self.initial_config['database_targets'] = []
+        self.assertRaisesWithMessage(Exception, "database_targets has no databases", Fleet, Config(self.initial_config))
+
+    def test_it_should_not_accept_paused_mode(self):
+        self.initial_config['paused_mode'] = True
+        self.assertRaisesWithMessage(Exception, "paused mode can not be used with database_targets", Fleet, Config(self.initial_config))
+
+    def test_it_should_close_the_sgdb_created_by_the_factory(self):
+        sgdbs = []
+        def sgdb_factory(name, config):
+            sgdbs.append(Mock(**{'get_all_schema_migrations.return_value': [Migration(id=1, version='0')]}))
+            return sgdbs[-1]
+
+        Fleet(Config(self.initial_config), sgdb_factory).execute()
+        self.assertEqual([1] * 5, [sgdb.close.call_count for sgdb in sgdbs])
+
+if __name__ == "__main__":
+    unittest.main()
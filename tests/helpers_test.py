@@ -22,6 +22,14 @@ class ListsTest(unittest.TestCase):
 
         self.assertEqual(len(result), 0)
 
+    def test_it_should_subtract_lists_with_unhashable_items(self):
+        a = [["a"], ["b"], ["c"]]
+        b = [["b"]]
+
+        result = Lists.subtract(a, b)
+
+        self.assertEqual([["a"], ["c"]], result)
+
 class UtilsTest(unittest.TestCase):
 
     def setUp(self):
@@ -118,6 +126,52 @@ SOME_CONSTANT = some_function("5")
             else:
                 self.assertEqual("error interpreting config file 'sample.py': No module named some_not_imported_module", str(e))
 
+    def test_it_should_extract_literal_variables_from_a_file_without_executing_it(self):
+        variables = Utils.get_literal_variables_from_file(os.path.abspath('sample.conf'))
+        self.assertEqual('root', variables['DATABASE_USER'])
+        self.assertEqual('example', variables['DATABASE_MIGRATIONS_DIR'])
+        self.assertEqual(True, variables['UTC_TIMESTAMP'])
+        self.assertEqual('', variables['DATABASE_PASSWORD'])
+
+    def test_it_should_ignore_docstrings_when_extracting_literal_variables(self):
+        f = open('sample.conf', 'a')
+        f.write('\n"""some documentation"""\nSQL_UP = u"""create table a;"""\n')
+        f.close()
+        variables = Utils.get_literal_variables_from_file(os.path.abspath('sample.conf'))
+        self.assertEqual(u'create table a;', variables['SQL_UP'])
+
+    def test_it_should_extract_literal_variables_with_non_ascii_characters_from_a_file_without_coding_declaration(self):
+        f = open('sample.conf', 'wb')
+        f.write(u'SQL_UP = u"insert into spam values (\'\u00e7\u00e3o\');"\n'.encode('utf-8'))
+        f.close()
+        self.assertEqual(u"insert into spam values ('\u00e7\u00e3o');", Utils.get_literal_variables_from_file(os.path.abspath('sample.conf'))['SQL_UP'])
+
+        f = open('sample.conf', 'wb')
+        f.write(u'# -*- coding: latin-1 -*-\nSQL_UP = u"insert into spam values (\'\u00e7\u00e3o\');"\n'.encode('latin-1'))
+        f.close()
+        if (sys.version_info < (3, 0)):
+            # python 2 uses the coding declaration of the file
+            self.assertEqual(u"insert into spam values ('\u00e7\u00e3o');", Utils.get_literal_variables_from_file(os.path.abspath('sample.conf'))['SQL_UP'])
+        else:
+            self.assertEqual(u"insert into spam values ('\u00e7\u00e3o');", Utils.get_literal_variables_from_file(os.path.abspath('sample.conf'), 'latin-1')['SQL_UP'])
+
+    def test_it_should_not_extract_literal_variables_from_a_file_with_python_code(self):
+        self.assertEqual(None, Utils.get_literal_variables_from_file(os.path.abspath('sample.py')))
+        self.assertEqual(None, Utils.get_literal_variables_from_file(os.path.abspath('sample2.conf')))
+
+    def test_it_should_not_extract_literal_variables_from_a_file_with_a_syntax_problem(self):
+        f = open('sample.conf', 'a')
+        f.write('\nSQL_UP = """unterminated\n')
+        f.close()
+        self.assertEqual(None, Utils.get_literal_variables_from_file(os.path.abspath('sample.conf')))
+
+    def test_it_should_raise_exception_when_extracting_literal_variables_and_file_not_exists(self):
+        try:
+            Utils.get_literal_variables_from_file(os.path.abspath('unexistent.conf'))
+            self.fail("it should not get here")
+        except Exception as e:
+            self.assertEqual("%s: file not found" % os.path.abspath('unexistent.conf'), str(e))
+
     def test_it_should_raise_exception_config_file_not_exists(self):
         try:
             Utils.get_variables_from_file(os.path.abspath('unexistent.conf'))
@@ -0,0 +1,107 @@
+import unittest
+from mock import Mock
+from simple_db_migrate.core import Migration
+from simple_db_migrate.core.history import SchemaHistory
+
+class SchemaHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.schema_migrations = [
+            Migration(id=1, version='0'),
+            Migration(id=2, version='20090214115100', label='label_a', file_name='20090214115100_01_test_migration.migration', sql_up='sql up 01', sql_down='sql down 01'),
+            Migration(id=3, version='20090214115200', label='label_a', file_name='20090214115200_02_test_migration.migration', sql_up='sql up 02', sql_down='sql down 02'),
+            Migration(id=4, version='20090214115300', label='label_b', file_name='20090214115300_03_test_migration.migration', sql_up='sql up 03', sql_down='sql down 03')
+        ]
+        self.history = SchemaHistory(self.schema_migrations)
+
+    def test_it_should_load_the_migrations_from_the_sgdb(self):
+        sgdb = Mock(**{'get_all_schema_migrations.return_value':self.schema_migrations})
+        history = SchemaHistory.load(sgdb)
+        self.assertEqual(self.schema_migrations, history.get_all_schema_migrations())
+        self.assertEqual(1, sgdb.get_all_schema_migrations.call_count)
+
+    def test_it_should_load_the_migrations_without_sql_when_the_sgdb_can_read_it_later(self):
+        sgdb = Mock(**{'get_all_schema_migrations.return_value':self.schema_migrations})
+        SchemaHistory.load(sgdb)
+        sgdb.get_all_schema_migrations.assert_called_with(with_sql=False)
+
+    def test_it_should_load_the_migrations_with_sql_when_the_sgdb_can_not_read_it_later(self):
+        sgdb = Mock(spec=['get_all_schema_migrations'], **{'get_all_schema_migrations.return_value':self.schema_migrations})
+        SchemaHistory.load(sgdb)
+        sgdb.get_all_schema_migrations.assert_called_with()
+
+    def test_it_should_read_the_sql_only_of_the_migrations_loaded_without_it(self):
+        sgdb = Mock(**{'get_schema_migrations_sql.return_value':{3: ('sql up 02', 'sql down 02')}})
+        history = SchemaHistory([
+            Migration(id=1, version='0', sql_up=None, sql_down=None),
+            Migration(id=2, version='20090214115100', sql_up='sql up 01', sql_down=''),
+            Migration(id=3, version='20090214115200', sql_up=None, sql_down=None),
+            Migration(id=4, version='20090214115300', sql_up=None, sql_down=None)
+        ])
+        history.read_sql(sgdb, [2, 3, 4])
+
+        sgdb.get_schema_migrations_sql.assert_called_with([3, 4])
+        self.assertEqual('sql down 02', history.get_migration_from_id(3).sql_down)
+        self.assertEqual('', history.get_migration_from_id(4).sql_up)
+        self.assertEqual('', history.get_migration_from_id(4).sql_down)
+        self.assertEqual(None, history.get_migration_from_id(1).sql_down)
+
+    def test_it_should_not_read_the_sql_when_all_migrations_have_it(self):
+        sgdb = Mock()
+        self.history.read_sql(sgdb, [2, 3, 4])
+        self.assertEqual(0, sgdb.get_schema_migrations_sql.call_count)
+
+    def test_it_should_return_a_copy_of_the_migrations(self):
+        self.history.get_all_schema_migrations().pop()
+        self.assertEqual(4, len(self.history.get_all_schema_migrations()))
+
+    def test_it_should_return_the_current_schema_version(self):
+        self.assertEqual('20090214115300', self.history.get_current_schema_version())
+
+    def test_it_should_return_none_as_current_schema_version_when_there_is_no_migration(self):
+        self.assertEqual(None, SchemaHistory([]).get_current_schema_version())
+
+    def test_it_should_return_all_schema_versions_sorted(self):
+        history = SchemaHistory([Migration(id=1, version='0'), Migration(id=2, version='20090214115300'), Migration(id=3, version='20090214115100')])
+        self.assertEqual(['0', '20090214115100', '20090214115300'], history.get_all_schema_versions())
+
+    def test_it_should_return_the_version_id_from_version_number(self):
+        self.assertEqual(3, self.history.get_version_id_from_version_number('20090214115200'))
+        self.assertEqual(3, self.history.get_version_id_from_version_number(20090214115200))
+        self.assertEqual(None, self.history.get_version_id_from_version_number('20090214115900'))
+
+    def test_it_should_return_the_last_id_of_a_repeated_version(self):
+        history = SchemaHistory(self.schema_migrations + [Migration(id=5, version='20090214115100')])
+        self.assertEqual(5, history.get_version_id_from_version_number('20090214115100'))
+
+    def test_it_should_return_the_last_version_of_a_label(self):
+        self.assertEqual('20090214115200', self.history.get_version_number_from_label('label_a'))
+        self.assertEqual('20090214115300', self.history.get_version_number_from_label('label_b'))
+        self.assertEqual(None, self.history.get_version_number_from_label('label_c'))
+
+    def test_it_should_return_the_migration_from_id(self):
+        self.assertEqual(self.schema_migrations[2], self.history.get_migration_from_id(3))
+        self.assertEqual(None, self.history.get_migration_from_id(9))
+
+    def test_it_should_record_a_migration_up(self):
+        migration = Migration(version='20090214115400', file_name='20090214115400_04_test_migration.migration', sql_up='sql up 04', sql_down='sql down 04')
+        self.history.record(migration, True, 'label_c')
+
+        self.assertEqual('20090214115400', self.history.get_current_schema_version())
+        self.assertEqual(5, self.history.get_version_id_from_version_number('20090214115400'))
+        self.assertEqual('20090214115400', self.history.get_version_number_from_label('label_c'))
+        recorded = self.history.get_migration_from_id(5)
+        self.assertEqual('20090214115400_04_test_migration.migration', recorded.file_name)
+        self.assertEqual('sql up 04', recorded.sql_up)
+        self.assertEqual('sql down 04', recorded.sql_down)
+
+    def test_it_should_record_a_migration_down(self):
+        self.history.record(Migration(version='20090214115300'), False)
+
+        self.assertEqual('20090214115200', self.history.get_current_schema_version())
+        self.assertEqual(None, self.history.get_version_id_from_version_number('20090214115300'))
+        self.assertEqual(None, self.history.get_version_number_from_label('label_b'))
+        self.assertEqual(3, len(self.history.get_all_schema_migrations()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,5 @@
 import unittest
 import os
-import re
 try:
     from StringIO import StringIO
 except ImportError:
@@ -8,8 +7,10 @@ except ImportError:
 from mock import patch, call, Mock
 from simple_db_migrate.core import Migration
 from simple_db_migrate.main import Main
+from simple_db_migrate.report import RunReport
 from simple_db_migrate.config import Config
-from tests import BaseTest, create_migration_file
+from simple_db_migrate.sql import SQLFile
+from tests import BaseTest, create_file, create_migration_file, delete_files
 
 class MainTest(BaseTest):
     def setUp(self):
@@ -55,10 +56,17 @@ class MainTest(BaseTest):
     @patch('simple_db_migrate.main.CLI')
     def test_it_should_use_the_other_utilities_classes(self, cli_mock, log_mock, simpledbmigrate_mock):
         config = Config(self.initial_config)
-        Main(sgdb=Mock(), config=config)
+        main = Main(sgdb=Mock(), config=config)
         self.assertEqual(1, cli_mock.call_count)
         log_mock.assert_called_with(None)
-        simpledbmigrate_mock.assert_called_with(config)
+        simpledbmigrate_mock.assert_called_with(config, main.report)
+
+    @patch('simple_db_migrate.main.SimpleDBMigrate')
+    def test_it_should_use_the_migration_files_already_loaded_when_given(self, simpledbmigrate_mock):
+        db_migrate = Mock()
+        main = Main(sgdb=Mock(), config=Config(self.initial_config), db_migrate=db_migrate)
+        self.assertEqual(db_migrate, main.db_migrate)
+        self.assertEqual(0, simpledbmigrate_mock.call_count)
 
     @patch('simple_db_migrate.main.LOG')
     def test_it_should_use_log_dir_from_config(self, log_mock):
@@ -87,6 +95,35 @@ class MainTest(BaseTest):
         Main(config=config)
         mssql_mock.assert_called_with(config)
 
+    @patch('simple_db_migrate.main.Main._execution_log')
+    @patch('simple_db_migrate.main.Main._migrate', side_effect=Exception("migration error"))
+    @patch('simple_db_migrate.mysql.MySQL')
+    def test_it_should_close_the_engine_connection_after_execution(self, mysql_mock, migrate_mock, _execution_log_mock):
+        mysql_mock.return_value.connection_count = 1
+        mysql_mock.return_value.round_trip_count = 12
+        self.initial_config.update({'database_engine': 'mysql', "database_migrations_dir":['.']})
+        main = Main(config=Config(self.initial_config))
+
+        self.assertRaisesWithMessage(Exception, "migration error", main.execute)
+
+        self.assertEqual(1, mysql_mock.return_value.close.call_count)
+        _execution_log_mock.assert_any_call("- 1 connection(s) opened, 12 round trip(s) to the database", log_level_limit=2)
+
+    @patch('simple_db_migrate.mysql.MySQL')
+    def test_it_should_close_the_engine_connection_after_listing_labels(self, mysql_mock):
+        mysql_mock.return_value.get_all_schema_migrations.return_value = [Migration(version='20090214115100', label='label_a', file_name='20090214115100_01_test_migration.migration')]
+        self.initial_config.update({'database_engine': 'mysql', "database_migrations_dir":['.']})
+        main = Main(config=Config(self.initial_config))
+
+        self.assertEqual(['label_a'], main.labels())
+        self.assertEqual(1, mysql_mock.return_value.close.call_count)
+
+    @patch('simple_db_migrate.main.Main._migrate')
+    def test_it_should_not_close_a_given_engine_connection(self, migrate_mock):
+        sgdb_mock = Mock()
+        Main(sgdb=sgdb_mock, config=Config(self.initial_config)).execute()
+        self.assertEqual(0, sgdb_mock.close.call_count)
+
     def test_it_should_raise_error_if_config_is_not_an_instance_of_simple_db_migrate_config(self):
         self.assertRaisesWithMessage(Exception, "config must be an instance of simple_db_migrate.config.Config", Main, config={})
 
@@ -189,63 +226,154 @@ class MainTest(BaseTest):
     @patch('simple_db_migrate.main.LOG')
     @patch('simple_db_migrate.main.CLI')
     def test_it_should_get_current_and_destination_versions_and_execute_migrations(self, cli_mock, log_mock, simpledbmigrate_mock, _get_destination_version_mock, execute_migrations_mock):
-        main = Main(sgdb=Mock(**{'get_current_schema_version.return_value':'current_schema_version'}), config=Config(self.initial_config))
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115400')), config=Config(self.initial_config))
+        main.execute()
+        execute_migrations_mock.assert_called_with('20090214115400', 'destination_version')
+
+    @patch('simple_db_migrate.main.Main._execute_migrations')
+    @patch('simple_db_migrate.main.SimpleDBMigrate', return_value=Mock(**{'get_migration_files_fingerprint.return_value': 'fingerprint'}))
+    def test_it_should_not_read_the_version_table_when_the_fingerprint_is_the_same(self, simpledbmigrate_mock, execute_migrations_mock):
+        self.initial_config.update({'fast_check': True, 'log_level': 0})
+        sgdb = schema_history_sgdb(schema_versions_up_to('20090214115400'), **{'get_fingerprint.return_value': 'fingerprint'})
+        Main(sgdb=sgdb, config=Config(self.initial_config)).execute()
+        self.assertEqual(0, execute_migrations_mock.call_count)
+        self.assertEqual(0, sgdb.get_all_schema_migrations.call_count)
+        self.assertEqual(0, simpledbmigrate_mock.return_value.get_all_migrations.call_count)
+
+    @patch('simple_db_migrate.main.Main._execute_migrations')
+    @patch('simple_db_migrate.main.Main._get_destination_version', return_value='destination_version')
+    @patch('simple_db_migrate.main.SimpleDBMigrate', return_value=Mock(**{'get_migration_files_fingerprint.return_value': 'fingerprint'}))
+    def test_it_should_store_the_fingerprint_after_migrating_when_it_is_different(self, simpledbmigrate_mock, _get_destination_version_mock, execute_migrations_mock):
+        self.initial_config.update({'fast_check': True, 'log_level': 0})
+        sgdb = schema_history_sgdb(schema_versions_up_to('20090214115400'), **{'get_fingerprint.return_value': 'old fingerprint'})
+        Main(sgdb=sgdb, config=Config(self.initial_config)).execute()
+        execute_migrations_mock.assert_called_with('20090214115400', 'destination_version')
+        sgdb.set_fingerprint.assert_called_with('fingerprint', '20090214115400')
+
+    @patch('simple_db_migrate.main.Main._execute_migrations')
+    @patch('simple_db_migrate.main.Main._get_destination_version', return_value='20090214115300')
+    def test_it_should_not_use_the_fingerprint_when_migrating_to_a_specific_version(self, _get_destination_version_mock, execute_migrations_mock):
+        self.initial_config.update({'fast_check': True, 'schema_version': '20090214115300', 'log_level': 0})
+        sgdb = schema_history_sgdb(schema_versions_up_to('20090214115400'))
+        Main(sgdb=sgdb, config=Config(self.initial_config)).execute()
+        self.assertEqual(1, execute_migrations_mock.call_count)
+        self.assertEqual(0, sgdb.get_fingerprint.call_count)
+        self.assertEqual(0, sgdb.set_fingerprint.call_count)
+
+    @patch('simple_db_migrate.main.Main._execute_migrations', side_effect=Exception('migration error'))
+    @patch('simple_db_migrate.main.Main._get_destination_version', return_value='20090214115600')
+    def test_it_should_release_the_advisory_lock_when_the_migration_fails(self, _get_destination_version_mock, execute_migrations_mock):
+        self.initial_config.update({'advisory_lock': True, 'advisory_lock_timeout': 30, 'database_migrations_dir': ['migrations', '.'], 'log_level': 0})
+        sgdb = schema_history_sgdb(schema_versions_up_to('20090214115400'), **{'get_current_schema_version.return_value': '20090214115400'})
+        self.assertRaisesWithMessage(Exception, 'migration error', Main(sgdb=sgdb, config=Config(self.initial_config)).execute)
+        sgdb.lock.assert_called_with(30)
+        self.assertEqual(1, sgdb.unlock.call_count)
+
+    @patch('simple_db_migrate.main.Main._execute_migrations')
+    def test_it_should_not_plan_the_migrations_when_the_database_was_migrated_while_waiting_for_the_advisory_lock(self, execute_migrations_mock):
+        self.initial_config.update({'advisory_lock': True, 'database_migrations_dir': ['migrations', '.'], 'log_level': 0})
+        sgdb = schema_history_sgdb(SCHEMA_VERSIONS, **{'get_current_schema_version.return_value': '20090214115600'})
+        main = Main(sgdb=sgdb, config=Config(self.initial_config))
+        main.execute()
+        sgdb.lock.assert_called_with(300)
+        self.assertEqual(0, execute_migrations_mock.call_count)
+        self.assertEqual(0, sgdb.get_all_schema_migrations.call_count)
+        self.assertNotEqual(None, main.lock_wait_time)
+
+    @patch('simple_db_migrate.main.Main._execute_migrations')
+    @patch('simple_db_migrate.main.Main._get_destination_version', return_value='20090214115600')
+    def test_it_should_not_take_the_advisory_lock_when_only_showing_the_sql(self, _get_destination_version_mock, execute_migrations_mock):
+        self.initial_config.update({'advisory_lock': True, 'show_sql_only': True, 'log_level': 0})
+        sgdb = schema_history_sgdb(schema_versions_up_to('20090214115400'))
+        Main(sgdb=sgdb, config=Config(self.initial_config)).execute()
+        self.assertEqual(0, sgdb.lock.call_count)
+        self.assertEqual(1, execute_migrations_mock.call_count)
+
+    def test_it_should_use_the_run_report_of_the_sgdb(self):
+        report = RunReport()
+        main = Main(sgdb=schema_history_sgdb(['0'], run_report=report), config=Config(self.initial_config))
+        self.assertTrue(main.report is report)
+        self.assertTrue(isinstance(Main(sgdb=schema_history_sgdb(['0']), config=Config(self.initial_config)).report, RunReport))
+
+    @patch('simple_db_migrate.main.Main._get_destination_version', return_value='20090214115300')
+    def test_it_should_report_the_time_of_each_migration(self, _get_destination_version_mock):
+        self.initial_config.update({'log_level': 0})
+        main = Main(sgdb=schema_history_sgdb(['0']), config=Config(self.initial_config))
         main.execute()
-        execute_migrations_mock.assert_called_with('current_schema_version', 'destination_version')
+        self.assertEqual(['20090214115100_01_test_migration.migration', '20090214115300_03_test_migration.migration'], [migration.file_name for migration in main.report.migrations])
+        self.assertEqual(['execute'], list(main.report.migrations[0].phases.keys()))
+        self.assertNotEqual(None, main.report.finished)
+
+    @patch('simple_db_migrate.main.CLI.msg')
+    @patch('simple_db_migrate.main.Main._get_destination_version', return_value='20090214115300')
+    def test_it_should_show_the_progress_estimated_from_the_durations_of_the_durations_file(self, _get_destination_version_mock, msg_mock):
+        create_file('test_durations.json', '{"migrations": [{"file_name": "20090214115100_01_test_migration.migration", "direction": "up", "elapsed": 60}, {"file_name": "20090214115300_03_test_migration.migration", "direction": "up", "elapsed": 120}]}')
+        self.initial_config.update({'progress': True, 'durations_file': 'test_durations.json'})
+        now = [0]
+        def change(*args):
+            now[0] += 30
+        sgdb = schema_history_sgdb(['0'], **{'change.side_effect': change})
+        try:
+            with patch.object(RunReport, 'clock', side_effect=lambda: now[0]):
+                Main(sgdb=sgdb, config=Config(self.initial_config)).execute()
+        finally:
+            delete_files('test_durations.json')
+
+        messages = [call_args[0][0] for call_args in msg_mock.call_args_list]
+        self.assertTrue('- Estimated time: about 3m00s for 2 migration(s), 2 of them timed on previous executions' in messages, messages)
+        # the first migration took half of the time it took before
+        self.assertTrue('- Progress: 1/2 migration(s) (33%), 30s elapsed, about 1m00s remaining' in messages, messages)
+        self.assertTrue('- Progress: 2/2 migration(s) (100%), 1m00s elapsed, about 0s remaining' in messages, messages)
+
+    @patch('simple_db_migrate.main.CLI.msg')
+    @patch('simple_db_migrate.main.Main._get_destination_version', return_value='20090214115300')
+    def test_it_should_not_show_the_progress_by_default(self, _get_destination_version_mock, msg_mock):
+        sgdb = schema_history_sgdb(['0'])
+        Main(sgdb=sgdb, config=Config(self.initial_config)).execute()
+        self.assertEqual([], [call_args for call_args in msg_mock.call_args_list if call_args[0][0].startswith('- Progress')])
 
     def test_it_should_get_destination_version_when_user_informs_a_specific_version(self):
         self.initial_config.update({"schema_version":"20090214115300", "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_version_id_from_version_number.return_value':None}), config=config)
+        main = Main(sgdb=schema_history_sgdb(['0']), config=config)
         self.assertEqual("20090214115300", main._get_destination_version())
-        main.sgdb.get_version_id_from_version_number.assert_called_with('20090214115300')
-        self.assertEqual(1, main.sgdb.get_version_id_from_version_number.call_count)
 
     def test_it_should_get_destination_version_when_user_does_not_inform_a_specific_version(self):
         self.initial_config.update({"database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(), config=config)
+        main = Main(sgdb=schema_history_sgdb(['0']), config=config)
         self.assertEqual("20090214115600", main._get_destination_version())
 
     def test_it_should_raise_exception_when_get_destination_version_and_version_does_not_exist_on_database_or_on_migrations_dir(self):
         self.initial_config.update({"schema_version":"20090214115900", "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_version_id_from_version_number.return_value':None}), config=config)
+        main = Main(sgdb=schema_history_sgdb(['0']), config=config)
         self.assertRaisesWithMessage(Exception, 'version not found (20090214115900)', main.execute)
-        main.sgdb.get_version_id_from_version_number.assert_called_with('20090214115900')
-        self.assertEqual(2, main.sgdb.get_version_id_from_version_number.call_count)
 
     def test_it_should_get_destination_version_when_user_informs_a_label_and_it_does_not_exists_in_database(self):
         self.initial_config.update({"label_version":"test_label", "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_version_number_from_label.return_value':None}), config=config)
+        main = Main(sgdb=schema_history_sgdb(['0']), config=config)
         self.assertEqual("20090214115600", main._get_destination_version())
-        main.sgdb.get_version_number_from_label.assert_called_with('test_label')
 
     def test_it_should_get_destination_version_when_user_informs_a_specific_version_and_it_exists_on_database(self):
         self.initial_config.update({"schema_version":"20090214115300", "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_version_id_from_version_number.return_value':3}), config=config)
+        main = Main(sgdb=schema_history_sgdb(SCHEMA_VERSIONS), config=config)
         self.assertEqual("20090214115300", main._get_destination_version())
-        main.sgdb.get_version_id_from_version_number.assert_called_with('20090214115300')
-        self.assertEqual(1, main.sgdb.get_version_id_from_version_number.call_count)
 
     def test_it_should_get_destination_version_when_user_informs_a_label_and_a_version_and_it_does_not_exists_in_database(self):
         self.initial_config.update({"schema_version":"20090214115300", "label_version":"test_label", "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_version_number_from_label.return_value':None, 'get_version_id_from_version_number.return_value':None}), config=config)
+        main = Main(sgdb=schema_history_sgdb(['0']), config=config)
         self.assertEqual("20090214115300", main._get_destination_version())
-        main.sgdb.get_version_number_from_label.assert_called_with('test_label')
-        self.assertEqual(1, main.sgdb.get_version_number_from_label.call_count)
-        main.sgdb.get_version_id_from_version_number.assert_called_with('20090214115300')
-        self.assertEqual(1, main.sgdb.get_version_id_from_version_number.call_count)
 
 
     @patch('simple_db_migrate.main.Main._get_migration_files_to_be_executed', return_value=[])
     def test_it_should_do_migration_down_if_a_label_and_a_version_were_specified_and_both_of_them_are_present_at_database_and_correspond_to_same_migration(self, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":"20090214115300", "label_version":"test_label", "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_current_schema_version.return_value':'20090214115600', 'get_version_number_from_label.return_value':'20090214115300', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115600'), labels={'20090214115300':'test_label'}), config=config)
         main.execute()
         files_to_be_executed_mock.assert_called_with('20090214115600', '20090214115300', False)
 
@@ -253,86 +381,58 @@ class MainTest(BaseTest):
     def test_it_should_do_migration_down_if_a_label_and_a_version_were_specified_and_both_of_them_are_present_at_database_and_correspond_to_same_migration_and_force_execute_old_migrations_versions_is_set(self, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":"20090214115300", "label_version":"test_label", "database_migrations_dir":['migrations', '.'], "force_execute_old_migrations_versions": True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_current_schema_version.return_value':'20090214115600', 'get_version_number_from_label.return_value':'20090214115300', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115600'), labels={'20090214115300':'test_label'}), config=config)
         main.execute()
         files_to_be_executed_mock.assert_called_with('20090214115600', '20090214115300', False)
 
     def test_it_should_get_destination_version_and_update_config_when_user_informs_a_label_and_it_exists_in_database(self):
         self.initial_config.update({"schema_version":None, "label_version":"test_label", "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_version_number_from_label.return_value':'20090214115300', 'get_version_id_from_version_number.return_value':3}), config=config)
+        main = Main(sgdb=schema_history_sgdb(SCHEMA_VERSIONS, labels={'20090214115300':'test_label'}), config=config)
         self.assertEqual("20090214115300", main._get_destination_version())
         self.assertEqual("20090214115300", config.get("schema_version"))
-        main.sgdb.get_version_number_from_label.assert_called_with('test_label')
-        self.assertEqual(1, main.sgdb.get_version_number_from_label.call_count)
-        main.sgdb.get_version_id_from_version_number.assert_called_with('20090214115300')
-        self.assertEqual(1, main.sgdb.get_version_id_from_version_number.call_count)
 
     def test_it_should_raise_exception_when_get_destination_version_and_version_and_label_point_to_a_different_migration_on_database(self):
         self.initial_config.update({"schema_version":"20090214115300", "label_version":"test_label", "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_version_number_from_label.return_value':'20090214115400', 'get_version_id_from_version_number.return_value':3}), config=config)
+        main = Main(sgdb=schema_history_sgdb(SCHEMA_VERSIONS, labels={'20090214115400':'test_label'}), config=config)
         self.assertRaisesWithMessage(Exception, "label (test_label) and schema_version (20090214115300) don't correspond to the same version at database", main.execute)
-        main.sgdb.get_version_number_from_label.assert_called_with('test_label')
-        self.assertEqual(1, main.sgdb.get_version_number_from_label.call_count)
-        main.sgdb.get_version_id_from_version_number.assert_called_with('20090214115300')
-        self.assertEqual(1, main.sgdb.get_version_id_from_version_number.call_count)
 
     def test_it_should_raise_exception_when_get_destination_version_and_version_exists_on_database_and_label_not(self):
         self.initial_config.update({"schema_version":"20090214115300", "label_version":"test_label", "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_version_number_from_label.return_value':None, 'get_version_id_from_version_number.return_value':3}), config=config)
+        main = Main(sgdb=schema_history_sgdb(SCHEMA_VERSIONS), config=config)
         self.assertRaisesWithMessage(Exception, "label (test_label) or schema_version (20090214115300), only one of them exists in the database", main.execute)
-        main.sgdb.get_version_number_from_label.assert_called_with('test_label')
-        self.assertEqual(1, main.sgdb.get_version_number_from_label.call_count)
-        main.sgdb.get_version_id_from_version_number.assert_called_with('20090214115300')
-        self.assertEqual(1, main.sgdb.get_version_id_from_version_number.call_count)
 
     def test_it_should_raise_exception_when_get_destination_version_and_label_exists_on_database_and_version_not(self):
         self.initial_config.update({"schema_version":"20090214115300", "label_version":"test_label", "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_version_number_from_label.return_value':'20090214115400', 'get_version_id_from_version_number.return_value':None}), config=config)
+        main = Main(sgdb=schema_history_sgdb(['0', '20090214115400'], labels={'20090214115400':'test_label'}), config=config)
         self.assertRaisesWithMessage(Exception, "label (test_label) or schema_version (20090214115300), only one of them exists in the database", main.execute)
-        main.sgdb.get_version_number_from_label.assert_called_with('test_label')
-        self.assertEqual(1, main.sgdb.get_version_number_from_label.call_count)
-        main.sgdb.get_version_id_from_version_number.assert_called_with('20090214115300')
-        self.assertEqual(1, main.sgdb.get_version_id_from_version_number.call_count)
 
     def test_it_should_raise_exception_when_get_destination_version_and_version_and_label_point_to_a_different_migration_on_database_and_force_execute_old_migrations_versions_is_set(self):
         self.initial_config.update({"schema_version":"20090214115300", "label_version":"test_label", "database_migrations_dir":['migrations', '.'], "force_execute_old_migrations_versions":True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_version_number_from_label.return_value':'20090214115400', 'get_version_id_from_version_number.return_value':3}), config=config)
+        main = Main(sgdb=schema_history_sgdb(SCHEMA_VERSIONS, labels={'20090214115400':'test_label'}), config=config)
         self.assertRaisesWithMessage(Exception, "label (test_label) and schema_version (20090214115300) don't correspond to the same version at database", main.execute)
-        main.sgdb.get_version_number_from_label.assert_called_with('test_label')
-        self.assertEqual(1, main.sgdb.get_version_number_from_label.call_count)
-        main.sgdb.get_version_id_from_version_number.assert_called_with('20090214115300')
-        self.assertEqual(1, main.sgdb.get_version_id_from_version_number.call_count)
 
     def test_it_should_raise_exception_when_get_destination_version_and_version_exists_on_database_and_label_not_and_force_execute_old_migrations_versions_is_set(self):
         self.initial_config.update({"schema_version":"20090214115300", "label_version":"test_label", "database_migrations_dir":['migrations', '.'], "force_execute_old_migrations_versions":True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_version_number_from_label.return_value':None, 'get_version_id_from_version_number.return_value':3}), config=config)
+        main = Main(sgdb=schema_history_sgdb(SCHEMA_VERSIONS), config=config)
         self.assertRaisesWithMessage(Exception, "label (test_label) or schema_version (20090214115300), only one of them exists in the database", main.execute)
-        main.sgdb.get_version_number_from_label.assert_called_with('test_label')
-        self.assertEqual(1, main.sgdb.get_version_number_from_label.call_count)
-        main.sgdb.get_version_id_from_version_number.assert_called_with('20090214115300')
-        self.assertEqual(1, main.sgdb.get_version_id_from_version_number.call_count)
 
     def test_it_should_raise_exception_when_get_destination_version_and_label_exists_on_database_and_version_not_and_force_execute_old_migrations_versions_is_set(self):
         self.initial_config.update({"schema_version":"20090214115300", "label_version":"test_label", "database_migrations_dir":['migrations', '.'], "force_execute_old_migrations_versions":True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_version_number_from_label.return_value':'20090214115400', 'get_version_id_from_version_number.return_value':None}), config=config)
+        main = Main(sgdb=schema_history_sgdb(['0', '20090214115400'], labels={'20090214115400':'test_label'}), config=config)
         self.assertRaisesWithMessage(Exception, "label (test_label) or schema_version (20090214115300), only one of them exists in the database", main.execute)
-        main.sgdb.get_version_number_from_label.assert_called_with('test_label')
-        self.assertEqual(1, main.sgdb.get_version_number_from_label.call_count)
-        main.sgdb.get_version_id_from_version_number.assert_called_with('20090214115300')
-        self.assertEqual(1, main.sgdb.get_version_id_from_version_number.call_count)
 
     @patch('simple_db_migrate.main.Main._get_migration_files_to_be_executed', return_value=[])
     def test_it_should_migrate_database_with_migration_is_up(self, files_to_be_executed_mock):
         self.initial_config.update({"schema_version": None, "label_version": None, "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_current_schema_version.return_value':'20090214115300', 'get_version_id_from_version_number.return_value':None}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115300')), config=config)
         main.execute()
         files_to_be_executed_mock.assert_called_with('20090214115300', '20090214115600', True)
 
@@ -340,21 +440,21 @@ class MainTest(BaseTest):
     def test_it_should_migrate_database_with_migration_is_down_when_specify_a_version_older_than_that_on_database(self, files_to_be_executed_mock):
         self.initial_config.update({"schema_version": '20090214115200', "label_version": None, "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_current_schema_version.return_value':'20090214115300', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115300')), config=config)
         main.execute()
         files_to_be_executed_mock.assert_called_with('20090214115300', '20090214115200', False)
 
     def test_it_should_raise_error_when_specify_a_version_older_than_the_current_database_version_and_is_not_present_on_database(self):
         self.initial_config.update({"schema_version": '20090214115100', "label_version": None, "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_current_schema_version.return_value':'20090214115300', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115300')), config=config)
         self.assertRaisesWithMessage(Exception, 'Trying to migrate to a lower version wich is not found on database (20090214115100)', main.execute)
 
     @patch('simple_db_migrate.main.Main._execution_log')
     def test_it_should_just_log_message_when_dont_have_any_migration_to_execute(self, _execution_log_mock):
         self.initial_config.update({"schema_version": None, "label_version": None, "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_current_schema_version.return_value':'20090214115600', 'get_version_id_from_version_number.return_value':None}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115600')), config=config)
         main.execute()
 
         expected_calls = [
@@ -366,11 +466,19 @@ class MainTest(BaseTest):
         ]
         self.assertEqual(expected_calls, _execution_log_mock.mock_calls)
 
+    @patch('simple_db_migrate.core.Migration._get_commands')
+    def test_it_should_not_read_any_migration_commands_when_database_is_up_to_date_and_lazy_load_is_set(self, get_commands_mock):
+        self.initial_config.update({"schema_version": None, "label_version": None, "database_migrations_dir":['migrations', '.'], "lazy_load": True})
+        config=Config(self.initial_config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115600')), config=config)
+        main.execute()
+        self.assertEqual(0, get_commands_mock.call_count)
+
     @patch('simple_db_migrate.main.Main._get_migration_files_to_be_executed', return_value=[])
     def test_it_should_do_migration_down_if_a_label_was_specified_and_a_version_was_not_specified_and_label_is_present_at_database(self, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":None, "label_version":"test_label", "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_current_schema_version.return_value':'20090214115600', 'get_version_number_from_label.return_value':'20090214115300', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115600'), labels={'20090214115300':'test_label'}), config=config)
         main.execute()
         files_to_be_executed_mock.assert_called_with('20090214115600', '20090214115300', False)
 
@@ -378,7 +486,7 @@ class MainTest(BaseTest):
     def test_it_should_do_migration_down_if_a_label_was_specified_and_a_version_was_not_specified_and_label_is_present_at_database_and_force_execute_old_migrations_versions_is_set(self, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":None, "label_version":"test_label", "database_migrations_dir":['migrations', '.'], "force_execute_old_migrations_versions":True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_current_schema_version.return_value':'20090214115600', 'get_version_number_from_label.return_value':'20090214115300', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115600'), labels={'20090214115300':'test_label'}), config=config)
         main.execute()
         files_to_be_executed_mock.assert_called_with('20090214115600', '20090214115300', False)
 
@@ -387,7 +495,7 @@ class MainTest(BaseTest):
     def test_it_should_only_log_sql_commands_when_show_sql_only_is_set_and_is_up(self, _execution_log_mock, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":'20090214115600', "label_version":None, "database_migrations_dir":['migrations', '.'], 'show_sql_only':True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'change.return_value':None, 'get_current_schema_version.return_value':'20090214115400', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115400'), **{'change.return_value':None}), config=config)
         main.execute()
 
         expected_calls = [
@@ -406,12 +514,31 @@ class MainTest(BaseTest):
         files_to_be_executed_mock.assert_called_with('20090214115400', '20090214115600', True)
         self.assertEqual(0, main.sgdb.change.call_count)
 
+    @patch('simple_db_migrate.main.Main._get_migration_files_to_be_executed', return_value=[Migration(file_name="20090214115500_05_test_migration.migration", version="20090214115500", sql_up="alter table spam add a int; alter table spam add b int;", sql_down="sql down 05")])
+    @patch('simple_db_migrate.main.Main._execution_log')
+    def test_it_should_log_the_merged_statements_when_show_sql_only_is_set(self, _execution_log_mock, files_to_be_executed_mock):
+        self.initial_config.update({"schema_version":'20090214115500', "label_version":None, "database_migrations_dir":['migrations', '.'], 'show_sql_only':True})
+        config=Config(self.initial_config)
+        merged_statements = [('alter table spam add a int,\nadd b int', ['alter table spam add a int', 'alter table spam add b int'])]
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115400'), **{'merged_statements.return_value':merged_statements}), config=config)
+        main.execute()
+
+        expected_calls = [
+            call('__________ SQL statements executed __________', 'YELLOW', log_level_limit=1),
+            call('alter table spam add a int; alter table spam add b int;', 'YELLOW', log_level_limit=1),
+            call('-- 2 statements would be merged in:\nalter table spam add a int,\nadd b int;', 'YELLOW', log_level_limit=1),
+            call('_____________________________________________', 'YELLOW', log_level_limit=1)
+        ]
+        self.assertEqual(expected_calls, _execution_log_mock.mock_calls[5:9])
+        main.sgdb.merged_statements.assert_called_with('alter table spam add a int; alter table spam add b int;')
+        self.assertEqual(0, main.sgdb.change.call_count)
+
     @patch('simple_db_migrate.main.Main._get_migration_files_to_be_executed', return_value=[Migration(file_name="20090214115600_06_test_migration.migration", version="20090214115600", sql_up="sql up 06", sql_down="sql down 06"), Migration(file_name="20090214115500_05_test_migration.migration", version="20090214115500", sql_up="sql up 05", sql_down="sql down 05")])
     @patch('simple_db_migrate.main.Main._execution_log')
     def test_it_should_only_log_sql_commands_when_show_sql_only_is_set_and_is_down(self, _execution_log_mock, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":'20090214115400', "label_version":None, "database_migrations_dir":['migrations', '.'], 'show_sql_only':True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'change.return_value':None, 'get_current_schema_version.return_value':'20090214115600', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115600'), **{'change.return_value':None}), config=config)
         main.execute()
 
         expected_calls = [
@@ -435,7 +562,7 @@ class MainTest(BaseTest):
     def test_it_should_execute_sql_commands_when_show_sql_only_is_not_set_and_is_up(self, _execution_log_mock, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":'20090214115600', "label_version":None, "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'change.return_value':None, 'get_current_schema_version.return_value':'20090214115400', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115400'), **{'change.return_value':None}), config=config)
         main.execute()
 
         expected_calls = [
@@ -461,7 +588,7 @@ class MainTest(BaseTest):
     def test_it_should_execute_sql_commands_when_show_sql_only_is_not_set_and_is_down(self, _execution_log_mock, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":'20090214115400', "label_version":None, "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'change.return_value':None, 'get_current_schema_version.return_value':'20090214115600', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115600'), **{'change.return_value':None}), config=config)
         main.execute()
 
         expected_calls = [
@@ -482,12 +609,64 @@ class MainTest(BaseTest):
         ]
         self.assertEqual(expected_calls, main.sgdb.change.mock_calls)
 
+    @patch('simple_db_migrate.main.Main._execution_log')
+    def test_it_should_read_the_sql_of_the_version_table_only_for_migrations_down(self, _execution_log_mock):
+        self.initial_config.update({"schema_version":'20090214115400', "database_migrations_dir":['migrations', '.']})
+        config=Config(self.initial_config)
+        all_schema_migrations = [Migration(id=index + 1, version=version, file_name="%s_test_migration.migration" % version, sql_up=None, sql_down=None) for index, version in enumerate(SCHEMA_VERSIONS)]
+        sql_by_id = {5: ('sql up 05', 'sql down 05'), 6: ('sql up 06', 'sql down 06')}
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_schema_migrations_sql.return_value':sql_by_id, 'change.return_value':None}), config=config)
+        main.execute()
+
+        main.sgdb.get_all_schema_migrations.assert_called_with(with_sql=False)
+        main.sgdb.get_schema_migrations_sql.assert_called_with([5, 6])
+        expected_calls = [
+            call('sql down 06', '20090214115600', '20090214115600_test_migration.migration', 'sql up 06', 'sql down 06', False, _execution_log_mock, None),
+            call('sql down 05', '20090214115500', '20090214115500_test_migration.migration', 'sql up 05', 'sql down 05', False, _execution_log_mock, None)
+        ]
+        self.assertEqual(expected_calls, main.sgdb.change.mock_calls)
+
+    @patch('simple_db_migrate.main.Main._execution_log')
+    def test_it_should_read_the_version_table_only_once_per_execution(self, _execution_log_mock):
+        self.initial_config.update({"schema_version":'20090214115600', "label_version":"test_label", "database_migrations_dir":['migrations', '.']})
+        config=Config(self.initial_config)
+        all_schema_migrations = [
+            Migration(id=1, version='0'),
+            Migration(id=2, version='20090214115100', file_name='20090214115100_01_test_migration.migration', sql_up='foo 1', sql_down='bar 1'),
+            Migration(id=3, version='20090214115200', file_name='20090214115200_02_test_migration.migration', sql_up='foo 2', sql_down='bar 2'),
+            Migration(id=4, version='20090214115300', file_name='20090214115300_03_test_migration.migration', sql_up='foo 3', sql_down='bar 3')
+        ]
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'change.return_value':None}), config=config)
+        main.execute()
+
+        self.assertEqual(3, main.sgdb.change.call_count)
+        self.assertEqual(1, main.sgdb.get_all_schema_migrations.call_count)
+        self.assertEqual(0, main.sgdb.get_all_schema_versions.call_count)
+        self.assertEqual(0, main.sgdb.get_current_schema_version.call_count)
+        self.assertEqual(0, main.sgdb.get_version_id_from_version_number.call_count)
+        self.assertEqual(0, main.sgdb.get_version_number_from_label.call_count)
+        self.assertEqual('20090214115600', main.schema_history.get_current_schema_version())
+        self.assertEqual('20090214115600', main.schema_history.get_version_number_from_label('test_label'))
+
+    @patch('simple_db_migrate.main.Main._get_migration_files_to_be_executed', return_value=[Migration(file_name="20090214115500_05_test_migration.migration", version="20090214115500", sql_up=SQLFile("20090214115500_05_test_migration.sql.gz"), sql_down="sql down 05")])
+    @patch('simple_db_migrate.main.Main._execution_log')
+    def test_it_should_execute_sql_files_without_saving_or_logging_their_statements(self, _execution_log_mock, files_to_be_executed_mock):
+        self.initial_config.update({"schema_version":'20090214115500', "label_version":None, "database_migrations_dir":['migrations', '.'], 'show_sql':True})
+        config=Config(self.initial_config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115400'), **{'change.return_value':None}), config=config)
+        main.execute()
+
+        sql_file = SQLFile("20090214115500_05_test_migration.sql.gz")
+        main.sgdb.change.assert_called_with(sql_file, '20090214115500', '20090214115500_05_test_migration.migration', '', 'sql down 05', True, _execution_log_mock, None)
+        _execution_log_mock.assert_any_call(str(sql_file), 'YELLOW', log_level_limit=1)
+        self.assertEqual('', main.schema_history.get_migration_from_id(5).sql_up)
+
     @patch('simple_db_migrate.main.Main._get_migration_files_to_be_executed', return_value=[Migration(file_name="20090214115500_05_test_migration.migration", version="20090214115500", sql_up="sql up 05", sql_down="sql down 05"), Migration(file_name="20090214115600_06_test_migration.migration", version="20090214115600", sql_up="sql up 06", sql_down="sql down 06")])
     @patch('simple_db_migrate.main.Main._execution_log')
     def test_it_should_execute_and_log_sql_commands_when_show_sql_is_set_and_is_up(self, _execution_log_mock, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":'20090214115600', "label_version":None, "database_migrations_dir":['migrations', '.'], 'show_sql':True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'change.return_value':None, 'get_current_schema_version.return_value':'20090214115400', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115400'), **{'change.return_value':None}), config=config)
         main.execute()
 
         expected_calls = [
@@ -517,7 +696,7 @@ class MainTest(BaseTest):
     def test_it_should_execute_and_log_sql_commands_when_show_sql_is_set_and_is_down(self, _execution_log_mock, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":'20090214115400', "label_version":None, "database_migrations_dir":['migrations', '.'], 'show_sql':True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'change.return_value':None, 'get_current_schema_version.return_value':'20090214115600', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115600'), **{'change.return_value':None}), config=config)
         main.execute()
 
         expected_calls = [
@@ -546,7 +725,7 @@ class MainTest(BaseTest):
     def test_it_should_apply_label_to_executed_sql_commands_when_a_label_was_specified_and_is_up(self, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":None, "label_version":"new_label", "database_migrations_dir":['migrations', '.']})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'change.return_value':None, 'get_version_number_from_label.return_value':None, 'get_current_schema_version.return_value':'20090214115400', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115400'), **{'change.return_value':None}), config=config)
         main.execute()
 
         expected_calls = [
@@ -560,7 +739,7 @@ class MainTest(BaseTest):
     def test_it_should_raise_exception_and_stop_process_when_an_error_occur_on_executing_sql_commands_and_is_up(self, _execution_log_mock, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":'20090214115600', "label_version":None, "database_migrations_dir":['migrations', '.'], 'show_sql':True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'change.side_effect':Exception('error when executin sql'), 'get_current_schema_version.return_value':'20090214115400', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115400'), **{'change.side_effect':Exception('error when executin sql')}), config=config)
         self.assertRaisesWithMessage(Exception, 'error when executin sql', main.execute)
 
         expected_calls = [
@@ -584,7 +763,7 @@ class MainTest(BaseTest):
     def test_it_should_raise_exception_and_stop_process_when_an_error_occur_on_executing_sql_commands_and_is_down(self, _execution_log_mock, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":'20090214115400', "label_version":None, "database_migrations_dir":['migrations', '.'], 'show_sql':True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'change.side_effect':Exception('error when executin sql'), 'get_current_schema_version.return_value':'20090214115600', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115600'), **{'change.side_effect':Exception('error when executin sql')}), config=config)
         self.assertRaisesWithMessage(Exception, 'error when executin sql', main.execute)
 
         expected_calls = [
@@ -608,7 +787,7 @@ class MainTest(BaseTest):
     def test_it_should_raise_exception_and_stop_process_when_an_error_occur_on_getting_migrations_to_execute_and_is_up(self, _execution_log_mock, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":'20090214115600', "label_version":None, "database_migrations_dir":['migrations', '.'], 'show_sql':True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_current_schema_version.return_value':'20090214115400', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115400')), config=config)
         self.assertRaisesWithMessage(Exception, 'error getting migrations to execute', main.execute)
 
         expected_calls = [
@@ -625,7 +804,7 @@ class MainTest(BaseTest):
     def test_it_should_raise_exception_and_stop_process_when_an_error_occur_on_getting_migrations_to_execute_and_is_down(self, _execution_log_mock, files_to_be_executed_mock):
         self.initial_config.update({"schema_version":'20090214115400', "label_version":None, "database_migrations_dir":['migrations', '.'], 'show_sql':True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'get_current_schema_version.return_value':'20090214115600', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115600')), config=config)
         self.assertRaisesWithMessage(Exception, 'error getting migrations to execute', main.execute)
 
         expected_calls = [
@@ -643,7 +822,7 @@ class MainTest(BaseTest):
     def test_it_should_pause_execution_after_each_migration_when_paused_mode_is_set_and_is_up(self, files_to_be_executed_mock, stdout_mock, stdin_mock):
         self.initial_config.update({"schema_version":'20090214115600', "label_version":None, "database_migrations_dir":['migrations', '.'], 'paused_mode':True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'change.return_value':None, 'get_current_schema_version.return_value':'20090214115400', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115400'), **{'change.return_value':None}), config=config)
         main.execute()
 
         self.assertEqual(2, stdout_mock.getvalue().count("* press <enter> to continue..."))
@@ -660,7 +839,7 @@ class MainTest(BaseTest):
     def test_it_should_pause_execution_after_each_migration_when_paused_mode_is_set_and_is_down(self, files_to_be_executed_mock, stdout_mock, stdin_mock):
         self.initial_config.update({"schema_version":'20090214115400', "label_version":None, "database_migrations_dir":['migrations', '.'], 'paused_mode':True})
         config=Config(self.initial_config)
-        main = Main(sgdb=Mock(**{'change.return_value':None, 'get_current_schema_version.return_value':'20090214115600', 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=schema_history_sgdb(schema_versions_up_to('20090214115600'), **{'change.return_value':None}), config=config)
         main.execute()
 
         self.assertEqual(2, stdout_mock.getvalue().count("* press <enter> to continue..."))
@@ -743,7 +922,7 @@ class MainTest(BaseTest):
             Migration(file_name="20090214115300_03_test_migration.migration", version="20090214115300", sql_up="sql up 03", sql_down="sql down 03", id=3),
             Migration(file_name="20090214115300_04_test_migration.migration", version="20090214115400", sql_up="sql up 04", sql_down="sql down 04", id=4)
         ]
-        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115300', '20090214115400'], 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115300', '20090214115400']}), config=config)
         self.assertEqual([], main._get_migration_files_to_be_executed('20090214115400', '20090214115400', False))
 
     def test_it_should_get_all_schema_migrations_to_check_wich_one_has_to_be_removed_if_current_and_destiny_version_are_equals_and_is_down_and_force_old_migrations_is_set(self):
@@ -754,7 +933,7 @@ class MainTest(BaseTest):
             Migration(file_name="20090214115300_03_test_migration.migration", version="20090214115300", sql_up="sql up 03", sql_down="sql down 03", id=3),
             Migration(file_name="20090214115300_04_test_migration.migration", version="20090214115400", sql_up="sql up 04", sql_down="sql down 04", id=4)
         ]
-        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115300', '20090214115400'], 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115300', '20090214115400']}), config=config)
         self.assertEqual([], main._get_migration_files_to_be_executed('20090214115400', '20090214115400', False))
 
     def test_it_should_get_all_schema_migrations_to_check_wich_one_has_to_be_removed_if_current_and_destiny_version_are_different_and_is_down(self):
@@ -765,7 +944,7 @@ class MainTest(BaseTest):
             Migration(file_name="20090214115300_03_test_migration.migration", version="20090214115300", sql_up="sql up 03", sql_down="sql down 03", id=3),
             Migration(file_name="20090214115300_04_test_migration.migration", version="20090214115400", sql_up="sql up 04", sql_down="sql down 04", id=4)
         ]
-        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115300', '20090214115400'], 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115300', '20090214115400']}), config=config)
         self.assertEqual([all_schema_migrations[-1], all_schema_migrations[-2]], main._get_migration_files_to_be_executed('20090214115400', '20090214115200', False))
 
     def test_it_should_get_all_schema_migrations_to_check_wich_one_has_to_be_removed_if_one_of_migration_file_does_not_exists_and_is_down(self):
@@ -776,7 +955,7 @@ class MainTest(BaseTest):
             Migration(file_name="20090214115301_03_test_migration.migration", version="20090214115301", sql_up="sql up 03.1", sql_down="sql down 03.1", id=3),
             Migration(file_name="20090214115300_04_test_migration.migration", version="20090214115400", sql_up="sql up 04", sql_down="sql down 04", id=4)
         ]
-        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115301', '20090214115400'], 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115301', '20090214115400']}), config=config)
         self.assertEqual([all_schema_migrations[-1], all_schema_migrations[-2]], main._get_migration_files_to_be_executed('20090214115400', '20090214115200', False))
 
     def test_it_should_not_fail_when_there_is_no_migrations_files_and_is_down(self):
@@ -787,7 +966,7 @@ class MainTest(BaseTest):
             Migration(file_name="20090214115301_03_test_migration.migration", version="20090214115301", sql_up="sql up 03.1", sql_down="sql down 03.1", id=3),
             Migration(file_name="20090214115300_04_test_migration.migration", version="20090214115400", sql_up="sql up 04", sql_down="sql down 04", id=4)
         ]
-        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115301', '20090214115400'], 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115301', '20090214115400']}), config=config)
         self.assertEqual([all_schema_migrations[-1], all_schema_migrations[-2]], main._get_migration_files_to_be_executed('20090214115400', '20090214115200', False))
 
     def test_it_should_get_sql_down_from_file_if_sql_down_is_empty_on_database_and_is_down(self):
@@ -798,7 +977,7 @@ class MainTest(BaseTest):
             Migration(file_name="20090214115300_03_test_migration.migration", version="20090214115300", sql_up="sql up 03", sql_down="", id=3),
             Migration(file_name="20090214115300_04_test_migration.migration", version="20090214115400", sql_up="sql up 04", sql_down="sql down 04", id=4)
         ]
-        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115300', '20090214115400'], 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115300', '20090214115400']}), config=config)
         migrations = main._get_migration_files_to_be_executed('20090214115400', '20090214115200', False)
         self.assertEqual([all_schema_migrations[-1], all_schema_migrations[-2]], migrations)
         self.assertEqual(u"sql down 04", migrations[0].sql_down)
@@ -812,7 +991,7 @@ class MainTest(BaseTest):
             Migration(file_name="20090214115300_03_test_migration.migration", version="20090214115300", sql_up="sql up 03", sql_down="sql down 03", id=3),
             Migration(file_name="20090214115300_04_test_migration.migration", version="20090214115400", sql_up="sql up 04", sql_down="sql down 04", id=4)
         ]
-        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115300', '20090214115400'], 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115300', '20090214115400']}), config=config)
         migrations = main._get_migration_files_to_be_executed('20090214115400', '20090214115200', False)
         self.assertEqual([all_schema_migrations[-1], all_schema_migrations[-2]], migrations)
         self.assertEqual(u"bar 4", migrations[0].sql_down)
@@ -826,7 +1005,7 @@ class MainTest(BaseTest):
             Migration(file_name="20090214115301_03_test_migration.migration", version="20090214115301", sql_up="sql up 03.1", sql_down="", id=3),
             Migration(file_name="20090214115300_04_test_migration.migration", version="20090214115400", sql_up="sql up 04", sql_down="sql down 04", id=4)
         ]
-        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115301', '20090214115400'], 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115301', '20090214115400']}), config=config)
         self.assertRaisesWithMessage(Exception, 'impossible to migrate down: one of the versions was not found (20090214115301)', main._get_migration_files_to_be_executed, '20090214115400', '20090214115200', False)
 
     def test_it_should_raise_exception_and_stop_process_when_a_migration_file_is_not_present_and_force_files_is_set_and_is_down(self):
@@ -837,7 +1016,7 @@ class MainTest(BaseTest):
             Migration(file_name="20090214115301_03_test_migration.migration", version="20090214115301", sql_up="sql up 03.1", sql_down="sql down 03.1", id=3),
             Migration(file_name="20090214115300_04_test_migration.migration", version="20090214115400", sql_up="sql up 04", sql_down="sql down 04", id=4)
         ]
-        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115301', '20090214115400'], 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115301', '20090214115400']}), config=config)
         self.assertRaisesWithMessage(Exception, 'impossible to migrate down: one of the versions was not found (20090214115301)', main._get_migration_files_to_be_executed, '20090214115400', '20090214115200', False)
 
     def test_it_should_return_migrations_with_same_version_to_execute_when_is_down(self):
@@ -849,7 +1028,7 @@ class MainTest(BaseTest):
             Migration(file_name="20090214115400_04_test_migration.migration", version="20090214115400", sql_up="sql up 04", sql_down="sql down 04", id=4),
             Migration(file_name="20090214115400_04_1_same_version_test_migration.migration", version="20090214115400", sql_up="sql up 04.1", sql_down="sql down 04.1", id=5)
         ]
-        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115301', '20090214115400', '20090214115400'], 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115301', '20090214115400', '20090214115400']}), config=config)
         migrations = main._get_migration_files_to_be_executed('20090214115400', '20090214115200', False)
 
         self.assertEqual(3, len(migrations))
@@ -868,10 +1047,7 @@ class MainTest(BaseTest):
             Migration(file_name="20090214115500_05_test_migration.migration", version="20090214115500", sql_up="sql up 05", sql_down="sql down 05", id=6)
         ]
 
-        def get_version_id_from_version_number_side_effect(args):
-            return [migration.id for migration in Migration.sort_migrations_list(all_schema_migrations, reverse=True) if migration.version == str(args)][0]
-
-        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115301', '20090214115400', '20090214115400', '20090214115500'], 'get_version_id_from_version_number.side_effect':get_version_id_from_version_number_side_effect}), config=config)
+        main = Main(sgdb=Mock(**{'get_all_schema_migrations.return_value':all_schema_migrations, 'get_all_schema_versions.return_value':['20090214115200', '20090214115301', '20090214115400', '20090214115400', '20090214115500']}), config=config)
         migrations = main._get_migration_files_to_be_executed('20090214115500', '20090214115400', False)
 
         self.assertEqual(1, len(migrations))
@@ -933,11 +1109,17 @@ class MainTest(BaseTest):
 
         self.assertEqual(None, label)
 
-def get_version_id_from_version_number_side_effect(args):
-    if str(args) == '20090214115100':
-        return None
-    match = re.match("[0-9]{11}([0-9])[0-9]{2}", str(args))
-    return int(match.group(1))
+SCHEMA_VERSIONS = ['0', '20090214115200', '20090214115300', '20090214115400', '20090214115500', '20090214115600']
+
+def schema_versions_up_to(version):
+    return [schema_version for schema_version in SCHEMA_VERSIONS if schema_version <= version]
+
+def schema_history_sgdb(versions, labels=None, **kwargs):
+    labels = labels or {}
+    all_schema_migrations = [Migration(id=index + 1, version=version, label=labels.get(version), file_name="%s_test_migration.migration" % version, sql_up="sql up %s" % version, sql_down="sql down %s" % version) for index, version in enumerate(versions)]
+    kwargs['get_all_schema_migrations.return_value'] = all_schema_migrations
+    kwargs.setdefault('merged_statements.return_value', [])
+    return Mock(**kwargs)
 
 if __name__ == "__main__":
     unittest.main()
@@ -73,7 +73,8 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
-        self.assertEqual(4, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;')
@@ -93,7 +94,8 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(2, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;')
@@ -130,13 +132,58 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;')
         ]
         self.assertEqual(expected_execute_calls, self.db_mock.execute_scalar.mock_calls)
 
+    def test_it_should_execute_consecutive_inserts_in_batches_of_at_most_1000_rows(self):
+        self.config_dict['insert_batch_size'] = 5000
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        mssql.change("".join(["insert into spam values (%d);" % i for i in range(1500)]), "20090212112104", "20090212112104_test_it_should_execute_consecutive_inserts_in_batches.migration", "", "")
+
+        batches = self.db_mock.execute_non_query.mock_calls[3:5]
+        self.assertEqual(call("insert into spam values (0),\n" + ",\n".join(["(%d)" % i for i in range(1, 1000)])), batches[0])
+        self.assertEqual(call("insert into spam values (1000),\n" + ",\n".join(["(%d)" % i for i in range(1001, 1500)])), batches[1])
+
+    def test_it_should_show_the_statement_which_failed_in_the_batch(self):
+        self.config_dict['insert_batch_size'] = 3
+        self.execute_returns["insert into spam values (1),\n(2),\n(3)"] = Exception("Violation of PRIMARY KEY constraint 'PK_spam'")
+        self.execute_returns["insert into spam values (3)"] = Exception("Violation of PRIMARY KEY constraint 'PK_spam'. The duplicate key value is (3).")
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        self.assertRaisesWithMessage(simple_db_migrate.core.exceptions.MigrationException, "error executing migration: Violation of PRIMARY KEY constraint 'PK_spam'. The duplicate key value is (3). (statement 3 of the 3 executed together)\n\n[ERROR DETAILS] SQL command was:\ninsert into spam values (3)", mssql.change, "insert into spam values (1); insert into spam values (2); insert into spam values (3);", "20090212112104", "20090212112104_test_it_should_show_the_statement_which_failed_in_the_batch.migration", "", "")
+
+        expected_execute_calls = [
+            call("insert into spam values (1),\n(2),\n(3)"),
+            call("BEGIN TRANSACTION simple_db_migrate_batch"),
+            call("insert into spam values (1)"),
+            call("insert into spam values (2)"),
+            call("insert into spam values (3)"),
+            call("ROLLBACK TRANSACTION simple_db_migrate_batch"),
+        ]
+        self.assertEqual(expected_execute_calls, self.db_mock.execute_non_query.mock_calls[3:])
+
+    def test_it_should_show_the_statement_which_failed_in_the_batch_in_a_savepoint_of_the_single_transaction(self):
+        self.config_dict['insert_batch_size'] = 2
+        self.config_dict['single_transaction'] = True
+        self.execute_returns["insert into spam values (1),\n(2)"] = Exception("Violation of PRIMARY KEY constraint 'PK_spam'")
+        self.execute_returns["insert into spam values (1)"] = Exception("Violation of PRIMARY KEY constraint 'PK_spam'. The duplicate key value is (1).")
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        self.assertRaisesWithMessage(simple_db_migrate.core.exceptions.MigrationException, "error executing migration: Violation of PRIMARY KEY constraint 'PK_spam'. The duplicate key value is (1). (statement 1 of the 2 executed together)\n\n[ERROR DETAILS] SQL command was:\ninsert into spam values (1)", mssql.change, "insert into spam values (1); insert into spam values (2);", "20090212112104", "20090212112104_test_it_should_show_the_statement_which_failed_in_the_batch.migration", "", "")
+
+        expected_execute_calls = [
+            call("BEGIN TRANSACTION"),
+            call("insert into spam values (1),\n(2)"),
+            call("SAVE TRANSACTION simple_db_migrate_batch"),
+            call("insert into spam values (1)"),
+            call("ROLLBACK TRANSACTION simple_db_migrate_batch"),
+            call("IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION"),
+        ]
+        self.assertEqual(expected_execute_calls, self.db_mock.execute_non_query.mock_calls[3:])
+
     def test_it_should_execute_migration_down_and_update_schema_version(self):
         mssql = MSSQL(self.config_mock, self.db_driver_mock)
         mssql.change("drop table spam;", "20090212112104", "20090212112104_test_it_should_execute_migration_down_and_update_schema_version.migration", "create table spam();", "drop table spam;", False)
@@ -150,7 +197,8 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;')
@@ -170,7 +218,8 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;')
@@ -210,7 +259,8 @@ class MSSQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(1, self.db_mock.cancel.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;')
@@ -237,7 +287,8 @@ class MSSQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(1, self.db_mock.cancel.call_count)
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;'),
@@ -255,6 +306,20 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_execution_log_calls, execution_log_mock.mock_calls)
 
+    def test_it_should_get_the_advisory_lock_of_the_database(self):
+        sql = "declare @result int; exec @result = sp_getapplock @Resource = 'simple-db-migrate.__db_version__', @LockMode = 'Exclusive', @LockOwner = 'Session', @LockTimeout = 30000; select @result;"
+        self.execute_returns[sql] = 1
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        mssql.lock(30)
+        mssql.unlock()
+        self.assertEqual(call(sql), self.db_mock.execute_scalar.mock_calls[-1])
+        self.assertEqual(call("exec sp_releaseapplock @Resource = 'simple-db-migrate.__db_version__', @LockOwner = 'Session';"), self.db_mock.execute_non_query.mock_calls[-1])
+
+    def test_it_should_raise_exception_when_the_advisory_lock_is_not_granted_in_time(self):
+        self.execute_returns["declare @result int; exec @result = sp_getapplock @Resource = 'simple-db-migrate.__db_version__', @LockMode = 'Exclusive', @LockOwner = 'Session', @LockTimeout = 30000; select @result;"] = -1
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        self.assertRaisesWithMessage(Exception, "could not get the advisory lock 'simple-db-migrate.__db_version__' in 30 seconds", mssql.lock, 30)
+
     def test_it_should_get_current_schema_version(self):
         self.execute_returns = {'select count(*) from __db_version__;': 0, 'select top 1 version from __db_version__ order by id desc': "0"}
 
@@ -268,7 +333,8 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;'),
@@ -301,7 +367,8 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;')
@@ -341,7 +408,8 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;'),
@@ -353,6 +421,29 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_execute_calls, self.db_mock.execute_query.mock_calls)
 
+    def test_it_should_get_all_schema_migrations_without_sql(self):
+        db_versions = [{'id': 1, 'version': "0", 'label': None, 'name': None}, {'id': 2, 'version': "20090211120001", 'label': "label", 'name': "20090211120001_name"}]
+        self.execute_returns = {'select count(*) from __db_version__;': 0, 'select id, version, label, name from __db_version__ order by id;': db_versions}
+
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        schema_migrations = mssql.get_all_schema_migrations(with_sql=False)
+
+        self.assertEqual(2, len(schema_migrations))
+        self.assertEqual("20090211120001", schema_migrations[1].version)
+        self.assertEqual("label", schema_migrations[1].label)
+        self.assertEqual("20090211120001_name", schema_migrations[1].file_name)
+        self.assertEqual(None, schema_migrations[1].sql_up)
+        self.assertEqual(None, schema_migrations[1].sql_down)
+        self.db_mock.execute_query.assert_called_with('select id, version, label, name from __db_version__ order by id;')
+
+    def test_it_should_get_the_sql_of_schema_migrations_from_ids(self):
+        sql = 'select id, cast(sql_up as text) as sql_up, cast(sql_down as text) as sql_down from __db_version__ where id in (2, 3);'
+        self.execute_returns = {'select count(*) from __db_version__;': 0, sql: [{'id': 2, 'sql_up': "sql_up 2", 'sql_down': "sql_down 2"}, {'id': 3, 'sql_up': None, 'sql_down': None}]}
+
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        self.assertEqual({2: ("sql_up 2", "sql_down 2"), 3: ("", "")}, mssql.get_schema_migrations_sql([2, 3]))
+        self.db_mock.execute_query.assert_called_with(sql)
+
     def test_it_should_parse_sql_statements(self):
         statements = MSSQL._parse_sql_statements('; ; create table eggs; drop table spam; ; ;')
 
@@ -397,7 +488,8 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;'),
@@ -422,7 +514,8 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;'),
@@ -446,7 +539,8 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select count(*) from __db_version__;'),
@@ -458,6 +552,89 @@ class MSSQLTest(BaseTest):
         ]
         self.assertEqual(expected_execute_calls, self.db_mock.execute_row.mock_calls)
 
+    def test_it_should_execute_migration_and_schema_version_in_a_transaction_when_using_single_transaction(self):
+        self.config_dict["single_transaction"] = True
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        self.db_mock.execute_non_query.reset_mock()
+
+        mssql.change("create table spam();", "20090212112104", "20090212112104_test_it_should_commit_once.migration", "create table spam();", "drop table spam;")
+
+        expected_query_calls = [
+            call('BEGIN TRANSACTION'),
+            call('create table spam()'),
+            call('insert into __db_version__ (version, label, name, sql_up, sql_down) values (%s, %s, %s, %s, %s);', ('20090212112104', None, '20090212112104_test_it_should_commit_once.migration', 'create table spam();', 'drop table spam;')),
+            call('COMMIT TRANSACTION')
+        ]
+        self.assertEqual(expected_query_calls, self.db_mock.execute_non_query.mock_calls)
+
+    def test_it_should_rollback_migration_when_an_error_occur_during_log_schema_version_using_single_transaction(self):
+        self.config_dict["single_transaction"] = True
+        self.execute_returns['insert into __db_version__ (version, label, name, sql_up, sql_down) values (%s, %s, %s, %s, %s);'] = Exception("invalid sql")
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        self.db_mock.execute_non_query.reset_mock()
+
+        self.assertRaisesWithMessage(Exception, "error logging migration: invalid sql\n\n[ERROR DETAILS] SQL command was:\n20090212112104_test_it_should_rollback.migration", mssql.change,
+                                     "create table spam();", "20090212112104", "20090212112104_test_it_should_rollback.migration", "create table spam();", "drop table spam;")
+
+        self.assertEqual(call('IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION'), self.db_mock.execute_non_query.mock_calls[-1])
+        self.assertFalse(call('COMMIT TRANSACTION') in self.db_mock.execute_non_query.mock_calls)
+
+    def test_it_should_reuse_the_same_connection_during_the_whole_execution(self):
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        mssql.change("create table spam();", "20090212112104", "20090212112104_test_it_should_reuse_the_same_connection.migration", "create table spam();", "drop table spam;")
+        mssql.get_current_schema_version()
+
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_mock.select_db.call_count)
+        self.assertEqual(1, mssql.connection_count)
+        self.assertEqual(7, mssql.round_trip_count)
+
+    def test_it_should_close_the_connection(self):
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        mssql.close()
+        mssql.close()
+
+        self.assertEqual(1, self.db_mock.close.call_count)
+
+    def test_it_should_reconnect_when_connection_is_lost_during_a_query(self):
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+
+        self.execute_returns = {'select top 1 version from __db_version__ order by id desc': Exception("DBPROCESS is dead or not enabled")}
+        def reset_execute_returns(**kwargs):
+            self.execute_returns = {'select top 1 version from __db_version__ order by id desc': "0"}
+            return self.db_mock
+        self.db_driver_mock.connect.side_effect = reset_execute_returns
+
+        self.assertEqual("0", mssql.get_current_schema_version())
+        self.assertEqual(2, self.db_driver_mock.connect.call_count)
+        self.assertEqual(2, self.db_mock.select_db.call_count)
+        self.assertEqual(1, self.db_mock.close.call_count)
+        self.assertEqual(2, mssql.connection_count)
+
+    def test_it_should_not_execute_again_a_change_when_connection_is_lost(self):
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        self.execute_returns = {'create table spam()': Exception("DBPROCESS is dead or not enabled")}
+
+        self.assertRaisesWithMessage(Exception, "error executing migration: DBPROCESS is dead or not enabled\n\n[ERROR DETAILS] SQL command was:\ncreate table spam()", mssql.change,
+                                     "create table spam();", "20090212112104", "20090212112104_test_it_should_not_execute_again.migration", "create table spam();", "drop table spam;")
+
+        self.assertEqual(1, self.db_mock.execute_non_query.mock_calls.count(call('create table spam()')))
+        self.assertEqual(0, self.db_mock.cancel.call_count)
+        self.assertEqual(1, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+
+    def test_it_should_not_reconnect_when_connection_holding_the_advisory_lock_is_lost(self):
+        self.execute_returns["declare @result int; exec @result = sp_getapplock @Resource = 'simple-db-migrate.__db_version__', @LockMode = 'Exclusive', @LockOwner = 'Session', @LockTimeout = 30000; select @result;"] = 0
+        mssql = MSSQL(self.config_mock, self.db_driver_mock)
+        mssql.lock(30)
+        self.execute_returns['select top 1 version from __db_version__ order by id desc'] = Exception("DBPROCESS is dead or not enabled")
+
+        self.assertRaisesWithMessage(simple_db_migrate.core.exceptions.MigrationException, "the connection was lost while holding the advisory lock 'simple-db-migrate.__db_version__', which was released with it", mssql.get_current_schema_version)
+
+        mssql.unlock()
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.execute_non_query.mock_calls.count(call("exec sp_releaseapplock @Resource = 'simple-db-migrate.__db_version__', @LockOwner = 'Session';")))
+
     def side_effect(self, returns, default_value):
         result = returns.get(self.last_execute_command, default_value)
         if isinstance(result, Exception):
@@ -1,10 +1,47 @@
 #-*- coding:utf-8 -*-
+import re
 import unittest
 import sys
 import simple_db_migrate.core
+from datetime import datetime
 from mock import patch, Mock, MagicMock, call
+from simple_db_migrate import SIMPLE_DB_MIGRATE_VERSION
+from simple_db_migrate.helpers import Utils
 from simple_db_migrate.mysql import MySQL
-from tests import BaseTest
+from simple_db_migrate.sql import SQLFile
+from tests import BaseTest, create_file, delete_files
+
+# the splitter of the migrations before SQLLexer, to compare their statements
+legacy_objects = re.compile("(?ims)(?P<pre>.*?)(?P<main>create[ \n\t\r]*(definer[ \n\t\r]*=[ \n\t\r]*[^ \n\t\r]*[ \n\t\r]*)?(trigger|function|procedure).*?)\n[ \n\t\r]*/([ \n\t\r]+(?P<pos>.*)|$)")
+
+def legacy_parse_sql_statements(migration_sql):
+    all_statements = []
+    last_statement = ''
+
+    match_stmt = legacy_objects.match(migration_sql)
+    if match_stmt:
+        if match_stmt.group('pre'):
+            all_statements = all_statements + legacy_parse_sql_statements(match_stmt.group('pre'))
+        if match_stmt.group('main'):
+            all_statements.append(match_stmt.group('main'))
+        if match_stmt.group('pos'):
+            all_statements = all_statements + legacy_parse_sql_statements(match_stmt.group('pos'))
+    else:
+        for statement in migration_sql.split(';'):
+            curr_statement = len(last_statement) > 0 and '%s;%s' % (last_statement, statement) or statement
+            count = Utils.count_occurrences(curr_statement)
+            if count.get("'", 0) % 2 == 0 and count.get('"', 0) % 2 == 0 and count.get('(', 0) == count.get(')', 0):
+                all_statements.append(curr_statement)
+                last_statement = ''
+            else:
+                last_statement = curr_statement
+
+    return [s.strip() for s in all_statements if ((s.strip() != "") and (last_statement == ""))]
+
+def without_comments(statements):
+    # the legacy splitter keeps the comments before a block as a statement of their own, the lexer keeps them with the block
+    statements = [re.sub(r"^(?:[ \t]*(?:#|--)[^\n]*(?:\n|$))*", "", statement).strip() for statement in statements]
+    return [statement for statement in statements if statement]
 
 class MySQLTest(BaseTest):
 
@@ -73,7 +110,8 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(4, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -95,7 +133,8 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(2, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -135,7 +174,8 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(4, self.db_mock.commit.call_count)
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -147,6 +187,80 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_execute_calls, self.cursor_mock.execute.mock_calls)
         self.assertEqual(5, self.cursor_mock.close.call_count)
 
+    def test_it_should_execute_the_statements_of_a_sql_file_without_saving_them(self):
+        create_file('test_sql_file.sql', "create table spam();\ninsert into spam values ('a;b');\n")
+        try:
+            mysql = MySQL(self.config_mock, self.db_driver_mock)
+            mysql.change(SQLFile('test_sql_file.sql'), "20090212112104", "20090212112104_test_it_should_execute_the_statements_of_a_sql_file.migration", "", "drop table spam;")
+        finally:
+            delete_files('test_sql_file.sql')
+
+        expected_execute_calls = [
+            call('create table spam()'),
+            call("insert into spam values ('a;b')"),
+            call('insert into __db_version__ (version, label, name, sql_up, sql_down) values ("20090212112104", NULL, "20090212112104_test_it_should_execute_the_statements_of_a_sql_file.migration", "", "drop table spam;");')
+        ]
+        self.assertEqual(expected_execute_calls, self.cursor_mock.execute.mock_calls[3:])
+
+    def test_it_should_execute_consecutive_inserts_in_batches(self):
+        self.config_dict['insert_batch_size'] = 2
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        mysql.change("insert into spam values (1); insert into spam values ('it\\'s'); insert into spam values (3);", "20090212112104", "20090212112104_test_it_should_execute_consecutive_inserts_in_batches.migration", "", "")
+
+        expected_execute_calls = [
+            call("insert into spam values (1),\n('it\\'s')"),
+            call('insert into spam values (3)'),
+        ]
+        self.assertEqual(expected_execute_calls, self.cursor_mock.execute.mock_calls[3:5])
+
+    def test_it_should_show_the_statements_of_the_batch_when_it_fails(self):
+        self.config_dict['insert_batch_size'] = 2
+        self.execute_returns["insert into spam values (1),\n(2)"] = Exception("invalid sql")
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        self.assertRaisesWithMessage(simple_db_migrate.core.exceptions.MigrationException, "error executing migration: invalid sql\n\n[ERROR DETAILS] SQL command was:\ninsert into spam values (1);\ninsert into spam values (2)", mysql.change, "insert into spam values (1); insert into spam values (2);", "20090212112104", "20090212112104_test_it_should_show_the_statements_of_the_batch_when_it_fails.migration", "", "")
+
+    def test_it_should_show_the_statement_which_failed_in_the_batch(self):
+        self.config_dict['insert_batch_size'] = 3
+        self.execute_returns["insert into spam values (1),\n(2),\n(3)"] = Exception("Data too long for column 'a' at row 2")
+        self.execute_returns["insert into spam values (2)"] = Exception("Data too long for column 'a' at row 1")
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        self.assertRaisesWithMessage(simple_db_migrate.core.exceptions.MigrationException, "error executing migration: Data too long for column 'a' at row 1 (statement 2 of the 3 executed together)\n\n[ERROR DETAILS] SQL command was:\ninsert into spam values (2)", mysql.change, "insert into spam values (1); insert into spam values (2); insert into spam values (3);", "20090212112104", "20090212112104_test_it_should_show_the_statement_which_failed_in_the_batch.migration", "", "")
+
+        expected_execute_calls = [
+            call("insert into spam values (1),\n(2),\n(3)"),
+            call("savepoint simple_db_migrate_batch"),
+            call("insert into spam values (1)"),
+            call("insert into spam values (2)"),
+            call("rollback to savepoint simple_db_migrate_batch"),
+        ]
+        self.assertEqual(expected_execute_calls, self.cursor_mock.execute.mock_calls[3:])
+        self.assertEqual(1, self.db_mock.rollback.call_count)
+
+    def test_it_should_not_execute_again_the_alter_tables_of_a_batch_which_failed(self):
+        self.config_dict['merge_alter_table'] = True
+        self.execute_returns["alter table spam add a int,\nadd b int"] = Exception("Duplicate column name 'b'")
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        self.assertRaisesWithMessage(simple_db_migrate.core.exceptions.MigrationException, "error executing migration: Duplicate column name 'b'\n\n[ERROR DETAILS] SQL command was:\nalter table spam add a int;\nalter table spam add b int", mysql.change, "alter table spam add a int; alter table spam add b int;", "20090212112104", "20090212112104_test_it_should_not_execute_again_the_alter_tables.migration", "", "")
+        self.assertEqual([call("alter table spam add a int,\nadd b int")], self.cursor_mock.execute.mock_calls[3:])
+
+    def test_it_should_merge_consecutive_alter_tables_when_asked(self):
+        self.config_dict['merge_alter_table'] = True
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        mysql.change("alter table spam add a int; alter table spam add b int;", "20090212112104", "20090212112104_test_it_should_merge_consecutive_alter_tables_when_asked.migration", "", "")
+
+        self.assertEqual(call('alter table spam add a int,\nadd b int'), self.cursor_mock.execute.mock_calls[3])
+
+    def test_it_should_not_merge_consecutive_alter_tables_by_default(self):
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        mysql.change("alter table spam add a int; alter table spam add b int;", "20090212112104", "20090212112104_test_it_should_not_merge_consecutive_alter_tables_by_default.migration", "", "")
+
+        self.assertEqual([call('alter table spam add a int'), call('alter table spam add b int')], self.cursor_mock.execute.mock_calls[3:5])
+
+    def test_it_should_return_the_merged_statements(self):
+        self.config_dict['merge_alter_table'] = True
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        self.assertEqual([('alter table spam add a int,\nadd b int', ['alter table spam add a int', 'alter table spam add b int'])], mysql.merged_statements("create table spam (); alter table spam add a int; alter table spam add b int;"))
+
     def test_it_should_execute_migration_down_and_update_schema_version(self):
         mysql = MySQL(self.config_mock, self.db_driver_mock)
         mysql.change("drop table spam;", "20090212112104", "20090212112104_test_it_should_execute_migration_down_and_update_schema_version.migration", "create table spam();", "drop table spam;", False)
@@ -157,7 +271,8 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(4, self.db_mock.commit.call_count)
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -179,7 +294,8 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(4, self.db_mock.commit.call_count)
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -221,7 +337,8 @@ class MySQLTest(BaseTest):
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(1, self.db_mock.rollback.call_count)
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -250,7 +367,8 @@ class MySQLTest(BaseTest):
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(1, self.db_mock.rollback.call_count)
         self.assertEqual(3, self.db_mock.commit.call_count)
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -285,7 +403,8 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -296,6 +415,84 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_execute_calls, self.cursor_mock.execute.mock_calls)
         self.assertEqual(4, self.cursor_mock.close.call_count)
 
+    def test_it_should_get_the_fingerprint_of_the_current_version_in_one_query(self):
+        sql = 'select fingerprint from __db_version___fingerprint where version = (select version from __db_version__ order by id desc limit 0,1);'
+        self.fetchone_returns[sql] = ['fingerprint']
+
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        round_trip_count = mysql.round_trip_count
+        self.assertEqual('fingerprint', mysql.get_fingerprint())
+        self.assertEqual(1, mysql.round_trip_count - round_trip_count)
+        self.assertEqual(call(sql), self.cursor_mock.execute.mock_calls[-1])
+
+    def test_it_should_not_get_the_fingerprint_before_it_is_stored(self):
+        self.execute_returns['select fingerprint from __db_version___fingerprint where version = (select version from __db_version__ order by id desc limit 0,1);'] = Exception("Table 'migration_test.__db_version___fingerprint' doesn't exist")
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        self.assertEqual(None, mysql.get_fingerprint())
+
+    def test_it_should_store_the_fingerprint_with_the_version(self):
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        mysql.set_fingerprint('fingerprint', '20090211120001')
+
+        expected_execute_calls = [
+            call('create table if not exists __db_version___fingerprint ( fingerprint varchar(64) NOT NULL, version varchar(20) NOT NULL )'),
+            call('delete from __db_version___fingerprint'),
+            call('insert into __db_version___fingerprint (fingerprint, version) values ("fingerprint", "20090211120001")')
+        ]
+        self.assertEqual(expected_execute_calls, self.cursor_mock.execute.mock_calls[-3:])
+
+    @patch('simple_db_migrate.report.socket.gethostname', return_value='migrator01')
+    @patch('simple_db_migrate.report.datetime')
+    def test_it_should_record_the_metadata_of_the_execution_on_the_version_table(self, datetime_mock, gethostname_mock):
+        # utcnow on python 2, deprecated on python 3
+        datetime_mock.utcnow.return_value = datetime_mock.now.return_value = datetime(2009, 2, 12, 11, 21, 4, 123)
+        self.config_dict['version_table_metadata'] = True
+        self.cursor_mock.fetchall.return_value = [('id',), ('version',), ('label',), ('name',), ('sql_up',), ('sql_down',)]
+        self.execute_returns['insert into spam values (1), (2)'] = 2
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        mysql.change("insert into spam values (1), (2);", "20090212112104", "20090212112104_spam.migration", "", "", label_version="v1")
+
+        self.assertEqual(call('alter table __db_version__ add column started_at datetime, add column duration_ms int(11), add column statements_count int(11), add column rows_affected bigint, add column hostname varchar(255), add column tool_version varchar(20)'), self.cursor_mock.execute.mock_calls[4])
+        insert, params = self.cursor_mock.execute.mock_calls[-1][1]
+        self.assertEqual('insert into __db_version__ (version, label, name, sql_up, sql_down, started_at, duration_ms, statements_count, rows_affected, hostname, tool_version) values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);', insert)
+        self.assertEqual(('20090212112104', 'v1', '20090212112104_spam.migration', '', '', datetime(2009, 2, 12, 11, 21, 4)), params[:6])
+        self.assertEqual((1, 2, 'migrator01', SIMPLE_DB_MIGRATE_VERSION), params[7:])
+
+    @patch('simple_db_migrate.report.socket.gethostname', return_value='migrator"01\\')
+    def test_it_should_pass_the_metadata_to_the_driver_to_be_escaped(self, gethostname_mock):
+        self.config_dict['version_table_metadata'] = True
+        self.cursor_mock.fetchall.return_value = [('id',), ('version',), ('label',), ('name',), ('sql_up',), ('sql_down',)]
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        mysql.change("insert into spam values (1);", "20090212112104", "20090212112104_spam.migration", 'insert into spam values ("50%");', "")
+        self.assertEqual((None, '20090212112104_spam.migration', 'insert into spam values ("50%");'), self.cursor_mock.execute.mock_calls[-1][1][1][1:4])
+        self.assertEqual('migrator"01\\', self.cursor_mock.execute.mock_calls[-1][1][1][9])
+
+    def test_it_should_not_add_the_metadata_columns_already_on_the_version_table(self):
+        self.config_dict['version_table_metadata'] = True
+        self.cursor_mock.fetchall.return_value = [('id',), ('version',), ('STARTED_AT',), ('duration_ms',), ('statements_count',), ('rows_affected',), ('hostname',), ('tool_version',)]
+        MySQL(self.config_mock, self.db_driver_mock)
+        self.assertEqual(call("select column_name from information_schema.columns where table_schema = database() and table_name = '__db_version__';"), self.cursor_mock.execute.mock_calls[-1])
+
+    def test_it_should_get_the_advisory_lock_of_the_database(self):
+        self.fetchone_returns["select get_lock('simple-db-migrate.migration_test.__db_version__', 30);"] = [1]
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        mysql.lock(30)
+        mysql.unlock()
+        self.assertEqual([call("select get_lock('simple-db-migrate.migration_test.__db_version__', 30);"), call("select release_lock('simple-db-migrate.migration_test.__db_version__');")], self.cursor_mock.execute.mock_calls[-2:])
+
+    def test_it_should_raise_exception_when_the_advisory_lock_is_not_granted_in_time(self):
+        self.fetchone_returns["select get_lock('simple-db-migrate.migration_test.__db_version__', 30);"] = [0]
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        self.assertRaisesWithMessage(Exception, "could not get the advisory lock 'simple-db-migrate.migration_test.__db_version__' in 30 seconds", mysql.lock, 30)
+
+    def test_it_should_hash_the_name_of_the_advisory_lock_longer_than_64_characters(self):
+        self.config_dict['database_name'] = 'a_database_with_a_very_long_name_of_a_tenant'
+        # the sha1 of 'simple-db-migrate.a_database_with_a_very_long_name_of_a_tenant.__db_version__'
+        self.fetchone_returns["select get_lock('simple-db-migrate.a6382cdde1ed5ad9dd1d8c971c906eccc35ccbc1', 30);"] = [1]
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        mysql.lock(30)
+        self.assertEqual(call("select get_lock('simple-db-migrate.a6382cdde1ed5ad9dd1d8c971c906eccc35ccbc1', 30);"), self.cursor_mock.execute.mock_calls[-1])
+
     def test_it_should_get_all_schema_versions(self):
         expected_versions = []
         expected_versions.append("0")
@@ -318,7 +515,8 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -329,6 +527,12 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_execute_calls, self.cursor_mock.execute.mock_calls)
         self.assertEqual(4, self.cursor_mock.close.call_count)
 
+    def test_it_should_get_no_schema_versions_when_the_query_returns_no_rows(self):
+        self.cursor_mock.fetchall.return_value = ()
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        self.assertEqual([], mysql.get_all_schema_versions())
+        self.assertEqual(0, self.cursor_mock.fetchone.call_count - 1)
+
     def test_it_should_get_all_schema_migrations(self):
         expected_versions = []
         expected_versions.append([1, "0", None, None, None, None])
@@ -354,7 +558,8 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -365,6 +570,33 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_execute_calls, self.cursor_mock.execute.mock_calls)
         self.assertEqual(4, self.cursor_mock.close.call_count)
 
+    def test_it_should_get_all_schema_migrations_without_sql(self):
+        self.cursor_mock.fetchall.return_value = ((1, "0", None, None), (2, "20090211120001", "label", "20090211120001_name"))
+
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        schema_migrations = mysql.get_all_schema_migrations(with_sql=False)
+
+        self.assertEqual(2, len(schema_migrations))
+        self.assertEqual("20090211120001", schema_migrations[1].version)
+        self.assertEqual("label", schema_migrations[1].label)
+        self.assertEqual("20090211120001_name", schema_migrations[1].file_name)
+        self.assertEqual(None, schema_migrations[1].sql_up)
+        self.assertEqual(None, schema_migrations[1].sql_down)
+        self.cursor_mock.execute.assert_called_with('select id, version, label, name from __db_version__ order by id;')
+
+    def test_it_should_get_the_sql_of_schema_migrations_from_ids(self):
+        self.cursor_mock.fetchall.return_value = ((2, "sql_up 2", "sql_down 2"), (3, None, None))
+
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        self.assertEqual({2: ("sql_up 2", "sql_down 2"), 3: ("", "")}, mysql.get_schema_migrations_sql([2, 3]))
+        self.cursor_mock.execute.assert_called_with('select id, sql_up, sql_down from __db_version__ where id in (2, 3);')
+
+    def test_it_should_not_query_the_sql_of_schema_migrations_without_ids(self):
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        execute_count = self.cursor_mock.execute.call_count
+        self.assertEqual({}, mysql.get_schema_migrations_sql([]))
+        self.assertEqual(execute_count, self.cursor_mock.execute.call_count)
+
     def test_it_should_parse_sql_statements(self):
         #TODO include other types of sql
         sql = "; ; create table eggs; drop table spam; ; ;\
@@ -428,6 +660,22 @@ class MySQLTest(BaseTest):
             FROM dual;\n\
         EnD;', statements[5])
 
+    def test_it_should_parse_a_trigger_after_a_hash_comment_as_one_statement(self):
+        sql = "# header comment\ncreate trigger spam_trigger before insert on spam for each row begin set new.x = 1; end\n/\ndrop table eggs;"
+        statements = MySQL._parse_sql_statements(sql)
+        self.assertEqual(["# header comment\ncreate trigger spam_trigger before insert on spam for each row begin set new.x = 1; end", "drop table eggs"], statements)
+        self.assertEqual(MySQL._parse_sql_statements(sql.replace("#", "--")), [statement.replace("#", "--") for statement in statements])
+
+    def test_it_should_parse_the_same_statements_as_the_legacy_splitter(self):
+        migrations = [
+            "create table eggs; drop table spam;\ninsert into eggs values ('a;b', \"c;d\", (1));",
+            "# header comment\ncreate trigger spam_trigger before insert on spam for each row begin set new.x = 1; end\n/\ndrop table eggs;",
+            "-- header comment\ncreate procedure spam_procedure()\nbegin\n  select 1;\n  select 2;\nend\n/\n# other comment\ncreate definer = 'admin'@'localhost' function spam_function() returns int\nbegin\n  return 1;\nend\n/\n",
+            "create table eggs (id int);\n-- a comment\ninsert into eggs values (1);\n#another comment\ninsert into eggs values (2);",
+        ]
+        for sql in migrations:
+            self.assertEqual(without_comments(legacy_parse_sql_statements(sql)), without_comments(MySQL._parse_sql_statements(sql)), sql)
+
     def test_it_should_parse_sql_statements_with_html_inside(self):
         sql = u"""
         create table eggs;
@@ -464,7 +712,8 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -487,7 +736,8 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -509,7 +759,8 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_query_calls, self.db_mock.query.mock_calls)
         self.db_mock.select_db.assert_called_with('migration_test')
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create table if not exists __db_version__ ( id int(11) NOT NULL AUTO_INCREMENT, version varchar(20) NOT NULL default "0", label varchar(255), name varchar(255), sql_up LONGTEXT, sql_down LONGTEXT, PRIMARY KEY (id))'),
@@ -520,6 +771,101 @@ class MySQLTest(BaseTest):
         self.assertEqual(expected_execute_calls, self.cursor_mock.execute.mock_calls)
         self.assertEqual(4, self.cursor_mock.close.call_count)
 
+    def test_it_should_commit_migration_and_schema_version_once_when_using_single_transaction(self):
+        self.config_dict["single_transaction"] = True
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        self.db_mock.commit.reset_mock()
+
+        mysql.change("create table spam();", "20090212112104", "20090212112104_test_it_should_commit_once.migration", "create table spam();", "drop table spam;")
+
+        self.assertEqual(1, self.db_mock.commit.call_count)
+        self.assertEqual(call('create table spam()'), self.cursor_mock.execute.mock_calls[-2])
+
+    def test_it_should_rollback_migration_when_an_error_occur_during_log_schema_version_using_single_transaction(self):
+        self.config_dict["single_transaction"] = True
+        self.execute_returns['insert into __db_version__ (version, label, name, sql_up, sql_down) values ("20090212112104", NULL, "20090212112104_test_it_should_rollback.migration", "create table spam();", "drop table spam;");'] = Exception("invalid sql")
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        self.db_mock.commit.reset_mock()
+
+        self.assertRaisesWithMessage(Exception, "error logging migration: invalid sql\n\n[ERROR DETAILS] SQL command was:\n20090212112104_test_it_should_rollback.migration", mysql.change,
+                                     "create table spam();", "20090212112104", "20090212112104_test_it_should_rollback.migration", "create table spam();", "drop table spam;")
+
+        self.assertEqual(0, self.db_mock.commit.call_count)
+        self.assertEqual(1, self.db_mock.rollback.call_count)
+
+    def test_it_should_reuse_the_same_connection_during_the_whole_execution(self):
+        self.fetchone_returns = {'select count(*) from __db_version__;': [0], 'select version from __db_version__ order by id desc limit 0,1;': ["0"]}
+
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        mysql.change("create table spam();", "20090212112104", "20090212112104_test_it_should_reuse_the_same_connection.migration", "create table spam();", "drop table spam;")
+        mysql.get_current_schema_version()
+
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_mock.select_db.call_count)
+        self.assertEqual(1, mysql.connection_count)
+        self.assertEqual(11, mysql.round_trip_count)
+
+    def test_it_should_close_the_connection(self):
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        mysql.close()
+        mysql.close()
+
+        self.assertEqual(1, self.db_mock.close.call_count)
+
+    def test_it_should_reconnect_when_connection_is_lost_during_a_query(self):
+        self.fetchone_returns = {'select count(*) from __db_version__;': [0], 'select version from __db_version__ order by id desc limit 0,1;': ["0"]}
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+
+        self.execute_returns = {'select version from __db_version__ order by id desc limit 0,1;': Exception(2006, 'MySQL server has gone away')}
+        def reset_execute_returns(**kwargs):
+            self.execute_returns = {}
+            return self.db_mock
+        self.db_driver_mock.connect.side_effect = reset_execute_returns
+
+        self.assertEqual("0", mysql.get_current_schema_version())
+        self.assertEqual(2, self.db_driver_mock.connect.call_count)
+        self.assertEqual(2, self.db_mock.select_db.call_count)
+        self.assertEqual(1, self.db_mock.close.call_count)
+        self.assertEqual(2, mysql.connection_count)
+
+    def test_it_should_not_execute_again_a_change_when_connection_is_lost(self):
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        self.execute_returns = {'create table spam()': Exception(2013, 'Lost connection to MySQL server during query')}
+
+        try:
+            mysql.change("create table spam();", "20090212112104", "20090212112104_test_it_should_not_execute_again.migration", "create table spam();", "drop table spam;")
+            self.fail("it should not get here")
+        except Exception as e:
+            self.assertEqual("error executing migration: (2013, 'Lost connection to MySQL server during query')\n\n[ERROR DETAILS] SQL command was:\ncreate table spam()", str(e))
+
+        self.assertEqual(1, self.cursor_mock.execute.mock_calls.count(call('create table spam()')))
+        self.assertEqual(0, self.db_mock.rollback.call_count)
+        self.assertEqual(1, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+
+    def test_it_should_not_reconnect_when_connection_holding_the_advisory_lock_is_lost(self):
+        self.fetchone_returns = {'select count(*) from __db_version__;': [0], "select get_lock('simple-db-migrate.migration_test.__db_version__', 30);": [1]}
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        mysql.lock(30)
+
+        self.execute_returns = {'select version from __db_version__ order by id desc limit 0,1;': Exception(2006, 'MySQL server has gone away')}
+        self.assertRaisesWithMessage(simple_db_migrate.core.exceptions.MigrationException, "the connection was lost while holding the advisory lock 'simple-db-migrate.migration_test.__db_version__', which was released with it", mysql.get_current_schema_version)
+        self.assertRaisesWithMessage(simple_db_migrate.core.exceptions.MigrationException, "the connection was lost while holding the advisory lock 'simple-db-migrate.migration_test.__db_version__', which was released with it", mysql.get_all_schema_versions)
+
+        mysql.unlock()
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(0, self.cursor_mock.execute.mock_calls.count(call("select release_lock('simple-db-migrate.migration_test.__db_version__');")))
+
+    def test_it_should_not_reconnect_after_a_change_loses_the_connection_holding_the_advisory_lock(self):
+        self.fetchone_returns["select get_lock('simple-db-migrate.migration_test.__db_version__', 30);"] = [1]
+        mysql = MySQL(self.config_mock, self.db_driver_mock)
+        mysql.lock(30)
+        self.execute_returns = {'create table spam()': Exception(2013, 'Lost connection to MySQL server during query')}
+
+        self.assertRaises(simple_db_migrate.core.exceptions.MigrationException, mysql.change, "create table spam();", "20090212112104", "20090212112104_test_it_should_not_execute_again.migration", "create table spam();", "drop table spam;")
+        self.assertRaisesWithMessage(simple_db_migrate.core.exceptions.MigrationException, "the connection was lost while holding the advisory lock 'simple-db-migrate.migration_test.__db_version__', which was released with it", mysql.get_current_schema_version)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+
     def side_effect(self, returns, default_value):
         result = returns.get(self.last_execute_command, default_value)
         if isinstance(result, Exception):
@@ -1,4 +1,5 @@
 #-*- coding:utf-8 -*-
+import re
 import unittest
 import sys
 import simple_db_migrate.core
@@ -95,9 +96,9 @@ class OracleTest(BaseTest):
         Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
 
         self.assertEqual(1, self.db_mock.rollback.call_count)
-        self.assertEqual(8, self.db_driver_mock.connect.call_count)
+        self.assertEqual(3, self.db_driver_mock.connect.call_count)
         self.assertEqual(4, self.db_mock.commit.call_count)
-        self.assertEqual(7, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create user root identified by migration_test'),
@@ -131,9 +132,9 @@ class OracleTest(BaseTest):
         Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
 
         self.assertEqual(2, self.db_mock.rollback.call_count)
-        self.assertEqual(8, self.db_driver_mock.connect.call_count)
+        self.assertEqual(3, self.db_driver_mock.connect.call_count)
         self.assertEqual(3, self.db_mock.commit.call_count)
-        self.assertEqual(7, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('create user root identified by migration_test'),
@@ -155,9 +156,9 @@ class OracleTest(BaseTest):
 
         Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
 
-        self.assertEqual(7, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(4, self.db_mock.commit.call_count)
-        self.assertEqual(7, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select version from db_version'),
@@ -191,9 +192,9 @@ class OracleTest(BaseTest):
 
         Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
 
-        self.assertEqual(9, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(5, self.db_mock.commit.call_count)
-        self.assertEqual(9, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call(select_elements_to_drop_sql),
@@ -229,9 +230,9 @@ class OracleTest(BaseTest):
 
         Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
 
-        self.assertEqual(6, self.db_driver_mock.connect.call_count)
+        self.assertEqual(2, self.db_driver_mock.connect.call_count)
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call(select_elements_to_drop_sql),
@@ -274,7 +275,7 @@ class OracleTest(BaseTest):
 
         self.assertEqual(2, self.db_driver_mock.connect.call_count)
         self.assertEqual(0, self.db_mock.commit.call_count)
-        self.assertEqual(2, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call(select_elements_to_drop_sql),
@@ -311,7 +312,7 @@ class OracleTest(BaseTest):
             self.assertEqual("error when dropping", str(e))
 
         self.assertEqual(0, self.db_mock.commit.call_count)
-        self.assertEqual(1, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call(select_elements_to_drop_sql)
@@ -348,7 +349,7 @@ class OracleTest(BaseTest):
 
         self.assertEqual(1, self.db_mock.rollback.call_count)
         self.assertEqual(1, self.db_mock.commit.call_count)
-        self.assertEqual(3, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call(select_elements_to_drop_sql),
@@ -383,7 +384,7 @@ class OracleTest(BaseTest):
 
         self.assertEqual(1, self.db_mock.rollback.call_count)
         self.assertEqual(3, self.db_mock.commit.call_count)
-        self.assertEqual(7, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call(select_elements_to_drop_sql),
@@ -401,9 +402,9 @@ class OracleTest(BaseTest):
         oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
         oracle.change("create table spam();", "20090212112104", "20090212112104_test_it_should_execute_migration_down_and_update_schema_version.migration", "create table spam();", "drop table spam;")
 
-        self.assertEqual(6, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(4, self.db_mock.commit.call_count)
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select version from db_version'),
@@ -420,9 +421,9 @@ class OracleTest(BaseTest):
         oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
         oracle.change("drop table spam;", "20090212112104", "20090212112104_test_it_should_execute_migration_down_and_update_schema_version.migration", "create table spam();", "drop table spam;", False)
 
-        self.assertEqual(6, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(4, self.db_mock.commit.call_count)
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select version from db_version'),
@@ -439,9 +440,9 @@ class OracleTest(BaseTest):
         oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
         oracle.change("create table spam();", "20090212112104", "20090212112104_test_it_should_execute_migration_down_and_update_schema_version.migration", "create table spam();", "drop table spam;", label_version="label")
 
-        self.assertEqual(6, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(4, self.db_mock.commit.call_count)
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select version from db_version'),
@@ -484,9 +485,9 @@ class OracleTest(BaseTest):
             self.assertTrue(isinstance(e, simple_db_migrate.core.exceptions.MigrationException))
 
         self.assertEqual(1, self.db_mock.rollback.call_count)
-        self.assertEqual(5, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select version from db_version'),
@@ -509,10 +510,10 @@ class OracleTest(BaseTest):
             self.assertEqual('error logging migration: invalid sql\n\n[ERROR DETAILS] SQL command was:\n20090212112104_test_it_should_execute_migration_down_and_update_schema_version.migration', str(e))
             self.assertTrue(isinstance(e, simple_db_migrate.core.exceptions.MigrationException))
 
-        self.assertEqual(6, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(1, self.db_mock.rollback.call_count)
         self.assertEqual(3, self.db_mock.commit.call_count)
-        self.assertEqual(6, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select version from db_version'),
@@ -536,6 +537,26 @@ class OracleTest(BaseTest):
         self.assertEqual(expected_execution_log_calls, execution_log_mock.mock_calls)
 
 
+    def test_it_should_get_the_advisory_lock_of_the_database(self):
+        self.cursor_mock.var.return_value.getvalue.return_value = 0
+        oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
+        oracle.lock(30)
+        oracle.unlock()
+
+        lock_call, unlock_call = self.cursor_mock.execute.mock_calls[-2:]
+        lock_id = re.match(r"begin :result := dbms_lock.request\((\d+), dbms_lock.x_mode, 30, false\); end;", lock_call[1][0]).group(1)
+        self.assertEqual(call("begin :result := dbms_lock.release(%s); end;" % lock_id, result=self.cursor_mock.var.return_value), unlock_call)
+        self.cursor_mock.var.assert_called_with(int)
+
+    def test_it_should_raise_exception_when_the_advisory_lock_is_not_granted_in_time(self):
+        self.cursor_mock.var.return_value.getvalue.return_value = 1
+        oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
+        try:
+            oracle.lock(30)
+            self.fail("it should not get here")
+        except Exception as e:
+            self.assertTrue(re.match(r"could not get the advisory lock \d+ in 30 seconds \(dbms_lock.request returned 1\)", str(e)))
+
     def test_it_should_get_current_schema_version(self):
         self.fetchone_returns = {'select count(*) from db_version': [0], 'select version from db_version order by id desc': ["0"]}
 
@@ -543,9 +564,9 @@ class OracleTest(BaseTest):
         self.assertEqual("0", oracle.get_current_schema_version())
 
 
-        self.assertEqual(5, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select version from db_version'),
@@ -572,9 +593,9 @@ class OracleTest(BaseTest):
         for version in schema_versions:
             self.assertTrue(version in expected_versions)
 
-        self.assertEqual(5, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select version from db_version'),
@@ -604,9 +625,9 @@ class OracleTest(BaseTest):
             self.assertEqual(migration.sql_up, expected_versions[index][4] and expected_versions[index][4].read() or "")
             self.assertEqual(migration.sql_down, expected_versions[index][5] and expected_versions[index][5].read() or "")
 
-        self.assertEqual(5, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select version from db_version'),
@@ -617,6 +638,35 @@ class OracleTest(BaseTest):
         self.assertEqual(expected_execute_calls, self.cursor_mock.execute.mock_calls)
         self.assertEqual(4, self.cursor_mock.close.call_count)
 
+    def test_it_should_get_all_schema_migrations_without_sql(self):
+        self.fetchone_returns["select id, version, label, name from db_version order by id"] = [[1, "0", None, None], [2, "20090211120001", "label", "20090211120001_name"]]
+
+        oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
+        schema_migrations = oracle.get_all_schema_migrations(with_sql=False)
+
+        self.assertEqual(2, len(schema_migrations))
+        self.assertEqual("20090211120001", schema_migrations[1].version)
+        self.assertEqual("label", schema_migrations[1].label)
+        self.assertEqual("20090211120001_name", schema_migrations[1].file_name)
+        self.assertEqual(None, schema_migrations[1].sql_up)
+        self.assertEqual(None, schema_migrations[1].sql_down)
+        self.cursor_mock.execute.assert_called_with('select id, version, label, name from db_version order by id')
+
+    def test_it_should_get_the_sql_of_schema_migrations_from_ids(self):
+        self.fetchone_returns["select id, sql_up, sql_down from db_version where id in (2, 3)"] = [[2, Mock(**{"read.return_value":"sql_up 2"}), Mock(**{"read.return_value":"sql_down 2"})], [3, None, None]]
+
+        oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
+        self.assertEqual({2: ("sql_up 2", "sql_down 2"), 3: ("", "")}, oracle.get_schema_migrations_sql([2, 3]))
+        self.cursor_mock.execute.assert_called_with('select id, sql_up, sql_down from db_version where id in (2, 3)')
+
+    def test_it_should_split_the_ids_of_schema_migrations_in_lists_of_one_thousand(self):
+        oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
+        execute_count = self.cursor_mock.execute.call_count
+        oracle.get_schema_migrations_sql(range(1, 2502))
+
+        self.assertEqual(execute_count + 3, self.cursor_mock.execute.call_count)
+        self.cursor_mock.execute.assert_called_with('select id, sql_up, sql_down from db_version where id in (%s)' % ", ".join([str(id) for id in range(2001, 2502)]))
+
     def test_it_should_parse_sql_statements(self):
         #TODO include other types of sql
         sql = "create table eggs; drop table spam; ; ;\
@@ -784,15 +834,53 @@ class OracleTest(BaseTest):
         self.assertEqual(expected_sql_with_html, statements[1])
         self.assertEqual('drop table spam', statements[2])
 
+    def test_it_should_parse_sql_statements_with_packages_and_anonymous_blocks(self):
+        sql = "drop table eggs;\n\
+        -- the package\n\
+        CREATE OR REPLACE PACKAGE BODY spam AS\n\
+          procedure eggs is begin null; end;\n\
+        END spam;\n\
+        /\n\
+        declare\n\
+          v number;\n\
+        begin\n\
+          select 1 into v from dual;\n\
+        end;\n\
+        /\n\
+        drop table spam;"
+
+        statements = Oracle._parse_sql_statements(sql)
+
+        self.assertEqual(4, len(statements))
+        self.assertEqual('drop table eggs', statements[0])
+        self.assertEqual("-- the package\n\
+        CREATE OR REPLACE PACKAGE BODY spam AS\n\
+          procedure eggs is begin null; end;\n\
+        END spam;", statements[1])
+        self.assertEqual("declare\n\
+          v number;\n\
+        begin\n\
+          select 1 into v from dual;\n\
+        end;", statements[2])
+        self.assertEqual('drop table spam', statements[3])
+
+    def test_it_should_parse_sql_statements_with_many_blocks(self):
+        sql = "".join(["create or replace procedure proc_%d as\nbegin\n  null;\nend;\n/\n" % i for i in range(3000)])
+
+        statements = Oracle._parse_sql_statements(sql)
+
+        self.assertEqual(3000, len(statements))
+        self.assertEqual("create or replace procedure proc_2999 as\nbegin\n  null;\nend;", statements[-1])
+
     def test_it_should_get_none_for_a_non_existent_version_in_database(self):
         oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
         ret = oracle.get_version_id_from_version_number('xxx')
 
         self.assertEqual(None, ret)
 
-        self.assertEqual(5, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select version from db_version'),
@@ -812,9 +900,9 @@ class OracleTest(BaseTest):
 
         self.assertEqual("vesion", ret)
 
-        self.assertEqual(5, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select version from db_version'),
@@ -832,9 +920,9 @@ class OracleTest(BaseTest):
 
         self.assertEqual(None, ret)
 
-        self.assertEqual(5, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
         self.assertEqual(2, self.db_mock.commit.call_count)
-        self.assertEqual(5, self.db_mock.close.call_count)
+        self.assertEqual(0, self.db_mock.close.call_count)
 
         expected_execute_calls = [
             call('select version from db_version'),
@@ -846,6 +934,84 @@ class OracleTest(BaseTest):
         self.assertEqual(expected_execute_calls, self.cursor_mock.execute.mock_calls)
         self.assertEqual(4, self.cursor_mock.close.call_count)
 
+    def test_it_should_commit_migration_and_schema_version_once_when_using_single_transaction(self):
+        self.config_dict["single_transaction"] = True
+        oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
+        self.db_mock.commit.reset_mock()
+
+        oracle.change("create table spam();", "20090212112104", "20090212112104_test_it_should_commit_once.migration", "create table spam();", "drop table spam;")
+
+        self.assertEqual(1, self.db_mock.commit.call_count)
+        self.assertEqual(call('create table spam()'), self.cursor_mock.execute.mock_calls[-2])
+
+    def test_it_should_rollback_migration_when_an_error_occur_during_log_schema_version_using_single_transaction(self):
+        self.config_dict["single_transaction"] = True
+        self.execute_returns['insert into db_version (id, version, label, name, sql_up, sql_down) values (db_version_seq.nextval, :version, :label, :migration_file_name, :sql_up, :sql_down)'] = Exception("invalid sql")
+        oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
+        self.db_mock.commit.reset_mock()
+
+        self.assertRaisesWithMessage(Exception, "error logging migration: invalid sql\n\n[ERROR DETAILS] SQL command was:\n20090212112104_test_it_should_rollback.migration", oracle.change,
+                                     "create table spam();", "20090212112104", "20090212112104_test_it_should_rollback.migration", "create table spam();", "drop table spam;")
+
+        self.assertEqual(0, self.db_mock.commit.call_count)
+        self.assertEqual(1, self.db_mock.rollback.call_count)
+
+    def test_it_should_reuse_the_same_connection_during_the_whole_execution(self):
+        self.fetchone_returns["select version from db_version order by id desc"] = ["0"]
+
+        oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
+        oracle.change("create table spam();", "20090212112104", "20090212112104_test_it_should_reuse_the_same_connection.migration", "create table spam();", "drop table spam;")
+        oracle.get_current_schema_version()
+
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, oracle.connection_count)
+        self.assertEqual(10, oracle.round_trip_count)
+
+    def test_it_should_close_the_connection(self):
+        oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
+        oracle.close()
+        oracle.close()
+
+        self.assertEqual(1, self.db_mock.close.call_count)
+
+    def test_it_should_reconnect_when_connection_is_lost_during_a_query(self):
+        oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
+        self.execute_returns["select version from db_version order by id desc"] = Exception("ORA-03113: end-of-file on communication channel")
+        self.fetchone_returns["select version from db_version order by id desc"] = ["0"]
+
+        self.assertEqual("0", oracle.get_current_schema_version())
+        self.assertEqual(2, self.db_driver_mock.connect.call_count)
+        self.assertEqual(1, self.db_mock.close.call_count)
+        self.assertEqual(2, oracle.connection_count)
+
+    def test_it_should_not_execute_again_a_change_when_connection_is_lost(self):
+        oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
+        self.execute_returns["create table spam()"] = Exception("ORA-03113: end-of-file on communication channel")
+
+        self.assertRaisesWithMessage(Exception, "error executing migration: ORA-03113: end-of-file on communication channel\n\n[ERROR DETAILS] SQL command was:\ncreate table spam()", oracle.change,
+                                     "create table spam();", "20090212112104", "20090212112104_test_it_should_not_execute_again.migration", "create table spam();", "drop table spam;")
+
+        self.assertEqual(1, self.cursor_mock.execute.mock_calls.count(call('create table spam()')))
+        self.assertEqual(0, self.db_mock.rollback.call_count)
+        self.assertEqual(1, self.db_mock.close.call_count)
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+
+    def test_it_should_not_reconnect_when_connection_holding_the_advisory_lock_is_lost(self):
+        self.cursor_mock.var.return_value.getvalue.return_value = 0
+        oracle = Oracle(self.config_mock, self.db_driver_mock, self.getpass_mock, self.stdin_mock)
+        oracle.lock(30)
+        self.execute_returns["select version from db_version order by id desc"] = Exception("ORA-03113: end-of-file on communication channel")
+
+        try:
+            oracle.get_current_schema_version()
+            self.fail("it should not get here")
+        except simple_db_migrate.core.exceptions.MigrationException as e:
+            self.assertTrue(re.match(r"the connection was lost while holding the advisory lock \d+, which was released with it$", str(e)))
+
+        oracle.unlock()
+        self.assertEqual(1, self.db_driver_mock.connect.call_count)
+        self.assertFalse([c for c in self.cursor_mock.execute.mock_calls if "dbms_lock.release" in c[1][0]])
+
     def side_effect(self, returns, default_value):
         commands = len(self.last_execute_commands)
         if commands > 0:
@@ -873,7 +1039,7 @@ class OracleTest(BaseTest):
 
         return value
 
-    def execute_side_effect(self, *args):
+    def execute_side_effect(self, *args, **kwargs):
         self.last_execute_commands.append(args[0])
         return self.side_effect(self.execute_returns, 0)
 
@@ -0,0 +1,87 @@
+import pstats
+import unittest
+from simple_db_migrate.config import Config
+from simple_db_migrate.helpers import Lists
+from simple_db_migrate.main import Main
+from simple_db_migrate.profiler import Profiler, tracemalloc
+from simple_db_migrate.sqlite import SQLite
+from tests import BaseTest, create_migration_file, delete_files
+
+class ProfilerTest(BaseTest):
+
+    def setUp(self):
+        super(ProfilerTest, self).setUp()
+        self.config = Config({
+            'database_name': 'profiler_test.db',
+            'database_migrations_dir': ['.'],
+            'database_engine': 'sqlite',
+            'database_version_table': '__db_version__',
+            'schema_version': None,
+            'drop_db_first': False,
+            'log_level': 0
+        })
+        create_migration_file('20090214115100_01_test_migration.migration', 'create table spam (id int);', 'drop table spam;')
+        create_migration_file('20090214115200_02_test_migration.migration', 'insert into spam values (1); insert into spam values (2);', 'delete from spam;')
+
+    def tearDown(self):
+        super(ProfilerTest, self).tearDown()
+        delete_files('profiler_test.db*')
+        delete_files('profiler_test.pstats')
+
+    def profile(self):
+        profiler = Profiler('profiler_test.pstats')
+        profiler.start()
+        try:
+            Main(self.config).execute()
+        finally:
+            profiler.stop()
+        return profiler
+
+    def test_it_should_write_the_time_of_every_function_to_a_pstats_file(self):
+        self.profile()
+        functions = [function[2] for function in pstats.Stats('profiler_test.pstats').stats]
+        self.assertTrue('execute' in functions)
+        self.assertTrue('get_all_migrations' in functions)
+
+    def test_it_should_break_down_the_loading_parsing_driver_calls_and_comparisons(self):
+        breakdown = dict([(label, (calls, cumulative, memory)) for label, calls, cumulative, memory in self.profile().breakdown()])
+        self.assertEqual(['SimpleDBMigrate.get_all_migrations', '_parse_sql_statements', 'driver calls', 'Lists.subtract'], [label for label, functions in Profiler.BREAKDOWN])
+        self.assertTrue(breakdown['SimpleDBMigrate.get_all_migrations'][0] >= 1)
+        # one for each migration executed
+        self.assertEqual(2, breakdown['_parse_sql_statements'][0])
+        # only the methods of the connections and cursors of sqlite3 which go to the database: the statements of
+        # the version table and of the migrations, the transactions and the fetches of the version table queries
+        self.assertEqual(16, breakdown['driver calls'][0])
+        self.assertTrue(breakdown['Lists.subtract'][0] >= 1)
+        self.assertEqual(None, breakdown['driver calls'][2])
+        if tracemalloc is not None:
+            self.assertTrue(breakdown['SimpleDBMigrate.get_all_migrations'][2] > 0)
+
+    def test_it_should_profile_the_functions_called_in_the_threads_of_the_jobs(self):
+        self.config.update('jobs', 2)
+        breakdown = dict([(label, (calls, cumulative, memory)) for label, calls, cumulative, memory in self.profile().breakdown()])
+        functions = pstats.Stats('profiler_test.pstats').stats
+        # the migration files are loaded in the threads of the pool
+        self.assertEqual([2], [stats[1] for function, stats in functions.items() if function[2] == '_load_migration_file'])
+        self.assertEqual(2, breakdown['_parse_sql_statements'][0])
+
+    def test_it_should_restore_the_functions_measured(self):
+        parse_sql_statements = SQLite.__dict__['_parse_sql_statements']
+        subtract = Lists.__dict__['subtract']
+        self.profile()
+        self.assertTrue(SQLite.__dict__['_parse_sql_statements'] is parse_sql_statements)
+        self.assertTrue(Lists.__dict__['subtract'] is subtract)
+
+    def test_it_should_summarize_the_peak_memory_and_the_breakdown(self):
+        summary = self.profile().summary()
+        self.assertEqual("time profile written to 'profiler_test.pstats' (python -m pstats profiler_test.pstats)", summary[0])
+        self.assertTrue(summary[1].startswith('total '))
+        self.assertEqual(['SimpleDBMigrate.get_all_migrations', '_parse_sql_statements', 'driver calls', 'Lists.subtract'], [line[:36].strip() for line in summary[3:]])
+
+    def test_it_should_raise_exception_when_the_pstats_file_can_not_be_written(self):
+        profiler = Profiler('invalid_path_it_does_not_exist/profiler_test.pstats')
+        profiler.start()
+        self.assertRaisesWithMessage(Exception, "could not write the profile ('invalid_path_it_does_not_exist/profiler_test.pstats'): [Errno 2] No such file or directory: 'invalid_path_it_does_not_exist/profiler_test.pstats'", profiler.stop)
+
+if __name__ == "__main__":
+    unittest.main()
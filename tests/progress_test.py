@@ -0,0 +1,84 @@
+import json
+import unittest
+from simple_db_migrate.core import Migration
+from simple_db_migrate.progress import MigrationDurations, Progress, format_duration
+from simple_db_migrate.sql import SQLFile
+from tests import BaseTest, create_file, delete_files
+
+class ProgressTest(BaseTest):
+
+    def tearDown(self):
+        super(ProgressTest, self).tearDown()
+        delete_files('test_durations.json')
+        delete_files('test_progress.sql')
+
+    def write_json(self, content):
+        with open('test_durations.json', 'w') as f:
+            json.dump(content, f)
+
+    def migrations(self, *sqls):
+        return [Migration(file_name='2009021411%04d_test.migration' % index, version='2009021411%04d' % index, sql_up=sql, sql_down=sql) for index, sql in enumerate(sqls)]
+
+    def test_it_should_format_durations(self):
+        self.assertEqual('0s', format_duration(0.4))
+        self.assertEqual('59s', format_duration(59))
+        self.assertEqual('1m05s', format_duration(65))
+        self.assertEqual('2h01m40s', format_duration(7300))
+
+    def test_it_should_read_the_durations_of_a_run_report(self):
+        self.write_json({'migrations': [{'file_name': '01.migration', 'direction': 'up', 'elapsed': 2}, {'file_name': '01.migration', 'direction': 'down', 'elapsed': 1}]})
+        durations = MigrationDurations()
+        durations.read_report_file('test_durations.json')
+        self.assertEqual(2, durations.get('01.migration'))
+        self.assertEqual(1, durations.get('01.migration', up=False))
+        self.assertEqual(None, durations.get('02.migration'))
+
+    def test_it_should_use_the_average_of_the_durations_of_many_databases(self):
+        self.write_json({'targets': [{'name': 'shard01', 'report': {'migrations': [{'file_name': '01.migration', 'direction': 'up', 'elapsed': 2}]}},
+                                     {'name': 'shard02', 'report': {'migrations': [{'file_name': '01.migration', 'direction': 'up', 'elapsed': 3}]}},
+                                     {'name': 'shard03', 'report': None}]})
+        durations = MigrationDurations()
+        durations.read_report_file('test_durations.json')
+        self.assertEqual(2.5, durations.get('01.migration'))
+
+    def test_it_should_raise_exception_when_the_durations_file_can_not_be_read(self):
+        create_file('test_durations.json', 'not json')
+        try:
+            MigrationDurations().read_report_file('test_durations.json')
+            self.fail("it should not get here")
+        except Exception as e:
+            self.assertTrue(str(e).startswith("could not read the durations file ('test_durations.json'): "), str(e))
+
+    def test_it_should_estimate_the_migrations_without_durations_from_their_number_of_statements(self):
+        progress = Progress(self.migrations('create table spam (id int);', 'insert into spam values (1); insert into spam values (2);'), True, MigrationDurations())
+        self.assertEqual(0, progress.from_history)
+        self.assertAlmostEqual(3 * Progress.STATEMENT_TIME, progress.remaining())
+
+        # the statements here take 2 seconds each
+        progress.finished(2)
+        self.assertAlmostEqual(4, progress.remaining())
+        self.assertEqual('- Progress: 1/2 migration(s) (33%), 2s elapsed, about 4s remaining', progress.line())
+
+    def test_it_should_correct_the_durations_of_previous_executions_by_the_time_of_the_migrations_finished(self):
+        durations = MigrationDurations()
+        durations.add('20090214110000_test.migration', True, 10)
+        durations.add('20090214110001_test.migration', True, 30)
+        progress = Progress(self.migrations('update spam set id = 1;', 'update spam set id = 2;'), True, durations)
+        self.assertEqual('- Estimated time: about 40s for 2 migration(s), 2 of them timed on previous executions', progress.estimate_line())
+
+        progress.finished(20)
+        self.assertAlmostEqual(60, progress.remaining())
+
+    def test_it_should_count_the_statements_without_the_semicolons_in_quotes_comments_and_parenthesis(self):
+        self.assertEqual(2, Progress.count_statements("insert into spam values ('a;b'); /* c; d */ insert into spam values (\"e;\");"))
+        self.assertEqual(1, Progress.count_statements("insert into spam (select id from eggs where name = 'x;y') -- z;"))
+        self.assertEqual(1, Progress.count_statements("insert into spam values ('unbalanced;"))
+        self.assertEqual(1, Progress.count_statements(None))
+
+    def test_it_should_estimate_the_statements_of_sql_files_from_their_size(self):
+        create_file('test_progress.sql', 'x' * (Progress.BYTES_PER_STATEMENT * 5))
+        self.assertEqual(5, Progress.count_statements(SQLFile('test_progress.sql')))
+        self.assertEqual(1, Progress.count_statements(SQLFile('test_progress_does_not_exist.sql')))
+
+if __name__ == "__main__":
+    unittest.main()
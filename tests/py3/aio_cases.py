@@ -0,0 +1,234 @@
+import asyncio
+import re
+import time
+import unittest
+from mock import patch
+from simple_db_migrate.py3.aio import AsyncFleet, AsyncMain, AsyncMySQL
+from simple_db_migrate.config import Config
+from simple_db_migrate.fleet import TargetResult
+from tests import BaseTest, create_migration_file
+
+class FakeAsyncMySQLDriver(object):
+    """
+    In process driver with the interface of aiomysql, keeping the version table of each database in memory
+    and sleeping on each round trip to simulate the network latency.
+    """
+
+    def __init__(self, latency=0.01):
+        self.latency = latency
+        self.databases = {}
+        self.executed = {}
+        self.failures = {}
+        self.connections = 0
+        self.max_connections = 0
+
+    async def connect(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.connections += 1
+        self.max_connections = max(self.max_connections, self.connections)
+        return FakeConnection(self)
+
+class FakeConnection(object):
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.database = None
+
+    async def select_db(self, database):
+        await asyncio.sleep(self.driver.latency)
+        self.database = database
+
+    async def cursor(self):
+        return FakeCursor(self)
+
+    async def commit(self):
+        await asyncio.sleep(self.driver.latency)
+
+    async def rollback(self):
+        await asyncio.sleep(self.driver.latency)
+
+    def close(self):
+        self.driver.connections -= 1
+
+class FakeCursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    async def execute(self, sql, args=None):
+        driver = self.connection.driver
+        await asyncio.sleep(driver.latency)
+        database = self.connection.database
+        versions = driver.databases.get(database)
+
+        create_database = re.match(r"create database if not exists `(.*)`;", sql)
+        if create_database:
+            driver.databases.setdefault(create_database.group(1), None)
+        elif sql.startswith("create table if not exists"):
+            if versions is None:
+                driver.databases[database] = []
+        elif sql.startswith("select count(*)"):
+            self.rows = [(len(versions),)]
+        elif sql.startswith("insert into __db_version__ (version) values"):
+            versions.append({'id': len(versions) + 1, 'version': '0', 'label': None, 'name': None, 'sql_up': None, 'sql_down': None})
+        elif sql.startswith("insert into __db_version__ (version, label, name, sql_up, sql_down)"):
+            versions.append(dict(zip(('version', 'label', 'name', 'sql_up', 'sql_down'), args), id=versions[-1]['id'] + 1))
+        elif sql.startswith("delete from __db_version__ where version = "):
+            versions[:] = [version for version in versions if version['version'] != args[0]]
+        elif sql.startswith("select id, version, label, name"):
+            columns = ('id', 'version', 'label', 'name', 'sql_up', 'sql_down')[:"sql_up" in sql and 6 or 4]
+            self.rows = [tuple([version[column] for column in columns]) for version in versions]
+        elif sql.startswith("select id, sql_up, sql_down"):
+            ids = [int(id) for id in re.search(r"in \((.*)\)", sql).group(1).split(", ")]
+            self.rows = [(version['id'], version['sql_up'], version['sql_down']) for version in versions if version['id'] in ids]
+        else:
+            if sql in driver.failures.get(database, ()):
+                raise Exception("failed on %s" % database)
+            driver.executed.setdefault(database, []).append(sql)
+        return 0
+
+    async def fetchone(self):
+        return self.rows and self.rows[0] or None
+
+    async def fetchall(self):
+        return self.rows
+
+    async def close(self):
+        pass
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+class AsyncTest(BaseTest):
+
+    def setUp(self):
+        super(AsyncTest, self).setUp()
+        self.driver = FakeAsyncMySQLDriver()
+        self.initial_config = {
+            'database_host': 'localhost',
+            'database_user': 'root',
+            'database_password': '',
+            'database_name': 'test',
+            'database_migrations_dir': ['.'],
+            'database_engine': 'mysql',
+            'database_version_table': '__db_version__',
+            'schema_version': None,
+            'drop_db_first': False,
+            'log_level': 0
+        }
+        create_migration_file('20090214115100_01_test_migration.migration', 'create table spam (id int);', 'drop table spam;')
+        create_migration_file('20090214115200_02_test_migration.migration', 'insert into spam values (1);', 'delete from spam;')
+
+    def sgdb_factory(self, name, config):
+        return AsyncMySQL(config, self.driver)
+
+    def targets(self, count):
+        return [{'name': 'tenant%03d' % index, 'database_name': 'tenant%03d' % index} for index in range(count)]
+
+    def test_it_should_migrate_up_with_async_main(self):
+        config = Config(self.initial_config)
+        run(AsyncMain(config, AsyncMySQL(config, self.driver)).execute())
+
+        self.assertEqual(['create table spam (id int)', 'insert into spam values (1)'], self.driver.executed['test'])
+        self.assertEqual(['0', '20090214115100', '20090214115200'], [version['version'] for version in self.driver.databases['test']])
+        self.assertEqual('create table spam (id int);', self.driver.databases['test'][1]['sql_up'])
+
+    def test_it_should_migrate_down_reading_the_sql_from_the_version_table(self):
+        config = Config(self.initial_config)
+        run(AsyncMain(config, AsyncMySQL(config, self.driver)).execute())
+        self.driver.databases['test'][2]['sql_down'] = 'delete from spam where id = 1;'
+
+        config = Config(dict(self.initial_config, schema_version='20090214115100'))
+        run(AsyncMain(config, AsyncMySQL(config, self.driver)).execute())
+
+        self.assertEqual('delete from spam where id = 1', self.driver.executed['test'][-1])
+        self.assertEqual(['0', '20090214115100'], [version['version'] for version in self.driver.databases['test']])
+
+    def test_it_should_create_its_own_engine_and_close_it(self):
+        with patch('simple_db_migrate.py3.aio.AsyncMySQL', side_effect=lambda config: AsyncMySQL(config, self.driver)):
+            run(AsyncMain(Config(self.initial_config)).execute())
+        self.assertEqual(0, self.driver.connections)
+
+    def test_it_should_raise_exception_for_engines_without_async_support(self):
+        self.assertRaisesWithMessage(Exception, "engine not supported by AsyncMain 'oracle'", AsyncMain, Config(dict(self.initial_config, database_engine='oracle')))
+
+    def test_it_should_raise_exception_for_the_options_not_supported_on_the_event_loop(self):
+        for option in ['advisory_lock', 'fast_check', 'progress', 'report_file', 'trace_file', 'version_table_metadata']:
+            self.assertRaisesWithMessage(Exception, "%s can not be used with AsyncMain" % option, AsyncMain, Config(dict(self.initial_config, **{option: True})), AsyncMySQL(Config(self.initial_config), self.driver))
+            self.assertRaisesWithMessage(Exception, "%s can not be used with AsyncFleet" % option, AsyncFleet, Config(dict(self.initial_config, database_targets=self.targets(2), **{option: True})), self.sgdb_factory)
+
+    def test_it_should_be_imported_from_simple_db_migrate_aio(self):
+        from simple_db_migrate import aio
+        self.assertTrue(aio.AsyncMain is AsyncMain)
+        self.assertTrue(aio.AsyncFleet is AsyncFleet)
+
+    def test_it_should_read_no_sql_when_the_query_returns_no_rows(self):
+        config = Config(self.initial_config)
+        sgdb = AsyncMySQL(config, self.driver)
+        async def read_sql():
+            await sgdb.open()
+            try:
+                return await sgdb.get_schema_migrations_sql([10])
+            finally:
+                await sgdb.close()
+        self.assertEqual({}, run(read_sql()))
+
+    def test_it_should_read_the_labels(self):
+        config = Config(dict(self.initial_config, label_version='first'))
+        run(AsyncMain(config, AsyncMySQL(config, self.driver)).execute())
+
+        config = Config(self.initial_config)
+        self.assertEqual(['first'], run(AsyncMain(config, AsyncMySQL(config, self.driver)).labels()))
+        self.assertEqual('first', run(AsyncMain(config, AsyncMySQL(config, self.driver)).last_label()))
+
+    def test_it_should_multiplex_many_databases_on_one_event_loop(self):
+        self.driver.latency = 0.02
+        config = Config(dict(self.initial_config, database_targets=self.targets(1)))
+        start = time.time()
+        run(AsyncFleet(config, self.sgdb_factory).execute())
+        one_database = time.time() - start
+
+        self.driver = FakeAsyncMySQLDriver(latency=0.02)
+        fleet = AsyncFleet(Config(dict(self.initial_config, database_targets=self.targets(40), targets_concurrency=40)), self.sgdb_factory)
+        start = time.time()
+        run(fleet.execute())
+        all_databases = time.time() - start
+
+        self.assertEqual([TargetResult.OK] * 40, [result.status for result in fleet.results])
+        self.assertEqual(['create table spam (id int)', 'insert into spam values (1)'], self.driver.executed['tenant039'])
+        # serially it would take 40 times longer
+        self.assertTrue(all_databases < one_database * 10, "%.2fs for 40 databases, %.2fs for one" % (all_databases, one_database))
+
+    def test_it_should_have_at_most_targets_concurrency_connections(self):
+        fleet = AsyncFleet(Config(dict(self.initial_config, database_targets=self.targets(20), targets_concurrency=5)), self.sgdb_factory)
+        run(fleet.execute())
+        self.assertEqual(5, self.driver.max_connections)
+        self.assertEqual(0, self.driver.connections)
+
+    def test_it_should_skip_the_databases_not_started_when_one_fails(self):
+        self.driver.failures['tenant001'] = ['insert into spam values (1)']
+        fleet = AsyncFleet(Config(dict(self.initial_config, database_targets=self.targets(4), targets_concurrency=1)), self.sgdb_factory)
+        self.assertRaisesWithMessage(Exception, "migration failed on 1 of 4 databases (tenant001)", run, fleet.execute())
+
+        self.assertEqual([TargetResult.OK, TargetResult.FAILED, TargetResult.SKIPPED, TargetResult.SKIPPED], [result.status for result in fleet.results])
+        self.assertEqual("error executing migration: failed on tenant001\n\n[ERROR DETAILS] SQL command was:\ninsert into spam values (1)", fleet.results[1].error)
+        self.assertEqual('20090214115100', fleet.results[1].version)
+
+    def test_it_should_migrate_the_other_databases_when_continue_on_error_is_set(self):
+        self.driver.failures['tenant001'] = ['insert into spam values (1)']
+        fleet = AsyncFleet(Config(dict(self.initial_config, database_targets=self.targets(4), targets_concurrency=1, continue_on_error=True)), self.sgdb_factory)
+        self.assertRaisesWithMessage(Exception, "migration failed on 1 of 4 databases (tenant001)", run, fleet.execute())
+        self.assertEqual([TargetResult.OK, TargetResult.FAILED, TargetResult.OK, TargetResult.OK], [result.status for result in fleet.results])
+
+    def test_it_should_read_the_labels_of_many_databases(self):
+        run(AsyncFleet(Config(dict(self.initial_config, database_targets=self.targets(2)[:1], label_version='v1')), self.sgdb_factory).execute())
+        fleet = AsyncFleet(Config(dict(self.initial_config, database_targets=self.targets(2))), self.sgdb_factory)
+        self.assertEqual([('tenant000', ['v1']), ('tenant001', [])], run(fleet.labels()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+import calendar
+import json
+import os
+import time
+import unittest
+from mock import patch
+from simple_db_migrate.report import ExecutionMetadata, RunReport, StatementTiming
+from tests import BaseTest, delete_files
+
+class RunReportTest(BaseTest):
+
+    def setUp(self):
+        super(RunReportTest, self).setUp()
+        self.now = [100.0]
+        self.clock_patch = patch.object(RunReport, 'clock', side_effect=lambda: self.now[0])
+        self.clock_patch.start()
+
+    def tearDown(self):
+        super(RunReportTest, self).tearDown()
+        self.clock_patch.stop()
+        delete_files('test_run_report.json')
+
+    def wait(self, seconds):
+        self.now[0] += seconds
+
+    def test_it_should_count_the_time_of_a_phase_inside_another_only_for_the_inner_one(self):
+        report = RunReport()
+        with report.phase("plan"):
+            self.wait(1)
+            with report.phase("connect"):
+                self.wait(2)
+            self.wait(3)
+        self.assertEqual(4, report.phases["plan"])
+        self.assertEqual(2, report.phases["connect"])
+        self.assertEqual(0, report.phases["execute"])
+
+    def test_it_should_keep_the_statements_and_phases_of_each_migration(self):
+        report = RunReport()
+        report.statement("create table __db_version__ (id int)", 0.5)
+        report.start_migration("20090214115100_01_test_migration.migration", "20090214115100")
+        with report.phase("execute"):
+            self.wait(2)
+            report.statement("insert into spam values (1)", 1.5, 1)
+            report.statement("insert into spam values (2), (3)", 0.5, 2)
+            with report.phase("record"):
+                self.wait(1)
+        report.end_migration()
+
+        migration = report.migrations[0]
+        self.assertEqual(3, migration.elapsed)
+        self.assertEqual({"execute": 2, "record": 1}, migration.phases)
+        self.assertEqual(3, migration.rows)
+        self.assertEqual(["insert into spam values (1)", "insert into spam values (2), (3)"], [statement.sql for statement in migration.statements])
+        self.assertEqual(["create table __db_version__ (id int)"], [statement.sql for statement in report.statements])
+
+    def test_it_should_keep_only_the_beginning_of_long_statements(self):
+        statement = StatementTiming("insert into spam values\n  (%s)" % ("1" * 300), 1)
+        self.assertEqual("insert into spam values (%s..." % ("1" * 175), statement.sql)
+
+    def test_it_should_cut_long_statements_before_joining_their_blanks(self):
+        statement = StatementTiming("insert into spam values %s" % ("(1),     " * 1000000), 1)
+        self.assertEqual("insert into spam values %s..." % ("(1), " * 36)[:176], statement.sql)
+
+    def test_it_should_keep_only_the_totals_and_the_slowest_statements_when_the_statements_are_not_kept(self):
+        report = RunReport(keep_statements=False, top=2)
+        report.statement("create table __db_version__ (id int)", 0.5)
+        report.start_migration("01.migration", "01")
+        for index, elapsed in enumerate([1, 5, 2, 4, 3]):
+            report.statement("update spam set id = %d" % index, elapsed, 10)
+        report.end_migration()
+
+        migration = report.migrations[0]
+        self.assertEqual([], report.statements)
+        self.assertEqual([], migration.statements)
+        self.assertEqual(5, migration.statements_count)
+        self.assertEqual(50, migration.rows)
+        self.assertEqual([("update spam set id = 1", 5), ("update spam set id = 3", 4)], [(statement.sql, statement.elapsed) for statement, _ in report.slowest_statements(10)])
+        self.assertTrue(report.summary(10)[2].endswith("01.migration (up), 5 statement(s), 50 row(s)"))
+
+    def test_it_should_keep_the_statements_only_for_the_report_file_and_the_trace(self):
+        self.assertEqual((False, 5), (RunReport.from_config({'report_top': 5}).keep_statements, RunReport.from_config({'report_top': 5}).top))
+        self.assertEqual(True, RunReport.from_config({'report_file': 'report.json'}).keep_statements)
+        self.assertEqual(True, RunReport.from_config({'trace_file': 'trace.json'}).keep_statements)
+
+    def test_it_should_summarize_the_slowest_migrations_and_statements(self):
+        report = RunReport()
+        for file_name, elapsed in (("01.migration", 1), ("02.migration", 5), ("03.migration", 3)):
+            report.start_migration(file_name, file_name[:2])
+            with report.phase("execute"):
+                self.wait(elapsed)
+                report.statement("update spam set id = %d" % elapsed, elapsed, elapsed * 10)
+            report.end_migration()
+        report.finish()
+
+        self.assertEqual(["total 9.00s: load 0.00s, plan 0.00s, lock 0.00s, connect 0.00s, execute 9.00s, record 0.00s",
+                          "slowest migrations:",
+                          "     5.000s  02.migration (up), 1 statement(s), 50 row(s)",
+                          "     3.000s  03.migration (up), 1 statement(s), 30 row(s)",
+                          "slowest statements:",
+                          "     5.000s  02.migration: update spam set id = 5",
+                          "     3.000s  03.migration: update spam set id = 3"], report.summary(2))
+
+    def test_it_should_write_the_timings_as_json(self):
+        report = RunReport()
+        report.start_migration("01.migration", "01", up=False)
+        self.wait(2)
+        report.statement("drop table spam", 2)
+        report.end_migration()
+        report.finish()
+        RunReport.write_json("test_run_report.json", report.to_dict())
+
+        with open("test_run_report.json") as f:
+            content = json.load(f)
+        self.assertEqual(2, content["elapsed"])
+        self.assertEqual([{"file_name": "01.migration", "version": "01", "direction": "down", "elapsed": 2, "phases": {}, "rows": 0, "statements": [{"sql": "drop table spam", "elapsed": 2, "rows": 0}]}], content["migrations"])
+
+    def test_it_should_raise_exception_when_the_json_can_not_be_written(self):
+        file_name = os.path.join("invalid_path_it_does_not_exist", "report.json")
+        self.assertRaisesWithMessage(Exception, "could not write the run report ('%s'): [Errno 2] No such file or directory: '%s'" % (file_name, file_name), RunReport.write_json, file_name, {})
+
+    def test_it_should_keep_the_phases_migrations_and_statements_on_the_timeline(self):
+        round_trips = [0]
+        report = RunReport(lambda: round_trips[0])
+        with report.phase("load"):
+            with report.span("discovery"):
+                self.wait(1)
+        report.start_migration("01.migration", "01")
+        with report.phase("execute"):
+            self.wait(2)
+            round_trips[0] += 1
+            report.statement("update spam set id = 1", 2, 3)
+        report.end_migration()
+
+        events = report.trace_events(2, "shard01", 100.0)
+        self.assertEqual({"name": "thread_name", "ph": "M", "pid": 1, "tid": 2, "args": {"name": "shard01"}}, events[0])
+        spans = [(event["name"], event["cat"], event["ts"], event["dur"]) for event in events if event["ph"] == "X"]
+        self.assertEqual([("discovery", "step", 0, 1000000), ("load", "phase", 0, 1000000), ("execute", "phase", 1000000, 2000000), ("01.migration", "migration", 1000000, 2000000), ("update spam set id = 1", "statement", 1000000, 2000000)], spans)
+        self.assertEqual([{"sql": "update spam set id = 1", "rows": 3}], [event["args"] for event in events if event.get("cat") == "statement"])
+        counters = [(event["name"], event["ts"], event["args"]) for event in events if event["ph"] == "C"]
+        self.assertEqual([("round trips (shard01)", 1000000, {"round trips": 0}), ("round trips (shard01)", 1000000, {"round trips": 0}), ("round trips (shard01)", 3000000, {"round trips": 1}), ("round trips (shard01)", 3000000, {"round trips": 1})], counters)
+
+    def test_it_should_write_a_trace_with_a_track_for_each_report(self):
+        first = RunReport()
+        self.wait(1)
+        second = RunReport()
+        second.add_span("config", 99.5, 100.5)
+        RunReport.write_trace("test_run_report.json", [("first", first), ("second", second)])
+
+        with open("test_run_report.json") as f:
+            content = json.load(f)
+        self.assertEqual({"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "simple-db-migrate"}}, content["traceEvents"][0])
+        self.assertEqual([(1, "first"), (2, "second")], [(event["tid"], event["args"]["name"]) for event in content["traceEvents"] if event["name"] == "thread_name"])
+        # the times are since the first span of all tracks
+        self.assertEqual([("config", 0, 1000000)], [(event["name"], event["ts"], event["dur"]) for event in content["traceEvents"] if event["ph"] == "X"])
+
+    def test_it_should_raise_exception_when_the_trace_can_not_be_written(self):
+        file_name = os.path.join("invalid_path_it_does_not_exist", "trace.json")
+        self.assertRaisesWithMessage(Exception, "could not write the trace ('%s'): [Errno 2] No such file or directory: '%s'" % (file_name, file_name), RunReport.write_trace, file_name, [("first", RunReport())])
+
+    def test_it_should_start_the_metadata_at_the_current_time_in_utc_without_time_zone(self):
+        started_at = ExecutionMetadata().started_at
+        self.assertEqual(None, started_at.tzinfo)
+        self.assertEqual(0, started_at.microsecond)
+        self.assertTrue(abs(calendar.timegm(started_at.timetuple()) - time.time()) < 5, started_at)
+
+    def test_it_should_sample_the_round_trips_only_for_the_trace(self):
+        round_trips = lambda: 1
+        report = RunReport.from_config({'report_file': 'report.json'}, round_trips)
+        report.statement("update spam set id = 1", 1)
+        with report.span("discovery"):
+            self.wait(1)
+        self.assertEqual(None, report.round_trips)
+        self.assertEqual([], report.round_trip_samples)
+
+        report = RunReport.from_config({'trace_file': 'trace.json'}, round_trips)
+        report.statement("update spam set id = 1", 1)
+        self.assertEqual([(101.0, 1)], report.round_trip_samples)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -139,6 +139,26 @@ DATABASE_OTHER_CUSTOM_VARIABLE = 'Value'
         self.assertEqual(False, config_used.get('force_use_files_on_down'))
         self.assertEqual(False, config_used.get('force_execute_old_migrations_versions'))
         self.assertEqual(1, config_used.get('log_level'))
+        self.assertEqual(None, config_used.get('jobs'))
+        self.assertEqual(None, config_used.get('jobs_mode'))
+        self.assertEqual(False, config_used.get('lazy_load'))
+        self.assertEqual(False, config_used.get('no_cache'))
+        self.assertEqual(False, config_used.get('clear_cache'))
+        self.assertEqual(False, config_used.get('single_transaction'))
+        self.assertEqual(None, config_used.get('insert_batch_size'))
+        self.assertEqual(False, config_used.get('merge_alter_table'))
+        self.assertEqual(None, config_used.get('targets_concurrency'))
+        self.assertEqual(False, config_used.get('continue_on_error'))
+        self.assertEqual(False, config_used.get('fast_check'))
+        self.assertEqual(False, config_used.get('advisory_lock'))
+        self.assertEqual(None, config_used.get('advisory_lock_timeout'))
+        self.assertEqual(None, config_used.get('report_top'))
+        self.assertEqual(None, config_used.get('report_file'))
+        self.assertEqual(False, config_used.get('version_table_metadata'))
+        self.assertEqual(False, config_used.get('progress'))
+        self.assertEqual(None, config_used.get('durations_file'))
+        self.assertEqual(None, config_used.get('profile'))
+        self.assertEqual(None, config_used.get('trace_file'))
 
     @patch.object(simple_db_migrate.main.Main, 'execute')
     @patch.object(simple_db_migrate.main.Main, '__init__', return_value=None)
@@ -171,6 +191,52 @@ DATABASE_OTHER_CUSTOM_VARIABLE = 'Value'
         self.assertEqual(False, config_used.get('force_use_files_on_down'))
         self.assertEqual(False, config_used.get('force_execute_old_migrations_versions'))
         self.assertEqual(1, config_used.get('log_level'))
+        self.assertEqual(None, config_used.get('jobs'))
+        self.assertEqual(None, config_used.get('jobs_mode'))
+        self.assertEqual(False, config_used.get('lazy_load'))
+        self.assertEqual(False, config_used.get('no_cache'))
+        self.assertEqual(False, config_used.get('clear_cache'))
+        self.assertEqual(False, config_used.get('single_transaction'))
+        self.assertEqual(None, config_used.get('insert_batch_size'))
+        self.assertEqual(False, config_used.get('merge_alter_table'))
+        self.assertEqual(None, config_used.get('targets_concurrency'))
+        self.assertEqual(False, config_used.get('continue_on_error'))
+        self.assertEqual(False, config_used.get('fast_check'))
+        self.assertEqual(False, config_used.get('advisory_lock'))
+        self.assertEqual(None, config_used.get('advisory_lock_timeout'))
+        self.assertEqual(None, config_used.get('report_top'))
+        self.assertEqual(None, config_used.get('report_file'))
+        self.assertEqual(False, config_used.get('version_table_metadata'))
+        self.assertEqual(False, config_used.get('progress'))
+        self.assertEqual(None, config_used.get('durations_file'))
+        self.assertEqual(None, config_used.get('profile'))
+        self.assertEqual(None, config_used.get('trace_file'))
+
+    @patch.object(simple_db_migrate.fleet.Fleet, 'execute')
+    @patch.object(simple_db_migrate.fleet.Fleet, '__init__', return_value=None)
+    @patch.object(simple_db_migrate.main.Main, '__init__', return_value=None)
+    @patch.object(simple_db_migrate.helpers.Utils, 'get_variables_from_file', return_value = {'DATABASE_HOST':'host', 'DATABASE_USER': 'root', 'DATABASE_PASSWORD':'', 'DATABASE_MIGRATIONS_DIR':'.', 'DATABASE_TARGETS':[{'DATABASE_NAME':'shard01'}, {'DATABASE_NAME':'shard02'}]})
+    def test_it_should_use_fleet_when_there_are_database_targets(self, import_file_mock, main_mock, fleet_mock, execute_mock):
+        simple_db_migrate.run_from_argv(["-c", os.path.abspath('sample.conf'), '--targets-concurrency', '8', '--continue-on-error'])
+        self.assertEqual(0, main_mock.call_count)
+        self.assertEqual(1, execute_mock.call_count)
+        config_used = fleet_mock.call_args[0][0]
+        self.assertEqual([{'DATABASE_NAME':'shard01'}, {'DATABASE_NAME':'shard02'}], config_used.get('database_targets'))
+        self.assertEqual(8, config_used.get('targets_concurrency'))
+        self.assertEqual(True, config_used.get('continue_on_error'))
+
+    @patch.object(simple_db_migrate.main.Main, 'execute')
+    @patch.object(simple_db_migrate.main.Main, '__init__', return_value=None)
+    @patch.object(simple_db_migrate.helpers.Utils, 'get_variables_from_file', return_value = {'DATABASE_HOST':'host', 'DATABASE_USER': 'root', 'DATABASE_PASSWORD':'', 'DATABASE_NAME':'database', 'DATABASE_MIGRATIONS_DIR':'.'})
+    def test_it_should_profile_the_execution_when_asked(self, import_file_mock, main_mock, execute_mock):
+        try:
+            simple_db_migrate.run_from_argv(["-c", os.path.abspath('sample.conf'), '--profile', 'run_test.pstats'])
+            self.assertEqual(1, execute_mock.call_count)
+            self.assertTrue(os.path.exists('run_test.pstats'))
+            self.assertTrue("\n__________ Profile __________\ntime profile written to 'run_test.pstats'" in sys.stdout.getvalue(), sys.stdout.getvalue())
+        finally:
+            if os.path.exists('run_test.pstats'):
+                os.remove('run_test.pstats')
 
     @patch.object(simple_db_migrate.main.Main, 'execute')
     @patch.object(simple_db_migrate.main.Main, '__init__', return_value=None)
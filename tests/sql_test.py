@@ -0,0 +1,197 @@
+import gzip
+import os
+import unittest
+from simple_db_migrate.sql import AlterTableMerger, InsertMerger, SQLDialect, SQLFile, SQLLexer, StatementBatcher, UnbalancedSQLException
+from tests import BaseTest, create_file, delete_files
+
+class SQLLexerTest(BaseTest):
+
+    def setUp(self):
+        super(SQLLexerTest, self).setUp()
+        self.lexer = SQLLexer(SQLDialect())
+
+    def test_it_should_split_statements_by_semicolon(self):
+        self.assertEqual(['create table eggs', 'drop table spam'], self.lexer.split('; ; create table eggs; drop table spam; ; ;'))
+
+    def test_it_should_keep_the_last_statement_without_semicolon(self):
+        self.assertEqual(['create table eggs', 'drop table spam'], self.lexer.split('create table eggs; drop table spam'))
+
+    def test_it_should_not_split_by_semicolons_inside_quotes(self):
+        sql = "insert into spam values ('a;b', \"c;d\"); drop table eggs;"
+        self.assertEqual(["insert into spam values ('a;b', \"c;d\")", 'drop table eggs'], self.lexer.split(sql))
+
+    def test_it_should_accept_quotes_escaped_by_doubling_them(self):
+        sql = "insert into spam values ('it''s; ok'); drop table eggs"
+        self.assertEqual(["insert into spam values ('it''s; ok')", 'drop table eggs'], self.lexer.split(sql))
+
+    def test_it_should_not_split_by_semicolons_inside_parenthesis(self):
+        sql = "create table spam (id int; name varchar(10)); drop table eggs"
+        self.assertEqual(['create table spam (id int; name varchar(10))', 'drop table eggs'], self.lexer.split(sql))
+
+    def test_it_should_ignore_parenthesis_inside_quotes(self):
+        sql = "insert into spam values (':)'); drop table eggs"
+        self.assertEqual(["insert into spam values (':)')", 'drop table eggs'], self.lexer.split(sql))
+
+    def test_it_should_not_split_by_semicolons_inside_comments(self):
+        sql = "-- drop table spam; it's gone\ncreate table eggs; /* drop; 'table' */ drop table spam;"
+        self.assertEqual(["-- drop table spam; it's gone\ncreate table eggs", "/* drop; 'table' */ drop table spam"], self.lexer.split(sql))
+
+    def test_it_should_return_no_statements_when_a_quote_is_not_closed(self):
+        self.assertEqual([], self.lexer.split("create table eggs; insert into spam values ('a;b);"))
+
+    def test_it_should_return_no_statements_when_a_parenthesis_is_not_closed(self):
+        self.assertEqual([], self.lexer.split("create table eggs; create table spam (id int;"))
+        self.assertEqual([], self.lexer.split("create table eggs; create table spam id int);"))
+
+    def test_it_should_return_no_statements_when_a_comment_is_not_closed(self):
+        self.assertEqual([], self.lexer.split("create table eggs; /* drop table spam;"))
+
+    def test_it_should_accept_a_line_comment_at_the_end(self):
+        self.assertEqual(['create table eggs', '-- the end'], self.lexer.split("create table eggs; -- the end"))
+
+    def test_it_should_accept_backslash_escapes_when_the_dialect_has_them(self):
+        sql = "insert into spam values ('it\\'s; ok', \"\\\\\"); drop table eggs"
+        self.assertEqual([], self.lexer.split(sql))
+        lexer = SQLLexer(SQLDialect(backslash_escapes=True))
+        self.assertEqual(["insert into spam values ('it\\'s; ok', \"\\\\\")", 'drop table eggs'], lexer.split(sql))
+
+    def test_it_should_accept_other_quotes_and_line_comments_of_the_dialect(self):
+        lexer = SQLLexer(SQLDialect(quotes={"'": "'", "[": "]"}, line_comments=("#",)))
+        sql = "select [a;b]]c] from spam; # drop; table\ndrop table eggs"
+        self.assertEqual(['select [a;b]]c] from spam', '# drop; table\ndrop table eggs'], lexer.split(sql))
+
+    def test_it_should_read_blocks_until_the_terminator(self):
+        lexer = SQLLexer(SQLDialect(block_start="create[ \n\t\r]+procedure"))
+        sql = "drop table eggs;\n-- spam\ncreate procedure spam()\nbegin\n  select 1;\nend;\n/\ndrop table spam;"
+        self.assertEqual(['drop table eggs', "-- spam\ncreate procedure spam()\nbegin\n  select 1;\nend;", 'drop table spam'], lexer.split(sql))
+
+    def test_it_should_split_blocks_by_semicolon_when_there_is_no_terminator(self):
+        lexer = SQLLexer(SQLDialect(block_start="create[ \n\t\r]+procedure"))
+        sql = "create procedure spam()\nbegin\n  select 1;\nend;"
+        self.assertEqual(['create procedure spam()\nbegin\n  select 1', 'end'], lexer.split(sql))
+
+    def test_it_should_yield_the_statements_as_they_are_read(self):
+        statements = self.lexer.statements("create table eggs; drop table spam; insert into eggs values ('a")
+        self.assertEqual('create table eggs', next(statements))
+        self.assertEqual('drop table spam', next(statements))
+        self.assertRaisesWithMessage(UnbalancedSQLException, "quote not closed (')", next, statements)
+
+    def test_it_should_split_bytes_with_the_same_rules(self):
+        self.assertEqual([b"insert into spam values ('a;b')", b'drop table eggs'], self.lexer.split(b"insert into spam values ('a;b'); drop table eggs;"))
+
+class SQLFileTest(BaseTest):
+
+    def setUp(self):
+        super(SQLFileTest, self).setUp()
+        self.lexer = SQLLexer(SQLDialect())
+        self.sql = u"create table eggs (name varchar(10));\ninsert into eggs values ('ma\u00e7\u00e3; verde');\ndrop table spam;\n"
+
+    def tearDown(self):
+        super(SQLFileTest, self).tearDown()
+        delete_files('*test_sql_file.sql*')
+
+    def test_it_should_read_the_statements_of_a_sql_file(self):
+        create_file('test_sql_file.sql', self.sql)
+        statements = list(SQLFile('test_sql_file.sql').statements(self.lexer))
+        self.assertEqual([u'create table eggs (name varchar(10))', u"insert into eggs values ('ma\u00e7\u00e3; verde')", u'drop table spam'], statements)
+
+    def test_it_should_read_the_statements_of_a_gzipped_sql_file(self):
+        f = gzip.open('test_sql_file.sql.gz', 'wb')
+        f.write(self.sql.encode('utf-8'))
+        f.close()
+        statements = list(SQLFile('test_sql_file.sql.gz').statements(self.lexer))
+        self.assertEqual([u'create table eggs (name varchar(10))', u"insert into eggs values ('ma\u00e7\u00e3; verde')", u'drop table spam'], statements)
+
+    def test_it_should_read_no_statements_of_an_empty_file(self):
+        create_file('test_sql_file.sql')
+        self.assertEqual([], list(SQLFile('test_sql_file.sql').statements(self.lexer)))
+
+    def test_it_should_raise_exception_when_the_sql_file_is_unbalanced(self):
+        create_file('test_sql_file.sql', "create table eggs; insert into eggs values ('a);")
+        statements = SQLFile('test_sql_file.sql').statements(self.lexer)
+        self.assertEqual('create table eggs', next(statements))
+        self.assertRaisesWithMessage(UnbalancedSQLException, "invalid sql syntax in file '%s' (quote not closed ('))" % os.path.abspath('test_sql_file.sql'), next, statements)
+
+    def test_it_should_show_only_the_file_name(self):
+        self.assertEqual("-- statements read from file %s" % os.path.abspath('test_sql_file.sql'), str(SQLFile('test_sql_file.sql')))
+
+class InsertMergerTest(BaseTest):
+
+    def test_it_should_keep_the_statements_when_the_batch_size_is_one(self):
+        statements = ["insert into spam values (1)", "insert into spam values (2)"]
+        self.assertEqual([("insert into spam values (1)", ["insert into spam values (1)"]), ("insert into spam values (2)", ["insert into spam values (2)"])], list(StatementBatcher([InsertMerger(1)]).batches(statements)))
+
+    def test_it_should_join_inserts_into_the_same_table_and_columns(self):
+        statements = ["insert into spam (a, b) values (1, 'x')", "INSERT INTO spam (a,b) VALUES (2, 'y')"]
+        self.assertEqual([("insert into spam (a, b) values (1, 'x'),\n(2, 'y')", statements)], list(StatementBatcher([InsertMerger(10)]).batches(statements)))
+
+    def test_it_should_join_at_most_batch_size_rows(self):
+        statements = ["insert into spam values (1), (2)", "insert into spam values (3)", "insert into spam values (4)", "insert into spam values (5)"]
+        self.assertEqual([("insert into spam values (1), (2),\n(3)", statements[:2]), ("insert into spam values (4),\n(5)", statements[2:])], list(StatementBatcher([InsertMerger(3)]).batches(statements)))
+
+    def test_it_should_not_join_inserts_into_other_tables_or_columns(self):
+        statements = ["insert into spam (a) values (1)", "insert into spam (b) values (2)", "insert into eggs (b) values (3)"]
+        self.assertEqual([(statement, [statement]) for statement in statements], list(StatementBatcher([InsertMerger(10)]).batches(statements)))
+
+    def test_it_should_keep_other_statements_between_the_batches(self):
+        statements = ["insert into spam values (1)", "insert into spam values (2)", "update spam set a = 3", "insert into spam values (4)"]
+        self.assertEqual([("insert into spam values (1),\n(2)", statements[:2]), ("update spam set a = 3", ["update spam set a = 3"]), ("insert into spam values (4)", ["insert into spam values (4)"])], list(StatementBatcher([InsertMerger(10)]).batches(statements)))
+
+    def test_it_should_not_join_inserts_with_anything_after_the_values(self):
+        statements = ["insert into spam (a) values (1) on duplicate key update a = values(a)", "insert into spam (a) values (2)", "insert into spam (a) select 3"]
+        self.assertEqual([(statement, [statement]) for statement in statements], list(StatementBatcher([InsertMerger(10)]).batches(statements)))
+
+    def test_it_should_not_be_confused_by_quotes_in_the_values(self):
+        statements = ["insert into spam values ('a), (b')", "insert into spam values ('it''s', \"c;d\")"]
+        self.assertEqual([("insert into spam values ('a), (b'),\n('it''s', \"c;d\")", statements)], list(StatementBatcher([InsertMerger(10)]).batches(statements)))
+
+    def test_it_should_accept_backslash_escapes_when_asked(self):
+        statements = ["insert into spam values ('it\\'s')", "insert into spam values ('b')"]
+        self.assertEqual([("insert into spam values ('it\\'s'),\n('b')", statements)], list(StatementBatcher([InsertMerger(10, backslash_escapes=True)]).batches(statements)))
+
+class AlterTableMergerTest(BaseTest):
+
+    def setUp(self):
+        super(AlterTableMergerTest, self).setUp()
+        self.batcher = StatementBatcher([AlterTableMerger(backslash_escapes=True)])
+
+    def test_it_should_merge_alter_table_statements_of_the_same_table(self):
+        statements = ["alter table orders add column a int", "ALTER TABLE `orders` modify b varchar(10) default 'a,b', drop index c", "alter table orders change d e int"]
+        self.assertEqual([("alter table orders add column a int,\nmodify b varchar(10) default 'a,b', drop index c,\nchange d e int", statements)], list(self.batcher.batches(statements)))
+
+    def test_it_should_not_merge_alter_table_statements_of_other_tables(self):
+        statements = ["alter table orders add a int", "alter table customers add a int", "alter table other.orders add a int"]
+        self.assertEqual([(statement, [statement]) for statement in statements], list(self.batcher.batches(statements)))
+
+    def test_it_should_not_merge_alter_table_statements_separated_by_other_statements(self):
+        statements = ["alter table orders add a int", "update orders set a = 1", "alter table orders add b int"]
+        self.assertEqual([(statement, [statement]) for statement in statements], list(self.batcher.batches(statements)))
+
+    def test_it_should_not_merge_other_alter_table_clauses(self):
+        statements = ["alter table orders add a int", "alter table orders rename to sales", "alter table orders engine=innodb", "alter table orders add partition (partition p1 values less than (10))", "alter table orders drop foreign key fk_customer", "alter table orders add b int, algorithm=inplace"]
+        self.assertEqual([(statement, [statement]) for statement in statements], list(self.batcher.batches(statements)))
+
+    def test_it_should_not_merge_alter_table_statements_which_refer_to_columns_added_renamed_or_dropped_before(self):
+        statements = ["alter table orders change a b int", "alter table orders modify B bigint", "alter table orders add column c int", "alter table orders alter column `c` set default 1"]
+        self.assertEqual([(statements[0], statements[:1]), ("alter table orders modify B bigint,\nadd column c int", statements[1:3]), (statements[3], statements[3:])], list(self.batcher.batches(statements)))
+
+        statements = ["alter table orders add (c int, d int)", "alter table orders add index idx_d (d)", "alter table orders drop column if exists e", "alter table orders add e int after c"]
+        self.assertEqual([(statements[0], statements[:1]), ("alter table orders add index idx_d (d),\ndrop column if exists e", statements[1:3]), (statements[3], statements[3:])], list(self.batcher.batches(statements)))
+
+    def test_it_should_merge_alter_table_statements_which_refer_to_other_columns(self):
+        statements = ["alter table orders add c int", "alter table orders add index idx_a (a)", "alter table orders modify b int default 'c'", "alter table orders add index c (a)", "alter table orders drop c"]
+        self.assertEqual([("alter table orders add c int,\nadd index idx_a (a),\nmodify b int default 'c'", statements[:3]), ("alter table orders add index c (a),\ndrop c", statements[3:])], list(self.batcher.batches(statements)))
+
+    def test_it_should_merge_inserts_and_alter_tables_with_both_mergers(self):
+        batcher = StatementBatcher([InsertMerger(10), AlterTableMerger()])
+        statements = ["alter table spam add a int", "alter table spam add b int", "insert into spam values (1)", "insert into spam values (2)"]
+        self.assertEqual([("alter table spam add a int,\nadd b int", statements[:2]), ("insert into spam values (1),\n(2)", statements[2:])], list(batcher.batches(statements)))
+
+    def test_it_should_tell_the_statements_undone_by_a_rollback(self):
+        batcher = StatementBatcher([InsertMerger(10), AlterTableMerger()])
+        self.assertTrue(batcher.transactional("insert into spam values (1)"))
+        self.assertFalse(batcher.transactional("alter table spam add a int"))
+        self.assertFalse(batcher.transactional("update spam set a = 1"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,343 @@
+#-*- coding:utf-8 -*-
+import json
+import re
+import socket
+import sqlite3
+import threading
+import time
+import unittest
+import simple_db_migrate.core
+from simple_db_migrate import SIMPLE_DB_MIGRATE_VERSION
+from mock import patch, Mock, MagicMock
+from simple_db_migrate.config import Config
+from simple_db_migrate.main import Main
+from simple_db_migrate.sql import SQLFile
+from simple_db_migrate.sqlite import SQLite
+from tests import BaseTest, create_file, delete_files
+
+class SQLiteTest(BaseTest):
+
+    def setUp(self):
+        super(SQLiteTest, self).setUp()
+        self.config_dict = {'database_script_encoding': 'utf8',
+                   'database_name': 'sqlite_test.db',
+                   'database_version_table': '__db_version__',
+                   'drop_db_first': False
+                }
+
+        self.config_mock = MagicMock(spec_set=dict, wraps=self.config_dict)
+
+    def tearDown(self):
+        super(SQLiteTest, self).tearDown()
+        delete_files('sqlite_test.db*')
+        delete_files('test_sql_file.sql')
+
+    def query(self, sql):
+        db = sqlite3.connect('sqlite_test.db')
+        try:
+            return db.execute(sql).fetchall()
+        finally:
+            db.close()
+
+    def test_it_should_use_sqlite3_as_driver(self):
+        sqlite_driver_mock = Mock(**{"connect.return_value.cursor.return_value.fetchone.return_value": [1]})
+        with patch.dict('sys.modules', sqlite3=sqlite_driver_mock):
+            SQLite(self.config_mock)
+        sqlite_driver_mock.connect.assert_called_with('sqlite_test.db', isolation_level=None)
+
+    def test_it_should_create_the_database_and_the_version_table(self):
+        sqlite = SQLite(self.config_mock)
+        sqlite.close()
+        self.assertEqual([(1, '0', None, None, None, None)], self.query("select * from __db_version__"))
+
+    def test_it_should_use_wal_journal_mode(self):
+        sqlite = SQLite(self.config_mock)
+        sqlite.close()
+        self.assertEqual([('wal',)], self.query("pragma journal_mode"))
+
+    def test_it_should_not_create_the_version_register_again(self):
+        SQLite(self.config_mock).close()
+        SQLite(self.config_mock).close()
+        self.assertEqual([('0',)], self.query("select version from __db_version__"))
+
+    def test_it_should_drop_the_database_first_when_asked(self):
+        sqlite = SQLite(self.config_mock)
+        sqlite.change("create table spam (id int);", "20090212112104", "20090212112104_test_it_should_drop_the_database_first_when_asked.migration", "create table spam (id int);", "drop table spam;")
+        sqlite.close()
+
+        self.config_dict['drop_db_first'] = True
+        SQLite(self.config_mock).close()
+        self.assertEqual([], self.query("select name from sqlite_master where name = 'spam'"))
+        self.assertEqual([('0',)], self.query("select version from __db_version__"))
+
+    def test_it_should_execute_migration_up_and_update_schema_version(self):
+        execution_log_mock = Mock()
+        sqlite = SQLite(self.config_mock)
+        sqlite.change("create table spam (id int); insert into spam values (1);", "20090212112104", "20090212112104_test_it_should_execute_migration_up_and_update_schema_version.migration", "create table spam (id int); insert into spam values (1);", "drop table spam;", execution_log=execution_log_mock, label_version="label")
+        sqlite.close()
+
+        self.assertEqual([(1,)], self.query("select id from spam"))
+        self.assertEqual([('0', None, None, None, None), ('20090212112104', 'label', '20090212112104_test_it_should_execute_migration_up_and_update_schema_version.migration', 'create table spam (id int); insert into spam values (1);', 'drop table spam;')], self.query("select version, label, name, sql_up, sql_down from __db_version__ order by id"))
+        self.assertEqual([(('create table spam (id int)\n-- 0 row(s) affected\n',), {}),
+                          (('insert into spam values (1)\n-- 1 row(s) affected\n',), {}),
+                          (('migration 20090212112104_test_it_should_execute_migration_up_and_update_schema_version.migration registered\n',), {})], execution_log_mock.call_args_list)
+
+    def test_it_should_execute_migration_down_and_update_schema_version(self):
+        sqlite = SQLite(self.config_mock)
+        sqlite.change("create table spam (id int);", "20090212112104", "20090212112104_test_it_should_execute_migration_down_and_update_schema_version.migration", "create table spam (id int);", "drop table spam;")
+        sqlite.change("drop table spam;", "20090212112104", "20090212112104_test_it_should_execute_migration_down_and_update_schema_version.migration", "create table spam (id int);", "drop table spam;", False)
+        sqlite.close()
+
+        self.assertEqual([], self.query("select name from sqlite_master where name = 'spam'"))
+        self.assertEqual([('0',)], self.query("select version from __db_version__"))
+
+    def test_it_should_execute_the_statements_of_a_sql_file(self):
+        create_file('test_sql_file.sql', "create table spam (name varchar(10));\ninsert into spam values ('a;b');\n")
+        sqlite = SQLite(self.config_mock)
+        sqlite.change(SQLFile('test_sql_file.sql'), "20090212112104", "20090212112104_test_it_should_execute_the_statements_of_a_sql_file.migration", "", "drop table spam;")
+        sqlite.close()
+
+        self.assertEqual([('a;b',)], self.query("select name from spam"))
+
+    def test_it_should_execute_triggers_until_the_slash(self):
+        sqlite = SQLite(self.config_mock)
+        sqlite.change("create table spam (id int);\ncreate table eggs (id int);\ncreate trigger spam_eggs after insert on spam\nbegin\n  insert into eggs values (new.id);\nend;\n/\ninsert into spam values (7);", "20090212112104", "20090212112104_test_it_should_execute_triggers_until_the_slash.migration", "", "")
+        sqlite.close()
+
+        self.assertEqual([(7,)], self.query("select id from eggs"))
+
+    def test_it_should_rollback_the_whole_migration_when_a_statement_fails(self):
+        sqlite = SQLite(self.config_mock)
+        try:
+            sqlite.change("create table spam (id int); insert into eggs values (1);", "20090212112104", "20090212112104_test_it_should_rollback_the_whole_migration.migration", "", "")
+            self.fail("it should not get here")
+        except Exception as e:
+            self.assertEqual("error executing migration: no such table: eggs\n\n[ERROR DETAILS] SQL command was:\ninsert into eggs values (1)", str(e))
+            self.assertTrue(isinstance(e, simple_db_migrate.core.exceptions.MigrationException))
+        sqlite.close()
+
+        # the table created before the error was rolled back with it
+        self.assertEqual([], self.query("select name from sqlite_master where name = 'spam'"))
+        self.assertEqual([('0',)], self.query("select version from __db_version__"))
+
+    def test_it_should_rollback_the_migration_when_an_error_occur_during_log_schema_version(self):
+        sqlite = SQLite(self.config_mock)
+        self.query("drop table __db_version__")
+        try:
+            sqlite.change("create table spam (id int);", "20090212112104", "20090212112104_test_it_should_rollback_the_migration.migration", "", "")
+            self.fail("it should not get here")
+        except Exception as e:
+            self.assertEqual("error logging migration: no such table: __db_version__\n\n[ERROR DETAILS] SQL command was:\n20090212112104_test_it_should_rollback_the_migration.migration", str(e))
+        sqlite.close()
+
+        self.assertEqual([], self.query("select name from sqlite_master where name = 'spam'"))
+
+    def test_it_should_raise_exception_when_the_sql_is_invalid(self):
+        sqlite = SQLite(self.config_mock)
+        self.assertRaisesWithMessage(Exception, "error executing migration: invalid sql syntax 'create table spam (id int'", sqlite.change, "create table spam (id int", "20090212112104", "20090212112104_test_it_should_raise_exception_when_the_sql_is_invalid.migration", "", "")
+        sqlite.close()
+
+    def test_it_should_read_the_schema_versions(self):
+        sqlite = SQLite(self.config_mock)
+        sqlite.change("create table spam (id int);", "20090212112104", "20090212112104_spam.migration", "create table spam (id int);", "drop table spam;", label_version="first")
+        sqlite.change("create table eggs (id int);", "20090212112105", "20090212112105_eggs.migration", "create table eggs (id int);", "drop table eggs;", label_version="second")
+
+        self.assertEqual('20090212112105', sqlite.get_current_schema_version())
+        self.assertEqual(['0', '20090212112104', '20090212112105'], sqlite.get_all_schema_versions())
+        self.assertEqual(2, sqlite.get_version_id_from_version_number('20090212112104'))
+        self.assertEqual(None, sqlite.get_version_id_from_version_number('20090212112199'))
+        self.assertEqual('20090212112104', sqlite.get_version_number_from_label('first'))
+        self.assertEqual(None, sqlite.get_version_number_from_label('third'))
+        sqlite.close()
+
+    def test_it_should_read_all_schema_migrations_with_or_without_sql(self):
+        sqlite = SQLite(self.config_mock)
+        sqlite.change(u"insert into __db_version__ (name) values ('ação');", "20090212112104", "20090212112104_spam.migration", u"insert into __db_version__ (name) values ('ação');", "drop table spam;", label_version="first")
+
+        migrations = sqlite.get_all_schema_migrations()
+        self.assertEqual([1, 2, 3], [migration.id for migration in migrations])
+        self.assertEqual(['0', '0', '20090212112104'], [migration.version for migration in migrations])
+        self.assertEqual([None, None, 'first'], [migration.label for migration in migrations])
+        self.assertEqual(u"insert into __db_version__ (name) values ('ação');", migrations[2].sql_up)
+        self.assertEqual(u"drop table spam;", migrations[2].sql_down)
+
+        migrations = sqlite.get_all_schema_migrations(with_sql=False)
+        self.assertEqual([None, None, None], [migration.sql_up for migration in migrations])
+        self.assertEqual({3: (u"insert into __db_version__ (name) values ('ação');", u"drop table spam;")}, sqlite.get_schema_migrations_sql([3]))
+        self.assertEqual({}, sqlite.get_schema_migrations_sql([]))
+        sqlite.close()
+
+    def test_it_should_use_only_one_connection(self):
+        sqlite = SQLite(self.config_mock)
+        sqlite.change("create table spam (id int);", "20090212112104", "20090212112104_spam.migration", "", "")
+        sqlite.get_all_schema_migrations()
+        sqlite.close()
+        self.assertEqual(1, sqlite.connection_count)
+
+    def test_it_should_record_the_metadata_of_the_execution_on_the_version_table(self):
+        self.config_dict['version_table_metadata'] = True
+        sqlite = SQLite(self.config_mock)
+        sqlite.change("create table spam (id int); insert into spam values (1); insert into spam values (2);", "20090212112104", "20090212112104_spam.migration", "", "")
+        sqlite.close()
+
+        started_at, duration_ms, statements_count, rows_affected, hostname, tool_version = self.query("select started_at, duration_ms, statements_count, rows_affected, hostname, tool_version from __db_version__ where version = '20090212112104'")[0]
+        self.assertTrue(re.match(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$", started_at), started_at)
+        self.assertTrue(duration_ms >= 0)
+        self.assertEqual(3, statements_count)
+        self.assertEqual(2, rows_affected)
+        self.assertEqual(socket.gethostname(), hostname)
+        self.assertEqual(SIMPLE_DB_MIGRATE_VERSION, tool_version)
+
+    def test_it_should_add_the_metadata_columns_to_an_existing_version_table(self):
+        sqlite = SQLite(self.config_mock)
+        sqlite.change("create table spam (id int);", "20090212112104", "20090212112104_spam.migration", "", "")
+        sqlite.close()
+
+        self.config_dict['version_table_metadata'] = True
+        sqlite = SQLite(self.config_mock)
+        sqlite.change("insert into spam values (1);", "20090212112105", "20090212112105_spam.migration", "", "")
+        sqlite.close()
+        SQLite(self.config_mock).close()
+
+        self.assertEqual([('0', None), ('20090212112104', None), ('20090212112105', 1)], self.query("select version, statements_count from __db_version__ order by id"))
+
+    def test_it_should_get_no_sql_of_migrations_not_recorded(self):
+        self.config_dict['version_table_metadata'] = True
+        sqlite = SQLite(self.config_mock)
+        self.assertEqual({}, sqlite.get_schema_migrations_sql([10]))
+        sqlite.close()
+
+    def test_it_should_show_the_progress_of_the_first_migrations_recorded_with_their_duration(self):
+        create_file('20090212112104_spam.migration', 'SQL_UP = "create table spam (id int);"\nSQL_DOWN = "drop table spam;"\n')
+        config = Config({'database_name': 'sqlite_test.db', 'database_engine': 'sqlite', 'database_version_table': '__db_version__', 'database_migrations_dir': ['.'], 'schema_version': None, 'drop_db_first': False, 'log_level': 0, 'progress': True, 'version_table_metadata': True})
+        try:
+            Main(config).execute()
+        finally:
+            delete_files('*.migration')
+        self.assertEqual([('20090212112104', 1)], self.query("select version, statements_count from __db_version__ where id > 1"))
+
+    def test_it_should_store_the_fingerprint_with_the_current_version(self):
+        sqlite = SQLite(self.config_mock)
+        self.assertEqual(None, sqlite.get_fingerprint())
+        sqlite.set_fingerprint('first', '0')
+        sqlite.set_fingerprint('second', '0')
+        self.assertEqual('second', sqlite.get_fingerprint())
+        self.assertEqual([('second', '0')], self.query("select fingerprint, version from __db_version___fingerprint"))
+
+        # another version was registered since the fingerprint was stored
+        sqlite.change("create table spam (id int);", "20090212112104", "20090212112104_spam.migration", "", "")
+        self.assertEqual(None, sqlite.get_fingerprint())
+        sqlite.close()
+
+    def test_it_should_skip_the_migration_when_the_fingerprint_is_the_same(self):
+        create_file('20090212112104_spam.migration', 'SQL_UP = "create table spam (id int);"\nSQL_DOWN = "drop table spam;"\n')
+        config = Config({'database_name': 'sqlite_test.db', 'database_engine': 'sqlite', 'database_version_table': '__db_version__', 'database_migrations_dir': ['.'], 'schema_version': None, 'drop_db_first': False, 'fast_check': True, 'log_level': 0})
+        try:
+            Main(config).execute()
+            self.assertEqual([('20090212112104',)], self.query("select version from __db_version___fingerprint"))
+
+            with patch('simple_db_migrate.main.SchemaHistory.load') as load_mock:
+                with patch('simple_db_migrate.core._load_migration_file') as load_file_mock:
+                    Main(config).execute()
+            self.assertEqual(0, load_mock.call_count)
+            self.assertEqual(0, load_file_mock.call_count)
+
+            create_file('20090212112105_eggs.migration', 'SQL_UP = "create table eggs (id int);"\nSQL_DOWN = "drop table eggs;"\n')
+            Main(config).execute()
+            self.assertEqual([], self.query("select id from eggs"))
+            self.assertEqual([('20090212112105',)], self.query("select version from __db_version___fingerprint"))
+        finally:
+            delete_files('*.migration')
+
+    def test_it_should_lock_the_database_file(self):
+        sqlite = SQLite(self.config_mock)
+        other_sqlite = SQLite(self.config_mock)
+        sqlite.lock(0)
+        self.assertRaisesWithMessage(Exception, "could not get the advisory lock 'sqlite_test.db.lock' in 0 seconds", other_sqlite.lock, 0)
+        sqlite.unlock()
+        other_sqlite.lock(0)
+        other_sqlite.close()
+        sqlite.close()
+
+    def test_it_should_only_check_the_current_version_after_waiting_for_the_lock(self):
+        create_file('20090212112104_spam.migration', 'SQL_UP = "create table spam (id int);"\nSQL_DOWN = "drop table spam;"\n')
+        config = Config({'database_name': 'sqlite_test.db', 'database_engine': 'sqlite', 'database_version_table': '__db_version__', 'database_migrations_dir': ['.'], 'schema_version': None, 'drop_db_first': False, 'advisory_lock': True, 'log_level': 0})
+        sqlite = SQLite(self.config_mock)
+        try:
+            sqlite.lock(0)
+            mains = []
+            def execute():
+                # sqlite connections are used only by the thread which opened them
+                mains.append(Main(config))
+                mains[0].execute()
+            thread = threading.Thread(target=execute)
+            thread.start()
+            time.sleep(0.3)
+
+            # other execution migrates the database while holding the lock
+            sqlite.change("create table spam (id int);", "20090212112104", "20090212112104_spam.migration", "", "")
+            with patch('simple_db_migrate.main.SchemaHistory.load') as load_mock:
+                sqlite.unlock()
+                thread.join()
+            self.assertEqual(0, load_mock.call_count)
+            self.assertTrue(mains[0].lock_wait_time >= 0.3)
+            self.assertEqual([('0',), ('20090212112104',)], self.query("select version from __db_version__ order by id"))
+        finally:
+            sqlite.close()
+            delete_files('*.migration')
+
+    @patch('simple_db_migrate.main.CLI.msg')
+    def test_it_should_report_the_timings_of_the_migrations_and_statements(self, msg_mock):
+        create_file('20090212112104_spam.migration', 'SQL_UP = "create table spam (id int); insert into spam values (1); insert into spam values (2);"\nSQL_DOWN = "drop table spam;"\n')
+        config = Config({'database_name': 'sqlite_test.db', 'database_engine': 'sqlite', 'database_version_table': '__db_version__', 'database_migrations_dir': ['.'], 'schema_version': None, 'drop_db_first': False, 'log_level': 1, 'report_top': 2, 'report_file': 'sqlite_test.db.json'})
+        try:
+            Main(config).execute()
+            with open('sqlite_test.db.json') as f:
+                report = json.load(f)
+        finally:
+            delete_files('*.migration')
+
+        self.assertEqual(['20090212112104_spam.migration'], [migration['file_name'] for migration in report['migrations']])
+        self.assertEqual(['create table spam (id int)', 'insert into spam values (1)', 'insert into spam values (2)'], [statement['sql'] for statement in report['migrations'][0]['statements']])
+        self.assertEqual(2, report['migrations'][0]['rows'])
+        self.assertEqual(['execute', 'record'], sorted(report['migrations'][0]['phases'].keys()))
+        self.assertTrue(report['phases']['connect'] > 0)
+        self.assertTrue(report['phases']['load'] > 0)
+
+        messages = [call_args[0][0] for call_args in msg_mock.call_args_list]
+        summary = messages[messages.index('\n__________ Run report __________') + 1:]
+        self.assertTrue(summary[0].startswith('total '))
+        self.assertEqual('slowest migrations:', summary[1])
+        self.assertTrue(summary[2].endswith('20090212112104_spam.migration (up), 3 statement(s), 2 row(s)'))
+        self.assertEqual('slowest statements:', summary[3])
+        self.assertEqual(7, len(summary))
+
+    def test_it_should_write_the_timeline_of_the_execution_as_a_trace(self):
+        create_file('20090212112104_spam.migration', 'SQL_UP = "create table spam (id int); insert into spam values (1);"\nSQL_DOWN = "drop table spam;"\n')
+        config = Config({'database_name': 'sqlite_test.db', 'database_engine': 'sqlite', 'database_version_table': '__db_version__', 'database_migrations_dir': ['.'], 'schema_version': None, 'drop_db_first': False, 'log_level': 0, 'trace_file': 'sqlite_test.db.trace.json'})
+        try:
+            Main(config).execute()
+            with open('sqlite_test.db.trace.json') as f:
+                events = json.load(f)['traceEvents']
+        finally:
+            delete_files('*.migration')
+
+        self.assertEqual([{'name': 'sqlite_test.db'}], [event['args'] for event in events if event['name'] == 'thread_name'])
+        spans = dict([(event['name'], event) for event in events if event['ph'] == 'X'])
+        for name in ('connect', 'discovery', 'parse', 'load', 'plan', 'execute', 'record', '20090212112104_spam.migration', 'create table spam (id int)', 'insert into spam values (1)'):
+            self.assertTrue(name in spans, name)
+        migration = spans['20090212112104_spam.migration']
+        statement = spans['insert into spam values (1)']
+        self.assertTrue(migration['ts'] <= statement['ts'] and statement['ts'] + statement['dur'] <= migration['ts'] + migration['dur'])
+        round_trips = [event['args']['round trips'] for event in events if event['ph'] == 'C']
+        self.assertEqual(sorted(round_trips), round_trips)
+        self.assertTrue(round_trips[-1] > 0)
+
+    def test_it_should_be_created_by_main_without_host_user_or_password(self):
+        config = Config({'database_name': 'sqlite_test.db', 'database_engine': 'sqlite', 'database_version_table': '__db_version__', 'database_migrations_dir': ['.'], 'schema_version': None, 'drop_db_first': False})
+        main = Main(config)
+        self.assertTrue(isinstance(main.sgdb, SQLite))
+        main.sgdb.close()
+
+if __name__ == "__main__":
+    unittest.main()